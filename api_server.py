@@ -0,0 +1,450 @@
+# api_server.py - واجهة HTTP/JSON محلية لتسجيل البريد والبحث فيه
+"""
+خادم HTTP خفيف (مكتبة Python القياسية) فوق طبقة الخدمات، لمحطة المسح
+الضوئي والسكريبتات الداخلية التي تسجل البريد دون المرور بواجهة Streamlit.
+
+الاستعمال:
+    python api_server.py --port 8601 --user admin --token سر
+
+المسارات:
+    GET   /api/health
+    GET   /metrics                               (مقاييس Prometheus)
+    GET   /api/changes?since=&limit=             (سجل التغييرات، انظر services/changes.py)
+    GET   /api/mail/<incoming|outgoing>?q=&status=&priority=&from=&to=&limit=&offset=
+    GET   /api/mail/<incoming|outgoing>/<id>
+    GET   /api/mail/<incoming|outgoing>/ref/<reference_no>
+    POST  /api/mail/<incoming|outgoing>          (كائن JSON أو قائمة كائنات)
+    PATCH /api/mail/<incoming|outgoing>/<id>/status   {"status": "..."}
+    GET   /api/mail/outgoing/<id>/bordereau      (ملف docx)
+
+- اتصالات SQLite معاد استعمالها عبر مجمع اتصالات لكل مؤسسة مشترك بين الخيوط
+- مع tenants.json تُحدد المؤسسة بالترويسة X-Institution (أو --institution)، ولكل
+  مؤسسة مجمعها وقفل كتابتها، فلا ينتظر طلب مدرسة طلبات مدرسة أخرى
+- القوائم تُرسل كـ JSON متدفق (Transfer-Encoding: chunked) أثناء القراءة من قاعدة البيانات
+- المصادقة برمز Bearer اختياري، والعمليات تُسجل باسم المستخدم المحدد في --user
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import database
+import metrics
+import tenants
+from database import get_db_connection
+from services import DuplicateReferenceError, NotFoundError, ServiceError
+from services import bordereau as bordereau_service
+from services import changes as change_service
+from services.bordereau import TemplateMissingError
+from services import contacts as contact_service
+from services import mail as mail_service
+from services import users as user_service
+
+MAX_BODY_SIZE = 5 * 1024 * 1024
+MAX_PAGE_SIZE = 5000
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class ConnectionPool:
+    """مجمع اتصالات SQLite يعاد استعمالها بين الطلبات بدل فتح اتصال لكل طلب"""
+
+    def __init__(self, size=4):
+        self._connections = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(get_db_connection())
+
+    @contextmanager
+    def acquire(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            # عدم إرجاع اتصال بمعاملة مفتوحة بعد خطأ
+            if conn.in_transaction:
+                conn.rollback()
+            self._connections.put(conn)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+class Shard:
+    """موارد مؤسسة واحدة في الخادم: مجمع اتصالات، قفل توليد المراجع، المستخدم المسجل للعمليات"""
+
+    def __init__(self, pool_size, username):
+        self.pool = ConnectionPool(pool_size)
+        self.write_lock = threading.Lock()
+        self.actor = _load_actor(username)
+
+    def close(self):
+        self.pool.close()
+
+
+class ApiError(Exception):
+    """خطأ يُرجع للعميل برمز HTTP محدد"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    """تحويل القيم غير القابلة للتسلسل (معرفات BLOB القديمة، التواريخ...)"""
+    if isinstance(value, bytes):
+        return int.from_bytes(value, "little") if len(value) == 8 else value.hex()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+class MailApiHandler(BaseHTTPRequestHandler):
+    """معالج طلبات واجهة البريد"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MailAPI/1.0"
+
+    # --- الاستجابات ---
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
+    def _send_json(self, status, data):
+        body = _dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _stream_json_list(self, rows, flush_every=200):
+        """إرسال قائمة JSON متدفقة أثناء قراءة الصفوف"""
+        # قراءة أول صف قبل إرسال الترويسات حتى تُرجع أخطاء الاستعلام كاستجابة عادية
+        rows = iter(rows)
+        first = next(rows, None)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        buffer = ["["]
+        if first is not None:
+            buffer.append(_dumps(first))
+        for row in rows:
+            buffer.append("," + _dumps(row))
+            if len(buffer) >= flush_every:
+                self._send_chunk("".join(buffer))
+                buffer = []
+        buffer.append("]")
+        self._send_chunk("".join(buffer))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_metrics(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, data, filename, mime):
+        self.send_response(200)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    # --- قراءة الطلب ---
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise ApiError(413, "حجم الطلب أكبر من المسموح")
+        try:
+            return json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            raise ApiError(400, "محتوى JSON غير صالح")
+
+    def _check_token(self):
+        token = self.server.api_token
+        if token and self.headers.get("Authorization") != f"Bearer {token}":
+            raise ApiError(401, "رمز الوصول غير صحيح")
+
+    def _require(self, permission):
+        if not user_service.has_permission(self.shard.actor.get('role'), permission):
+            raise ApiError(403, "ليس لديك صلاحية لهذه العملية")
+
+    def _dispatch(self, method):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        try:
+            self._check_token()
+            self._route(method, parts, parse_qs(url.query))
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except DuplicateReferenceError as e:
+            self._send_json(409, {"error": str(e)})
+        except NotFoundError as e:
+            self._send_json(404, {"error": str(e)})
+        except TemplateMissingError as e:
+            self._send_json(503, {"error": str(e)})
+        except ServiceError as e:
+            self._send_json(400, {"error": str(e)})
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json(400, {"error": f"بيانات ناقصة أو غير صالحة: {e}"})
+        except Exception as e:
+            print(f"⚠️ خطأ في واجهة البريد: {e}")
+            self._send_json(500, {"error": "خطأ داخلي في الخادم"})
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.API_REQUEST_SECONDS.observe(elapsed, method=method, status=getattr(self, '_status', 0))
+            if not self.server.quiet:
+                print(f"{method} {url.path} {elapsed * 1000:.1f}ms")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def log_message(self, format, *args):
+        # السجل يُطبع في _dispatch مع زمن التنفيذ
+        pass
+
+    # --- المسارات ---
+    def _route(self, method, parts, query):
+        if parts == ["api", "health"] and method == "GET":
+            return self._send_json(200, {"status": "ok"})
+        if parts == ["metrics"] and method == "GET":
+            return self._send_metrics()
+
+        code = self.headers.get("X-Institution") or self.server.default_institution
+        if code not in self.server.shards:
+            raise ApiError(400, "يجب تحديد المؤسسة (X-Institution)" if code is None else f"مؤسسة غير معرفة: {code}")
+        self.shard = self.server.shards[code]
+        with tenants.use(code):
+            return self._route_institution(method, parts, query)
+
+    def _route_institution(self, method, parts, query):
+        if parts == ["api", "changes"] and method == "GET":
+            return self._list_changes(query)
+
+        if len(parts) < 3 or parts[:2] != ["api", "mail"] or parts[2] not in mail_service.MAIL_TABLES:
+            raise ApiError(404, "المسار غير موجود")
+
+        mail_type, rest = parts[2], parts[3:]
+
+        if method == "GET" and not rest:
+            return self._list_mail(mail_type, query)
+        if method == "POST" and not rest:
+            return self._create_mail(mail_type)
+        if method == "GET" and len(rest) == 2 and rest[0] == "ref":
+            return self._get_mail(mail_type, reference_no=rest[1])
+        if method == "GET" and len(rest) == 1:
+            return self._get_mail(mail_type, mail_id=_parse_id(rest[0]))
+        if method == "PATCH" and len(rest) == 2 and rest[1] == "status":
+            return self._update_status(mail_type, _parse_id(rest[0]))
+        if method == "GET" and len(rest) == 2 and rest[1] == "bordereau" and mail_type == "outgoing":
+            return self._render_bordereau(_parse_id(rest[0]))
+
+        raise ApiError(404, "المسار غير موجود")
+
+    def _list_changes(self, query):
+        self._require('view')
+        arg = lambda name: (query.get(name) or [None])[0]
+        with self.shard.pool.acquire() as conn:
+            result = change_service.changes_since(arg("since") or 0, arg("limit") or change_service.CHANGES_PAGE_SIZE,
+                                                  conn=conn)
+        self._send_json(200, result)
+
+    def _list_mail(self, mail_type, query):
+        self._require('view')
+        arg = lambda name: (query.get(name) or [None])[0]
+        limit = min(int(arg("limit") or 100), MAX_PAGE_SIZE)
+        offset = int(arg("offset") or 0)
+
+        with self.shard.pool.acquire() as conn:
+            rows = mail_service.search_mail(
+                mail_type, text=arg("q"), status=arg("status"), priority=arg("priority"),
+                date_from=arg("from"), date_to=arg("to"), limit=limit, offset=offset, conn=conn)
+            self._stream_json_list(rows)
+
+    def _get_mail(self, mail_type, mail_id=None, reference_no=None):
+        self._require('view')
+        with self.shard.pool.acquire() as conn:
+            if reference_no is not None:
+                mail = mail_service.get_mail_by_reference(reference_no, mail_type, conn)
+            else:
+                mail = mail_service.get_mail(mail_id, mail_type, conn)
+        if mail is None:
+            raise ApiError(404, "البريد غير موجود")
+        self._send_json(200, mail)
+
+    def _create_mail(self, mail_type):
+        self._require('add')
+        payload = self._read_json()
+        if isinstance(payload, list):
+            results = [self._create_one(mail_type, item) for item in payload]
+            status = 201 if all('id' in result for result in results) else 207
+            return self._send_json(status, results)
+        if not isinstance(payload, dict):
+            raise ApiError(400, "يجب إرسال كائن JSON أو قائمة كائنات")
+
+        result = self._create_one(mail_type, payload)
+        if 'error' in result:
+            raise ApiError(result['status'], result['error'])
+        self._send_json(201, result)
+
+    def _create_one(self, mail_type, item):
+        """تسجيل بريد واحد وإرجاع النتيجة أو الخطأ (للطلبات الدفعية)"""
+        try:
+            if not isinstance(item, dict):
+                raise ServiceError("يجب أن يكون كل عنصر كائن JSON")
+            mail = dict(item)
+            party_id, party_name = (('recipient_id', 'recipient_name') if mail_type == "outgoing"
+                                    else ('sender_id', 'sender_name'))
+            for field in (party_name, 'subject'):
+                if not mail.get(field):
+                    raise ServiceError(f"الحقل {field} مطلوب")
+
+            with self.shard.pool.acquire() as conn:
+                if mail.get('contact_code') and not mail.get(party_id):
+                    mail[party_id] = _contact_id_by_code(conn, mail['contact_code'])
+
+                # توليد رقم المرجع والإدراج تحت قفل واحد لتفادي تكرار الرقم بين الطلبات المتزامنة
+                lock_requested = time.perf_counter()
+                with self.shard.write_lock:
+                    metrics.WRITE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - lock_requested)
+                    if not mail.get('reference_no'):
+                        mail['reference_no'] = mail_service.generate_ref_no(mail_type, conn)
+                    actor_id = self.shard.actor.get('id')
+                    if mail_type == "outgoing":
+                        mail.setdefault('sent_date', time.strftime('%Y-%m-%d'))
+                        result = mail_service.create_outgoing(mail, actor_id=actor_id, conn=conn)
+                        return {'id': result['id'], 'reference_no': mail['reference_no'],
+                                'bordereau': result['bordereau'],
+                                'bordereau_error': result['bordereau_error']}
+
+                    mail.setdefault('received_date', time.strftime('%Y-%m-%d'))
+                    mail_id = mail_service.register_incoming(mail, actor_id=actor_id, conn=conn)
+                    return {'id': mail_id, 'reference_no': mail['reference_no']}
+        except (DuplicateReferenceError, ServiceError) as e:
+            status = 409 if isinstance(e, DuplicateReferenceError) else 400
+            reference_no = item.get('reference_no') if isinstance(item, dict) else None
+            return {'status': status, 'error': str(e), 'reference_no': reference_no}
+
+    def _update_status(self, mail_type, mail_id):
+        self._require('edit')
+        payload = self._read_json()
+        if not isinstance(payload, dict) or not payload.get('status'):
+            raise ApiError(400, "الحقل status مطلوب")
+
+        with self.shard.pool.acquire() as conn:
+            result = mail_service.update_status(mail_id, payload['status'], mail_type,
+                                                actor_id=self.shard.actor.get('id'), conn=conn)
+        self._send_json(200, {'id': mail_id, 'status': payload['status'], **result})
+
+    def _render_bordereau(self, mail_id):
+        self._require('view')
+        with self.shard.pool.acquire() as conn:
+            mail = mail_service.get_mail(mail_id, "outgoing", conn)
+            if mail is None:
+                raise ApiError(404, "البريد غير موجود")
+            contact = contact_service.get_contact_by_id(mail.get('recipient_id'), conn)
+        buffer = bordereau_service.render_bordereau(mail, contact)
+        self._send_file(buffer.getvalue(), bordereau_service.bordereau_filename(mail['reference_no']),
+                        DOCX_MIME)
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(404, "المسار غير موجود")
+
+
+def _contact_id_by_code(conn, code):
+    row = conn.execute("SELECT id FROM contacts WHERE code = ?", (code,)).fetchone()
+    if row is None:
+        raise ServiceError(f"جهة الاتصال بالكود '{code}' غير موجودة")
+    return row[0]
+
+
+def _load_actor(username):
+    """تحميل المستخدم الذي تُسجل العمليات باسمه"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT id, username, role FROM users WHERE username = ? AND is_active = 1", (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise SystemExit(f"❌ المستخدم '{username}' غير موجود أو غير نشط")
+    return {'id': row[0], 'username': row[1], 'role': row[2]}
+
+
+def create_server(host="127.0.0.1", port=8601, username="admin", token=None, pool_size=4, quiet=False,
+                  institution=None):
+    """إنشاء خادم الواجهة (دون تشغيله) مع موارد كل مؤسسة"""
+    server = ThreadingHTTPServer((host, port), MailApiHandler)
+    server.daemon_threads = True
+    server.shards = {}
+    for code in list(tenants.registry()) or [None]:
+        with tenants.use(code):
+            server.shards[code] = Shard(pool_size, username)
+    server.default_institution = institution if tenants.registry() else None
+    server.api_token = token
+    server.quiet = quiet
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="واجهة HTTP/JSON لتسجيل البريد والبحث فيه")
+    parser.add_argument("--host", default="127.0.0.1", help="عنوان الاستماع (افتراضياً محلي فقط)")
+    parser.add_argument("--port", type=int, default=8601)
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--user", default="admin", help="المستخدم الذي تُسجل العمليات باسمه")
+    parser.add_argument("--token", default=os.environ.get("MAIL_API_TOKEN"),
+                        help="رمز Bearer المطلوب (أو متغير البيئة MAIL_API_TOKEN)")
+    parser.add_argument("--pool-size", type=int, default=4, help="عدد اتصالات قاعدة البيانات المعاد استعمالها")
+    parser.add_argument("--quiet", action="store_true", help="عدم طباعة سجل الطلبات")
+    parser.add_argument("--institution", default=None,
+                        help="المؤسسة الافتراضية للطلبات بدون ترويسة X-Institution (مع tenants.json)")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    for code in list(tenants.registry()) or [None]:
+        with tenants.use(code):
+            database.init_db()
+
+    server = create_server(args.host, args.port, args.user, args.token, args.pool_size, args.quiet,
+                           args.institution)
+    print(f"✅ واجهة البريد تعمل على http://{args.host}:{args.port}/api (المستخدم: {args.user})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for shard in server.shards.values():
+            shard.close()
@@ -1,17 +1,30 @@
 # app.py - مع سكربت إنشاء البوردرية المحدث والنظام المحسن
 import streamlit as st
 import pandas as pd
-import numpy as np
 import os
-import sqlite3
 from datetime import datetime, date, timedelta
-import json
-import tempfile
-import io
-import hashlib
-import secrets
-from database import get_db_connection, log_activity
-from docxtpl import DocxTemplate
+from database import active_db_path, init_db, log_activity
+from bulk_import import import_register, rejected_rows_to_csv
+import metrics
+import profiling
+import query_cache
+import query_trace
+import tenants
+from services import ConcurrentEditError, DuplicateReferenceError
+from services import actions as action_service
+from services import attachments as attachment_service
+from services import bordereau as bordereau_service
+from services import contact_merge as contact_merge_service
+from services import contacts as contact_service
+from services import duplicates as duplicate_service
+from services import exports as export_service
+from services import fulltext as fulltext_service
+from services.frames import days_until, format_day
+from services import mail as mail_service
+from services import sla as sla_service
+from services import stats as stats_service
+from services import threads as thread_service
+from services import users as user_service
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -22,6 +35,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# تصدير مقاييس التشغيل (مرة واحدة لكل عملية، حسب MAIL_METRICS_PORT / MAIL_METRICS_FILE)
+metrics.start_exporters()
+
 # تحميل التنسيقات
 try:
     with open('style.css', encoding='utf-8') as f:
@@ -54,42 +70,56 @@ if 'bordereau_buffer' not in st.session_state:
     st.session_state.bordereau_buffer = None
 if 'manage_users_mode' not in st.session_state:
     st.session_state.manage_users_mode = "view"
+if 'profile_cpu' not in st.session_state:
+    st.session_state.profile_cpu = False
+if 'profile_memory' not in st.session_state:
+    st.session_state.profile_memory = False
+if 'trace_statements' not in st.session_state:
+    st.session_state.trace_statements = False
+if 'due_reminders' not in st.session_state:
+    st.session_state.due_reminders = None
+if 'menu_options' not in st.session_state:
+    st.session_state.menu_options = None
+if 'edit_snapshot' not in st.session_state:
+    st.session_state.edit_snapshot = None
+if 'edit_conflict' not in st.session_state:
+    st.session_state.edit_conflict = None
+if 'tenant' not in st.session_state:
+    st.session_state.tenant = None
+
+def session_institution():
+    """رمز مؤسسة الجلسة الحالية (None في وضع المؤسسة الواحدة)"""
+    return st.session_state.get('tenant')
 
-# --- دالة التجزئة لكلمات المرور ---
-def hash_password(password):
-    """تجزئة كلمة المرور باستخدام SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+# كل اتصال بقاعدة البيانات في الجلسة (بما فيه إعادة تشغيل الأجزاء) يذهب لقاعدة مؤسستها
+tenants.set_resolver(session_institution)
 
-def generate_temp_password(length=8):
-    """توليد كلمة مرور مؤقتة"""
-    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%&"
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+@st.cache_resource(show_spinner="⏳ تهيئة قاعدة البيانات...")
+def migrate_database(db_path):
+    """إنشاء الجداول والمشغلات الناقصة وترحيل الأعمدة، مرة واحدة لكل قاعدة في عملية الخادم"""
+    init_db(db_path)
+    return db_path
+
+def ensure_database():
+    """تهيئة قاعدة مؤسسة الجلسة قبل أول استعلام عليها، مع إيقاف الصفحة إذا فشلت"""
+    try:
+        migrate_database(os.path.abspath(active_db_path()))
+    except Exception as e:
+        st.error(f"❌ تعذر تهيئة قاعدة البيانات: {e}")
+        st.stop()
+
+def institution_title():
+    """اسم مؤسسة الجلسة لعناوين الواجهة"""
+    tenant = tenants.active()
+    return tenant['name'] if tenant else "المدرسة الإعدادية حي الأمل"
 
 # --- نظام المصادقة المحسن ---
 def authenticate_user(username, password):
     """مصادقة المستخدم"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    hashed_password = hash_password(password)
-    
-    cursor.execute('''
-    SELECT id, username, full_name, role, email, is_active FROM users 
-    WHERE username = ? AND password = ? AND is_active = 1
-    ''', (username, hashed_password))
-    user = cursor.fetchone()
-    conn.close()
+    user = user_service.authenticate(username, password)
     
     if user:
-        st.session_state.user = {
-            'id': user[0],
-            'username': user[1],
-            'full_name': user[2],
-            'role': user[3],
-            'email': user[4],
-            'is_active': user[5]
-        }
-        log_activity(user[0], "تسجيل دخول", f"المستخدم {user[2]} سجل دخول")
+        st.session_state.user = user
         return True
     return False
 
@@ -98,7 +128,10 @@ def logout_user():
     if st.session_state.user:
         log_activity(st.session_state.user['id'], "تسجيل خروج")
     st.session_state.user = None
+    st.session_state.tenant = None
     st.session_state.page = "لوحة القيادة"
+    st.session_state.menu_options = None
+    invalidate_mail_views()
     st.rerun()
 
 def check_permission(required_permission="view"):
@@ -113,360 +146,112 @@ def check_permission(required_permission="view"):
     if not st.session_state.user:
         return False
     
-    user_role = st.session_state.user['role']
-    
-    # تعريف صلاحيات كل دور
-    permissions = {
-        'admin': ['view', 'add', 'edit', 'delete', 'manage_users', 'export'],
-        'user': ['view', 'add', 'edit', 'export'],
-        'viewer': ['view', 'export']
-    }
-    
-    # التحقق من أن الدور موجود في القائمة
-    if user_role not in permissions:
-        return False
-    
-    # التحقق من الصلاحية المطلوبة
-    return required_permission in permissions[user_role]
+    return user_service.has_permission(st.session_state.user['role'], required_permission)
 
 # --- وظائف إدارة المستخدمين ---
 def get_all_users():
     """جلب جميع المستخدمين"""
-    conn = get_db_connection()
     try:
-        df = pd.read_sql("""
-            SELECT id, username, full_name, role, email, 
-                   created_at, last_login, is_active,
-                   CASE WHEN role = 'admin' THEN 'مشرف'
-                        WHEN role = 'user' THEN 'مستخدم'
-                        WHEN role = 'viewer' THEN 'مستشار'
-                        ELSE role END as role_display
-            FROM users 
-            ORDER BY created_at DESC
-        """, conn)
+        return user_service.get_all_users()
     except Exception as e:
         st.error(f"خطأ في جلب المستخدمين: {str(e)}")
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    return df
+        return pd.DataFrame()
 
 def create_user(username, full_name, email, role, password=None):
     """إنشاء مستخدم جديد"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # التحقق من أن اسم المستخدم غير مستخدم
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
-            return False, "اسم المستخدم موجود مسبقاً"
-        
-        # توليد كلمة مرور مؤقتة إذا لم يتم تقديم واحدة
-        if not password:
-            temp_password = generate_temp_password()
-        else:
-            temp_password = password
-        
-        hashed_password = hash_password(temp_password)
-        
-        cursor.execute('''
-        INSERT INTO users (username, password, full_name, email, role, is_active, created_by)
-        VALUES (?, ?, ?, ?, ?, 1, ?)
-        ''', (username, hashed_password, full_name, email, role, st.session_state.user['id']))
-        
-        conn.commit()
-        log_activity(st.session_state.user['id'], "إنشاء مستخدم", 
-                   f"تم إنشاء مستخدم جديد: {username}")
-        
-        return True, temp_password
-    
-    except Exception as e:
-        return False, f"خطأ في إنشاء المستخدم: {str(e)}"
-    
-    finally:
-        conn.close()
+    return user_service.create_user(username, full_name, email, role, password,
+                                    actor_id=st.session_state.user['id'])
 
 def update_user(user_id, full_name=None, email=None, role=None, is_active=None):
     """تحديث بيانات المستخدم"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        updates = []
-        params = []
-        
-        if full_name is not None:
-            updates.append("full_name = ?")
-            params.append(full_name)
-        
-        if email is not None:
-            updates.append("email = ?")
-            params.append(email)
-        
-        if role is not None:
-            updates.append("role = ?")
-            params.append(role)
-        
-        if is_active is not None:
-            updates.append("is_active = ?")
-            params.append(1 if is_active else 0)
-        
-        if updates:
-            params.append(user_id)
-            query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
-            cursor.execute(query, params)
-            conn.commit()
-            
-            log_activity(st.session_state.user['id'], "تحديث مستخدم", 
-                       f"تم تحديث بيانات المستخدم ID: {user_id}")
-            return True, "تم تحديث بيانات المستخدم بنجاح"
-        
-        return False, "لا توجد تحديثات لإجرائها"
-    
-    except Exception as e:
-        return False, f"خطأ في تحديث المستخدم: {str(e)}"
-    
-    finally:
-        conn.close()
+    return user_service.update_user(user_id, full_name, email, role, is_active,
+                                    actor_id=st.session_state.user['id'])
 
 def reset_user_password(user_id):
     """إعادة تعيين كلمة مرور المستخدم"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # توليد كلمة مرور مؤقتة جديدة
-        temp_password = generate_temp_password()
-        hashed_password = hash_password(temp_password)
-        
-        cursor.execute("UPDATE users SET password = ? WHERE id = ?", 
-                      (hashed_password, user_id))
-        conn.commit()
-        
-        log_activity(st.session_state.user['id'], "إعادة تعيين كلمة مرور", 
-                   f"تم إعادة تعيين كلمة مرور المستخدم ID: {user_id}")
-        
-        return True, temp_password
-    
-    except Exception as e:
-        return False, f"خطأ في إعادة تعيين كلمة المرور: {str(e)}"
-    
-    finally:
-        conn.close()
+    return user_service.reset_user_password(user_id, actor_id=st.session_state.user['id'])
 
 def change_own_password(old_password, new_password):
     """تغيير كلمة مرور المستخدم الحالي"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # التحقق من كلمة المرور القديمة
-        user_id = st.session_state.user['id']
-        hashed_old = hash_password(old_password)
-        
-        cursor.execute("SELECT id FROM users WHERE id = ? AND password = ?", 
-                      (user_id, hashed_old))
-        
-        if not cursor.fetchone():
-            return False, "كلمة المرور القديمة غير صحيحة"
-        
-        # تحديث كلمة المرور الجديدة
-        hashed_new = hash_password(new_password)
-        cursor.execute("UPDATE users SET password = ? WHERE id = ?", 
-                      (hashed_new, user_id))
-        conn.commit()
-        
-        log_activity(user_id, "تغيير كلمة المرور", "تم تغيير كلمة المرور بنجاح")
-        return True, "تم تغيير كلمة المرور بنجاح"
-    
-    except Exception as e:
-        return False, f"خطأ في تغيير كلمة المرور: {str(e)}"
-    
-    finally:
-        conn.close()
+    return user_service.change_password(st.session_state.user['id'], old_password, new_password)
 
 def delete_user(user_id):
     """حذف مستخدم"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # التحقق من أن المستخدم ليس المشرف الوحيد
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin' AND is_active = 1")
-        admin_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        user_role = cursor.fetchone()[0]
-        
-        if user_role == 'admin' and admin_count <= 1:
-            return False, "لا يمكن حذف المشرف الوحيد في النظام"
-        
-        # حذف المستخدم
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
-        
-        log_activity(st.session_state.user['id'], "حذف مستخدم", 
-                   f"تم حذف المستخدم ID: {user_id}")
-        return True, "تم حذف المستخدم بنجاح"
-    
-    except Exception as e:
-        return False, f"خطأ في حذف المستخدم: {str(e)}"
-    
-    finally:
-        conn.close()
+    return user_service.delete_user(user_id, actor_id=st.session_state.user['id'])
 
 # --- الوظائف المساعدة ---
+@profiling.timed
 def generate_ref_no(mail_type="incoming"):
     """توليد رقم مرجعي بالتنسيق الجديد"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    current_month = datetime.now().strftime('%m')
-    current_year = datetime.now().strftime('%Y')
-    
-    prefix = "و" if mail_type == "incoming" else "ص"
-    
-    try:
-        if mail_type == "incoming":
-            cursor.execute(f'''
-            SELECT MAX(CAST(SUBSTR(reference_no, 3, 4) AS INTEGER)) 
-            FROM incoming_mail 
-            WHERE reference_no LIKE '{prefix}-____-{current_month}-{current_year}'
-            ''')
-        else:
-            cursor.execute(f'''
-            SELECT MAX(CAST(SUBSTR(reference_no, 3, 4) AS INTEGER)) 
-            FROM outgoing_mail 
-            WHERE reference_no LIKE '{prefix}-____-{current_month}-{current_year}'
-            ''')
-        
-        result = cursor.fetchone()[0]
-        count = result if result is not None else 0
-    except:
-        count = 0
-    
-    conn.close()
-    
-    return f"{prefix}-{count+1:04d}-{current_month}-{current_year}"
+    return mail_service.generate_ref_no(mail_type)
 
+@profiling.timed
 def get_contacts():
     """جلب جميع جهات الاتصال"""
-    conn = get_db_connection()
     try:
-        df = pd.read_sql("SELECT id, code, name, organization, phone, email FROM contacts ORDER BY name", conn)
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    return df
+        return contact_service.get_contacts()
+    except Exception:
+        return pd.DataFrame()
 
+@profiling.timed
 def get_users():
     """جلب جميع المستخدمين (للأغراض العامة)"""
-    conn = get_db_connection()
     try:
-        df = pd.read_sql("SELECT id, username, full_name, role FROM users WHERE is_active = 1 ORDER BY full_name", conn)
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    return df
+        return user_service.get_active_users()
+    except Exception:
+        return pd.DataFrame()
 
+@profiling.timed
 def get_contact_by_id(contact_id):
     """جلب معلومات جهة اتصال حسب ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name, organization, phone, email FROM contacts WHERE id = ?", (contact_id,))
-    contact = cursor.fetchone()
-    conn.close()
-    
-    if contact:
-        return {
-            'name': contact[0],
-            'organization': contact[1],
-            'phone': contact[2],
-            'email': contact[3]
-        }
-    return None
+    return contact_service.get_contact_by_id(contact_id)
 
+@profiling.timed
 def get_mail_by_id(mail_id, mail_type="incoming"):
     """جلب معلومات البريد حسب ID"""
-    conn = get_db_connection()
-    
-    if mail_type == "incoming":
-        query = "SELECT * FROM incoming_mail WHERE id = ?"
-    else:
-        query = "SELECT * FROM outgoing_mail WHERE id = ?"
-    
     try:
-        df = pd.read_sql(query, conn, params=(mail_id,))
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    
-    if not df.empty:
-        return df.iloc[0].to_dict()
-    return None
+        return mail_service.get_mail(mail_id, mail_type)
+    except Exception:
+        return None
 
+@profiling.timed
 def check_due_date_reminders():
     """فحص تواريخ الاستحقاق القريبة"""
-    conn = get_db_connection()
-    today = date.today()
-    three_days_later = today + timedelta(days=3)
-    
-    query = """
-    SELECT reference_no, subject, due_date, sender_name 
-    FROM incoming_mail 
-    WHERE due_date IS NOT NULL 
-    AND due_date BETWEEN ? AND ?
-    AND status NOT IN ('مكتمل', 'ملغي')
-    ORDER BY due_date
-    """
-    
     try:
-        df = pd.read_sql(query, conn, params=(today.strftime('%Y-%m-%d'), three_days_later.strftime('%Y-%m-%d')))
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    
-    return df
+        return mail_service.due_date_reminders(days=3)
+    except Exception:
+        return pd.DataFrame()
+
+def get_session_reminders():
+    """تنبيهات الاستحقاق محسوبة مرة واحدة في اليوم لكل جلسة (تُعاد بعد تعديل البريد)"""
+    cached = st.session_state.due_reminders
+    if cached is None or cached[0] != date.today():
+        st.session_state.due_reminders = (date.today(), check_due_date_reminders())
+    return st.session_state.due_reminders[1]
+
+def invalidate_mail_views():
+    """إعادة حساب التنبيهات في إعادة التشغيل القادمة (بعد تسجيل أو تعديل أو حذف بريد وارد)"""
+    st.session_state.due_reminders = None
 
 # --- وظائف إدارة الملفات ---
+@profiling.timed
 def save_uploaded_file(uploaded_file, mail_type="incoming"):
     """حفظ الملف المرفوع"""
     if uploaded_file is None:
         return None
     
-    upload_dir = f"uploads/{mail_type}"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_ext = os.path.splitext(uploaded_file.name)[1]
-    filename = f"{timestamp}_{uploaded_file.name}"
-    filepath = os.path.join(upload_dir, filename)
-    
     try:
-        with open(filepath, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return filepath
+        return attachment_service.save_attachment(uploaded_file.getbuffer(), uploaded_file.name, mail_type)
     except Exception as e:
         st.error(f"خطأ في حفظ الملف: {str(e)}")
         return None
 
 def get_attachment_list(attachments_json):
     """الحصول على قائمة المرفقات من JSON"""
-    if attachments_json and isinstance(attachments_json, str):
-        try:
-            return json.loads(attachments_json)
-        except:
-            return []
-    elif attachments_json and isinstance(attachments_json, list):
-        return attachments_json
-    return []
+    return attachment_service.get_attachment_list(attachments_json)
 
 # --- وظيفة إنشاء البوردرية باستخدام القالب ---
+@profiling.timed
 def generate_bordereau_for_mail(mail_data, contact_info=None):
     """
     إنشاء بوردرية للبريد الصادر باستخدام القالب الموجود
@@ -478,55 +263,143 @@ def generate_bordereau_for_mail(mail_data, contact_info=None):
     Returns:
         BytesIO: الملف الناتج في الذاكرة أو None إذا فشل
     """
-    template_path = "templates/bordereau_template.docx"
-    
-    # التحقق من وجود القالب
-    if not os.path.exists(template_path):
-        st.error("❌ قالب البوردرية غير موجود. الرجاء وضع القالب في: templates/bordereau_template.docx")
-        st.info("""
-        **متغيرات القالب المطلوبة:**
-        - {{ reference_no }} : رقم المرجع
-        - {{ sent_date }} : تاريخ الإرسال
-        - {{ recipient_name }} : اسم المستلم
-        - {{ organization }} : المؤسسة
-        - {{ phone }} : الهاتف
-        - {{ email }} : البريد الإلكتروني
-        - {{ subject }} : الموضوع
-        - {{ notes }} : الملاحظات
-        """)
-        return None
-    
     try:
-        # تحميل القالب
-        doc = DocxTemplate(template_path)
-        
-        # إعداد البيانات (Context)
-        context = {
-            'reference_no': mail_data.get('reference_no', 'غير محدد'),
-            'sent_date': mail_data.get('sent_date', 'غير محدد'),
-            'recipient_name': mail_data.get('recipient_name', 'غير محدد'),
-            'organization': contact_info.get('organization', '') if contact_info else '',
-            'phone': contact_info.get('phone', '') if contact_info else '',
-            'email': contact_info.get('email', '') if contact_info else '',
-            'subject': mail_data.get('subject', 'غير محدد'),
-            'notes': mail_data.get('notes', '')
-        }
-        
-        # تعبئة القالب بالبيانات
-        doc.render(context)
-        
-        # حفظ الملف في الذاكرة
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        
-        return buffer
-        
+        return bordereau_service.render_bordereau(mail_data, contact_info)
+    except bordereau_service.TemplateMissingError as e:
+        st.error(f"❌ {str(e)}")
+        st.info("**متغيرات القالب المطلوبة:**\n" + "\n".join(
+            f"- {{{{ {name} }}}} : {label}" for name, label in bordereau_service.TEMPLATE_VARIABLES.items()))
+        return None
     except Exception as e:
         st.error(f"❌ خطأ في إنشاء البوردرية: {str(e)}")
         return None
 
 # --- وظائف تعديل البريد ---
+# تسميات الحقول في عرض تعارض التعديل
+EDIT_FIELD_LABELS = {
+    'reference_no': "رقم المرجع",
+    'sender_id': "جهة المرسل",
+    'sender_name': "المرسل",
+    'recipient_id': "جهة المستلم",
+    'recipient_name': "المستلم",
+    'subject': "الموضوع",
+    'content': "المحتوى",
+    'received_date': "تاريخ الاستلام",
+    'sent_date': "تاريخ الإرسال",
+    'priority': "الأولوية",
+    'status': "الحالة",
+    'category': "التصنيف",
+    'due_date': "تاريخ الاستحقاق",
+    'attachments': "المرفقات",
+    'bordereau': "البوردرية",
+    'notes': "الملاحظات",
+    'reply_required': "مطلوب الرد"
+}
+
+def editing_snapshot(mail_id, mail_type):
+    """البريد كما فُتح عليه نموذج التعديل: ثابت حتى الحفظ أو الإلغاء، والحفظ مشروط بإصداره"""
+    snapshot = st.session_state.edit_snapshot
+    if snapshot is None or snapshot[:2] != (mail_type, mail_id):
+        mail_data = get_mail_by_id(mail_id, mail_type)
+        if mail_data is None:
+            return None
+        snapshot = st.session_state.edit_snapshot = (mail_type, mail_id, mail_data)
+    return snapshot[2]
+
+def finish_editing():
+    """نسيان نسخة النموذج والتعارض المعلق (بعد الحفظ أو الإلغاء أو مغادرة التعديل)"""
+    st.session_state.edit_snapshot = None
+    st.session_state.edit_conflict = None
+
+def remember_conflict(mail_type, mail_id, base, mine, error):
+    """حفظ التعارض لعرضه بدل النموذج في إعادة التشغيل القادمة"""
+    base = mail_service.edit_values(mail_type, base)
+    # الحقول التي لا يعرضها النموذج (None) لم يغيرها المستخدم
+    mine = {field: base[field] if value is None and field == 'reply_required' else value
+            for field, value in mail_service.edit_values(mail_type, mine).items()}
+    st.session_state.edit_conflict = {
+        'mail_type': mail_type,
+        'mail_id': mail_id,
+        'base': base,
+        'mine': mine,
+        'current': error.current,
+        'merged': error.merged,
+        'conflicts': error.conflicts
+    }
+
+def conflict_value(value):
+    """قيمة حقل مختصرة للعرض في جدول التعارض"""
+    if value is None or value == '':
+        return "-"
+    value = str(value)
+    return value if len(value) <= 80 else value[:80] + "…"
+
+def display_edit_conflict(mail_type, mail_id):
+    """
+    تعارض التعديل: الفروق بين نسخة النموذج وتعديل المستخدم والنسخة المحفوظة، واختيار قيمة كل
+    حقل تعارض ثم الحفظ المشروط بالإصدار المحفوظ حالياً
+    
+    Returns:
+        bool: True إذا كان هناك تعارض معروض لهذا البريد
+    """
+    conflict = st.session_state.edit_conflict
+    if not conflict or (conflict['mail_type'], conflict['mail_id']) != (mail_type, mail_id):
+        return False
+    
+    st.warning("⚠️ عدّل مستخدم آخر هذا البريد منذ فتحك للنموذج. دُمجت التعديلات غير المتعارضة تلقائياً، "
+               "اختر القيمة المعتمدة للحقول التي عدلها الطرفان.")
+    current = mail_service.edit_values(mail_type, conflict['current'])
+    changed = [field for field in conflict['merged']
+               if len({conflict_value(conflict['base'][field]), conflict_value(conflict['mine'][field]),
+                       conflict_value(current[field])}) > 1]
+    st.dataframe(pd.DataFrame([{
+        'الحقل': EDIT_FIELD_LABELS.get(field, field),
+        'عند فتح النموذج': conflict_value(conflict['base'][field]),
+        'تعديلي': conflict_value(conflict['mine'][field]),
+        'المحفوظ حالياً': conflict_value(current[field]),
+        'تعارض': '⚠️' if field in conflict['conflicts'] else ''
+    } for field in changed]), use_container_width=True, hide_index=True)
+    
+    resolved = dict(conflict['merged'])
+    for field in conflict['conflicts']:
+        choice = st.radio(EDIT_FIELD_LABELS.get(field, field), ["mine", "saved"], horizontal=True,
+                          format_func={"mine": f"تعديلي: {conflict_value(conflict['mine'][field])}",
+                                       "saved": f"المحفوظ حالياً: {conflict_value(current[field])}"}.get,
+                          key=f"conflict_{mail_type}_{field}")
+        if choice == "saved":
+            resolved[field] = current[field]
+    
+    col_save, col_discard = st.columns(2)
+    with col_save:
+        save = st.button("💾 حفظ بعد الدمج", key="save_merged_edit", use_container_width=True)
+    with col_discard:
+        st.button("↩️ تجاهل تعديلاتي", key="discard_edit", use_container_width=True, on_click=finish_editing)
+    
+    if save:
+        try:
+            if mail_type == "incoming":
+                mail_service.update_incoming(mail_id, resolved, previous=conflict['current'],
+                                             actor_id=st.session_state.user['id'])
+            else:
+                mail_service.update_outgoing(mail_id, resolved, previous=conflict['current'],
+                                             actor_id=st.session_state.user['id'])
+        except ConcurrentEditError as e:
+            # تعديل جديد أثناء حل التعارض: يُعرض التعارض مع النسخة الأحدث
+            remember_conflict(mail_type, mail_id, conflict['current'], resolved, e)
+            st.rerun()
+        except DuplicateReferenceError as e:
+            st.error(f"❌ {e}")
+        except Exception as e:
+            st.error(f"❌ خطأ في التحديث: {str(e)}")
+        else:
+            finish_editing()
+            invalidate_mail_views()
+            st.success("✅ تم حفظ التعديلات بعد الدمج")
+            st.rerun()
+    return True
+
+@st.fragment
+@profiling.timed
 def edit_incoming_mail(mail_id):
     """تعديل بريد وارد"""
     if not check_permission('edit'):
@@ -538,8 +411,11 @@ def edit_incoming_mail(mail_id):
     
     st.markdown('<div class="card"><h3>تعديل البريد الوارد</h3></div>', unsafe_allow_html=True)
     
-    # جلب بيانات البريد
-    mail_data = get_mail_by_id(mail_id, "incoming")
+    if display_edit_conflict("incoming", mail_id):
+        return
+    
+    # جلب بيانات البريد (النسخة التي فُتح عليها النموذج)
+    mail_data = editing_snapshot(mail_id, "incoming")
     
     if not mail_data:
         st.error("❌ لم يتم العثور على البريد المطلوب")
@@ -548,6 +424,11 @@ def edit_incoming_mail(mail_id):
                                                  st.rerun()])
         return
     
+    # مسودة من ملفات الماسح: الحفظ يستكمل البيانات وينقلها إلى "جديد"
+    is_draft = mail_data.get('status') == mail_service.DRAFT_STATUS
+    if is_draft:
+        st.info("📠 هذا البريد مسودة من الماسح الضوئي: اختر المرسل وأكمل البيانات ثم احفظ لتسجيله كبريد جديد.")
+    
     # جلب قائمة جهات الاتصال
     contacts_df = get_contacts()
     
@@ -603,10 +484,10 @@ def edit_incoming_mail(mail_id):
                                         value=datetime.strptime(mail_data.get('received_date', date.today().strftime('%Y-%m-%d')), '%Y-%m-%d').date())
             priority = st.selectbox("الأولوية", ["عادي", "مهم", "عاجل"], 
                                   index=["عادي", "مهم", "عاجل"].index(mail_data.get('priority', 'عادي')))
-            status = st.selectbox("الحالة", ["جديد", "قيد المعالجة", "مكتمل", "ملغي"], 
-                                index=["جديد", "قيد المعالجة", "مكتمل", "ملغي"].index(mail_data.get('status', 'جديد')))
+            status = st.selectbox("الحالة", mail_service.INCOMING_STATUSES, 
+                                index=mail_service.INCOMING_STATUSES.index("جديد" if is_draft else mail_data.get('status') or 'جديد'))
             category = st.selectbox("التصنيف", ["إداري", "مالي", "فني", "قانوني", "أخرى"], 
-                                  index=["إداري", "مالي", "فني", "قانوني", "أخرى"].index(mail_data.get('category', 'إداري')))
+                                  index=["إداري", "مالي", "فني", "قانوني", "أخرى"].index(mail_data.get('category') or 'إداري'))
         
         # تاريخ الاستحقاق
         due_date_val = mail_data.get('due_date')
@@ -653,15 +534,13 @@ def edit_incoming_mail(mail_id):
             if st.form_submit_button("إلغاء", use_container_width=True):
                 st.session_state.edit_mail_id = None
                 st.session_state.edit_mail_type = None
+                finish_editing()
                 st.rerun()
         
         if save_changes:
             if not sender_name or not subject:
                 st.error("الرجاء ملء الحقول الإلزامية (*)")
             else:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
                 try:
                     # حفظ المرفقات الجديدة
                     new_attachments = current_attachments.copy() if current_attachments else []
@@ -670,47 +549,42 @@ def edit_incoming_mail(mail_id):
                             filepath = save_uploaded_file(file, "incoming")
                             if filepath:
                                 new_attachments.append(os.path.basename(filepath))
-                    
-                    # تحديث البريد الوارد
-                    cursor.execute('''
-                    UPDATE incoming_mail 
-                    SET reference_no = ?, sender_id = ?, sender_name = ?, subject = ?, 
-                        content = ?, received_date = ?, priority = ?, status = ?, 
-                        category = ?, due_date = ?, attachments = ?, notes = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                    ''', (
-                        reference_no,
-                        sender_id,
-                        sender_name,
-                        subject,
-                        content,
-                        received_date.strftime('%Y-%m-%d'),
-                        priority,
-                        status,
-                        category,
-                        due_date.strftime('%Y-%m-%d') if due_date else None,
-                        json.dumps(new_attachments) if new_attachments else None,
-                        notes,
-                        mail_id
-                    ))
-                    
-                    conn.commit()
-                    log_activity(st.session_state.user['id'], "تعديل بريد وارد", 
-                               f"رقم المرجع: {reference_no}")
-                    
+
+                    # تحديث البريد الوارد (مشروط بإصدار النسخة التي فُتح عليها النموذج)
+                    edited = {
+                        'reference_no': reference_no,
+                        'sender_id': sender_id,
+                        'sender_name': sender_name,
+                        'subject': subject,
+                        'content': content,
+                        'received_date': received_date,
+                        'priority': priority,
+                        'status': status,
+                        'category': category,
+                        'due_date': due_date,
+                        'attachments': new_attachments,
+                        'notes': notes
+                    }
+                    mail_service.update_incoming(mail_id, edited, previous=mail_data,
+                                                 actor_id=st.session_state.user['id'])
+                    finish_editing()
+                    invalidate_mail_views()
+
                     st.success("✅ تم تحديث البريد الوارد بنجاح!")
-                    
+
                     # تأخير لإظهار الرسالة ثم العودة
                     st.rerun()
-                    
-                except sqlite3.IntegrityError:
-                    st.error(f"❌ رقم المرجع '{reference_no}' موجود مسبقاً لبريد آخر!")
+
+                except ConcurrentEditError as e:
+                    remember_conflict("incoming", mail_id, mail_data, edited, e)
+                    st.rerun()
+                except DuplicateReferenceError as e:
+                    st.error(f"❌ {e}")
                 except Exception as e:
                     st.error(f"❌ خطأ في التحديث: {str(e)}")
-                finally:
-                    conn.close()
 
+@st.fragment
+@profiling.timed
 def edit_outgoing_mail(mail_id):
     """تعديل بريد صادر"""
     if not check_permission('edit'):
@@ -722,8 +596,11 @@ def edit_outgoing_mail(mail_id):
     
     st.markdown('<div class="card"><h3>تعديل البريد الصادر</h3></div>', unsafe_allow_html=True)
     
-    # جلب بيانات البريد
-    mail_data = get_mail_by_id(mail_id, "outgoing")
+    if display_edit_conflict("outgoing", mail_id):
+        return
+    
+    # جلب بيانات البريد (النسخة التي فُتح عليها النموذج)
+    mail_data = editing_snapshot(mail_id, "outgoing")
     
     if not mail_data:
         st.error("❌ لم يتم العثور على البريد المطلوب")
@@ -800,6 +677,7 @@ def edit_outgoing_mail(mail_id):
             if st.form_submit_button("إلغاء", use_container_width=True):
                 st.session_state.edit_mail_id = None
                 st.session_state.edit_mail_type = None
+                finish_editing()
                 st.rerun()
         
         if save_changes:
@@ -808,9 +686,6 @@ def edit_outgoing_mail(mail_id):
             elif recipient_choice == "--- اختر من جهات الاتصال ---":
                 st.error("الرجاء اختيار المستلم من قائمة جهات الاتصال")
             else:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
                 try:
                     # حفظ المرفقات الجديدة
                     new_attachments = current_attachments.copy() if current_attachments else []
@@ -819,70 +694,42 @@ def edit_outgoing_mail(mail_id):
                             filepath = save_uploaded_file(file, "outgoing")
                             if filepath:
                                 new_attachments.append(os.path.basename(filepath))
-                    
-                    # التحقق إذا تم تغيير الحالة إلى "مرسل" وإنشاء بوردرية
-                    bordereau_filename = mail_data.get('bordereau')
-                    if status == "مرسل" and mail_data.get('status') != "مرسل" and recipient_id:
-                        # إنشاء بوردرية جديدة
-                        contact_info = get_contact_by_id(recipient_id)
-                        mail_context = {
-                            'reference_no': reference_no,
-                            'sent_date': sent_date.strftime('%Y-%m-%d'),
-                            'recipient_name': recipient_name,
-                            'subject': subject,
-                            'notes': notes
-                        }
-                        
-                        buffer = generate_bordereau_for_mail(mail_context, contact_info)
-                        
-                        if buffer:
-                            upload_dir = "uploads/bordereau"
-                            os.makedirs(upload_dir, exist_ok=True)
-                            bordereau_filename = f"بوردرية_{reference_no}.docx"
-                            bordereau_path = os.path.join(upload_dir, bordereau_filename)
-                            
-                            with open(bordereau_path, "wb") as f:
-                                f.write(buffer.getvalue())
-                            st.success("✅ تم إنشاء بوردرية جديدة!")
-                    
-                    # تحديث البريد الصادر
-                    cursor.execute('''
-                    UPDATE outgoing_mail 
-                    SET reference_no = ?, recipient_id = ?, recipient_name = ?, subject = ?, 
-                        content = ?, priority = ?, status = ?, sent_date = ?, 
-                        category = ?, attachments = ?, bordereau = ?, notes = ?,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                    ''', (
-                        reference_no,
-                        recipient_id,
-                        recipient_name,
-                        subject,
-                        content,
-                        priority,
-                        status,
-                        sent_date.strftime('%Y-%m-%d'),
-                        category,
-                        json.dumps(new_attachments) if new_attachments else None,
-                        bordereau_filename,
-                        notes,
-                        mail_id
-                    ))
-                    
-                    conn.commit()
-                    log_activity(st.session_state.user['id'], "تعديل بريد صادر", 
-                               f"رقم المرجع: {reference_no}")
-                    
+
+                    # تحديث البريد الصادر (مع إنشاء بوردرية إذا تم تغيير الحالة إلى "مرسل")
+                    edited = {
+                        'reference_no': reference_no,
+                        'recipient_id': recipient_id,
+                        'recipient_name': recipient_name,
+                        'subject': subject,
+                        'content': content,
+                        'priority': priority,
+                        'status': status,
+                        'sent_date': sent_date,
+                        'category': category,
+                        'attachments': new_attachments,
+                        'notes': notes
+                    }
+                    result = mail_service.update_outgoing(mail_id, edited, previous=mail_data,
+                                                          actor_id=st.session_state.user['id'])
+                    finish_editing()
+
+                    if result['bordereau_created']:
+                        st.success("✅ تم إنشاء بوردرية جديدة!")
+                    if result['bordereau_error']:
+                        st.error(f"❌ {result['bordereau_error']}")
+
                     st.success("✅ تم تحديث البريد الصادر بنجاح!")
                     st.rerun()
-                    
-                except sqlite3.IntegrityError:
-                    st.error(f"❌ رقم المرجع '{reference_no}' موجود مسبقاً لبريد آخر!")
+
+                except ConcurrentEditError as e:
+                    remember_conflict("outgoing", mail_id, mail_data, edited, e)
+                    st.rerun()
+                except DuplicateReferenceError as e:
+                    st.error(f"❌ {e}")
                 except Exception as e:
                     st.error(f"❌ خطأ في التحديث: {str(e)}")
-                finally:
-                    conn.close()
 
+@profiling.timed
 def view_mail_details(mail_id, mail_type):
     """عرض تفاصيل البريد"""
     st.markdown('<div class="card"><h3>تفاصيل البريد</h3></div>', unsafe_allow_html=True)
@@ -908,6 +755,9 @@ def view_mail_details(mail_id, mail_type):
     else:
         display_outgoing_details(mail_data)
     
+    display_mail_thread(mail_data, mail_type)
+    display_mail_actions(mail_data, mail_type)
+    
     # زر التعديل (إذا كان لدى المستخدم الصلاحية)
     if check_permission('edit'):
         if st.button("✏️ تعديل", use_container_width=True):
@@ -1002,7 +852,7 @@ def display_outgoing_details(mail_data):
     # البوردرية
     if mail_data.get('bordereau'):
         st.markdown("### 📄 البوردرية")
-        bordereau_path = f"uploads/bordereau/{mail_data['bordereau']}"
+        bordereau_path = bordereau_service.bordereau_path(mail_data['bordereau'])
         if os.path.exists(bordereau_path):
             with open(bordereau_path, "rb") as f:
                 bordereau_bytes = f.read()
@@ -1017,7 +867,116 @@ def display_outgoing_details(mail_data):
         else:
             st.warning("ملف البوردرية غير موجود")
 
+def display_mail_thread(mail_data, mail_type):
+    """حالة الرد وسلسلة المراسلات التي ينتمي إليها البريد، مع ربطه كرد على بريد آخر"""
+    st.markdown("### 🧵 سلسلة المراسلات")
+    if mail_type == "incoming":
+        if mail_data.get('reply_count'):
+            st.success(f"✅ تم الرد ({mail_data['reply_count']} رد، آخر رد: {mail_data.get('last_reply_date') or '-'})")
+        elif mail_data.get('reply_required'):
+            st.warning("⏳ بانتظار الرد")
+    
+    try:
+        thread = thread_service.get_thread(mail_data['id'], mail_type)
+    except Exception as e:
+        st.error(f"خطأ في جلب سلسلة المراسلات: {str(e)}")
+        return
+    
+    if len(thread) > 1:
+        current = (thread['mail_type'] == mail_type) & (thread['id'] == mail_data['id'])
+        thread = thread.assign(
+            mail_type=thread['mail_type'].map({'incoming': '📥 وارد', 'outgoing': '📤 صادر'}),
+            current=current.map({True: '👈', False: ''})
+        )
+        st.dataframe(thread[['current', 'mail_type', 'reference_no', 'mail_date', 'party', 'subject', 'status']].rename(columns={
+            'current': '',
+            'mail_type': 'النوع',
+            'reference_no': 'رقم المرجع',
+            'mail_date': 'التاريخ',
+            'party': 'المرسل / المستلم',
+            'subject': 'الموضوع',
+            'status': 'الحالة'
+        }), use_container_width=True, hide_index=True)
+    else:
+        st.caption("هذا البريد ليس جزءاً من سلسلة ردود")
+    
+    if not check_permission('edit'):
+        return
+    
+    parent_label = "البريد الصادر" if mail_type == "incoming" else "البريد الوارد"
+    col_ref, col_link, col_unlink = st.columns([2, 1, 1])
+    with col_ref:
+        parent_reference = st.text_input(f"رقم مرجع {parent_label} الذي يرد عليه", key="thread_parent_reference")
+    with col_link:
+        link = st.button("🔗 ربط كرد", key="thread_link", use_container_width=True, disabled=not parent_reference)
+    with col_unlink:
+        unlink = st.button("✂️ فك الربط", key="thread_unlink", use_container_width=True,
+                           disabled=not mail_data.get('reply_to_id'))
+    
+    if link or unlink:
+        reply_to_id = None
+        if link:
+            parent = mail_service.get_mail_by_reference(parent_reference.strip(), thread_service.other_type(mail_type))
+            if parent is None:
+                st.error(f"❌ لا يوجد {parent_label} برقم المرجع {parent_reference}")
+                return
+            reply_to_id = parent['id']
+        success, message = thread_service.set_reply_to(mail_data['id'], mail_type, reply_to_id,
+                                                       actor_id=st.session_state.user['id'])
+        if success:
+            invalidate_mail_views()
+            st.success(f"✅ {message}")
+            st.rerun()
+        else:
+            st.warning(f"⚠️ {message}")
+
+def display_mail_actions(mail_data, mail_type):
+    """إجراءات المتابعة المسجلة على البريد، مع تكليف مستخدم بإجراء جديد"""
+    st.markdown("### ✅ إجراءات المتابعة")
+    try:
+        actions = action_service.mail_actions(mail_data['id'], mail_type)
+    except Exception as e:
+        st.error(f"خطأ في جلب إجراءات المتابعة: {str(e)}")
+        return
+    
+    if actions.empty:
+        st.caption("لا توجد إجراءات متابعة لهذا البريد")
+    else:
+        st.dataframe(actions.drop(columns=['id']).rename(columns={
+            'action_type': 'الإجراء',
+            'description': 'الوصف',
+            'assigned_user': 'المكلف',
+            'due_date': 'تاريخ الاستحقاق',
+            'status': 'الحالة',
+            'completed_date': 'تاريخ الإكمال'
+        }), use_container_width=True, hide_index=True)
+    
+    if not check_permission('edit'):
+        return
+    
+    users = get_users()
+    with st.form("add_action_form", clear_on_submit=True):
+        col_type, col_user, col_due = st.columns(3)
+        with col_type:
+            action_type = st.selectbox("الإجراء", action_service.ACTION_TYPES)
+        with col_user:
+            assigned_to = st.selectbox("المكلف", users['id'].tolist() if not users.empty else [],
+                                       format_func=dict(zip(users['id'], users['full_name'])).get
+                                       if not users.empty else str)
+        with col_due:
+            due_date = st.date_input("تاريخ الاستحقاق", value=None)
+        description = st.text_input("الوصف")
+        if st.form_submit_button("➕ إضافة إجراء", use_container_width=True):
+            try:
+                action_service.create_action(mail_data['id'], mail_type, action_type, description or None,
+                                             assigned_to, due_date, actor_id=st.session_state.user['id'])
+                st.success("✅ تمت إضافة الإجراء")
+                st.rerun()
+            except Exception as e:
+                st.error(f"خطأ في إضافة الإجراء: {str(e)}")
+
 # --- وظيفة إنشاء البوردرية من صفحة مخصصة ---
+@profiling.timed
 def display_bordereau_generator():
     """عرض واجهة إنشاء البوردرية"""
     st.markdown('<div class="card"><h3>إنشاء بوردرية</h3></div>', unsafe_allow_html=True)
@@ -1099,23 +1058,16 @@ def create_new_bordereau():
                     if st.button("💾 حفظ البوردرية في النظام", use_container_width=True):
                         save_bordereau_to_system(reference_no, buffer)
 
+@profiling.timed
 def create_bordereau_from_existing_mail():
     """إنشاء بوردرية من بريد صادر موجود"""
     st.markdown("### إنشاء بوردرية من بريد صادر")
     
     # جلب البريد الصادر
-    conn = get_db_connection()
     try:
-        outgoing_df = pd.read_sql("""
-            SELECT id, reference_no, recipient_name, subject, sent_date, status
-            FROM outgoing_mail 
-            WHERE status IN ('مسودة', 'مرسل')
-            ORDER BY sent_date DESC
-        """, conn)
-    except:
+        outgoing_df = mail_service.list_outgoing_for_bordereau()
+    except Exception:
         outgoing_df = pd.DataFrame()
-    finally:
-        conn.close()
     
     if not outgoing_df.empty:
         # اختيار البريد
@@ -1183,28 +1135,11 @@ def create_bordereau_from_existing_mail():
                             
                             # تحديث البريد الصادر بملف البوردرية
                             if st.button("💾 تحديث البريد بالبوردرية", use_container_width=True):
-                                conn = get_db_connection()
-                                cursor = conn.cursor()
-                                
-                                bordereau_filename = f"بوردرية_{mail_data.get('reference_no')}.docx"
-                                upload_dir = "uploads/bordereau"
-                                os.makedirs(upload_dir, exist_ok=True)
-                                bordereau_path = os.path.join(upload_dir, bordereau_filename)
-                                
-                                with open(bordereau_path, "wb") as f:
-                                    f.write(buffer.getvalue())
-                                
-                                cursor.execute('''
-                                UPDATE outgoing_mail 
-                                SET bordereau = ?
-                                WHERE id = ?
-                                ''', (bordereau_filename, selected_id))
-                                
-                                conn.commit()
-                                conn.close()
-                                
-                                log_activity(st.session_state.user['id'], "إضافة بوردرية", 
-                                           f"للبريد الصادر: {mail_data.get('reference_no')}")
+                                bordereau_filename = bordereau_service.save_bordereau(
+                                    mail_data.get('reference_no'), buffer)
+                                mail_service.set_bordereau(selected_id, bordereau_filename,
+                                                           mail_data.get('reference_no'),
+                                                           actor_id=st.session_state.user['id'])
                                 
                                 st.success("✅ تم تحديث البريد بملف البوردرية!")
                 else:
@@ -1214,15 +1149,9 @@ def create_bordereau_from_existing_mail():
 
 def save_bordereau_to_system(reference_no, buffer):
     """حفظ البوردرية في النظام"""
-    upload_dir = "uploads/bordereau"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    filename = f"بوردرية_{reference_no}.docx"
-    filepath = os.path.join(upload_dir, filename)
-    
     try:
-        with open(filepath, "wb") as f:
-            f.write(buffer.getvalue())
+        filename = bordereau_service.save_bordereau(reference_no, buffer)
+        filepath = bordereau_service.bordereau_path(filename)
         
         log_activity(st.session_state.user['id'], "حفظ بوردرية", 
                    f"البوردرية: {filename}")
@@ -1231,34 +1160,15 @@ def save_bordereau_to_system(reference_no, buffer):
     except Exception as e:
         st.error(f"❌ خطأ في حفظ البوردرية: {str(e)}")
 
+@profiling.timed
 def show_incoming_stats():
     """عرض إحصائيات البريد الوارد"""
-    conn = get_db_connection()
-    
     try:
-        # إحصائيات حسب الحالة
-        status_stats = pd.read_sql("""
-            SELECT status as 'الحالة', COUNT(*) as 'العدد'
-            FROM incoming_mail
-            GROUP BY status
-            ORDER BY COUNT(*) DESC
-        """, conn)
-        
-        # إحصائيات حسب الأولوية
-        priority_stats = pd.read_sql("""
-            SELECT priority as 'الأولوية', COUNT(*) as 'العدد'
-            FROM incoming_mail
-            GROUP BY priority
-            ORDER BY COUNT(*) DESC
-        """, conn)
-        
-        # إحصائيات حسب التصنيف
-        category_stats = pd.read_sql("""
-            SELECT category as 'التصنيف', COUNT(*) as 'العدد'
-            FROM incoming_mail
-            GROUP BY category
-            ORDER BY COUNT(*) DESC
-        """, conn)
+        stats = stats_service.incoming_breakdown(months=6)
+        status_stats = stats['status']
+        priority_stats = stats['priority']
+        category_stats = stats['category']
+        monthly_stats = stats['monthly']
         
         col1, col2, col3 = st.columns(3)
         
@@ -1275,113 +1185,199 @@ def show_incoming_stats():
             st.dataframe(category_stats, use_container_width=True, hide_index=True)
         
         # إحصائيات شهرية
-        monthly_stats = pd.read_sql("""
-            SELECT strftime('%Y-%m', received_date) as 'الشهر', COUNT(*) as 'عدد الرسائل'
-            FROM incoming_mail
-            GROUP BY strftime('%Y-%m', received_date)
-            ORDER BY strftime('%Y-%m', received_date) DESC
-            LIMIT 6
-        """, conn)
-        
         if not monthly_stats.empty:
             st.markdown("##### الإحصائيات الشهرية (آخر 6 أشهر)")
             st.dataframe(monthly_stats, use_container_width=True, hide_index=True)
         
     except Exception as e:
         st.error(f"خطأ في جلب الإحصائيات: {str(e)}")
-    finally:
-        conn.close()
+
+@profiling.timed
+def display_sla_report():
+    """آجال معالجة البريد الوارد من مجاميع انتقالات الحالة"""
+    st.markdown('<div class="card"><h3>آجال معالجة البريد</h3></div>', unsafe_allow_html=True)
+    
+    col_period, col_group = st.columns(2)
+    with col_period:
+        months = st.selectbox("الفترة", [3, 6, 12, 24], index=2, format_func=lambda m: f"آخر {m} شهراً",
+                              key="sla_months")
+    with col_group:
+        group_labels = {'category': "التصنيف", 'priority': "الأولوية", 'month': "الشهر"}
+        group_by = st.selectbox("التجميع حسب", list(group_labels), format_func=group_labels.get, key="sla_group")
+    
+    try:
+        overall = sla_service.handling_report(months, group_by=None)
+        by_group = sla_service.handling_report(months, group_by=group_by)
+        by_status = sla_service.status_time_report(months)
+        overdue = sla_service.open_overdue()
+    except Exception as e:
+        st.error(f"خطأ في جلب آجال المعالجة: {str(e)}")
+        return
+    
+    col1, col2, col3, col4, col5 = st.columns(5)
+    if not overall.empty:
+        summary = overall.iloc[0]
+        col1.metric("✅ بريد مكتمل", int(summary['المكتمل']))
+        col2.metric("⏱️ الوسيط", f"{summary['الوسيط (ساعة)']} ساعة")
+        col3.metric("📈 p90", f"{summary['p90 (ساعة)']} ساعة")
+        col4.metric("⚠️ مكتمل بعد الاستحقاق", f"{summary['نسبة التأخر %']}%")
+    col5.metric("⏰ مفتوح متجاوز للاستحقاق", f"{overdue['overdue']} / {overdue['with_due_date']}")
+    
+    if overall.empty:
+        st.info("📭 لم يُسجل أي اكتمال لبريد وارد في هذه الفترة بعد")
+    else:
+        st.markdown(f"##### مدة المعالجة حسب {group_labels[group_by]}")
+        st.dataframe(by_group, use_container_width=True, hide_index=True)
+    
+    if not by_status.empty:
+        st.markdown("##### المدة في كل حالة قبل مغادرتها")
+        st.dataframe(by_status, use_container_width=True, hide_index=True)
+    st.caption("تُحسب المدد من سجل انتقالات الحالة؛ الوسيط و p90 تقريبيان داخل شرائح المدة.")
+
+def my_task_counts():
+    """عدد إجراءات المستخدم المفتوحة والمتأخرة للشريط الجانبي (None عند الخطأ)"""
+    try:
+        return action_service.queue_counts(st.session_state.user['id'])
+    except Exception:
+        return None
+
+@profiling.timed
+def display_my_tasks():
+    """قائمة مهام المستخدم: إجراءات المتابعة المفتوحة المكلف بها"""
+    st.markdown('<div class="card"><h3>مهامي</h3></div>', unsafe_allow_html=True)
+    
+    user_id = st.session_state.user['id']
+    if check_permission('manage_users'):
+        users = get_users()
+        if not users.empty:
+            names = dict(zip(users['id'], users['full_name']))
+            ids = users['id'].tolist()
+            user_id = st.selectbox("قائمة مهام المستخدم", ids, format_func=names.get,
+                                   index=ids.index(user_id) if user_id in ids else 0, key="tasks_user")
+    my_tasks_panel(user_id)
+
+@st.fragment
+def my_tasks_panel(user_id):
+    """صفحة من قائمة المهام مع الإكمال وإعادة التكليف الجماعيين (التنقل يعيد تشغيل هذا الجزء فقط)"""
+    # مؤشرات الصفحات المعروضة لهذا المستخدم: الأول None (الأقرب استحقاقاً)
+    pages = st.session_state.get('task_queue_pages')
+    if not pages or pages[0] != user_id:
+        pages = st.session_state.task_queue_pages = [user_id, None]
+    
+    try:
+        counts = action_service.queue_counts(user_id)
+        queue, next_cursor = action_service.user_queue(user_id, cursor=pages[-1])
+    except Exception as e:
+        st.error(f"خطأ في جلب قائمة المهام: {str(e)}")
+        return
+    
+    col1, col2 = st.columns(2)
+    col1.metric("📋 مهام مفتوحة", counts['open'])
+    col2.metric("⏰ متأخرة", counts['overdue'])
+    
+    if queue.empty:
+        st.success("✅ لا توجد مهام مفتوحة")
+        return
+    
+    today = date.today().strftime('%Y-%m-%d')
+    queue = queue.assign(
+        selected=False,
+        mail_type=queue['mail_type'].map({'incoming': '📥 وارد', 'outgoing': '📤 صادر'}),
+        late=queue['due_date'].map(lambda due: '⏰' if due and due < today else '')
+    )
+    edited = st.data_editor(
+        queue[['selected', 'late', 'due_date', 'action_type', 'mail_type', 'reference_no', 'subject',
+               'description', 'status']].rename(columns={
+            'selected': 'تحديد',
+            'late': '',
+            'due_date': 'تاريخ الاستحقاق',
+            'action_type': 'الإجراء',
+            'mail_type': 'النوع',
+            'reference_no': 'رقم المرجع',
+            'subject': 'الموضوع',
+            'description': 'الوصف',
+            'status': 'الحالة'
+        }),
+        disabled=['', 'تاريخ الاستحقاق', 'الإجراء', 'النوع', 'رقم المرجع', 'الموضوع', 'الوصف', 'الحالة'],
+        use_container_width=True, hide_index=True, key=f"task_queue_{user_id}_{len(pages)}"
+    )
+    selected = queue['id'][edited['تحديد'].to_numpy()].tolist()
+    
+    col_newer, col_page, col_later = st.columns([1, 1, 1])
+    with col_newer:
+        st.button("⬅️ السابقة", key="tasks_previous", use_container_width=True, disabled=len(pages) <= 2,
+                  on_click=pages.pop)
+    with col_page:
+        st.caption(f"الصفحة {len(pages) - 1}")
+    with col_later:
+        st.button("التالية ➡️", key="tasks_next", use_container_width=True, disabled=next_cursor is None,
+                  on_click=pages.append, args=(next_cursor,))
+    
+    if not check_permission('edit'):
+        return
+    
+    users = get_users()
+    col_complete, col_user, col_reassign = st.columns([1, 1, 1])
+    with col_complete:
+        complete = st.button(f"✅ إكمال المحدد ({len(selected)})", key="tasks_complete",
+                             use_container_width=True, disabled=not selected)
+    with col_user:
+        assignee = st.selectbox("تكليف", users['id'].tolist() if not users.empty else [],
+                                format_func=dict(zip(users['id'], users['full_name'])).get if not users.empty else str,
+                                key="tasks_assignee", label_visibility="collapsed")
+    with col_reassign:
+        reassign = st.button("👤 إعادة تكليف المحدد", key="tasks_reassign", use_container_width=True,
+                             disabled=not selected or assignee is None)
+    
+    if complete or reassign:
+        try:
+            if complete:
+                success, message = action_service.complete_actions(selected, actor_id=st.session_state.user['id'])
+            else:
+                success, message = action_service.reassign_actions(selected, assignee,
+                                                                   actor_id=st.session_state.user['id'])
+        except Exception as e:
+            success, message = False, f"خطأ في تحديث المهام: {str(e)}"
+        if success:
+            # العودة إلى الصفحة الأولى: المؤشرات المحفوظة قد تشير إلى مهام لم تعد في القائمة
+            del pages[2:]
+            st.success(f"✅ {message}")
+            st.rerun()
+        else:
+            st.warning(f"⚠️ {message}")
 
 # --- وظائف تصدير إلى Excel ---
+@profiling.timed
 def export_incoming_to_excel():
     """تصدير البريد الوارد إلى Excel"""
     if not check_permission('export'):
         return None
     
-    conn = get_db_connection()
-    
-    query = """
-    SELECT 
-        reference_no as 'رقم المرجع',
-        sender_name as 'المرسل',
-        received_date as 'تاريخ الاستلام',
-        subject as 'الموضوع',
-        priority as 'الأولوية',
-        status as 'الحالة',
-        category as 'التصنيف',
-        due_date as 'تاريخ الاستحقاق',
-        notes as 'ملاحظات'
-    FROM incoming_mail
-    ORDER BY received_date DESC
-    """
-    
     try:
-        df = pd.read_sql(query, conn)
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
-    
-    if not df.empty:
-        # إنشاء ملف Excel في الذاكرة
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='البريد الوارد')
-            
-            # تحسين عرض الأعمدة
-            worksheet = writer.sheets['البريد الوارد']
-            for idx, col in enumerate(df.columns):
-                column_width = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.column_dimensions[chr(65 + idx)].width = min(column_width, 50)
-        
-        output.seek(0)
-        return output
-    else:
+        return export_service.export_incoming()
+    except Exception:
         return None
 
+@profiling.timed
 def export_outgoing_to_excel():
     """تصدير البريد الصادر إلى Excel"""
     if not check_permission('export'):
         return None
     
-    conn = get_db_connection()
-    
-    query = """
-    SELECT 
-        reference_no as 'رقم المرجع',
-        recipient_name as 'المستلم',
-        sent_date as 'تاريخ الإرسال',
-        subject as 'الموضوع',
-        priority as 'الأولوية',
-        status as 'الحالة',
-        category as 'التصنيف',
-        notes as 'ملاحظات'
-    FROM outgoing_mail
-    ORDER BY sent_date DESC
-    """
-    
     try:
-        df = pd.read_sql(query, conn)
-    except:
-        df = pd.DataFrame()
-    finally:
-        conn.close()
+        return export_service.export_outgoing()
+    except Exception:
+        return None
+
+@profiling.timed
+def export_contact_timeline_to_excel(contact_id):
+    """تصدير مراسلات جهة اتصال إلى Excel"""
+    if not check_permission('export'):
+        return None
     
-    if not df.empty:
-        # إنشاء ملف Excel في الذاكرة
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='البريد الصادر')
-            
-            # تحسين عرض الأعمدة
-            worksheet = writer.sheets['البريد الصادر']
-            for idx, col in enumerate(df.columns):
-                column_width = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.column_dimensions[chr(65 + idx)].width = min(column_width, 50)
-        
-        output.seek(0)
-        return output
-    else:
+    try:
+        return export_service.export_contact_timeline(contact_id)
+    except Exception:
         return None
 
 # --- شاشة تسجيل الدخول ---
@@ -1421,18 +1417,28 @@ def login_screen():
         st.markdown('<p style="text-align: center; color: #666; margin-bottom: 30px;">الرجاء تسجيل الدخول للوصول إلى النظام</p>', unsafe_allow_html=True)
         
         with st.form("login_form"):
+            institutions = tenants.registry()
+            institution = None
+            if institutions:
+                institution = st.selectbox("المؤسسة", list(institutions),
+                                           format_func=lambda code: institutions[code]['name'])
             username = st.text_input("اسم المستخدم", placeholder="أدخل اسم المستخدم")
             password = st.text_input("كلمة المرور", type="password", placeholder="أدخل كلمة المرور")
             submit = st.form_submit_button("تسجيل الدخول", use_container_width=True)
             
             if submit:
+                # المصادقة على قاعدة المؤسسة المختارة
+                st.session_state.tenant = institution
+                ensure_database()
                 if authenticate_user(username, password):
                     st.success(f"مرحباً {st.session_state.user['full_name']}!")
                     st.rerun()
                 else:
+                    st.session_state.tenant = None
                     st.error("اسم المستخدم أو كلمة المرور غير صحيحة")
 
 # --- واجهة إدارة المستخدمين ---
+@profiling.timed
 def display_user_management():
     """عرض واجهة إدارة المستخدمين"""
     st.markdown('<div class="card"><h3>إدارة المستخدمين</h3></div>', unsafe_allow_html=True)
@@ -1722,55 +1728,371 @@ def display_change_password_form():
                 else:
                     st.error(message)
 
+# --- واجهة استيراد السجلات القديمة ---
+@profiling.timed
+def display_bulk_import():
+    """عرض واجهة استيراد السجلات الورقية من Excel/CSV"""
+    st.markdown('<div class="card"><h3>استيراد السجلات القديمة</h3></div>', unsafe_allow_html=True)
+    
+    if not check_permission('manage_users'):
+        st.warning("⚠️ ليس لديك الصلاحية لاستيراد السجلات")
+        return
+    
+    st.info("""
+    **الأعمدة المعتمدة (الصف الأول من الملف):**
+    رقم المرجع (اختياري) - المرسل/المستلم * - تاريخ الاستلام/الإرسال * - الموضوع * -
+    الأولوية - الحالة - التصنيف - تاريخ الاستحقاق - ملاحظات
+    """)
+    
+    mail_type = st.radio("نوع السجل", ["incoming", "outgoing"], horizontal=True,
+                         format_func=lambda x: "بريد وارد" if x == "incoming" else "بريد صادر")
+    uploaded_file = st.file_uploader("ملف السجل", type=['xlsx', 'csv'])
+    
+    if uploaded_file and st.button("📥 بدء الاستيراد", use_container_width=True):
+        progress_text = st.empty()
+        
+        try:
+            with st.spinner("جاري الاستيراد..."):
+                summary = import_register(
+                    uploaded_file,
+                    uploaded_file.name,
+                    mail_type,
+                    user_id=st.session_state.user['id'],
+                    progress=lambda n: progress_text.text(f"تمت معالجة {n:,} صف")
+                )
+        except ValueError as e:
+            st.error(f"❌ {str(e)}")
+            return
+        except Exception as e:
+            st.error(f"❌ خطأ في الاستيراد: {str(e)}")
+            return
+        
+        invalidate_mail_views()
+        st.success(f"✅ تم استيراد {summary['imported']:,} بريد في {summary['seconds']} ثانية")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("بريد مستورد", summary['imported'])
+        with col2:
+            st.metric("جهات اتصال جديدة", summary['contacts_created'])
+        with col3:
+            st.metric("صفوف مرفوضة", summary['rejected'])
+        
+        if summary['rejected_rows']:
+            st.markdown("#### الصفوف المرفوضة")
+            rejected_df = pd.DataFrame(summary['rejected_rows']).rename(columns={
+                'line': 'السطر',
+                'reason': 'السبب',
+                'reference_no': 'رقم المرجع',
+                'party_name': 'الجهة',
+                'subject': 'الموضوع'
+            })
+            st.dataframe(rejected_df.head(500), use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 تحميل تقرير الصفوف المرفوضة",
+                data=rejected_rows_to_csv(summary['rejected_rows']),
+                file_name=f"صفوف_مرفوضة_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+
+# --- لوحات تتبع الاستعلامات وقياس الأزمنة (للمشرف) ---
+def display_query_debug_panel(trace):
+    """عرض استعلامات SQL المنفذة في إعادة التشغيل الحالية ومجاميع كل صفحة"""
+    if not trace:
+        return
+    
+    title = f"🐞 الاستعلامات: {trace['count']} استعلام في {trace['total_ms']:.1f} ms (الصفحة: {trace['wall_ms']:.0f} ms)"
+    with st.expander(title, expanded=False):
+        if not query_trace.ENABLED:
+            st.caption("تتبع الاستعلامات معطل بمتغير البيئة MAIL_SQL_TRACE=0")
+        st.checkbox("عدّ العبارات وبرامج المشغلات", key="trace_statements",
+                    help="يُطبق على إعادة التشغيل التالية، ويبطئ الكتابات ذات المعاملات الكثيرة")
+        if trace['queries']:
+            queries_df = pd.DataFrame(trace['queries'])
+            queries_df = queries_df.rename(columns={
+                'caller': 'الدالة',
+                'duration_ms': 'المدة (ms)',
+                'rows': 'الصفوف',
+                'steps': 'خطوات المحرك',
+                'statements': 'العبارات',
+                'kind': 'النوع',
+                'sql': 'الاستعلام'
+            })
+            st.dataframe(queries_df, use_container_width=True, hide_index=True)
+            
+            # المجموع حسب الدالة المستدعية
+            by_caller = (pd.DataFrame(trace['queries'])
+                         .groupby('caller')
+                         .agg(count=('sql', 'size'), total_ms=('duration_ms', 'sum'), rows=('rows', 'sum'))
+                         .sort_values('total_ms', ascending=False)
+                         .reset_index())
+            st.markdown("##### حسب الدالة")
+            st.dataframe(by_caller, use_container_width=True, hide_index=True)
+        
+        page_stats = query_trace.page_stats()
+        if page_stats:
+            st.markdown("##### مجاميع الصفحات منذ تشغيل الخادم")
+            stats_df = pd.DataFrame.from_dict(page_stats, orient='index').rename_axis('الصفحة').reset_index()
+            st.dataframe(stats_df, use_container_width=True, hide_index=True)
+        
+        cache = query_cache.stats()
+        st.markdown("##### الذاكرة المؤقتة للاستعلامات")
+        st.caption(f"إصابات: {cache['hits']:,} | إخفاقات: {cache['misses']:,} | نسبة الإصابة: {cache['hit_ratio']:.0%} | "
+                   f"عناصر: {cache['entries']:,} | الحجم: {cache['bytes'] / 1024 / 1024:.1f} من "
+                   f"{cache['max_bytes'] / 1024 / 1024:.0f} MB | طرد: {cache['evictions']:,}")
+        
+        st.caption(f"الاستعلامات الأبطأ من {query_trace.SLOW_QUERY_MS:.0f} ms تُسجل في {query_trace.SLOW_QUERY_LOG}")
+
+def display_profiling_panel(timing):
+    """عرض أزمنة إعادة التشغيل الحالية وسجل الأزمنة (p50/p95) مع خيارات التحليل"""
+    if not timing:
+        return
+    
+    with st.expander(f"⏱️ زمن إعادة التشغيل: {timing['total_ms']:.0f} ms", expanded=False):
+        col_cpu, col_memory = st.columns(2)
+        with col_cpu:
+            st.checkbox("تحليل المعالج (cProfile)", key="profile_cpu",
+                        help="يُطبق على إعادة التشغيل التالية")
+        with col_memory:
+            st.checkbox("تحليل الذاكرة (tracemalloc)", key="profile_memory",
+                        help="يُطبق على إعادة التشغيل التالية")
+        
+        if timing['spans']:
+            spans_df = pd.DataFrame(timing['spans'])
+            spans_df['name'] = spans_df.apply(lambda row: "  " * row['depth'] + row['name'], axis=1)
+            st.dataframe(spans_df[['name', 'start_ms', 'duration_ms']].rename(columns={
+                'name': 'المرحلة', 'start_ms': 'البداية (ms)', 'duration_ms': 'المدة (ms)'
+            }), use_container_width=True, hide_index=True)
+        
+        if timing['cpu_profile']:
+            st.markdown("##### cProfile (مرتب حسب الزمن التراكمي)")
+            st.code(timing['cpu_profile'], language=None)
+        
+        if timing['memory']:
+            st.markdown(f"##### الذاكرة: الذروة {timing['memory']['peak_kb']:,.0f} KB")
+            st.dataframe(pd.DataFrame(timing['memory']['top']), use_container_width=True, hide_index=True)
+        
+        summary = profiling.summary()
+        if summary:
+            st.markdown("##### سجل الأزمنة (p50 / p95)")
+            st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 تصدير سجل الأزمنة (CSV)",
+                data=profiling.history_csv(),
+                file_name=f"أزمنة_الصفحات_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                mime="text/csv",
+                key="export_timing_history"
+            )
+
+# --- أدوات قوائم البريد (أجزاء st.fragment) ---
+MAIL_PAGE_SIZE = 25
+
+def set_mail_filter(filter_name, page_key):
+    """تغيير التصفية والعودة للصفحة الأولى (callback لأزرار التصفية)"""
+    st.session_state.mail_filter = filter_name
+    st.session_state[page_key] = 1
+
+def paginate(df, page_key, page_size=MAIL_PAGE_SIZE):
+    """عرض أزرار التصفح وإرجاع صفوف الصفحة الحالية"""
+    pages = max(1, -(-len(df) // page_size))
+    current = min(max(st.session_state.get(page_key, 1), 1), pages)
+    st.session_state[page_key] = current
+    
+    if pages > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("→ السابق", key=f"{page_key}_prev", disabled=current <= 1, use_container_width=True,
+                      on_click=lambda: st.session_state.update({page_key: current - 1}))
+        with col_info:
+            st.markdown(f'<div style="text-align: center;">الصفحة {current} من {pages}</div>',
+                        unsafe_allow_html=True)
+        with col_next:
+            st.button("التالي ←", key=f"{page_key}_next", disabled=current >= pages, use_container_width=True,
+                      on_click=lambda: st.session_state.update({page_key: current + 1}))
+    
+    return df.iloc[(current - 1) * page_size:current * page_size]
+
+def selected_mail(mail_type):
+    """معرفات البريد المحدد للعمليات الجماعية (تبقى عبر صفحات القائمة)"""
+    return st.session_state.setdefault(f"selected_{mail_type}", set())
+
+def toggle_mail_selection(mail_type, mail_id):
+    """callback لمربع تحديد بريد في القائمة"""
+    if st.session_state[f"select_{mail_type}_{mail_id}"]:
+        selected_mail(mail_type).add(mail_id)
+    else:
+        selected_mail(mail_type).discard(mail_id)
+
+def mail_select_checkbox(mail_type, mail_id):
+    """مربع تحديد البريد (حالته من مجموعة المحدد لتتبع "تحديد الكل" و"مسح التحديد")"""
+    key = f"select_{mail_type}_{mail_id}"
+    st.session_state[key] = mail_id in selected_mail(mail_type)
+    st.checkbox("تحديد", key=key, label_visibility="collapsed",
+                on_change=toggle_mail_selection, args=(mail_type, mail_id))
+
+def request_delete(mail_type, mail_id):
+    """callback لزر الحذف: طلب التأكيد في إعادة التشغيل القادمة"""
+    st.session_state.confirm_delete = (mail_type, mail_id)
+
+def delete_confirmation(mail_type, row):
+    """أزرار تأكيد الحذف أو إلغائه تحت البريد المطلوب حذفه"""
+    if st.session_state.get('confirm_delete') != (mail_type, row['id']):
+        return
+    col_confirm, col_cancel = st.columns(2)
+    with col_confirm:
+        confirm = st.button(f"⚠️ تأكيد حذف {row['reference_no']}", key=f"confirm_delete_{mail_type}_{row['id']}",
+                            use_container_width=True)
+    with col_cancel:
+        st.button("إلغاء", key=f"cancel_delete_{mail_type}_{row['id']}", use_container_width=True,
+                  on_click=st.session_state.pop, args=('confirm_delete', None))
+    if confirm:
+        st.session_state.confirm_delete = None
+        selected_mail(mail_type).discard(row['id'])
+        mail_service.delete_mail(row['id'], mail_type, row['reference_no'], actor_id=st.session_state.user['id'])
+        invalidate_mail_views()
+        st.success("تم حذف البريد الوارد" if mail_type == "incoming" else "تم حذف البريد الصادر")
+        st.rerun()
+
+def mail_bulk_panel(df, mail_type):
+    """تحديد البريد المعروض بعد التصفية والعمليات الجماعية عليه (كل عملية استعلام واحد)"""
+    if not check_permission('edit'):
+        return
+    
+    selected = selected_mail(mail_type)
+    # العمليات تشمل المحدد الظاهر في التصفية والبحث الحاليين فقط
+    ids = [mail_id for mail_id in df['id'].tolist() if mail_id in selected]
+    
+    col_all, col_clear, col_count = st.columns([1, 1, 2])
+    with col_all:
+        st.button(f"☑️ تحديد كل النتائج ({len(df)})", key=f"select_all_{mail_type}", use_container_width=True,
+                  on_click=selected.update, args=(df['id'].tolist(),))
+    with col_clear:
+        st.button("✖️ مسح التحديد", key=f"clear_selection_{mail_type}", use_container_width=True,
+                  disabled=not selected, on_click=selected.clear)
+    with col_count:
+        st.markdown(f"**المحدد:** {len(ids)} بريد")
+    
+    if not ids:
+        return
+    
+    with st.expander(f"⚡ عمليات جماعية على {len(ids)} بريد", expanded=True):
+        statuses = mail_service.OUTGOING_STATUSES if mail_type == "outgoing" else mail_service.INCOMING_STATUSES
+        col_status, col_apply = st.columns([2, 1])
+        with col_status:
+            status = st.selectbox("الحالة الجديدة", statuses, key=f"bulk_status_{mail_type}")
+        with col_apply:
+            st.markdown("<br>", unsafe_allow_html=True)
+            change_status = st.button("🔄 تغيير الحالة", key=f"bulk_status_apply_{mail_type}",
+                                      use_container_width=True)
+        
+        users = get_users()
+        col_user, col_type, col_due, col_assign = st.columns([2, 1, 1, 1])
+        with col_user:
+            assignee = st.selectbox("تكليف المستخدم", users['id'].tolist() if not users.empty else [],
+                                    format_func=dict(zip(users['id'], users['full_name'])).get
+                                    if not users.empty else str, key=f"bulk_assignee_{mail_type}")
+        with col_type:
+            action_type = st.selectbox("بالإجراء", action_service.ACTION_TYPES, key=f"bulk_action_{mail_type}")
+        with col_due:
+            due_date = st.date_input("قبل", value=None, key=f"bulk_due_{mail_type}")
+        with col_assign:
+            st.markdown("<br>", unsafe_allow_html=True)
+            assign = st.button("👤 تكليف", key=f"bulk_assign_{mail_type}", use_container_width=True,
+                               disabled=assignee is None)
+        
+        delete = False
+        if check_permission('delete'):
+            col_confirm, col_delete = st.columns([2, 1])
+            with col_confirm:
+                confirmed = st.checkbox(f"تأكيد الحذف النهائي لـ {len(ids)} بريد", key=f"bulk_delete_confirm_{mail_type}")
+            with col_delete:
+                delete = st.button("🗑️ حذف المحدد", key=f"bulk_delete_{mail_type}", use_container_width=True,
+                                   disabled=not confirmed)
+        
+        if not (change_status or assign or delete):
+            return
+        actor_id = st.session_state.user['id']
+        try:
+            if change_status:
+                success, message = mail_service.bulk_update_status(ids, status, mail_type, actor_id=actor_id)
+            elif assign:
+                success, message = action_service.assign_mails(ids, mail_type, assignee, action_type, due_date,
+                                                               actor_id=actor_id)
+            else:
+                success, message = mail_service.bulk_delete(ids, mail_type, actor_id=actor_id)
+        except Exception as e:
+            success, message = False, f"خطأ في العملية الجماعية: {str(e)}"
+        if success:
+            if not assign:
+                selected.clear()
+                invalidate_mail_views()
+            st.success(f"✅ {message}")
+            st.rerun()
+        else:
+            st.warning(f"⚠️ {message}")
+
+def excel_bytes(export_func):
+    """محتوى ملف Excel لزر التنزيل (يُستدعى عند الضغط فقط)"""
+    output = export_func()
+    return output.getvalue() if output else b""
+
+def sidebar_menu_options():
+    """خيارات القائمة الجانبية حسب الصلاحيات (تُحسب مرة واحدة بعد تسجيل الدخول)"""
+    if st.session_state.menu_options is None:
+        menu_options = {
+            "📊 لوحة القيادة": "لوحة القيادة",
+            "📥 البريد الوارد": "البريد الوارد",
+            "📤 البريد الصادر": "البريد الصادر",
+            "📇 جهات الاتصال": "جهات الاتصال",
+            "📄 إنشاء بوردرية": "إنشاء بوردرية",
+            "⏱️ آجال المعالجة": "آجال المعالجة",
+            "✅ مهامي": "مهامي"
+        }
+        
+        # إضافة خيارات حسب الصلاحيات
+        if check_permission('add'):
+            menu_options["➕ تسجيل بريد وارد"] = "تسجيل بريد وارد"
+            menu_options["✏️ إنشاء بريد صادر"] = "إنشاء بريد صادر"
+        
+        if check_permission('manage_users'):
+            menu_options["👥 إدارة المستخدمين"] = "إدارة المستخدمين"
+            menu_options["📚 استيراد السجلات"] = "استيراد السجلات"
+        
+        st.session_state.menu_options = menu_options
+    return st.session_state.menu_options
+
 # --- وظائف عرض الصفحات (المحدثة مع الصلاحيات) ---
+@profiling.timed
 def display_dashboard():
     """عرض لوحة القيادة"""
-    conn = get_db_connection()
+    try:
+        counts = stats_service.dashboard_counts()
+    except Exception:
+        counts = {}
     
-    col1, col2, col3, col4 = st.columns(4)
+    col1, col2, col3, col4, col5 = st.columns(5)
     
     with col1:
-        try:
-            new_mail = pd.read_sql("SELECT COUNT(*) FROM incoming_mail WHERE status = 'جديد'", conn).iloc[0,0]
-            st.metric("بريد وارد جديد", new_mail)
-        except:
-            st.metric("بريد وارد جديد", 0)
+        st.metric("بريد وارد جديد", counts.get('new_mail', 0))
     
     with col2:
-        try:
-            pending_mail = pd.read_sql("SELECT COUNT(*) FROM incoming_mail WHERE status = 'قيد المعالجة'", conn).iloc[0,0]
-            st.metric("قيد المعالجة", pending_mail)
-        except:
-            st.metric("قيد المعالجة", 0)
+        st.metric("قيد المعالجة", counts.get('pending_mail', 0))
     
     with col3:
-        try:
-            total_contacts = pd.read_sql("SELECT COUNT(*) FROM contacts", conn).iloc[0,0]
-            st.metric("جهات اتصال", total_contacts)
-        except:
-            st.metric("جهات اتصال", 0)
+        st.metric("جهات اتصال", counts.get('total_contacts', 0))
     
     with col4:
-        try:
-            total_mail = pd.read_sql("SELECT COUNT(*) FROM incoming_mail", conn).iloc[0,0]
-            st.metric("إجمالي البريد", total_mail)
-        except:
-            st.metric("إجمالي البريد", 0)
+        st.metric("إجمالي البريد", counts.get('total_mail', 0))
+    
+    with col5:
+        st.metric("مسودات الماسح", counts.get('draft_mail', 0),
+                  help="بريد وارد استُقبل من مجلد الماسح الضوئي وينتظر استكمال بياناته (تصفية: مسودة)")
     
     # البريد القريب من تاريخ الاستحقاق
     st.markdown("### البريد القريب من تاريخ الاستحقاق")
-    today = date.today()
-    next_week = today + timedelta(days=7)
-    
     try:
-        due_mail = pd.read_sql('''
-        SELECT reference_no, sender_name, subject, received_date, due_date, status 
-        FROM incoming_mail 
-        WHERE due_date IS NOT NULL 
-        AND due_date BETWEEN ? AND ?
-        AND status NOT IN ('مكتمل', 'ملغي')
-        ORDER BY due_date
-        ''', conn, params=(today.strftime('%Y-%m-%d'), next_week.strftime('%Y-%m-%d')))
+        due_mail = stats_service.due_soon(days=7)
         
         if not due_mail.empty:
             st.dataframe(due_mail, use_container_width=True, hide_index=True)
@@ -1782,11 +2104,7 @@ def display_dashboard():
     # آخر البريد الوارد
     st.markdown("### آخر البريد الوارد")
     try:
-        recent_mail = pd.read_sql('''
-        SELECT reference_no, sender_name, subject, received_date, priority, status 
-        FROM incoming_mail 
-        ORDER BY received_date DESC LIMIT 10
-        ''', conn)
+        recent_mail = stats_service.recent_incoming(limit=10)
         
         if not recent_mail.empty:
             st.dataframe(recent_mail, use_container_width=True, hide_index=True)
@@ -1794,84 +2112,68 @@ def display_dashboard():
             st.info("لا توجد رسائل واردة حالياً")
     except:
         st.info("لا توجد رسائل واردة حالياً")
-    
-    conn.close()
 
+@profiling.timed
 def display_incoming_mail():
     """عرض البريد الوارد"""
     if not check_permission('view'):
         st.warning("⚠️ ليس لديك صلاحية لعرض البريد الوارد")
         return
     
-    conn = get_db_connection()
-    
     st.markdown('<div class="card"><h3>إدارة البريد الوارد</h3></div>', unsafe_allow_html=True)
     
+    incoming_stats_panel()
+    incoming_mail_list()
+
+@st.fragment
+@profiling.timed
+def incoming_stats_panel():
+    """زر الإحصائيات (يعيد تشغيل هذا الجزء فقط)"""
+    if st.toggle("📊 إحصائيات", key="show_incoming_stats"):
+        show_incoming_stats()
+
+@st.fragment
+@profiling.timed
+def incoming_mail_list():
+    """قائمة البريد الوارد: التصفية والبحث والتصفح تعيد تشغيل هذا الجزء فقط"""
     # أزرار التصفية
-    col_filters = st.columns([2, 1, 1, 1, 1, 1, 1])
-    filters = ["الكل", "جديد", "قيد المعالجة", "مكتمل", "مهم", "عاجل", "قريب من الاستحقاق"]
+    col_filters = st.columns([2, 1, 1, 1, 1, 1, 1, 1, 1])
+    filters = ["الكل", "جديد", "قيد المعالجة", "مكتمل", "مهم", "عاجل", "قريب من الاستحقاق", "مسودة", "بانتظار الرد"]
     
     for i, filter_name in enumerate(filters):
         with col_filters[i]:
-            if st.button(filter_name, key=f"filter_{filter_name}", use_container_width=True):
-                st.session_state.mail_filter = filter_name
-    
-    # أزرار التصدير والإحصائيات
-    col_export, col_stats = st.columns([1, 1])
-    with col_export:
-        if st.button("📊 إحصائيات", use_container_width=True):
-            show_incoming_stats()
-    
-    with col_stats:
-        if check_permission('export'):
-            excel_data = export_incoming_to_excel()
-            if excel_data:
-                st.download_button(
-                    label="📥 تصدير إلى Excel",
-                    data=excel_data,
-                    file_name=f"البريد_الوارد_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
+            st.button(filter_name, key=f"filter_{filter_name}", use_container_width=True,
+                      on_click=set_mail_filter, args=(filter_name, "incoming_list_page"))
     
     # تطبيق التصفية
-    if st.session_state.mail_filter == "الكل":
-        query = "SELECT * FROM incoming_mail ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "جديد":
-        query = "SELECT * FROM incoming_mail WHERE status = 'جديد' ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "قيد المعالجة":
-        query = "SELECT * FROM incoming_mail WHERE status = 'قيد المعالجة' ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "مكتمل":
-        query = "SELECT * FROM incoming_mail WHERE status = 'مكتمل' ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "مهم":
-        query = "SELECT * FROM incoming_mail WHERE priority = 'مهم' ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "عاجل":
-        query = "SELECT * FROM incoming_mail WHERE priority = 'عاجل' ORDER BY received_date DESC"
-    elif st.session_state.mail_filter == "قريب من الاستحقاق":
-        today = date.today()
-        next_week = today + timedelta(days=7)
-        query = f"""
-        SELECT * FROM incoming_mail 
-        WHERE due_date IS NOT NULL 
-        AND due_date BETWEEN '{today}' AND '{next_week}'
-        AND status NOT IN ('مكتمل', 'ملغي')
-        ORDER BY due_date
-        """
-    
     try:
-        df = pd.read_sql(query, conn)
+        df = mail_service.list_incoming(st.session_state.mail_filter)
     except:
         df = pd.DataFrame()
     
     if not df.empty:
+        # زر التصدير: الملف يُنشأ عند الضغط فقط
+        if check_permission('export'):
+            st.download_button(
+                label="📥 تصدير إلى Excel",
+                data=lambda: excel_bytes(export_incoming_to_excel),
+                file_name=f"البريد_الوارد_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True,
+                on_click="ignore",
+                key="export_incoming_excel"
+            )
+        
         # البحث
         search_col1, search_col2, search_col3 = st.columns(3)
         with search_col1:
-            search_ref = st.text_input("🔍 البحث برقم المرجع")
+            search_ref = st.text_input("🔍 البحث برقم المرجع", key="search_incoming_ref")
         with search_col2:
-            search_sender = st.text_input("🔍 البحث بالمرسل")
+            search_sender = st.text_input("🔍 البحث بالمرسل", key="search_incoming_sender")
         with search_col3:
-            search_subject = st.text_input("🔍 البحث بالموضوع")
+            search_subject = st.text_input("🔍 البحث بالموضوع", key="search_incoming_subject")
+        search_text = st.text_input("📄 البحث في المحتوى والمرفقات", key="search_incoming_text",
+                                    help="بحث في نص الرسالة ونصوص مرفقات PDF و Word المفهرسة")
         
         if search_ref:
             df = df[df['reference_no'].str.contains(search_ref, case=False, na=False)]
@@ -1879,11 +2181,20 @@ def display_incoming_mail():
             df = df[df['sender_name'].str.contains(search_sender, case=False, na=False)]
         if search_subject:
             df = df[df['subject'].str.contains(search_subject, case=False, na=False)]
+        if search_text:
+            df = df[df['id'].isin(fulltext_service.matching_ids(search_text, "incoming"))]
         
-        # عرض البيانات
-        for idx, row in df.iterrows():
+        mail_bulk_panel(df, "incoming")
+        
+        # عرض البيانات (صفحة واحدة فقط)، مع الأيام المتبقية محسوبة للصفحة دفعة واحدة
+        page_df = paginate(df, "incoming_list_page").assign(days_left=lambda frame: days_until(frame['due_date']))
+        for idx, row in page_df.iterrows():
             with st.container():
-                col_info, col_actions = st.columns([4, 1])
+                col_select, col_info, col_actions = st.columns([0.3, 4, 1])
+                
+                with col_select:
+                    if check_permission('edit'):
+                        mail_select_checkbox("incoming", row['id'])
                 
                 with col_info:
                     # بطاقة عرض مختصرة
@@ -1896,27 +2207,24 @@ def display_incoming_mail():
                         </div>
                         <div class="mail-body">
                             <strong>{row['subject']}</strong><br>
-                            <small>المرسل: {row['sender_name']} | التاريخ: {row['received_date']}</small>
+                            <small>المرسل: {row['sender_name']} | التاريخ: {format_day(row['received_date'])}</small>
                         </div>
                     </div>
                     """, unsafe_allow_html=True)
                     
                     # عرض تاريخ الاستحقاق إذا كان موجوداً
-                    if row['due_date']:
-                        try:
-                            due_date = datetime.strptime(row['due_date'], '%Y-%m-%d').date()
-                            days_left = (due_date - date.today()).days
-                            if days_left < 0:
-                                st.error(f"⏰ تجاوز تاريخ الاستحقاق ب {abs(days_left)} يوم")
-                            elif days_left <= 3:
-                                st.warning(f"⏰ تاريخ الاستحقاق: {row['due_date']} (متبقي {days_left} يوم)")
-                            else:
-                                st.info(f"⏰ تاريخ الاستحقاق: {row['due_date']} (متبقي {days_left} يوم)")
-                        except:
-                            pass
+                    if pd.notna(row['days_left']):
+                        days_left = row['days_left']
+                        due_date = format_day(row['due_date'])
+                        if days_left < 0:
+                            st.error(f"⏰ تجاوز تاريخ الاستحقاق ب {abs(days_left)} يوم")
+                        elif days_left <= 3:
+                            st.warning(f"⏰ تاريخ الاستحقاق: {due_date} (متبقي {days_left} يوم)")
+                        else:
+                            st.info(f"⏰ تاريخ الاستحقاق: {due_date} (متبقي {days_left} يوم)")
                 
                 with col_actions:
-                    # أزرار الإجراءات
+                    # أزرار الإجراءات (الانتقال للعرض أو التعديل يعيد تشغيل التطبيق كاملاً)
                     col_view, col_edit, col_delete = st.columns(3)
                     
                     with col_view:
@@ -1935,19 +2243,11 @@ def display_incoming_mail():
                             st.button("✏️", key=f"edit_{row['id']}", help="تعديل", disabled=True)
                     
                     with col_delete:
-                        if check_permission('delete'):
-                            if st.button("🗑️", key=f"delete_{row['id']}", help="حذف"):
-                                if st.button(f"⚠️ تأكيد حذف {row['reference_no']}", key=f"confirm_delete_{row['id']}"):
-                                    cursor = conn.cursor()
-                                    cursor.execute("DELETE FROM incoming_mail WHERE id = ?", (row['id'],))
-                                    conn.commit()
-                                    log_activity(st.session_state.user['id'], "حذف بريد وارد", 
-                                               f"{row['reference_no']}")
-                                    st.success("تم حذف البريد الوارد")
-                                    st.rerun()
-                        else:
-                            st.button("🗑️", key=f"delete_{row['id']}", help="حذف", disabled=True)
+                        st.button("🗑️", key=f"delete_{row['id']}", help="حذف",
+                                  disabled=not check_permission('delete'),
+                                  on_click=request_delete, args=("incoming", row['id']))
                 
+                delete_confirmation("incoming", row)
                 st.divider()
         
         # عرض ملخص
@@ -1955,9 +2255,9 @@ def display_incoming_mail():
         
     else:
         st.info("لا توجد رسائل واردة")
-    
-    conn.close()
 
+@st.fragment
+@profiling.timed
 def register_incoming_mail():
     """تسجيل بريد وارد جديد"""
     if not check_permission('add'):
@@ -2052,6 +2352,7 @@ def register_incoming_mail():
         
         content = st.text_area("محتوى الرسالة", height=150, placeholder="أدخل محتوى الرسالة...")
         notes = st.text_area("ملاحظات إضافية", height=100, placeholder="ملاحظات إضافية...")
+        reply_required = st.checkbox("📨 يتطلب رداً", help="يظهر البريد في قائمة \"بانتظار الرد\" حتى يُربط به رد صادر")
         
         # المرفقات
         st.markdown("#### 📎 المرفقات")
@@ -2072,6 +2373,7 @@ def register_incoming_mail():
         submitted = st.form_submit_button("💾 تسجيل البريد الوارد", use_container_width=True)
         
         if submitted:
+            mail_files = [(file.name, file.getvalue()) for file in uploaded_files or []]
             # التحقق من صحة البيانات
             validation_errors = []
             
@@ -2084,13 +2386,35 @@ def register_incoming_mail():
             if contact_choice == "--- اختر من جهات الاتصال ---" and not add_new_sender:
                 validation_errors.append("الرجاء اختيار المرسل من القائمة أو تفعيل خيار 'إضافة مرسل جديد'")
             
+            # البحث عن بريد مشابه مسجل مسبقاً (نفس الرسالة بالفاكس ثم بالبريد...)
+            candidates = [] if validation_errors else duplicate_service.find_candidates(
+                sender_name, subject, received_date,
+                [duplicate_service.content_hash(data) for _, data in mail_files])
+            
             if validation_errors:
                 for error in validation_errors:
                     st.error(f"❌ {error}")
+            elif candidates:
+                # التسجيل ينتظر تأكيد المستخدم خارج النموذج (النموذج يُفرغ بعد الإرسال)
+                st.session_state.pending_incoming = {
+                    'mail': {
+                        'reference_no': reference_no,
+                        'sender_id': sender_id,
+                        'sender_name': sender_name,
+                        'subject': subject,
+                        'content': content,
+                        'received_date': received_date,
+                        'priority': priority,
+                        'status': "جديد",
+                        'category': category,
+                        'due_date': due_date,
+                        'notes': notes,
+                        'reply_required': reply_required
+                    },
+                    'files': mail_files,
+                    'candidates': candidates
+                }
             else:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
                 try:
                     # حفظ المرفقات
                     attachments = []
@@ -2101,28 +2425,22 @@ def register_incoming_mail():
                                 attachments.append(os.path.basename(filepath))
                     
                     # تسجيل البريد الوارد
-                    cursor.execute('''
-                    INSERT INTO incoming_mail 
-                    (reference_no, sender_id, sender_name, subject, content, received_date, 
-                     priority, status, category, due_date, attachments, notes, recorded_by)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        reference_no,
-                        sender_id,  # يمكن أن يكون NULL إذا كان مرسل جديد
-                        sender_name,
-                        subject,
-                        content,
-                        received_date.strftime('%Y-%m-%d'),
-                        priority,
-                        "جديد",  # الحالة الافتراضية
-                        category,
-                        due_date.strftime('%Y-%m-%d') if due_date else None,
-                        json.dumps(attachments) if attachments else None,
-                        notes,
-                        st.session_state.user['id']
-                    ))
-                    
-                    conn.commit()
+                    mail_service.register_incoming({
+                        'reference_no': reference_no,
+                        'sender_id': sender_id,  # يمكن أن يكون NULL إذا كان مرسل جديد
+                        'sender_name': sender_name,
+                        'subject': subject,
+                        'content': content,
+                        'received_date': received_date,
+                        'priority': priority,
+                        'status': "جديد",  # الحالة الافتراضية
+                        'category': category,
+                        'due_date': due_date,
+                        'attachments': attachments,
+                        'notes': notes,
+                        'reply_required': reply_required
+                    }, actor_id=st.session_state.user['id'])
+                    invalidate_mail_views()
                     
                     # إذا كان مرسلاً جديداً، عرض خيار لإضافته لجهات الاتصال
                     if add_new_sender and sender_id is None:
@@ -2132,25 +2450,14 @@ def register_incoming_mail():
                         with col_add:
                             if st.button("➕ إضافة لجهات الاتصال", key="add_to_contacts"):
                                 # توليد كود تلقائي
-                                cursor.execute("SELECT MAX(CAST(SUBSTR(code, 2) AS INTEGER)) FROM contacts WHERE code LIKE 'C%'")
-                                result = cursor.fetchone()[0]
-                                next_code = f"C{(result or 0) + 1:03d}"
-                                
-                                cursor.execute('''
-                                INSERT INTO contacts (code, name)
-                                VALUES (?, ?)
-                                ''', (next_code, sender_name))
-                                
-                                conn.commit()
+                                next_code = contact_service.next_contact_code()
+                                contact_service.create_contact(next_code, sender_name)
                                 st.success(f"✅ تمت إضافة '{sender_name}' لجهات الاتصال بالكود: {next_code}")
                         
                         with col_skip:
                             if st.button("تخطي", key="skip_add_contact"):
                                 st.info("تم تخطي إضافة المرسل لجهات الاتصال")
                     
-                    log_activity(st.session_state.user['id'], "تسجيل بريد وارد", 
-                               f"رقم المرجع: {reference_no} - المرسل: {sender_name}")
-                    
                     st.success(f"✅ تم تسجيل البريد الوارد بنجاح!")
                     st.balloons()
                     
@@ -2173,80 +2480,122 @@ def register_incoming_mail():
                     # إعادة تعيين النموذج
                     st.rerun()
                     
-                except sqlite3.IntegrityError:
-                    st.error(f"❌ رقم المرجع '{reference_no}' موجود مسبقاً!")
+                except DuplicateReferenceError as e:
+                    st.error(f"❌ {e}")
                 except Exception as e:
                     st.error(f"❌ خطأ في التسجيل: {str(e)}")
                     st.exception(e)
-                finally:
-                    conn.close()
+    
+    confirm_duplicate_incoming()
+
+def confirm_duplicate_incoming():
+    """تأكيد أو إلغاء تسجيل بريد وارد يشبه بريداً مسجلاً مسبقاً"""
+    pending = st.session_state.get('pending_incoming')
+    if not pending:
+        return
+    
+    mail = pending['mail']
+    st.warning(f"⚠️ البريد '{mail['subject']}' من {mail['sender_name']} يشبه بريداً وارداً مسجلاً مسبقاً. "
+               "تحقق من أنه ليس نسخة مكررة قبل تسجيله.")
+    candidates_df = pd.DataFrame(pending['candidates']).rename(columns={
+        'reference_no': 'رقم المرجع',
+        'sender_name': 'المرسل',
+        'subject': 'الموضوع',
+        'received_date': 'تاريخ الاستلام',
+        'similarity': 'تشابه الموضوع',
+        'same_attachment': 'نفس المرفق'
+    }).drop(columns=['id'])
+    st.dataframe(candidates_df, use_container_width=True, hide_index=True)
+    
+    col_confirm, col_cancel = st.columns(2)
+    with col_confirm:
+        if st.button("💾 تسجيل رغم التشابه", key="confirm_duplicate_incoming", use_container_width=True):
+            try:
+                attachments = [os.path.basename(attachment_service.save_attachment(data, name, "incoming"))
+                               for name, data in pending['files']]
+                mail_service.register_incoming({**mail, 'attachments': attachments},
+                                               actor_id=st.session_state.user['id'])
+                invalidate_mail_views()
+                del st.session_state.pending_incoming
+                st.success(f"✅ تم تسجيل البريد الوارد بنجاح! ({mail['reference_no']})")
+            except DuplicateReferenceError as e:
+                st.error(f"❌ {e}")
+            except Exception as e:
+                st.error(f"❌ خطأ في التسجيل: {str(e)}")
+    with col_cancel:
+        if st.button("✖️ إلغاء التسجيل", key="cancel_duplicate_incoming", use_container_width=True):
+            del st.session_state.pending_incoming
+            st.rerun(scope="fragment")
 
+@profiling.timed
 def display_outgoing_mail():
     """عرض البريد الصادر"""
     if not check_permission('view'):
         st.warning("⚠️ ليس لديك صلاحية لعرض البريد الصادر")
         return
     
-    conn = get_db_connection()
-    
     st.markdown('<div class="card"><h3>إدارة البريد الصادر</h3></div>', unsafe_allow_html=True)
     
+    outgoing_mail_list()
+
+@st.fragment
+@profiling.timed
+def outgoing_mail_list():
+    """قائمة البريد الصادر: التصفية والبحث والتصفح تعيد تشغيل هذا الجزء فقط"""
     # أزرار التصفية
     col_filters = st.columns([2, 1, 1, 1, 1])
     filters = ["الكل", "مسودة", "مرسل", "مؤرشف", "عاجل"]
     
     for i, filter_name in enumerate(filters):
         with col_filters[i]:
-            if st.button(filter_name, key=f"filter_out_{filter_name}", use_container_width=True):
-                st.session_state.mail_filter = filter_name
+            st.button(filter_name, key=f"filter_out_{filter_name}", use_container_width=True,
+                      on_click=set_mail_filter, args=(filter_name, "outgoing_list_page"))
     
-    # زر التصدير إلى Excel
-    if check_permission('export'):
-        excel_data = export_outgoing_to_excel()
-        if excel_data:
+    # تطبيق التصفية
+    try:
+        df = mail_service.list_outgoing(st.session_state.mail_filter)
+    except:
+        df = pd.DataFrame()
+    
+    if not df.empty:
+        # زر التصدير إلى Excel: الملف يُنشأ عند الضغط فقط
+        if check_permission('export'):
             st.download_button(
                 label="📥 تصدير إلى Excel",
-                data=excel_data,
+                data=lambda: excel_bytes(export_outgoing_to_excel),
                 file_name=f"البريد_الصادر_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
+                on_click="ignore",
                 key="export_outgoing_excel"
             )
-    
-    # تطبيق التصفية
-    if st.session_state.mail_filter == "الكل":
-        query = "SELECT * FROM outgoing_mail ORDER BY sent_date DESC"
-    elif st.session_state.mail_filter == "مسودة":
-        query = "SELECT * FROM outgoing_mail WHERE status = 'مسودة' ORDER BY sent_date DESC"
-    elif st.session_state.mail_filter == "مرسل":
-        query = "SELECT * FROM outgoing_mail WHERE status = 'مرسل' ORDER BY sent_date DESC"
-    elif st.session_state.mail_filter == "مؤرشف":
-        query = "SELECT * FROM outgoing_mail WHERE status = 'مؤرشف' ORDER BY sent_date DESC"
-    elif st.session_state.mail_filter == "عاجل":
-        query = "SELECT * FROM outgoing_mail WHERE priority = 'عاجل' ORDER BY sent_date DESC"
-    
-    try:
-        df = pd.read_sql(query, conn)
-    except:
-        df = pd.DataFrame()
-    
-    if not df.empty:
+        
         # البحث
         search_col1, search_col2 = st.columns(2)
         with search_col1:
-            search_ref = st.text_input("🔍 البحث برقم المرجع")
+            search_ref = st.text_input("🔍 البحث برقم المرجع", key="search_outgoing_ref")
         with search_col2:
-            search_recipient = st.text_input("🔍 البحث بالمستلم")
+            search_recipient = st.text_input("🔍 البحث بالمستلم", key="search_outgoing_recipient")
+        search_text = st.text_input("📄 البحث في المحتوى والمرفقات", key="search_outgoing_text",
+                                    help="بحث في نص الرسالة ونصوص المرفقات والبوردرية المفهرسة")
         
         if search_ref:
             df = df[df['reference_no'].str.contains(search_ref, case=False, na=False)]
         if search_recipient:
             df = df[df['recipient_name'].str.contains(search_recipient, case=False, na=False)]
+        if search_text:
+            df = df[df['id'].isin(fulltext_service.matching_ids(search_text, "outgoing"))]
         
-        # عرض البيانات
-        for idx, row in df.iterrows():
+        mail_bulk_panel(df, "outgoing")
+        
+        # عرض البيانات (صفحة واحدة فقط)
+        for idx, row in paginate(df, "outgoing_list_page").iterrows():
             with st.container():
-                col_info, col_actions = st.columns([4, 1])
+                col_select, col_info, col_actions = st.columns([0.3, 4, 1])
+                
+                with col_select:
+                    if check_permission('edit'):
+                        mail_select_checkbox("outgoing", row['id'])
                 
                 with col_info:
                     st.markdown(f"""
@@ -2258,7 +2607,7 @@ def display_outgoing_mail():
                         </div>
                         <div class="mail-body">
                             <strong>{row['subject']}</strong><br>
-                            <small>المستلم: {row['recipient_name']} | التاريخ: {row['sent_date']}</small>
+                            <small>المستلم: {row['recipient_name']} | التاريخ: {format_day(row['sent_date'])}</small>
                         </div>
                     </div>
                     """, unsafe_allow_html=True)
@@ -2286,10 +2635,9 @@ def display_outgoing_mail():
         st.markdown(f"**عدد النتائج:** {len(df)} بريد")
     else:
         st.info("لا توجد رسائل صادرة")
-    
-    if conn:
-        conn.close()
 
+@st.fragment
+@profiling.timed
 def create_outgoing_mail():
     """إنشاء بريد صادر جديد"""
     if not check_permission('add'):
@@ -2301,6 +2649,15 @@ def create_outgoing_mail():
     contacts_df = get_contacts()
     contact_names = ["--- اختر من جهات الاتصال ---"] + contacts_df['name'].tolist() if not contacts_df.empty else ["--- لا توجد جهات اتصال ---"]
     
+    # البريد الوارد الذي ينتظر رداً (لربط البريد الصادر به)
+    try:
+        awaiting_df = thread_service.awaiting_reply(limit=thread_service.REPLY_CHOICES_LIMIT)
+    except Exception:
+        awaiting_df = pd.DataFrame()
+    reply_choices = {"--- ليس رداً على بريد وارد ---": None}
+    for _, row in awaiting_df.iterrows():
+        reply_choices[f"{row['reference_no']} - {row['sender_name']} - {row['subject']}"] = row['id']
+    
     with st.form("outgoing_mail_form"):
         col1, col2 = st.columns(2)
         
@@ -2329,6 +2686,9 @@ def create_outgoing_mail():
             status = st.selectbox("الحالة", ["مسودة", "مرسل"])
             sent_date = st.date_input("تاريخ الإرسال", value=date.today())
         
+        reply_choice = st.selectbox("↩️ رد على بريد وارد", list(reply_choices),
+                                    help="البريد الوارد الذي ينتظر رداً؛ يمكن ربط بريد آخر من صفحة تفاصيله")
+        
         content = st.text_area("محتوى الرسالة", height=200, placeholder="أدخل محتوى الرسالة...")
         notes = st.text_area("ملاحظات إضافية", height=100, placeholder="ملاحظات إضافية...")
         
@@ -2350,11 +2710,7 @@ def create_outgoing_mail():
             elif recipient_choice == "--- اختر من جهات الاتصال ---":
                 st.error("الرجاء اختيار المستلم من قائمة جهات الاتصال")
             else:
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                
                 final_status = "مرسل" if send_mail else "مسودة"
-                bordereau_filename = None
                 
                 try:
                     attachments = []
@@ -2364,43 +2720,26 @@ def create_outgoing_mail():
                             if filepath:
                                 attachments.append(os.path.basename(filepath))
                     
-                    # إنشاء البوردرية إذا كان البريد مرسلاً
-                    if send_mail and recipient_id:
-                        contact_info = get_contact_by_id(recipient_id)
-                        mail_context = {
-                            'reference_no': reference_no,
-                            'sent_date': sent_date.strftime('%Y-%m-%d'),
-                            'recipient_name': recipient_name,
-                            'subject': subject,
-                            'notes': notes
-                        }
-                        
-                        buffer = generate_bordereau_for_mail(mail_context, contact_info)
-                        
-                        if buffer:
-                            upload_dir = "uploads/bordereau"
-                            os.makedirs(upload_dir, exist_ok=True)
-                            bordereau_filename = f"بوردرية_{reference_no}.docx"
-                            bordereau_path = os.path.join(upload_dir, bordereau_filename)
-                            
-                            with open(bordereau_path, "wb") as f:
-                                f.write(buffer.getvalue())
+                    # إنشاء البريد (والبوردرية تلقائياً إذا كان البريد مرسلاً)
+                    result = mail_service.create_outgoing({
+                        'reference_no': reference_no,
+                        'recipient_id': recipient_id,
+                        'recipient_name': recipient_name,
+                        'subject': subject,
+                        'content': content,
+                        'priority': priority,
+                        'status': final_status,
+                        'sent_date': sent_date,
+                        'category': category,
+                        'attachments': attachments,
+                        'notes': notes,
+                        'reply_to_id': reply_choices[reply_choice]
+                    }, actor_id=st.session_state.user['id'])
                     
-                    cursor.execute('''
-                    INSERT INTO outgoing_mail 
-                    (reference_no, recipient_id, recipient_name, subject, content, priority, 
-                     status, sent_date, sent_by, category, attachments, bordereau, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (reference_no, recipient_id, recipient_name, subject, content, priority,
-                          final_status, sent_date.strftime('%Y-%m-%d'), 
-                          st.session_state.user['id'], category, 
-                          json.dumps(attachments) if attachments else None,
-                          bordereau_filename, notes))
+                    if result['bordereau_error']:
+                        st.error(f"❌ {result['bordereau_error']}")
                     
-                    conn.commit()
                     action = "إرسال بريد صادر" if send_mail else "حفظ مسودة بريد صادر"
-                    log_activity(st.session_state.user['id'], action, f"رقم المرجع: {reference_no}")
-                    
                     st.success(f"✅ تم {action} بنجاح!")
                     if send_mail:
                         st.balloons()
@@ -2413,15 +2752,14 @@ def create_outgoing_mail():
                         "تاريخ الإرسال": sent_date.strftime('%Y-%m-%d'),
                         "الحالة": final_status
                     }
-                    if send_mail:
+                    if result['bordereau']:
                         summary_data["البوردرية"] = "تم إنشاؤها تلقائياً"
                     st.json(summary_data)
                     
-                except sqlite3.IntegrityError:
-                    st.error(f"❌ رقم المرجع '{reference_no}' موجود مسبقاً!")
-                finally:
-                    conn.close()
+                except DuplicateReferenceError as e:
+                    st.error(f"❌ {e}")
 
+@profiling.timed
 def display_contacts():
     """عرض وإدارة جهات الاتصال"""
     st.markdown('<div class="card"><h3>إدارة جهات الاتصال</h3></div>', unsafe_allow_html=True)
@@ -2455,24 +2793,15 @@ def display_contacts():
             
             if submitted:
                 if code and name:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
                     try:
-                        cursor.execute('''
-                        INSERT INTO contacts (code, name, organization, phone, email)
-                        VALUES (?, ?, ?, ?, ?)
-                        ''', (code, name, organization, phone, email))
-                        
-                        conn.commit()
+                        contact_service.create_contact(code, name, organization, phone, email)
                         st.success(f"✅ تم إضافة جهة الاتصال {name} بنجاح")
                         st.session_state.show_contact_form = False
                         st.rerun()
-                    except sqlite3.IntegrityError:
-                        st.error(f"❌ الكود '{code}' موجود مسبقاً!")
+                    except DuplicateReferenceError as e:
+                        st.error(f"❌ {e}")
                     except Exception as e:
                         st.error(f"❌ خطأ في إضافة جهة الاتصال: {str(e)}")
-                    finally:
-                        conn.close()
                 else:
                     st.error("❌ الرجاء إدخال الكود والاسم")
     
@@ -2502,32 +2831,127 @@ def display_contacts():
                     col_del, col_edit = st.columns(2)
                     with col_del:
                         if st.button("🗑️ حذف الجهة", use_container_width=True, key="delete_contact"):
-                            conn = get_db_connection()
-                            try:
-                                cursor = conn.cursor()
-                                cursor.execute("SELECT COUNT(*) FROM incoming_mail WHERE sender_id = ?", (contact_id,))
-                                mail_incoming = cursor.fetchone()[0]
-                                cursor.execute("SELECT COUNT(*) FROM outgoing_mail WHERE recipient_id = ?", (contact_id,))
-                                mail_outgoing = cursor.fetchone()[0]
-                                
-                                if mail_incoming > 0 or mail_outgoing > 0:
-                                    st.warning(f"⚠️ لا يمكن حذف الجهة لأنها مستخدمة في {mail_incoming + mail_outgoing} بريد")
-                                else:
-                                    cursor.execute("DELETE FROM contacts WHERE id = ?", (contact_id,))
-                                    conn.commit()
-                                    st.success("✅ تم حذف الجهة بنجاح")
-                                    st.rerun()
-                            finally:
-                                conn.close()
+                            deleted, message = contact_service.delete_contact(contact_id)
+                            if deleted:
+                                st.success(f"✅ {message}")
+                                st.rerun()
+                            else:
+                                st.warning(f"⚠️ {message}")
+                    
+                    contact_timeline_panel(int(contact_id))
     else:
         st.info("📭 لا توجد جهات اتصال مسجلة")
+    
+    if check_permission('delete'):
+        contact_merge_panel()
+
+@st.fragment
+def contact_timeline_panel(contact_id):
+    """عدادات جهة الاتصال ومراسلاتها صفحة بصفحة (التنقل يعيد تشغيل هذا الجزء فقط)"""
+    # مؤشرات الصفحات المعروضة لهذه الجهة: الأول None (الأحدث)
+    pages = st.session_state.get('contact_timeline_pages')
+    if not pages or pages[0] != contact_id:
+        pages = st.session_state.contact_timeline_pages = [contact_id, None]
+    
+    try:
+        summary = contact_service.contact_summary(contact_id)
+        timeline, next_cursor = contact_service.contact_timeline(contact_id, cursor=pages[-1])
+    except Exception as e:
+        st.error(f"خطأ في جلب مراسلات الجهة: {str(e)}")
+        return
+    
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("📥 وارد", summary['incoming'])
+    col2.metric("📤 صادر", summary['outgoing'])
+    col3.metric("⏳ مفتوح", summary['open'])
+    col4.metric("🕒 آخر مراسلة", summary['last_exchange'] or "-")
+    
+    if timeline.empty:
+        st.info("📭 لا توجد مراسلات مؤرخة مع هذه الجهة")
+        return
+    
+    timeline['mail_type'] = timeline['mail_type'].map({'incoming': '📥 وارد', 'outgoing': '📤 صادر'})
+    timeline['linked'] = timeline['linked'].map({1: '', 0: 'بالاسم'})
+    st.dataframe(timeline.drop(columns=['id']).rename(columns={
+        'mail_type': 'النوع',
+        'reference_no': 'رقم المرجع',
+        'party': 'المرسل / المستلم',
+        'subject': 'الموضوع',
+        'mail_date': 'التاريخ',
+        'status': 'الحالة',
+        'linked': 'الربط'
+    }), use_container_width=True, hide_index=True)
+    
+    col_newer, col_page, col_older = st.columns([1, 1, 1])
+    with col_newer:
+        st.button("⬅️ الأحدث", key="timeline_newer", use_container_width=True, disabled=len(pages) <= 2,
+                  on_click=pages.pop)
+    with col_page:
+        st.caption(f"الصفحة {len(pages) - 1}")
+    with col_older:
+        st.button("الأقدم ➡️", key="timeline_older", use_container_width=True, disabled=next_cursor is None,
+                  on_click=pages.append, args=(next_cursor,))
+    
+    if check_permission('export'):
+        st.download_button(
+            label="📥 تصدير مراسلات الجهة إلى Excel",
+            data=lambda: excel_bytes(lambda: export_contact_timeline_to_excel(contact_id)),
+            file_name=f"مراسلات_الجهة_{contact_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True,
+            on_click="ignore",
+            key="export_contact_timeline"
+        )
+
+# عدد اقتراحات دمج الجهات المعروضة في الصفحة
+MERGE_PROPOSALS_SHOWN = 50
+
+@st.fragment
+def contact_merge_panel():
+    """اقتراحات دمج الجهات المكررة وأسماء المرسلين/المستلمين غير المربوطة بجهة"""
+    with st.expander("🔗 دمج الجهات المكررة"):
+        st.caption("يجمع الكتابات المختلفة لنفس الجهة (جهات الاتصال والأسماء المكتوبة يدوياً في البريد) "
+                   "ويربط بريدها بجهة واحدة.")
+        if st.button("🔍 البحث عن الجهات المكررة", key="find_contact_duplicates", use_container_width=True):
+            st.session_state.contact_merge_proposals = contact_merge_service.find_merge_candidates()
+        
+        proposals = st.session_state.get('contact_merge_proposals')
+        if proposals is None:
+            return
+        if not proposals:
+            st.success("✅ لا توجد جهات مكررة")
+            return
+        
+        st.markdown(f"**{len(proposals)} مجموعة مقترحة** (تُعرض أول {min(len(proposals), MERGE_PROPOSALS_SHOWN)})")
+        selected = []
+        for index, proposal in enumerate(proposals[:MERGE_PROPOSALS_SHOWN]):
+            members = "، ".join(
+                f"{member['name']} ({'جهة' if member['kind'] == 'contact' else 'اسم'}، {member['mail_count']} بريد)"
+                for member in proposal['members'])
+            target = proposal['name'] if proposal['target'] else f"{proposal['name']} (جهة جديدة)"
+            if st.checkbox(f"**{target}** ← {members}", key=f"merge_proposal_{index}"):
+                selected.append(proposal)
+        
+        if st.button("🔗 دمج المجموعات المحددة", key="apply_contact_merge", use_container_width=True,
+                     disabled=not selected):
+            try:
+                success, message = contact_merge_service.apply_merges(selected, actor_id=st.session_state.user['id'])
+            except Exception as e:
+                success, message = False, f"خطأ في الدمج: {str(e)}"
+            if success:
+                st.session_state.contact_merge_proposals = None
+                invalidate_mail_views()
+                st.success(f"✅ {message}")
+                st.rerun()
+            else:
+                st.warning(f"⚠️ {message}")
 
 # --- الواجهة الرئيسية ---
 def main_interface():
     """الواجهة الرئيسية بعد تسجيل الدخول"""
     
     # --- القائمة الجانبية (العمود الأيمن) ---
-    with st.sidebar:
+    with st.sidebar, profiling.span("الشريط الجانبي"):
         st.markdown("""
         <style>
         .sidebar-container {
@@ -2547,29 +2971,13 @@ def main_interface():
         </style>
         """, unsafe_allow_html=True)
         
-        st.markdown('<div class="sidebar-title">المدرسة الإعدادية حي الأمل </div>', unsafe_allow_html=True)
+        st.markdown(f'<div class="sidebar-title">{institution_title()} </div>', unsafe_allow_html=True)
         st.markdown('<div class="sidebar-subtitle">مكتب الضبط </div>', unsafe_allow_html=True)
         
         st.markdown("---")
         
         # القائمة الرئيسية
-        menu_options = {
-            "📊 لوحة القيادة": "لوحة القيادة",
-            "📥 البريد الوارد": "البريد الوارد",
-            "📤 البريد الصادر": "البريد الصادر",
-            "📇 جهات الاتصال": "جهات الاتصال",
-            "📄 إنشاء بوردرية": "إنشاء بوردرية"
-        }
-        
-        # إضافة خيارات حسب الصلاحيات
-        if check_permission('add'):
-            menu_options["➕ تسجيل بريد وارد"] = "تسجيل بريد وارد"
-            menu_options["✏️ إنشاء بريد صادر"] = "إنشاء بريد صادر"
-        
-        if check_permission('manage_users'):
-            menu_options["👥 إدارة المستخدمين"] = "إدارة المستخدمين"
-        
-        for icon_text, page_name in menu_options.items():
+        for icon_text, page_name in sidebar_menu_options().items():
             if st.button(icon_text, key=f"menu_{page_name}", use_container_width=True):
                 st.session_state.page = page_name
                 st.session_state.edit_mail_id = None
@@ -2583,6 +2991,9 @@ def main_interface():
         if st.session_state.user:
             st.markdown(f"**المستخدم:** {st.session_state.user['full_name']}")
             st.markdown(f"**الدور:** {st.session_state.user['role']}")
+            counts = my_task_counts()
+            if counts and counts['open']:
+                st.markdown(f"**📋 مهامي:** {counts['open']} ({counts['overdue']} متأخرة)")
         
         st.markdown("---")
         
@@ -2601,11 +3012,11 @@ def main_interface():
     
     # التحقق من تواريخ الاستحقاق القريبة
     if check_permission('view'):
-        reminders = check_due_date_reminders()
+        reminders = get_session_reminders()
         if not reminders.empty:
             with st.expander("📢 تنبيه: بريد وارد قريب من تاريخ الاستحقاق", expanded=True):
-                for idx, row in reminders.iterrows():
-                    days_left = (datetime.strptime(row['due_date'], '%Y-%m-%d').date() - date.today()).days
+                for idx, row in reminders.assign(days_left=days_until(reminders['due_date'])).iterrows():
+                    days_left = row['days_left']
                     if days_left < 0:
                         st.error(f"**{row['reference_no']}** - {row['subject']} - تجاوز الاستحقاق ب {abs(days_left)} يوم")
                     else:
@@ -2613,6 +3024,10 @@ def main_interface():
     
     st.markdown(f'<h1>{st.session_state.page}</h1>', unsafe_allow_html=True)
     
+    # مغادرة نموذج التعديل تنسى نسخته: العودة إليه لاحقاً تبدأ من النسخة المحفوظة حينها
+    if st.session_state.edit_mail_id is None and st.session_state.edit_snapshot is not None:
+        finish_editing()
+    
     # توجيه إلى الصفحة المحددة
     if st.session_state.page == "لوحة القيادة":
         display_dashboard()
@@ -2638,17 +3053,38 @@ def main_interface():
         display_contacts()
     elif st.session_state.page == "إنشاء بوردرية":
         display_bordereau_generator()
+    elif st.session_state.page == "آجال المعالجة":
+        display_sla_report()
+    elif st.session_state.page == "مهامي":
+        display_my_tasks()
     elif st.session_state.page == "إدارة المستخدمين":
         display_user_management()
+    elif st.session_state.page == "استيراد السجلات":
+        display_bulk_import()
 
 # --- التطبيق الرئيسي ---
 def main():
     """الدالة الرئيسية للتطبيق"""
     
+    ensure_database()
     if st.session_state.user is None:
         login_screen()
     else:
-        main_interface()
+        # جمع استعلامات وأزمنة إعادة التشغيل هذه لعرضها في لوحات التتبع
+        query_trace.begin_rerun(st.session_state.page, statements=st.session_state.trace_statements)
+        profiling.begin_rerun(st.session_state.page,
+                              cpu_profile=st.session_state.profile_cpu,
+                              memory_profile=st.session_state.profile_memory)
+        try:
+            main_interface()
+        finally:
+            timing = profiling.end_rerun()
+            trace = query_trace.end_rerun()
+            metrics.PAGE_RERUN_SECONDS.observe(timing['total_ms'] / 1000, page=timing['page'])
+        
+        if check_permission('manage_users'):
+            display_query_debug_panel(trace)
+            display_profiling_panel(timing)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,273 @@
+# benchmark.py - قياس أداء المسارات الحرجة على قواعد بيانات بأحجام مختلفة
+"""
+مشغل قياس مستقل لدوال البيانات التي تستدعيها صفحات app4.py (عبر طبقة الخدمات).
+
+الاستعمال:
+    python benchmark.py --sizes 10000 100000 --output bench.json
+    python benchmark.py --sizes 100000 --baseline bench.json --threshold 0.2
+    python benchmark.py --sizes 1000000 --only dashboard_counts export_incoming
+
+- تُولد قواعد البيانات مرة واحدة بـ generate_dataset.py وتُحفظ في --data-dir
+- كل قياس: تشغيل تمهيدي ثم عدة تكرارات (min / median / mean / max بالملي ثانية)
+- get_mail_by_id يُفرغ ذاكرة التفاصيل قبل كل تكرار (قراءة باردة)، و get_mail_by_id_warm
+  يقيس القراءة من الذاكرة بعد التشغيل التمهيدي؛ رمز الخروج 1 إذا لم تكن أسرع من الباردة
+- النتائج تُحفظ بصيغة JSON، وتُقارن (الوسيط) مع ملف مرجعي عند تمرير --baseline
+- رمز الخروج 1 إذا تجاوز أي قياس عتبة التراجع
+- الذاكرة المؤقتة للاستعلامات (query_cache) معطلة أثناء القياس إلا مع --with-cache
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, datetime
+
+import database
+import query_cache
+from generate_dataset import generate
+from services import attachments as attachment_service
+from services import bordereau as bordereau_service
+from services import contacts as contact_service
+from services import exports as export_service
+from services import mail as mail_service
+from services import stats as stats_service
+
+DEFAULT_SIZES = [10000, 100000]
+DATA_DIR = ".bench"
+# آخر يوم في البيانات المولدة للقياس
+DATASET_END_DATE = date(2025, 12, 31)
+ATTACHMENT_SIZE = 1024 * 1024
+
+
+def _get_mail_by_id(size, warm=False):
+    """
+    جلب 200 بريد بمعرفات ثابتة (بذرة) موزعة على الجدول
+
+    بدون warm تُفرغ ذاكرة التفاصيل قبل كل تكرار (خارج الزمن المقاس) فيُقاس جلب الصفوف.
+    """
+    rng = random.Random(7)
+    ids = [rng.randint(1, size) for _ in range(200)] if size else [1]
+    func = lambda: [mail_service.get_mail(mail_id, "incoming") for mail_id in ids]
+    return func if warm else (func, mail_service.clear_detail_cache)
+
+
+def _generate_bordereau(size):
+    mail = mail_service.get_mail(1, "outgoing") or {}
+    contact = contact_service.get_contact_by_id(mail.get('recipient_id'))
+    return lambda: bordereau_service.render_bordereau(mail, contact)
+
+
+def _save_uploaded_file(size):
+    payload = os.urandom(ATTACHMENT_SIZE)
+    return lambda: attachment_service.save_attachment(payload, "bench.pdf", "incoming")
+
+
+# اسم القياس -> دالة تحضير تأخذ الحجم وتُرجع الدالة المقاسة (بعد اختيار قاعدة البيانات)،
+# أو (الدالة، دالة تُستدعى قبل كل تكرار خارج الزمن المقاس)
+BENCHMARKS = {
+    'generate_ref_no': lambda size: lambda: mail_service.generate_ref_no("incoming"),
+    'get_contacts': lambda size: contact_service.get_contacts,
+    'get_mail_by_id': _get_mail_by_id,
+    'get_mail_by_id_warm': lambda size: _get_mail_by_id(size, warm=True),
+    'dashboard_counts': lambda size: stats_service.dashboard_counts,
+    'dashboard_due_soon': lambda size: stats_service.due_soon,
+    'dashboard_recent': lambda size: stats_service.recent_incoming,
+    'check_due_date_reminders': lambda size: mail_service.due_date_reminders,
+    'list_incoming': lambda size: mail_service.list_incoming,
+    'show_incoming_stats': lambda size: stats_service.incoming_breakdown,
+    'export_incoming': lambda size: export_service.export_incoming,
+    'export_outgoing': lambda size: export_service.export_outgoing,
+    'generate_bordereau_for_mail': _generate_bordereau,
+    'save_uploaded_file': _save_uploaded_file,
+}
+
+# القياسات الثقيلة جداً على الأحجام الكبيرة تُكرر مرات أقل
+HEAVY_BENCHMARKS = {'export_incoming', 'export_outgoing', 'list_incoming'}
+
+
+def dataset_path(data_dir, size, seed, end_date=DATASET_END_DATE):
+    """
+    مسار قاعدة البيانات المولدة لحجم معين (تُولد إذا لم تكن موجودة)
+
+    تاريخ النهاية ثابت (وجزء من اسم الملف) فتبقى البيانات نفسها مهما كان يوم التوليد.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"bench_{size}_s{seed}_{end_date:%Y%m%d}.db")
+    if not os.path.exists(path):
+        print(f"⏳ توليد قاعدة بيانات بـ {size:,} بريد وارد...")
+        generate(path, incoming=size, seed=seed, end_date=end_date, progress=None)
+    return path
+
+
+def measure(func, repeat, warmup=1, before=None):
+    """تشغيل الدالة وإرجاع إحصائيات الزمن بالملي ثانية (before قبل كل تشغيل، خارج الزمن)"""
+    for _ in range(warmup):
+        if before:
+            before()
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'min': round(min(timings), 3),
+        'median': round(statistics.median(timings), 3),
+        'mean': round(statistics.fmean(timings), 3),
+        'max': round(max(timings), 3),
+        'repeat': repeat
+    }
+
+
+def run(sizes, names=None, repeat=5, seed=42, data_dir=DATA_DIR, progress=print, use_cache=False):
+    """
+    تشغيل القياسات على كل حجم
+
+    Returns:
+        dict: meta (البيئة) و results {الحجم: {القياس: إحصائيات}}
+    """
+    names = names or list(BENCHMARKS)
+    results = {}
+    upload_root, db_path, cache_enabled = attachment_service.UPLOAD_ROOT, database.DB_PATH, query_cache.ENABLED
+    scratch = tempfile.mkdtemp(prefix="bench_uploads_")
+
+    try:
+        # حفظ المرفقات في مجلد مؤقت بدل uploads الخاص بالتطبيق
+        attachment_service.UPLOAD_ROOT = scratch
+        query_cache.ENABLED = use_cache
+        for size in sizes:
+            source = dataset_path(data_dir, size, seed)
+            # العمل على نسخة حتى لا تغير القياسات (إنشاء مرفقات...) القاعدة المرجعية
+            working = os.path.join(scratch, os.path.basename(source))
+            shutil.copyfile(source, working)
+            database.DB_PATH = working
+
+            results[str(size)] = {}
+            for name in names:
+                try:
+                    func, before = BENCHMARKS[name](size), None
+                    if isinstance(func, tuple):
+                        func, before = func
+                    count = max(1, repeat // 2) if name in HEAVY_BENCHMARKS and size >= 1000000 else repeat
+                    results[str(size)][name] = measure(func, count, before=before)
+                except bordereau_service.TemplateMissingError as e:
+                    results[str(size)][name] = {'skipped': str(e)}
+                if progress:
+                    progress(_format_line(size, name, results[str(size)][name]))
+    finally:
+        attachment_service.UPLOAD_ROOT = upload_root
+        database.DB_PATH = db_path
+        query_cache.ENABLED = cache_enabled
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': seed,
+            'end_date': DATASET_END_DATE.isoformat(),
+            'repeat': repeat,
+            'query_cache': use_cache
+        },
+        'results': results
+    }
+
+
+def _format_line(size, name, stats):
+    if 'skipped' in stats:
+        return f"   {size:>9,}  {name:<28} ⏭️  {stats['skipped']}"
+    return (f"   {size:>9,}  {name:<28} median {stats['median']:>10.2f} ms"
+            f"   min {stats['min']:>10.2f}   max {stats['max']:>10.2f}")
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+    مقارنة الوسيط مع النتائج المرجعية
+
+    Returns:
+        list: (الحجم، القياس، المرجع، الحالي، نسبة التغير، تراجع؟)
+    """
+    rows = []
+    for size, benchmarks in current['results'].items():
+        for name, stats in benchmarks.items():
+            reference = baseline.get('results', {}).get(size, {}).get(name)
+            if not reference or 'median' not in reference or 'median' not in stats:
+                continue
+            change = (stats['median'] - reference['median']) / reference['median'] if reference['median'] else 0
+            rows.append((size, name, reference['median'], stats['median'], change, change > threshold))
+    return rows
+
+
+def warm_regressions(report, cold='get_mail_by_id', warm='get_mail_by_id_warm'):
+    """
+    الأحجام التي لم تكن فيها القراءة من ذاكرة التفاصيل أسرع من القراءة الباردة (الوسيط)
+
+    Returns:
+        list: (الحجم، وسيط البارد، وسيط الدافئ)
+    """
+    rows = []
+    for size, benchmarks in report['results'].items():
+        cold_stats, warm_stats = benchmarks.get(cold, {}), benchmarks.get(warm, {})
+        if 'median' in cold_stats and 'median' in warm_stats and warm_stats['median'] >= cold_stats['median']:
+            rows.append((size, cold_stats['median'], warm_stats['median']))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="قياس أداء المسارات الحرجة")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="أحجام البريد الوارد (مثال: 10000 100000 1000000)")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="تشغيل قياسات محددة فقط")
+    parser.add_argument("--repeat", type=int, default=5, help="عدد التكرارات لكل قياس")
+    parser.add_argument("--seed", type=int, default=42, help="بذرة توليد البيانات")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="مجلد قواعد البيانات المولدة")
+    parser.add_argument("--with-cache", action="store_true",
+                        help="تفعيل الذاكرة المؤقتة للاستعلامات (قياس مسار الإصابة)")
+    parser.add_argument("--output", default=None, help="ملف JSON لحفظ النتائج")
+    parser.add_argument("--baseline", default=None, help="ملف JSON مرجعي للمقارنة")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="نسبة التراجع المسموحة للوسيط (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.only, args.repeat, args.seed, args.data_dir, use_cache=args.with_cache)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 تم حفظ النتائج في {args.output}")
+
+    slow_warm = warm_regressions(report)
+    for size, cold, warm in slow_warm:
+        print(f"❌ {int(size):>9,}  get_mail_by_id_warm ليس أسرع من get_mail_by_id "
+              f"({warm:.2f} ms ≥ {cold:.2f} ms): ذاكرة التفاصيل لا تعمل")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+        rows = compare(report, baseline, args.threshold)
+        print("=" * 80)
+        regressions = 0
+        for size, name, before, after, change, regressed in rows:
+            marker = "❌" if regressed else ("✅" if change < -args.threshold else "  ")
+            print(f"{marker} {int(size):>9,}  {name:<28} {before:>10.2f} → {after:>10.2f} ms  ({change:+.0%})")
+            regressions += regressed
+        print("=" * 80)
+        if regressions:
+            print(f"❌ {regressions} قياس تجاوز عتبة التراجع ({args.threshold:.0%})")
+            raise SystemExit(1)
+        print("✅ لا يوجد تراجع في الأداء")
+
+    if slow_warm:
+        raise SystemExit(1)
@@ -0,0 +1,414 @@
+# bulk_import.py - استيراد السجلات الورقية القديمة من Excel/CSV
+"""
+استيراد دفعي لسجلات البريد الوارد أو الصادر المكتوبة في جداول Excel أو CSV.
+
+الاستعمال:
+    python bulk_import.py السجل.xlsx --type incoming --user-id 1 --rejected rejected.csv
+
+- قراءة متدفقة (openpyxl بنمط القراءة فقط أو csv)
+- تحقق وتوحيد التواريخ والأولويات والتصنيفات على دفعات (pandas)
+- ربط المرسلين/المستلمين بجهات الاتصال أو إنشاؤها عبر فهرس في الذاكرة
+- توليد أرقام المرجع حسب شهر وسنة كل بريد
+- إدراج على دفعات في معاملات مستقلة مع تقرير بالصفوف المرفوضة
+"""
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+import database
+from database import get_db_connection, log_activity
+from services import duplicates
+
+CHUNK_SIZE = 5000
+
+# أسماء الأعمدة المقبولة في ملف السجل لكل حقل
+COLUMN_ALIASES = {
+    'reference_no': ['رقم المرجع', 'المرجع', 'رقم الترتيب', 'reference_no', 'reference', 'ref'],
+    'party_name': ['المرسل', 'المستلم', 'الجهة', 'sender', 'sender_name', 'recipient', 'recipient_name'],
+    'mail_date': ['تاريخ الاستلام', 'تاريخ الإرسال', 'التاريخ', 'received_date', 'sent_date', 'date'],
+    'subject': ['الموضوع', 'subject'],
+    'content': ['المحتوى', 'محتوى الرسالة', 'content'],
+    'priority': ['الأولوية', 'priority'],
+    'status': ['الحالة', 'status'],
+    'category': ['التصنيف', 'category'],
+    'due_date': ['تاريخ الاستحقاق', 'due_date'],
+    'notes': ['ملاحظات', 'notes']
+}
+
+PRIORITY_ALIASES = {
+    'عادي': 'عادي', 'عادية': 'عادي', 'normal': 'عادي',
+    'مهم': 'مهم', 'هام': 'مهم', 'مهمة': 'مهم', 'important': 'مهم',
+    'عاجل': 'عاجل', 'عاجلة': 'عاجل', 'مستعجل': 'عاجل', 'urgent': 'عاجل'
+}
+
+MAIL_TYPES = {
+    'incoming': {
+        'table': 'incoming_mail',
+        'prefix': 'و',
+        'party_id': 'sender_id',
+        'party_name': 'sender_name',
+        'date': 'received_date',
+        'user_column': 'recorded_by',
+        'statuses': ['جديد', 'قيد المعالجة', 'مكتمل', 'ملغي'],
+        'default_status': 'مكتمل'
+    },
+    'outgoing': {
+        'table': 'outgoing_mail',
+        'prefix': 'ص',
+        'party_id': 'recipient_id',
+        'party_name': 'recipient_name',
+        'date': 'sent_date',
+        'user_column': 'sent_by',
+        'statuses': ['مسودة', 'مرسل', 'مؤرشف'],
+        'default_status': 'مرسل'
+    }
+}
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y']
+
+
+def _match_columns(header):
+    """ربط أعمدة الملف بالحقول المعروفة"""
+    lookup = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            lookup[alias.strip().lower()] = field
+
+    mapping = {}
+    for index, name in enumerate(header):
+        field = lookup.get(str(name or '').strip().lower())
+        if field and field not in mapping:
+            mapping[field] = index
+    return mapping
+
+
+def _iter_source_rows(source, filename):
+    """قراءة صفوف الملف بشكل متدفق (الصف الأول هو العناوين)"""
+    extension = os.path.splitext(filename or '')[1].lower()
+
+    if extension in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+    elif extension in ('.csv', '.txt'):
+        if isinstance(source, (str, os.PathLike)):
+            handle = open(source, encoding='utf-8-sig', newline='')
+        else:
+            handle = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+        try:
+            yield from csv.reader(handle)
+        finally:
+            if isinstance(source, (str, os.PathLike)):
+                handle.close()
+            else:
+                handle.detach()
+    else:
+        raise ValueError(f"نوع الملف غير مدعوم: {extension or filename}")
+
+
+def _clean_text(series):
+    """توحيد النصوص (إزالة المسافات الزائدة وتحويل الخلايا الفارغة إلى None)"""
+    text = series.astype('string').str.strip()
+    return text.mask(text == '')
+
+
+def _parse_dates(series):
+    """تحويل التواريخ إلى datetime64 بتجربة الصيغ المعروفة على الدفعة كاملة"""
+    text = _clean_text(series.map(
+        lambda v: v.strftime('%Y-%m-%d') if isinstance(v, (datetime, date)) else v))
+    text = text.str.slice(0, 10)
+    parsed = pd.to_datetime(text, format=DATE_FORMATS[0], errors='coerce')
+    for date_format in DATE_FORMATS[1:]:
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=date_format, errors='coerce')
+    return parsed, text
+
+
+def _normalize_chunk(rows, line_numbers, spec, categories):
+    """تحقق وتوحيد دفعة صفوف، وإرجاع (الصفوف المقبولة، الصفوف المرفوضة)"""
+    df = pd.DataFrame(rows, columns=list(COLUMN_ALIASES))
+    df['line'] = line_numbers
+
+    for column in ('reference_no', 'party_name', 'subject', 'content', 'notes',
+                   'priority', 'status', 'category'):
+        df[column] = _clean_text(df[column])
+
+    df['mail_date'], raw_date = _parse_dates(df['mail_date'])
+    df['due_date'], raw_due = _parse_dates(df['due_date'])
+
+    df['priority'] = df['priority'].str.lower().map(PRIORITY_ALIASES).where(
+        df['priority'].notna(), 'عادي')
+    df['status'] = df['status'].where(df['status'].notna(), spec['default_status'])
+    df['category'] = df['category'].where(
+        df['category'].isin(categories) | df['category'].isna(), 'أخرى').fillna('إداري')
+
+    reasons = pd.Series(pd.NA, index=df.index, dtype='string')
+    checks = [
+        (df['party_name'].isna(), 'اسم الجهة مفقود'),
+        (df['subject'].isna(), 'الموضوع مفقود'),
+        (df['mail_date'].isna() & raw_date.notna(), 'تاريخ غير صالح'),
+        (df['mail_date'].isna() & raw_date.isna(), 'التاريخ مفقود'),
+        (df['due_date'].isna() & raw_due.notna(), 'تاريخ استحقاق غير صالح'),
+        (df['priority'].isna(), 'أولوية غير معروفة'),
+        (~df['status'].isin(spec['statuses']), 'حالة غير معروفة')
+    ]
+    for mask, reason in checks:
+        reasons = reasons.mask(mask & reasons.isna(), reason)
+
+    rejected = df[reasons.notna()].assign(reason=reasons[reasons.notna()])
+    accepted = df[reasons.isna()].copy()
+    accepted['mail_date'] = accepted['mail_date'].dt.strftime('%Y-%m-%d')
+    accepted['due_date'] = accepted['due_date'].dt.strftime('%Y-%m-%d')
+    return accepted, rejected
+
+
+def _reference_counters(cursor, spec):
+    """آخر رقم تسلسلي مستعمل لكل (شهر، سنة) في الجدول"""
+    cursor.execute(f'''
+    SELECT SUBSTR(reference_no, -7, 2), SUBSTR(reference_no, -4),
+           MAX(CAST(SUBSTR(reference_no, 3, LENGTH(reference_no) - 10) AS INTEGER))
+    FROM {spec['table']}
+    WHERE reference_no GLOB ?
+    GROUP BY 1, 2
+    ''', (f"{spec['prefix']}-[0-9]*-[0-9][0-9]-[0-9][0-9][0-9][0-9]",))
+    return {(month, year): count or 0 for month, year, count in cursor.fetchall()}
+
+
+def _next_contact_number(cursor):
+    cursor.execute("SELECT MAX(CAST(SUBSTR(code, 2) AS INTEGER)) FROM contacts WHERE code LIKE 'C%'")
+    return (cursor.fetchone()[0] or 0) + 1
+
+
+def import_register(source, filename, mail_type="incoming", user_id=None,
+                    chunk_size=CHUNK_SIZE, progress=None):
+    """
+    استيراد سجل بريد من ملف Excel أو CSV
+
+    Args:
+        source: مسار الملف أو كائن ملف ثنائي (مثل ملف مرفوع في Streamlit)
+        filename (str): اسم الملف لتحديد نوعه
+        mail_type (str): incoming أو outgoing
+        user_id (int): المستخدم المسجل للعملية
+        chunk_size (int): عدد الصفوف في كل معاملة
+        progress (callable): دالة تستقبل عدد الصفوف المعالجة
+
+    Returns:
+        dict: ملخص الاستيراد مع قائمة الصفوف المرفوضة
+    """
+    spec = MAIL_TYPES[mail_type]
+    started = time.perf_counter()
+    summary = {'imported': 0, 'rejected': 0, 'contacts_created': 0, 'rejected_rows': []}
+
+    rows_iter = _iter_source_rows(source, filename)
+    header = next(rows_iter, None)
+    if header is None:
+        raise ValueError("الملف فارغ")
+    column_map = _match_columns(header)
+    missing = [field for field in ('party_name', 'subject', 'mail_date') if field not in column_map]
+    if missing:
+        raise ValueError(f"أعمدة إلزامية مفقودة: {', '.join(missing)}")
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        categories = [row[0] for row in cursor.execute("SELECT name FROM mail_categories")]
+        counters = _reference_counters(cursor, spec)
+        known_refs = {row[0] for row in cursor.execute(
+            f"SELECT reference_no FROM {spec['table']} WHERE reference_no IS NOT NULL")}
+        contacts = {}
+        for contact_id, name in cursor.execute("SELECT id, name FROM contacts"):
+            contacts.setdefault(' '.join(name.split()), contact_id)
+        next_contact = _next_contact_number(cursor)
+
+        insert_columns = ['reference_no', spec['party_id'], spec['party_name'], 'subject', 'content',
+                          spec['date'], 'priority', 'status', 'category']
+        if mail_type == 'incoming':
+            insert_columns.append('due_date')
+        insert_columns += ['notes', spec['user_column']]
+        insert_sql = (f"INSERT INTO {spec['table']} ({', '.join(insert_columns)}) "
+                      f"VALUES ({', '.join('?' for _ in insert_columns)})")
+
+        def reject(line, reason, reference_no, party_name, subject):
+            summary['rejected_rows'].append(
+                {'line': line, 'reason': reason, 'reference_no': reference_no,
+                 'party_name': party_name, 'subject': subject})
+
+        def insert(records, new_contacts, known_ids=None):
+            """
+            إدراج دفعة في معاملة واحدة وإرجاع معرفات جهات الاتصال الجديدة حسب كودها المؤقت
+
+            known_ids: معرفات جهات أُنشئت قبل هذه الدفعة بكودها المؤقت (إعادة المحاولة صفاً صفاً)
+            """
+            with conn:
+                code_ids = {}
+                if new_contacts:
+                    cursor.executemany("INSERT INTO contacts (code, name) VALUES (?, ?)", new_contacts)
+                    codes = [code for code, _ in new_contacts]
+                    placeholders = ', '.join('?' for _ in codes)
+                    cursor.execute(f"SELECT code, id FROM contacts WHERE code IN ({placeholders})", codes)
+                    code_ids = dict(cursor.fetchall())
+                resolved = {**(known_ids or {}), **code_ids}
+                rows = [[values[0], resolved.get(values[1], values[1])] + values[2:] for values in records]
+                # كود مؤقت بقي بلا معرف كان سيُخزن نصاً في عمود معرف الجهة
+                unresolved = {row[1] for row in rows if isinstance(row[1], str)}
+                if unresolved:
+                    raise ValueError(f"جهات اتصال بلا معرف: {', '.join(sorted(unresolved))}")
+                cursor.executemany(insert_sql, rows)
+            return code_ids
+
+        def flush(rows, line_numbers):
+            nonlocal next_contact
+            accepted, rejected = _normalize_chunk(rows, line_numbers, spec, categories)
+
+            new_contacts = []
+            records = []
+            sources = []
+            for row in accepted.itertuples(index=False):
+                reference_no = row.reference_no
+                if reference_no is pd.NA:
+                    # تخطي الأرقام المستعملة (مراجع صريحة في نفس الملف أو في الجدول)
+                    month, year = row.mail_date[5:7], row.mail_date[:4]
+                    while reference_no is pd.NA or reference_no in known_refs:
+                        counters[(month, year)] = counters.get((month, year), 0) + 1
+                        reference_no = f"{spec['prefix']}-{counters[(month, year)]:04d}-{month}-{year}"
+                elif reference_no in known_refs:
+                    reject(row.line, 'رقم المرجع موجود مسبقاً', reference_no, row.party_name, row.subject)
+                    continue
+                known_refs.add(reference_no)
+
+                party_name = ' '.join(row.party_name.split())
+                party_id = contacts.get(party_name)
+                if party_id is None:
+                    # الكود مؤقت إلى حين معرفة المعرف بعد الإدراج
+                    party_id = f"C{next_contact:03d}"
+                    next_contact += 1
+                    new_contacts.append((party_id, party_name))
+                    contacts[party_name] = party_id
+
+                values = [reference_no, party_id, party_name, row.subject,
+                          None if row.content is pd.NA else row.content, row.mail_date,
+                          row.priority, row.status, row.category]
+                if mail_type == 'incoming':
+                    values.append(None if pd.isna(row.due_date) else row.due_date)
+                values += [None if row.notes is pd.NA else row.notes, user_id]
+                records.append(values)
+                sources.append((row.line, reference_no, party_name, row.subject))
+
+            try:
+                code_ids = insert(records, new_contacts)
+                imported = len(records)
+            except sqlite3.IntegrityError:
+                # تعارض مع كتابة متزامنة (رقم مرجع أو كود جهة): أُلغيت الدفعة، فيعاد إدراجها
+                # صفاً صفاً وتُرفض الصفوف المتعارضة وحدها بدل إيقاف الاستيراد
+                contact_names = dict(new_contacts)
+                code_ids, imported = {}, 0
+                for values, source in zip(records, sources):
+                    party = values[1]
+                    contact = ([(party, contact_names[party])]
+                               if isinstance(party, str) and party not in code_ids else [])
+                    try:
+                        code_ids.update(insert([values], contact, code_ids))
+                        imported += 1
+                    except sqlite3.IntegrityError as e:
+                        line, reference_no, party_name, subject = source
+                        reject(line, f'تعارض عند الإدراج: {e}', reference_no, party_name, subject)
+
+            for code, name in new_contacts:
+                if code in code_ids:
+                    contacts[name] = code_ids[code]
+                else:
+                    # لم تُنشأ (رُفضت كل صفوفها): تُنشأ من جديد إذا ظهرت في دفعة لاحقة
+                    contacts.pop(name, None)
+            summary['contacts_created'] += len(code_ids)
+            summary['imported'] += imported
+            for row in rejected.itertuples(index=False):
+                reject(row.line, row.reason,
+                       None if row.reference_no is pd.NA else row.reference_no,
+                       None if row.party_name is pd.NA else row.party_name,
+                       None if row.subject is pd.NA else row.subject)
+
+        fields = list(COLUMN_ALIASES)
+        buffer, line_numbers = [], []
+        processed = 0
+        for line, raw in enumerate(rows_iter, start=2):
+            if not raw or all(value is None or str(value).strip() == '' for value in raw):
+                continue
+            buffer.append([raw[column_map[field]] if field in column_map and column_map[field] < len(raw)
+                           else None for field in fields])
+            line_numbers.append(line)
+            if len(buffer) >= chunk_size:
+                flush(buffer, line_numbers)
+                processed += len(buffer)
+                buffer, line_numbers = [], []
+                if progress:
+                    progress(processed)
+        if buffer:
+            flush(buffer, line_numbers)
+            processed += len(buffer)
+            if progress:
+                progress(processed)
+    finally:
+        conn.close()
+
+    # بصمات كشف التكرار للسجلات المستوردة (الإدراج الدفعي لا يمر بطبقة الخدمات)
+    if mail_type == 'incoming' and summary['imported']:
+        try:
+            duplicates.index_missing()
+        except Exception as e:
+            print(f"⚠️ خطأ في تحديث بصمات التكرار: {e}")
+
+    summary['rejected'] = len(summary['rejected_rows'])
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+
+    if user_id is not None and summary['imported']:
+        log_activity(user_id, "استيراد سجل بريد",
+                     f"{filename}: {summary['imported']} بريد، {summary['rejected']} مرفوض")
+    return summary
+
+
+def rejected_rows_to_csv(rejected_rows):
+    """تقرير الصفوف المرفوضة بصيغة CSV (bytes)"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=['line', 'reason', 'reference_no', 'party_name', 'subject'])
+    writer.writeheader()
+    writer.writerows(rejected_rows)
+    return output.getvalue().encode('utf-8-sig')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="استيراد سجل بريد من Excel أو CSV")
+    parser.add_argument("file", help="ملف السجل (.xlsx أو .csv)")
+    parser.add_argument("--type", choices=list(MAIL_TYPES), default="incoming", help="نوع البريد")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--user-id", type=int, default=None, help="معرف المستخدم المسجل")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="عدد الصفوف في كل معاملة")
+    parser.add_argument("--rejected", default=None, help="مسار تقرير الصفوف المرفوضة (CSV)")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+
+    result = import_register(args.file, args.file, args.type, args.user_id, args.chunk_size,
+                             progress=lambda n: print(f"   تمت معالجة {n:,} صف"))
+
+    print("=" * 50)
+    print(f"✅ تم استيراد {result['imported']:,} بريد في {result['seconds']} ثانية")
+    print(f"👥 جهات اتصال جديدة: {result['contacts_created']:,}")
+    print(f"❌ صفوف مرفوضة: {result['rejected']:,}")
+    if args.rejected and result['rejected_rows']:
+        with open(args.rejected, 'wb') as f:
+            f.write(rejected_rows_to_csv(result['rejected_rows']))
+        print(f"📄 تقرير الصفوف المرفوضة: {args.rejected}")
+    print("=" * 50)
@@ -0,0 +1,53 @@
+# change_feed.py - متابعة سجل التغييرات وضغطه
+"""
+يطبع التغييرات بعد مؤشر (صفاً JSON لكل تغيير)، أو يتابعها باستمرار، أو يضغط السجل.
+يُشغَّل الضغط دورياً (مهمة مجدولة) حتى لا يكبر السجل مع الزمن.
+
+الاستعمال:
+    python change_feed.py --since 0
+    python change_feed.py --since 1200 --follow --interval 5
+    python change_feed.py --compact --days 30
+"""
+import argparse
+import json
+import time
+
+import database
+from services import changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="متابعة سجل التغييرات وضغطه")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--since", type=int, default=None, help="المؤشر الذي يبدأ بعده العرض (افتراضياً آخر تغيير)")
+    parser.add_argument("--follow", action="store_true", help="متابعة التغييرات الجديدة باستمرار")
+    parser.add_argument("--interval", type=float, default=5, help="ثواني الانتظار بين القراءات مع --follow")
+    parser.add_argument("--compact", action="store_true", help="ضغط السجل بدل عرضه")
+    parser.add_argument("--days", type=int, default=changes.CHANGE_LOG_RETENTION_DAYS,
+                        help="مدة الاحتفاظ بالتغييرات عند الضغط")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_db()
+
+    if args.compact:
+        started = time.perf_counter()
+        result = changes.compact_change_log(args.days)
+        print(f"🗜️ حذف {result['superseded']} تغيير مكرر و {result['expired']} منتهي، "
+              f"أصغر مؤشر متاح {result['floor']} ({time.perf_counter() - started:.1f} ثانية)")
+        raise SystemExit(0)
+
+    cursor = changes.latest_cursor() if args.since is None else args.since
+    while True:
+        page = changes.changes_since(cursor)
+        if page['reset']:
+            print(f"⚠️ فات المؤشر {cursor} ما حُذف من السجل: يجب إعادة النسخ الكامل ثم المتابعة من {page['cursor']}")
+        for change in page['changes']:
+            print(json.dumps(change, ensure_ascii=False))
+        cursor = page['cursor']
+        if page['more']:
+            continue
+        if not args.follow:
+            break
+        time.sleep(args.interval)
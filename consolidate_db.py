@@ -0,0 +1,453 @@
+# consolidate_db.py - دمج قواعد البيانات القديمة في قاعدة بيانات واحدة
+"""
+أداة دمج قواعد بيانات مكتب الضبط (management.db و management1-3.db)
+في قاعدة واحدة مطابقة لهيكل init_db() الحالي.
+
+الاستعمال:
+    python consolidate_db.py management.db management1.db management2.db management3.db
+
+- تقرأ أي هيكل قديم (جداول database1.py بدون تصنيفات أو إعدادات)
+- تحذف التكرار في المستخدمين (اسم المستخدم) وجهات الاتصال (الكود أو الاسم والمؤسسة)
+  والبريد (بصمة المحتوى، ثم رقم المرجع)
+- تعيد ربط المفاتيح الأجنبية نحو المعرفات الجديدة
+- تحمّل البيانات على دفعات executemany داخل معاملة واحدة
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+
+from database import init_db, hash_password
+
+BATCH_SIZE = 5000
+
+# الأدوار القديمة (database1.py) ومقابلها في نظام الصلاحيات الحالي
+LEGACY_ROLES = {
+    'مدير': 'admin',
+    'مشرف': 'admin',
+    'مستخدم': 'user',
+    'مستشار': 'viewer'
+}
+
+# ترتيب الجداول مهم لإعادة ربط المفاتيح الأجنبية
+MAIL_TABLES = {
+    'incoming_mail': {
+        'party_id': 'sender_id',
+        'party_name': 'sender_name',
+        'date': 'received_date',
+        'user_columns': ['recorded_by']
+    },
+    'outgoing_mail': {
+        'party_id': 'recipient_id',
+        'party_name': 'recipient_name',
+        'date': 'sent_date',
+        'user_columns': ['sent_by']
+    }
+}
+
+LOOKUP_TABLES = {
+    'mail_categories': 'name',
+    'mail_priorities': 'name',
+    'system_settings': 'setting_key'
+}
+
+
+def print_progress(table, done, total):
+    """عرض تقدم الدمج في الطرفية"""
+    percent = (done * 100 // total) if total else 100
+    print(f"   {table}: {done:,}/{total:,} ({percent}%)")
+
+
+def _as_int(value):
+    """تحويل المعرفات المخزنة كـ BLOB (أعداد numpy قديمة) إلى أعداد صحيحة"""
+    if isinstance(value, bytes):
+        return int.from_bytes(value, 'little', signed=True) if value else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def _normalize(text):
+    """توحيد النص للمقارنة (المسافات وحالة الأحرف)"""
+    return ' '.join(str(text or '').split()).lower()
+
+
+def _contact_key(name, organization):
+    """مفتاح مطابقة جهة الاتصال عند غياب الكود"""
+    return (_normalize(name), _normalize(organization))
+
+
+def _mail_hash(party_name, subject, mail_date, content):
+    """بصمة محتوى البريد لاكتشاف التكرار بين القواعد"""
+    raw = '\x1f'.join(_normalize(v) for v in (party_name, subject, mail_date, content))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _password_hash(password):
+    """تجزئة كلمات المرور القديمة المخزنة كنص صريح"""
+    password = password or ''
+    if len(password) == 64 and all(c in '0123456789abcdef' for c in password):
+        return password
+    return hash_password(password)
+
+
+def _table_columns(conn, table):
+    """أعمدة الجدول أو قائمة فارغة إذا لم يوجد"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def _iter_batches(conn, table, columns, batch_size):
+    """قراءة صفوف الجدول المصدر على دفعات"""
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [dict(zip(columns, row)) for row in rows]
+
+
+def _insert_many(target, table, columns, rows):
+    """إدراج دفعة صفوف بأمر executemany واحد"""
+    if not rows:
+        return
+    placeholders = ', '.join('?' for _ in columns)
+    target.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+        ([row.get(col) for col in columns] for row in rows)
+    )
+
+
+class _TargetState:
+    """فهارس القاعدة الهدف في الذاكرة (المفاتيح الطبيعية والمعرفات التالية)"""
+
+    def __init__(self, target):
+        self.next_id = {}
+        for table in ('users', 'contacts', 'incoming_mail', 'outgoing_mail', 'actions', 'activity_log'):
+            max_id = target.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0]
+            self.next_id[table] = (max_id or 0) + 1
+
+        self.users = {row[0]: row[1] for row in target.execute("SELECT username, id FROM users")}
+
+        self.contact_codes = {}
+        self.contact_names = {}
+        for contact_id, code, name, organization in target.execute(
+                "SELECT id, code, name, organization FROM contacts"):
+            self.contact_codes[code] = contact_id
+            self.contact_names.setdefault(_contact_key(name, organization), contact_id)
+
+        self.mail_refs = {}
+        self.mail_hashes = {}
+        for table, spec in MAIL_TABLES.items():
+            refs, hashes = {}, {}
+            query = (f"SELECT id, reference_no, {spec['party_name']}, subject, "
+                     f"{spec['date']}, content FROM {table}")
+            for mail_id, ref, party, subject, mail_date, content in target.execute(query):
+                digest = _mail_hash(party, subject, mail_date, content)
+                hashes.setdefault(digest, mail_id)
+                if ref:
+                    refs[ref] = mail_id
+            self.mail_refs[table] = refs
+            self.mail_hashes[table] = hashes
+
+        self.activity_keys = set(target.execute(
+            "SELECT user_id, action, details, created_at FROM activity_log"))
+
+        self.lookups = {
+            table: {row[0] for row in target.execute(f"SELECT {key} FROM {table}")}
+            for table, key in LOOKUP_TABLES.items()
+        }
+
+    def allocate(self, table):
+        new_id = self.next_id[table]
+        self.next_id[table] += 1
+        return new_id
+
+
+def _merge_users(source, target, state, id_maps, report, progress, batch_size):
+    columns = _table_columns(source, 'users')
+    target_columns = _table_columns(target, 'users')
+    insert_columns = [c for c in target_columns if c in columns or c == 'id']
+    total = _count(source, 'users')
+    done = 0
+    mapping = id_maps['users']
+    added = set()
+
+    for batch in _iter_batches(source, 'users', columns, batch_size):
+        new_rows = []
+        for row in batch:
+            username = row.get('username')
+            if username in state.users:
+                mapping[row['id']] = state.users[username]
+                report['users_merged'] += 1
+                continue
+
+            new_id = state.allocate('users')
+            mapping[row['id']] = new_id
+            state.users[username] = new_id
+            row['id'] = new_id
+            row['password'] = _password_hash(row.get('password'))
+            row['role'] = LEGACY_ROLES.get(row.get('role'), row.get('role'))
+            added.add(new_id)
+            new_rows.append(row)
+
+        _insert_many(target, 'users', insert_columns, new_rows)
+        report['users_added'] += len(new_rows)
+        done += len(batch)
+        progress('users', done, total)
+
+    # إعادة ربط created_by للمستخدمين المضافين بعد معرفة جميع المعرفات الجديدة
+    if 'created_by' in columns and added:
+        target.executemany(
+            "UPDATE users SET created_by = ? WHERE id = ?",
+            ((mapping.get(_as_int(created_by)), mapping[old_id])
+             for old_id, created_by in source.execute("SELECT id, created_by FROM users")
+             if mapping[old_id] in added)
+        )
+
+
+def _merge_contacts(source, target, state, id_maps, report, progress, batch_size):
+    columns = _table_columns(source, 'contacts')
+    target_columns = _table_columns(target, 'contacts')
+    insert_columns = [c for c in target_columns if c in columns or c in ('id', 'code')]
+    total = _count(source, 'contacts')
+    done = 0
+    mapping = id_maps['contacts']
+
+    for batch in _iter_batches(source, 'contacts', columns, batch_size):
+        new_rows = []
+        for row in batch:
+            code = (row.get('code') or '').strip() or None
+            key = _contact_key(row.get('name'), row.get('organization'))
+
+            existing = state.contact_codes.get(code) if code else None
+            if existing is None:
+                existing = state.contact_names.get(key)
+            if existing is not None:
+                mapping[row['id']] = existing
+                report['contacts_merged'] += 1
+                continue
+
+            new_id = state.allocate('contacts')
+            if not code or code in state.contact_codes:
+                code = f"C{new_id:03d}"
+            mapping[row['id']] = new_id
+            state.contact_codes[code] = new_id
+            state.contact_names[key] = new_id
+            row['id'] = new_id
+            row['code'] = code
+            new_rows.append(row)
+
+        _insert_many(target, 'contacts', insert_columns, new_rows)
+        report['contacts_added'] += len(new_rows)
+        done += len(batch)
+        progress('contacts', done, total)
+
+
+def _merge_mail(table, source, target, state, id_maps, source_index, report, progress, batch_size):
+    spec = MAIL_TABLES[table]
+    columns = _table_columns(source, table)
+    target_columns = _table_columns(target, table)
+    insert_columns = [c for c in target_columns if c in columns or c == 'id']
+    if 'updated_at' in target_columns and 'updated_at' not in insert_columns:
+        insert_columns.append('updated_at')
+    total = _count(source, table)
+    done = 0
+    mapping = id_maps[table]
+    refs = state.mail_refs[table]
+    hashes = state.mail_hashes[table]
+
+    for batch in _iter_batches(source, table, columns, batch_size):
+        new_rows = []
+        for row in batch:
+            digest = _mail_hash(row.get(spec['party_name']), row.get('subject'),
+                                row.get(spec['date']), row.get('content'))
+            if digest in hashes:
+                mapping[row['id']] = hashes[digest]
+                report[f'{table}_duplicates'] += 1
+                continue
+
+            new_id = state.allocate(table)
+            ref = row.get('reference_no')
+            if ref and ref in refs:
+                # نفس رقم المرجع لبريد مختلف: نحتفظ بالبريد مع تمييز مصدره
+                ref = f"{ref}/{source_index}"
+                suffix = 1
+                while ref in refs:
+                    suffix += 1
+                    ref = f"{row['reference_no']}/{source_index}.{suffix}"
+                report[f'{table}_renamed'] += 1
+
+            mapping[row['id']] = new_id
+            hashes[digest] = new_id
+            if ref:
+                refs[ref] = new_id
+
+            row['id'] = new_id
+            row['reference_no'] = ref
+            party_id = _as_int(row.get(spec['party_id']))
+            row[spec['party_id']] = id_maps['contacts'].get(party_id)
+            for user_column in spec['user_columns']:
+                if user_column in row:
+                    row[user_column] = id_maps['users'].get(_as_int(row[user_column]))
+            if row.get('updated_at') is None:
+                row['updated_at'] = row.get('created_at')
+            new_rows.append(row)
+
+        _insert_many(target, table, insert_columns, new_rows)
+        report[f'{table}_added'] += len(new_rows)
+        done += len(batch)
+        progress(table, done, total)
+
+
+def _merge_actions(source, target, state, id_maps, report, progress, batch_size):
+    columns = _table_columns(source, 'actions')
+    if not columns:
+        return
+    target_columns = _table_columns(target, 'actions')
+    insert_columns = [c for c in target_columns if c in columns]
+    total = _count(source, 'actions')
+    done = 0
+
+    for batch in _iter_batches(source, 'actions', columns, batch_size):
+        new_rows = []
+        for row in batch:
+            mail_table = 'outgoing_mail' if row.get('mail_type') == 'outgoing' else 'incoming_mail'
+            mail_id = id_maps[mail_table].get(_as_int(row.get('mail_id')))
+            if mail_id is None:
+                report['actions_orphaned'] += 1
+                continue
+            row['id'] = state.allocate('actions')
+            row['mail_id'] = mail_id
+            for user_column in ('assigned_to', 'created_by'):
+                row[user_column] = id_maps['users'].get(_as_int(row.get(user_column)))
+            new_rows.append(row)
+
+        _insert_many(target, 'actions', insert_columns, new_rows)
+        report['actions_added'] += len(new_rows)
+        done += len(batch)
+        progress('actions', done, total)
+
+
+def _merge_activity_log(source, target, state, id_maps, report, progress, batch_size):
+    columns = _table_columns(source, 'activity_log')
+    if not columns:
+        return
+    target_columns = _table_columns(target, 'activity_log')
+    insert_columns = [c for c in target_columns if c in columns]
+    total = _count(source, 'activity_log')
+    done = 0
+
+    for batch in _iter_batches(source, 'activity_log', columns, batch_size):
+        new_rows = []
+        for row in batch:
+            row['user_id'] = id_maps['users'].get(_as_int(row.get('user_id')))
+            key = (row['user_id'], row.get('action'), row.get('details'), row.get('created_at'))
+            if key in state.activity_keys:
+                continue
+            state.activity_keys.add(key)
+            row['id'] = state.allocate('activity_log')
+            new_rows.append(row)
+
+        _insert_many(target, 'activity_log', insert_columns, new_rows)
+        report['activity_added'] += len(new_rows)
+        done += len(batch)
+        progress('activity_log', done, total)
+
+
+def _merge_lookups(source, target, state):
+    """دمج التصنيفات والأولويات والإعدادات (القيم الموجودة في الهدف لها الأولوية)"""
+    for table, key in LOOKUP_TABLES.items():
+        columns = [c for c in _table_columns(source, table) if c != 'id']
+        if not columns:
+            continue
+        known = state.lookups[table]
+        rows = [dict(zip(columns, row)) for row in
+                source.execute(f"SELECT {', '.join(columns)} FROM {table}")]
+        rows = [row for row in rows if row.get(key) not in known]
+        insert_columns = [c for c in _table_columns(target, table) if c in columns]
+        _insert_many(target, table, insert_columns, rows)
+        known.update(row[key] for row in rows)
+
+
+def consolidate(target_path, source_paths, progress=print_progress, batch_size=BATCH_SIZE):
+    """
+    دمج قواعد بيانات مصدر في قاعدة بيانات هدف
+
+    Args:
+        target_path (str): مسار القاعدة الهدف (تُنشأ بهيكل init_db() إذا لم توجد)
+        source_paths (list): مسارات القواعد المصدر بالترتيب
+        progress (callable): دالة تقدم تستقبل (الجدول، المنجز، الإجمالي)
+        batch_size (int): حجم دفعة القراءة والإدراج
+
+    Returns:
+        dict: تقرير الدمج (الإضافات والتكرارات وإعادة التسمية)
+    """
+    init_db(target_path)
+
+    report = {key: 0 for key in (
+        'users_added', 'users_merged', 'contacts_added', 'contacts_merged',
+        'incoming_mail_added', 'incoming_mail_duplicates', 'incoming_mail_renamed',
+        'outgoing_mail_added', 'outgoing_mail_duplicates', 'outgoing_mail_renamed',
+        'actions_added', 'actions_orphaned', 'activity_added'
+    )}
+    started = time.perf_counter()
+
+    target = sqlite3.connect(target_path, isolation_level=None)
+    try:
+        target.execute("PRAGMA foreign_keys = OFF")
+        target.execute("BEGIN IMMEDIATE")
+        state = _TargetState(target)
+
+        for source_index, source_path in enumerate(source_paths, 1):
+            if os.path.abspath(source_path) == os.path.abspath(target_path):
+                print(f"⚠️ تم تجاهل {source_path}: هو نفسه القاعدة الهدف")
+                continue
+
+            print(f"📂 دمج {source_path}")
+            source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+            try:
+                id_maps = {table: {} for table in ('users', 'contacts', 'incoming_mail', 'outgoing_mail')}
+                if _table_columns(source, 'users'):
+                    _merge_users(source, target, state, id_maps, report, progress, batch_size)
+                if _table_columns(source, 'contacts'):
+                    _merge_contacts(source, target, state, id_maps, report, progress, batch_size)
+                for table in MAIL_TABLES:
+                    if _table_columns(source, table):
+                        _merge_mail(table, source, target, state, id_maps, source_index,
+                                    report, progress, batch_size)
+                _merge_actions(source, target, state, id_maps, report, progress, batch_size)
+                _merge_activity_log(source, target, state, id_maps, report, progress, batch_size)
+                _merge_lookups(source, target, state)
+            finally:
+                source.close()
+
+        target.execute("COMMIT")
+    except Exception:
+        target.execute("ROLLBACK")
+        raise
+    finally:
+        target.close()
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="دمج قواعد بيانات مكتب الضبط في قاعدة واحدة")
+    parser.add_argument("target", help="القاعدة الهدف (مثال: management.db)")
+    parser.add_argument("sources", nargs="+", help="القواعد المصدر (مثال: management1.db management2.db)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="حجم الدفعة")
+    args = parser.parse_args()
+
+    result = consolidate(args.target, args.sources, batch_size=args.batch_size)
+
+    print("=" * 50)
+    print("✅ تم الدمج بنجاح")
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    print("=" * 50)
@@ -1,17 +1,31 @@
 # database.py - نسخة معدلة لنظام المصادقة المحسن
+import os
 import sqlite3
 import streamlit as st
 from datetime import datetime
 import pandas as pd
 import hashlib
+import query_trace
+import tenants
+
+# مسار قاعدة البيانات الافتراضي (وضع المؤسسة الواحدة)
+DB_PATH = 'management.db'
+
+def active_db_path():
+    """قاعدة المؤسسة النشطة (tenants.py) أو DB_PATH"""
+    return tenants.db_path() or DB_PATH
 
 def hash_password(password):
     """تجزئة كلمة المرور باستخدام SHA256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
-def init_db():
+def init_db(db_path=None):
     """تهيئة قاعدة البيانات وإنشاء الجداول مع نظام الصلاحيات"""
-    conn = sqlite3.connect('management.db')
+    db_path = db_path or active_db_path()
+    # قاعدة مؤسسة جديدة في مجلدها (tenants/<الرمز>/)
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # جدول المستخدمين (محدث مع حقول جديدة)
@@ -65,6 +79,12 @@ def init_db():
         recorded_by INTEGER,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        reply_to_id INTEGER,
+        thread_id INTEGER,
+        reply_required INTEGER DEFAULT 0,
+        reply_count INTEGER DEFAULT 0,
+        last_reply_date DATE,
+        version INTEGER NOT NULL DEFAULT 1,
         FOREIGN KEY (sender_id) REFERENCES contacts(id),
         FOREIGN KEY (recorded_by) REFERENCES users(id)
     )
@@ -89,6 +109,9 @@ def init_db():
         notes TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        reply_to_id INTEGER,
+        thread_id INTEGER,
+        version INTEGER NOT NULL DEFAULT 1,
         FOREIGN KEY (recipient_id) REFERENCES contacts(id),
         FOREIGN KEY (sent_by) REFERENCES users(id)
     )
@@ -162,6 +185,144 @@ def init_db():
     )
     ''')
     
+    # نصوص المرفقات المستخرجة حسب بصمة المحتوى (services/fulltext.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS attachment_text (
+        blob_hash TEXT PRIMARY KEY,
+        text TEXT,
+        error TEXT,
+        extracted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # بصمة كل ملف مرفق مع حجمه ووقت تعديله (لتجنب إعادة قراءة الملفات غير المتغيرة)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS attachment_blobs (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime REAL,
+        blob_hash TEXT NOT NULL
+    )
+    ''')
+    
+    # فهرس البحث النصي الكامل: بيانات البريد ونصوص مرفقاته (موحدة)
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS mail_search USING fts5(
+        mail_type UNINDEXED,
+        mail_id UNINDEXED,
+        signature UNINDEXED,
+        reference_no,
+        subject,
+        party,
+        body,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''')
+    
+    # بصمات كشف البريد الوارد المكرر (services/duplicates.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS mail_signatures (
+        mail_id INTEGER PRIMARY KEY,
+        sender_key TEXT,
+        received_date DATE,
+        minhash BLOB,
+        file_hashes TEXT,
+        updated_at TIMESTAMP
+    )
+    ''')
+    
+    # مفاتيح البحث عن المرشحين: نطاقات LSH للموضوع وبصمات المرفقات، مرتبة بتاريخ
+    # الاستلام داخل كل مفتاح حتى يكون البحث قراءة نطاق النافذة الزمنية فقط
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS mail_signature_keys (
+        key TEXT NOT NULL,
+        received_date DATE,
+        mail_id INTEGER NOT NULL,
+        PRIMARY KEY (key, received_date, mail_id)
+    ) WITHOUT ROWID
+    ''')
+    
+    # عدادات البريد لكل جهة اتصال تحدّثها المشغلات (triggers) أدناه
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS contact_stats (
+        contact_id INTEGER PRIMARY KEY,
+        incoming_count INTEGER NOT NULL DEFAULT 0,
+        outgoing_count INTEGER NOT NULL DEFAULT 0,
+        open_count INTEGER NOT NULL DEFAULT 0,
+        last_exchange DATE
+    )
+    ''')
+    
+    # سجل انتقالات حالة البريد (تكتبه مشغلات status_triggers)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS status_history (
+        id INTEGER PRIMARY KEY,
+        mail_type TEXT NOT NULL,
+        mail_id INTEGER NOT NULL,
+        old_status TEXT,
+        new_status TEXT,
+        changed_at TIMESTAMP NOT NULL
+    )
+    ''')
+    
+    # مجاميع المدة في كل حالة حسب التصنيف والأولوية والشهر، موزعة على شرائح مدة
+    # (DURATION_BUCKETS_HOURS) لحساب الوسيط و p90 دون قراءة السجل
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS status_durations (
+        mail_type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        category TEXT NOT NULL,
+        priority TEXT NOT NULL,
+        month TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        transitions INTEGER NOT NULL DEFAULT 0,
+        total_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (mail_type, status, category, priority, month, bucket)
+    ) WITHOUT ROWID
+    ''')
+    
+    # حدود شرائح المدة بالثواني (تُملأ من DURATION_BUCKETS_HOURS)، تقرؤها المشغلات
+    # بدل تعبير CASE مكرر في جسم كل مشغل
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS duration_buckets (
+        bucket INTEGER PRIMARY KEY,
+        upper_seconds INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("DELETE FROM duration_buckets WHERE bucket >= ?", (len(DURATION_BUCKETS_HOURS),))
+    cursor.executemany("INSERT OR REPLACE INTO duration_buckets (bucket, upper_seconds) VALUES (?, ?)",
+                       [(bucket, hours * 3600) for bucket, hours in enumerate(DURATION_BUCKETS_HOURS)])
+    
+    # مدة معالجة البريد الوارد من تسجيله إلى أول انتقال إلى "مكتمل"
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS handling_times (
+        category TEXT NOT NULL,
+        priority TEXT NOT NULL,
+        month TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        completed INTEGER NOT NULL DEFAULT 0,
+        overdue INTEGER NOT NULL DEFAULT 0,
+        total_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (category, priority, month, bucket)
+    ) WITHOUT ROWID
+    ''')
+    
+    # سجل التغييرات (تكتبه مشغلات change_log_triggers، وتقرأه services/changes.py)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER,
+        op TEXT NOT NULL,
+        version INTEGER,
+        changed_at TIMESTAMP NOT NULL
+    )
+    ''')
+    
+    # أعمدة أضيفت بعد إنشاء الجداول في القواعد الموجودة
+    for table, columns in ADDED_COLUMNS.items():
+        _add_missing_columns(cursor, table, columns)
+    
     # إضافة مستخدمين افتراضيين إذا لم يوجدوا
     cursor.execute("SELECT COUNT(*) FROM users")
     if cursor.fetchone()[0] == 0:
@@ -262,6 +423,94 @@ def init_db():
     CREATE INDEX IF NOT EXISTS idx_outgoing_mail_status ON outgoing_mail(status);
     ''')
     
+    # فهارس تغطي أعمدة بطاقات القوائم (LIST_COLUMNS في services/mail.py) حتى تُقرأ
+    # القوائم من الفهرس دون المرور بصفوف content و notes و attachments
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_list ON incoming_mail(
+        received_date, status, priority, due_date, reference_no, sender_name, subject);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_outgoing_mail_list ON outgoing_mail(
+        sent_date, status, priority, reference_no, recipient_name, subject);
+    ''')
+    
+    # خط مراسلات الجهة (services/contacts.py): بريد الجهة مرتباً بالتاريخ داخل الفهرس،
+    # والأسماء المكتوبة يدوياً دون جهة في فهرس جزئي. حلت محل فهارس sender_id/recipient_id وحدها
+    cursor.execute("DROP INDEX IF EXISTS idx_incoming_mail_sender")
+    cursor.execute("DROP INDEX IF EXISTS idx_outgoing_mail_recipient")
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_sender_date ON incoming_mail(sender_id, received_date);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_outgoing_mail_recipient_date ON outgoing_mail(recipient_id, sent_date);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_sender_name ON incoming_mail(sender_name, received_date)
+    WHERE sender_id IS NULL;
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_outgoing_mail_recipient_name ON outgoing_mail(recipient_name, sent_date)
+    WHERE recipient_id IS NULL;
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_mail_signature_keys_mail ON mail_signature_keys(mail_id);
+    ''')
+    
+    # سلاسل الردود (services/threads.py): أعضاء السلسلة، والردود على بريد معين، والبريد
+    # الذي ينتظر رداً (القائمة قراءة لهذا الفهرس الجزئي وحده)
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_thread ON incoming_mail(thread_id);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_outgoing_mail_thread ON outgoing_mail(thread_id);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_reply_to ON incoming_mail(reply_to_id)
+    WHERE reply_to_id IS NOT NULL;
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_outgoing_mail_reply_to ON outgoing_mail(reply_to_id)
+    WHERE reply_to_id IS NOT NULL;
+    ''')
+    
+    # قوائم مهام المستخدمين (services/actions.py): الإجراءات المفتوحة فقط مرتبة بالاستحقاق
+    # لكل مكلف، فحجم الفهرس لا يتبع الإجراءات المكتملة المتراكمة
+    cursor.execute(f'''
+    CREATE INDEX IF NOT EXISTS idx_actions_queue ON actions(assigned_to, {ACTION_DUE_KEY}, id)
+    WHERE {OPEN_ACTIONS};
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_actions_mail ON actions(mail_id, mail_type);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_status_history_mail ON status_history(mail_type, mail_id, id);
+    ''')
+    
+    # ضغط سجل التغييرات (آخر تغيير لكل صف) وعلامات إعادة المزامنة النادرة
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log(table_name, row_id, seq);
+    ''')
+    
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_change_log_resets ON change_log(seq) WHERE op = 'reset';
+    ''')
+    
+    cursor.execute(f'''
+    CREATE INDEX IF NOT EXISTS idx_incoming_mail_awaiting_reply ON incoming_mail(received_date)
+    WHERE {AWAITING_REPLY};
+    ''')
+    
     cursor.execute('''
     CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
     ''')
@@ -278,13 +527,343 @@ def init_db():
     CREATE INDEX IF NOT EXISTS idx_activity_log_date ON activity_log(created_at);
     ''')
     
+    # المشغلات: عند إنشائها (قاعدة جديدة أو بعد التوليد الدفعي الذي يحذفها) تُعاد
+    # البيانات التي تحافظ عليها من الجداول مرة واحدة؛ المشغل الذي تغير جسمه يُستبدل فقط
+    existing = dict(cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall())
+    for triggers, rebuild in ((contact_stats_triggers(), rebuild_contact_stats), (thread_triggers(), rebuild_threads),
+                              (status_triggers(), rebuild_status_history),
+                              (change_log_triggers(), mark_change_log_reset)):
+        for name, sql in triggers:
+            if name in existing and existing[name] != sql.strip():
+                cursor.execute(f"DROP TRIGGER {name}")
+            if existing.get(name) != sql.strip():
+                cursor.execute(sql)
+        if not existing.keys() >= {name for name, _ in triggers}:
+            rebuild(cursor)
+    
     conn.commit()
     conn.close()
     print("✅ تم تهيئة قاعدة البيانات بنجاح!")
 
-def get_db_connection():
+ADDED_COLUMNS = {
+    'incoming_mail': {
+        'reply_to_id': 'INTEGER',
+        'thread_id': 'INTEGER',
+        'reply_required': 'INTEGER DEFAULT 0',
+        'reply_count': 'INTEGER DEFAULT 0',
+        'last_reply_date': 'DATE',
+        'version': 'INTEGER NOT NULL DEFAULT 1'
+    },
+    'outgoing_mail': {
+        'reply_to_id': 'INTEGER',
+        'thread_id': 'INTEGER',
+        'version': 'INTEGER NOT NULL DEFAULT 1'
+    }
+}
+
+
+def _add_missing_columns(cursor, table, columns):
+    """إضافة الأعمدة غير الموجودة في جدول قديم (ALTER TABLE لا يدعم IF NOT EXISTS)"""
+    present = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in present:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+# --- عدادات جهات الاتصال ---
+# (نوع البريد، الجدول، عمود الجهة، عمود التاريخ، عمود العداد، شرط البريد المفتوح)
+CONTACT_STATS_SOURCES = [
+    ('incoming', 'incoming_mail', 'sender_id', 'received_date', 'incoming_count',
+     "status NOT IN ('مكتمل', 'ملغي')"),
+    ('outgoing', 'outgoing_mail', 'recipient_id', 'sent_date', 'outgoing_count', "status = 'مسودة'")
+]
+
+LAST_EXCHANGE_SQL = '''(SELECT MAX(d) FROM (
+    SELECT MAX(received_date) AS d FROM incoming_mail WHERE sender_id = {contact}
+    UNION ALL
+    SELECT MAX(sent_date) FROM outgoing_mail WHERE recipient_id = {contact}))'''
+
+
+def contact_stats_triggers():
+    """
+    مشغلات تحدّث contact_stats مع كل إدراج أو تعديل أو حذف بريد (بما فيه الاستيراد الدفعي)
+
+    العدادات تُزاد وتُنقص مباشرة؛ آخر مراسلة تُحسب من جديد عند الحذف أو النقل فقط،
+    وهي قراءة MAX من فهرس (الجهة، التاريخ). المعرفات التي خزنتها إصدارات قديمة كـ BLOB
+    (numpy.int64 قبل to_int) لا تشير إلى أي جهة فتُتجاهل.
+    """
+    triggers = []
+    for mail_type, table, contact_column, date_column, count_column, open_condition in CONTACT_STATS_SOURCES:
+        add = f'''
+        INSERT OR IGNORE INTO contact_stats (contact_id) SELECT NEW.{contact_column} WHERE typeof(NEW.{contact_column}) = 'integer';
+        UPDATE contact_stats SET
+            {count_column} = {count_column} + 1,
+            open_count = open_count + (NEW.{open_condition}),
+            last_exchange = COALESCE(MAX(last_exchange, NEW.{date_column}), last_exchange, NEW.{date_column})
+        WHERE contact_id = NEW.{contact_column};'''
+        remove = f'''
+        UPDATE contact_stats SET
+            {count_column} = {count_column} - 1,
+            open_count = open_count - (OLD.{open_condition}),
+            last_exchange = {LAST_EXCHANGE_SQL.format(contact='OLD.' + contact_column)}
+        WHERE contact_id = OLD.{contact_column};'''
+        triggers += [
+            (f'contact_stats_{mail_type}_insert', f'''
+            CREATE TRIGGER contact_stats_{mail_type}_insert AFTER INSERT ON {table}
+            WHEN typeof(NEW.{contact_column}) = 'integer'
+            BEGIN{add}
+            END'''),
+            (f'contact_stats_{mail_type}_delete', f'''
+            CREATE TRIGGER contact_stats_{mail_type}_delete AFTER DELETE ON {table}
+            WHEN typeof(OLD.{contact_column}) = 'integer'
+            BEGIN{remove}
+            END'''),
+            (f'contact_stats_{mail_type}_update', f'''
+            CREATE TRIGGER contact_stats_{mail_type}_update AFTER UPDATE OF {contact_column}, status, {date_column} ON {table}
+            WHEN OLD.{contact_column} IS NOT NEW.{contact_column} OR OLD.status IS NOT NEW.status
+              OR OLD.{date_column} IS NOT NEW.{date_column}
+            BEGIN{remove}{add}
+            END''')
+        ]
+    triggers.append(('contact_stats_contact_delete', '''
+    CREATE TRIGGER contact_stats_contact_delete AFTER DELETE ON contacts
+    BEGIN
+        DELETE FROM contact_stats WHERE contact_id = OLD.id;
+    END'''))
+    return triggers
+
+
+def rebuild_contact_stats(conn):
+    """إعادة حساب عدادات كل الجهات من جداول البريد"""
+    conn.execute("DELETE FROM contact_stats")
+    conn.execute(f'''
+    INSERT INTO contact_stats (contact_id, incoming_count, outgoing_count, open_count, last_exchange)
+    SELECT contact_id, SUM(incoming), SUM(outgoing), SUM(open), MAX(mail_date)
+    FROM (
+        SELECT sender_id AS contact_id, 1 AS incoming, 0 AS outgoing,
+               {CONTACT_STATS_SOURCES[0][5]} AS open, received_date AS mail_date
+        FROM incoming_mail WHERE typeof(sender_id) = 'integer'
+        UNION ALL
+        SELECT recipient_id, 0, 1, {CONTACT_STATS_SOURCES[1][5]}, sent_date
+        FROM outgoing_mail WHERE typeof(recipient_id) = 'integer'
+    )
+    GROUP BY contact_id
+    ''')
+
+# --- قوائم المهام ---
+# إجراء مفتوح، ومفتاح ترتيب قائمة المهام بالاستحقاق (الإجراء بدون تاريخ في الآخر)
+OPEN_ACTIONS = "status IN ('معلق', 'قيد التنفيذ')"
+ACTION_DUE_KEY = "COALESCE(due_date, '9999-12-31')"
+
+# --- سلاسل الردود ---
+# بريد وارد ينتظر رداً: مطلوب رده (عند التسجيل أو بإجراء "رد")، لم يُربط به أي رد، وغير مغلق
+AWAITING_REPLY = "reply_required = 1 AND reply_count = 0 AND status NOT IN ('مكتمل', 'ملغي')"
+
+# معرف السلسلة هو مفتاح أول بريد فيها: id * 2 للوارد و id * 2 + 1 للصادر (services/threads.py)
+REPLY_STATE_SQL = """
+        UPDATE incoming_mail SET
+            reply_count = (SELECT COUNT(*) FROM outgoing_mail WHERE reply_to_id = {parent}),
+            last_reply_date = (SELECT MAX(sent_date) FROM outgoing_mail WHERE reply_to_id = {parent}),
+            updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+        WHERE id = {parent};"""
+
+
+def thread_triggers():
+    """
+    مشغلات السلاسل وحالة الرد: معرف السلسلة للبريد الجديد (سلسلة البريد الذي يرد عليه
+    أو سلسلة جديدة)، وعدد الردود وتاريخ آخر رد على البريد الوارد مع كل إضافة أو حذف أو
+    نقل رد صادر، وإتمام إجراءات "رد" المعلقة عند ربط الرد
+    """
+    return [
+        ('thread_incoming_insert', '''
+        CREATE TRIGGER thread_incoming_insert AFTER INSERT ON incoming_mail
+        WHEN NEW.thread_id IS NULL
+        BEGIN
+            UPDATE incoming_mail
+            SET thread_id = COALESCE((SELECT thread_id FROM outgoing_mail WHERE id = NEW.reply_to_id), NEW.id * 2)
+            WHERE id = NEW.id;
+        END'''),
+        ('thread_outgoing_insert', '''
+        CREATE TRIGGER thread_outgoing_insert AFTER INSERT ON outgoing_mail
+        WHEN NEW.thread_id IS NULL
+        BEGIN
+            UPDATE outgoing_mail
+            SET thread_id = COALESCE((SELECT thread_id FROM incoming_mail WHERE id = NEW.reply_to_id), NEW.id * 2 + 1)
+            WHERE id = NEW.id;
+        END'''),
+        ('reply_outgoing_insert', f'''
+        CREATE TRIGGER reply_outgoing_insert AFTER INSERT ON outgoing_mail
+        WHEN NEW.reply_to_id IS NOT NULL
+        BEGIN{REPLY_STATE_SQL.format(parent='NEW.reply_to_id')}
+            UPDATE actions SET status = 'مكتمل', completed_date = date('now')
+            WHERE mail_id = NEW.reply_to_id AND mail_type = 'incoming' AND action_type = 'رد' AND status != 'مكتمل';
+        END'''),
+        ('reply_outgoing_delete', f'''
+        CREATE TRIGGER reply_outgoing_delete AFTER DELETE ON outgoing_mail
+        WHEN OLD.reply_to_id IS NOT NULL
+        BEGIN{REPLY_STATE_SQL.format(parent='OLD.reply_to_id')}
+        END'''),
+        ('reply_outgoing_update', f'''
+        CREATE TRIGGER reply_outgoing_update AFTER UPDATE OF reply_to_id, sent_date ON outgoing_mail
+        WHEN OLD.reply_to_id IS NOT NEW.reply_to_id OR OLD.sent_date IS NOT NEW.sent_date
+        BEGIN{REPLY_STATE_SQL.format(parent='OLD.reply_to_id')}{REPLY_STATE_SQL.format(parent='NEW.reply_to_id')}
+            UPDATE actions SET status = 'مكتمل', completed_date = date('now')
+            WHERE mail_id = NEW.reply_to_id AND mail_type = 'incoming' AND action_type = 'رد' AND status != 'مكتمل';
+        END'''),
+        ('reply_action_insert', '''
+        CREATE TRIGGER reply_action_insert AFTER INSERT ON actions
+        WHEN NEW.mail_type = 'incoming' AND NEW.action_type = 'رد' AND NEW.status != 'مكتمل'
+        BEGIN
+            UPDATE incoming_mail SET reply_required = 1, updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE id = NEW.mail_id AND reply_required = 0;
+        END''')
+    ]
+
+
+def rebuild_threads(conn):
+    """سلاسل البريد غير المصنف وحالة الرد لكل البريد الوارد من الجداول"""
+    conn.execute("UPDATE incoming_mail SET thread_id = id * 2 WHERE thread_id IS NULL AND reply_to_id IS NULL")
+    conn.execute("UPDATE outgoing_mail SET thread_id = id * 2 + 1 WHERE thread_id IS NULL AND reply_to_id IS NULL")
+    conn.execute('''
+    UPDATE outgoing_mail SET thread_id = (SELECT thread_id FROM incoming_mail WHERE id = outgoing_mail.reply_to_id)
+    WHERE thread_id IS NULL
+    ''')
+    conn.execute('''
+    UPDATE incoming_mail SET thread_id = COALESCE(
+        (SELECT thread_id FROM outgoing_mail WHERE id = incoming_mail.reply_to_id), id * 2)
+    WHERE thread_id IS NULL
+    ''')
+    conn.execute("UPDATE incoming_mail SET reply_count = 0, last_reply_date = NULL WHERE reply_count != 0")
+    conn.execute('''
+    UPDATE incoming_mail SET (reply_count, last_reply_date) = (
+        SELECT COUNT(*), MAX(sent_date) FROM outgoing_mail WHERE reply_to_id = incoming_mail.id)
+    WHERE id IN (SELECT reply_to_id FROM outgoing_mail WHERE reply_to_id IS NOT NULL)
+    ''')
+    conn.execute('''
+    UPDATE incoming_mail SET reply_required = 1
+    WHERE reply_required = 0 AND id IN (
+        SELECT mail_id FROM actions WHERE mail_type = 'incoming' AND action_type = 'رد' AND status != 'مكتمل')
+    ''')
+
+# --- سجل الحالات ومجاميع آجال المعالجة ---
+# الحدود العليا لشرائح المدة بالساعات؛ الشريحة الأخيرة (len) لكل ما تجاوزها
+DURATION_BUCKETS_HOURS = [1, 4, 8, 24, 48, 72, 120, 168, 336, 720, 1440, 2160]
+STATUS_TABLES = {'incoming': 'incoming_mail', 'outgoing': 'outgoing_mail'}
+
+
+def duration_bucket_sql(seconds):
+    """تعبير SQL لرقم شريحة مدة بالثواني: عدد الحدود التي لا تتجاوزها (جدول duration_buckets)"""
+    return f"(SELECT COUNT(*) FROM duration_buckets WHERE upper_seconds <= {seconds})"
+
+
+def status_triggers():
+    """
+    مشغلات سجل الحالات: صف في status_history عند إنشاء البريد وعند كل تغيير لحالته،
+    مع إضافة المدة التي قضاها في الحالة السابقة إلى status_durations، ومدة المعالجة
+    إلى handling_times عند أول اكتمال لبريد وارد. التقرير يقرأ المجاميع فقط.
+    """
+    now = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    month = "strftime('%Y-%m', 'now')"
+    triggers = []
+    for mail_type, table in STATUS_TABLES.items():
+        entered = f'''COALESCE((SELECT changed_at FROM status_history
+            WHERE mail_type = '{mail_type}' AND mail_id = NEW.id ORDER BY id DESC LIMIT 1), OLD.created_at)'''
+        seconds = f"((julianday('now') - julianday({entered})) * 86400)"
+        handling = ""
+        if mail_type == "incoming":
+            completion = "((julianday('now') - julianday(OLD.created_at)) * 86400)"
+            handling = f'''
+            INSERT INTO handling_times (category, priority, month, bucket, completed, overdue, total_seconds)
+            SELECT COALESCE(NEW.category, ''), COALESCE(NEW.priority, ''), {month},
+                   {duration_bucket_sql(completion)}, 1, NEW.due_date IS NOT NULL AND date('now') > NEW.due_date,
+                   {completion}
+            WHERE NEW.status = 'مكتمل' AND NOT EXISTS (
+                SELECT 1 FROM status_history WHERE mail_type = 'incoming' AND mail_id = NEW.id AND new_status = 'مكتمل')
+            ON CONFLICT (category, priority, month, bucket) DO UPDATE SET
+                completed = completed + 1, overdue = overdue + excluded.overdue,
+                total_seconds = total_seconds + excluded.total_seconds;'''
+        triggers += [
+            (f'status_{mail_type}_insert', f'''
+            CREATE TRIGGER status_{mail_type}_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO status_history (mail_type, mail_id, old_status, new_status, changed_at)
+                VALUES ('{mail_type}', NEW.id, NULL, NEW.status, COALESCE(NEW.created_at, {now}));
+            END'''),
+            (f'status_{mail_type}_update', f'''
+            CREATE TRIGGER status_{mail_type}_update AFTER UPDATE OF status ON {table}
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO status_durations (mail_type, status, category, priority, month, bucket,
+                                              transitions, total_seconds)
+                VALUES ('{mail_type}', COALESCE(OLD.status, ''), COALESCE(NEW.category, ''),
+                        COALESCE(NEW.priority, ''), {month}, {duration_bucket_sql(seconds)}, 1, {seconds})
+                ON CONFLICT (mail_type, status, category, priority, month, bucket) DO UPDATE SET
+                    transitions = transitions + 1, total_seconds = total_seconds + excluded.total_seconds;{handling}
+                INSERT INTO status_history (mail_type, mail_id, old_status, new_status, changed_at)
+                VALUES ('{mail_type}', NEW.id, OLD.status, NEW.status, {now});
+            END'''),
+            (f'status_{mail_type}_delete', f'''
+            CREATE TRIGGER status_{mail_type}_delete AFTER DELETE ON {table}
+            BEGIN
+                DELETE FROM status_history WHERE mail_type = '{mail_type}' AND mail_id = OLD.id;
+            END''')
+        ]
+    return triggers
+
+
+def rebuild_status_history(conn):
+    """
+    صف بداية في status_history لكل بريد ليس له سجل (قواعد قديمة أو توليد دفعي)
+
+    الانتقالات السابقة لإنشاء المشغلات غير معروفة فلا تدخل المجاميع.
+    """
+    for mail_type, table in STATUS_TABLES.items():
+        conn.execute(f'''
+        INSERT INTO status_history (mail_type, mail_id, old_status, new_status, changed_at)
+        SELECT ?, id, NULL, status, COALESCE(created_at, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        FROM {table}
+        WHERE id NOT IN (SELECT mail_id FROM status_history WHERE mail_type = ?)
+        ''', (mail_type, mail_type))
+
+# --- سجل التغييرات ---
+# الجداول المتتبعة وعمود إصدار الصف فيها (None: بدون إصدار)
+CHANGE_TABLES = {
+    'incoming_mail': 'version',
+    'outgoing_mail': 'version',
+    'contacts': None,
+    'users': None,
+    'actions': None
+}
+
+
+def change_log_triggers():
+    """مشغلات سجل التغييرات: صف (الجدول، المعرف، العملية، الإصدار، الوقت) لكل إضافة وتعديل وحذف"""
+    now = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    triggers = []
+    for table, version in CHANGE_TABLES.items():
+        for op, event, row in (('insert', 'INSERT', 'NEW'), ('update', 'UPDATE', 'NEW'), ('delete', 'DELETE', 'OLD')):
+            triggers.append((f'change_log_{table}_{op}', f'''
+            CREATE TRIGGER change_log_{table}_{op} AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, row_id, op, version, changed_at)
+                VALUES ('{table}', {row}.id, '{op}', {f"{row}.{version}" if version else "NULL"}, {now});
+            END'''))
+    return triggers
+
+
+def mark_change_log_reset(conn):
+    """
+    علامة إعادة مزامنة: التغييرات قبل إنشاء المشغلات (قاعدة قديمة أو توليد دفعي) غير مسجلة،
+    فالمستهلك الذي يقرأ بعدها من مؤشر أقدم يعيد نسخ كل شيء
+    """
+    conn.execute('''
+    INSERT INTO change_log (table_name, row_id, op, version, changed_at)
+    VALUES ('*', NULL, 'reset', NULL, strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    ''')
+
+def get_db_connection(db_path=None):
     """إنشاء اتصال بقاعدة البيانات"""
-    return sqlite3.connect('management.db', check_same_thread=False)
+    return sqlite3.connect(db_path or active_db_path(), check_same_thread=False,
+                           factory=query_trace.connection_factory())
 
 def log_activity(user_id, action, details=""):
     """تسجيل نشاط المستخدم"""
@@ -295,7 +874,7 @@ def log_activity(user_id, action, details=""):
         # الحصول على معلومات المتصفح (إذا كان في سياق Streamlit)
         try:
             from streamlit.runtime.scriptrunner import get_script_run_ctx
-            ctx = get_script_run_ctx()
+            ctx = get_script_run_ctx(suppress_warning=True)
             if ctx:
                 ip_address = ctx.request.remote_ip
                 user_agent = ctx.request.headers.get('User-Agent', '')
@@ -435,17 +1014,20 @@ def create_backup():
         backup_dir = "backups"
         os.makedirs(backup_dir, exist_ok=True)
         
+        # نسخ كل مؤسسة باسمها حتى لا يحذف تدوير النسخ نسخ مؤسسة أخرى
+        tenant = tenants.active()
+        prefix = tenant['code'] if tenant else "management"
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = f"{backup_dir}/management_backup_{timestamp}.db"
+        backup_file = f"{backup_dir}/{prefix}_backup_{timestamp}.db"
         
-        shutil.copy2('management.db', backup_file)
+        shutil.copy2(active_db_path(), backup_file)
         
         # تسجيل إنشاء النسخة الاحتياطية
         log_activity(0, "نسخة احتياطية", f"تم إنشاء نسخة احتياطية: {backup_file}")
         
         # الحفاظ على آخر 10 نسخ فقط
         import glob
-        backups = sorted(glob.glob(f"{backup_dir}/*.db"), key=os.path.getmtime)
+        backups = sorted(glob.glob(f"{backup_dir}/{prefix}_backup_*.db"), key=os.path.getmtime)
         if len(backups) > 10:
             for old_backup in backups[:-10]:
                 os.remove(old_backup)
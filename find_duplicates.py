@@ -0,0 +1,43 @@
+# find_duplicates.py - البحث عن البريد الوارد المكرر في كل الأرشيف
+"""
+يحدث بصمات كشف التكرار للبريد غير المفهرس (الاستيراد الدفعي، القواعد القديمة) ثم
+يعرض أزواج البريد الوارد المكرر المحتمل: نفس المرفق، أو موضوع متشابه من نفس المرسل
+خلال نافذة أيام.
+
+الاستعمال:
+    python find_duplicates.py --window 14 --output duplicates.csv
+"""
+import argparse
+import time
+
+import database
+from services import duplicates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="البحث عن البريد الوارد المكرر في الأرشيف")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--window", type=int, default=duplicates.WINDOW_DAYS,
+                        help="أقصى فرق بالأيام بين تاريخي استلام النسختين")
+    parser.add_argument("--output", default=None, help="حفظ الأزواج في ملف CSV")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_db()
+
+    started = time.perf_counter()
+    indexed = duplicates.index_missing()
+    print(f"📇 تحديث {indexed} بصمة ({time.perf_counter() - started:.1f} ثانية)")
+
+    started = time.perf_counter()
+    pairs = duplicates.find_archive_duplicates(args.window)
+    print(f"🔎 {len(pairs)} زوج مكرر محتمل ({time.perf_counter() - started:.1f} ثانية)")
+    if pairs.empty:
+        raise SystemExit(0)
+
+    if args.output:
+        pairs.to_csv(args.output, index=False, encoding='utf-8-sig')
+        print(f"✅ تم حفظ النتائج في {args.output}")
+    else:
+        print(pairs.drop(columns=['id_a', 'id_b']).head(50).to_string(index=False))
@@ -0,0 +1,344 @@
+# generate_dataset.py - توليد قاعدة بيانات اصطناعية لاختبارات الحجم والأداء
+"""
+توليد قاعدة بيانات بهيكل init_db() مملوءة ببريد وارد وصادر وجهات اتصال
+وإجراءات وسجل نشاطات واقعية (أسماء ومواضيع عربية) بالحجم المطلوب.
+
+الاستعمال:
+    python generate_dataset.py bench_100k.db --incoming 100000 --seed 42
+    python generate_dataset.py bench_1m.db --incoming 1000000 --end-date 2026-01-31 --force
+
+- نفس البذرة ونفس المعاملات (مع --end-date) تعطي نفس البيانات تماماً
+- إدراج على دفعات executemany مع تعطيل اليومية والمزامنة أثناء التوليد
+- الفهارس والمشغلات تُحذف قبل الإدراج ويعاد إنشاؤها بعده عبر init_db()
+- المرفقات: مجموعة صغيرة من الملفات الوهمية (--uploads) تشير إليها الرسائل
+"""
+import argparse
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from database import change_log_triggers, contact_stats_triggers, get_db_connection, init_db, thread_triggers
+
+BATCH_SIZE = 20000
+
+# الفهارس التي تبطئ الإدراج الكثيف (يعاد إنشاؤها بـ init_db في النهاية)
+BULK_INDEXES = [
+    'idx_incoming_mail_reference', 'idx_incoming_mail_status', 'idx_incoming_mail_due_date',
+    'idx_outgoing_mail_reference', 'idx_outgoing_mail_status',
+    'idx_incoming_mail_list', 'idx_outgoing_mail_list',
+    'idx_incoming_mail_sender_date', 'idx_outgoing_mail_recipient_date',
+    'idx_incoming_mail_sender_name', 'idx_outgoing_mail_recipient_name',
+    'idx_actions_queue', 'idx_actions_mail',
+    'idx_activity_log_user', 'idx_activity_log_date'
+]
+
+# مشغلات العدادات والسلاسل وسجل التغييرات: تُحذف أثناء التوليد ويعيد init_db إنشاءها وحساب ما تحافظ عليه
+BULK_TRIGGERS = [name for name, _ in contact_stats_triggers() + thread_triggers() + change_log_triggers()]
+
+FIRST_NAMES = ['محمد', 'أحمد', 'علي', 'فاطمة', 'مريم', 'يوسف', 'خديجة', 'عمر', 'سلمى', 'الهادي',
+               'منية', 'سامي', 'نجلاء', 'كمال', 'هالة', 'رضا', 'آمنة', 'الطاهر', 'سنية', 'بلال']
+LAST_NAMES = ['بن علي', 'الطرابلسي', 'القابسي', 'الحامي', 'المرزوقي', 'الشابي', 'بن صالح',
+              'العياري', 'الغربي', 'الجلاصي', 'بن عمر', 'الزواري', 'المنصوري', 'الدريدي']
+ORGANIZATIONS = ['المندوبية الجهوية للتربية بقابس', 'وزارة التربية', 'بلدية قابس',
+                 'ولاية قابس', 'المعهد الثانوي حي الأمل', 'المدرسة الابتدائية النصر',
+                 'الإدارة الجهوية للصحة', 'جمعية أولياء التلاميذ', 'الديوان الوطني للخدمات المدرسية',
+                 'المركز الجهوي للتربية والتكوين المستمر', 'الصندوق الوطني للتقاعد والحيطة الاجتماعية',
+                 'القباضة المالية بقابس', 'الشركة التونسية للكهرباء والغاز', 'الحماية المدنية']
+
+SUBJECT_ACTIONS = ['طلب', 'إعلام بخصوص', 'دعوة لحضور', 'مراسلة حول', 'استفسار عن',
+                   'إرسال', 'تذكير بخصوص', 'موافقة على', 'رفض', 'متابعة']
+SUBJECT_TOPICS = ['قائمة التلاميذ المرسمين', 'جدول الأوقات للسداسي الثاني', 'اجتماع مجلس المؤسسة',
+                  'امتحانات الثلاثي الأول', 'الميزانية التقديرية', 'أشغال الصيانة', 'عطلة استثنائية',
+                  'ندوة تكوينية للأساتذة', 'شهادة عمل', 'نقلة إطار تربوي', 'المنح المدرسية',
+                  'تجهيزات المخبر', 'ملف صحي لتلميذ', 'الحركة السنوية للمديرين', 'مناظرة الدخول',
+                  'تقرير التفقد البيداغوجي', 'الأنشطة الثقافية والرياضية', 'عقد تزويد بالمطعم المدرسي']
+CONTENT_SENTENCES = ['وبعد، يشرفني أن أحيطكم علماً بما يلي.',
+                     'الرجاء الإطلاع واتخاذ ما ترونه صالحاً.',
+                     'وذلك في أجل أقصاه نهاية الأسبوع الجاري.',
+                     'مع الشكر على حسن تعاونكم.',
+                     'تجدون صحبة هذا الوثائق المطلوبة.',
+                     'والسلام.']
+NOTES = ['', '', '', 'تمت الإحالة على الإدارة', 'يتطلب رداً', 'نسخة للأرشيف', 'عاجل جداً']
+
+PRIORITIES = (['عادي', 'مهم', 'عاجل'], [70, 20, 10])
+CATEGORIES = (['إداري', 'مالي', 'فني', 'قانوني', 'أخرى'], [50, 15, 15, 5, 15])
+# حالة البريد حسب عمره: الرسائل القديمة مكتملة في الغالب والحديثة جديدة أو قيد المعالجة
+INCOMING_STATUS_OLD = (['جديد', 'قيد المعالجة', 'مكتمل', 'ملغي'], [2, 5, 88, 5])
+INCOMING_STATUS_RECENT = (['جديد', 'قيد المعالجة', 'مكتمل', 'ملغي'], [45, 35, 18, 2])
+OUTGOING_STATUS = (['مسودة', 'مرسل', 'مؤرشف'], [5, 55, 40])
+ACTION_TYPES = ['رد', 'إحالة', 'متابعة', 'توقيع', 'أرشفة']
+ACTION_STATUSES = (['معلق', 'قيد التنفيذ', 'مكتمل'], [20, 15, 65])
+ACTIVITY_ACTIONS = ['تسجيل دخول', 'تسجيل خروج', 'تسجيل بريد وارد', 'تعديل بريد وارد',
+                    'إرسال بريد صادر', 'حفظ مسودة بريد صادر', 'إضافة بوردرية']
+ATTACHMENT_EXTENSIONS = ['pdf', 'pdf', 'pdf', 'docx', 'jpg', 'png']
+
+
+def print_progress(table, done, total):
+    """عرض تقدم التوليد في الطرفية"""
+    percent = (done * 100 // total) if total else 100
+    print(f"   {table}: {done:,}/{total:,} ({percent}%)")
+
+
+def _batches(rows, size):
+    """تقسيم مولد الصفوف إلى دفعات"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(conn, table, sql, rows, total, batch_size, progress):
+    done = 0
+    for batch in _batches(rows, batch_size):
+        conn.executemany(sql, batch)
+        done += len(batch)
+        if progress:
+            progress(table, done, total)
+    return done
+
+
+def _dates(rng, count, start, end):
+    """تواريخ مرتبة تصاعدياً موزعة على الفترة (البريد يُسجل بترتيب وصوله)"""
+    span = (end - start).days
+    offsets = sorted(rng.randrange(span + 1) for _ in range(count))
+    return [start + timedelta(days=offset) for offset in offsets]
+
+
+def _subject(rng):
+    return f"{rng.choice(SUBJECT_ACTIONS)} {rng.choice(SUBJECT_TOPICS)}"
+
+
+def _content(rng):
+    return ' '.join(rng.sample(CONTENT_SENTENCES, rng.randint(2, 4)))
+
+
+def _attachments(rng, pool, ratio):
+    if not pool or rng.random() >= ratio:
+        return None
+    return json.dumps(rng.sample(pool, min(len(pool), rng.randint(1, 3))), ensure_ascii=False)
+
+
+def _create_attachment_files(uploads_dir, count, size, rng):
+    """إنشاء ملفات مرفقات وهمية يعاد استعمالها في كل الرسائل"""
+    names = [f"synthetic_{index:04d}.{rng.choice(ATTACHMENT_EXTENSIONS)}" for index in range(count)]
+    if uploads_dir:
+        # مولد مستقل للمحتوى حتى لا يغير إنشاء الملفات بقية البيانات المولدة
+        blob_rng = random.Random(count)
+        for kind in ('incoming', 'outgoing'):
+            os.makedirs(os.path.join(uploads_dir, kind), exist_ok=True)
+            for name in names:
+                with open(os.path.join(uploads_dir, kind, name), 'wb') as f:
+                    f.write(blob_rng.randbytes(size))
+    return names
+
+
+def _contact_rows(rng, count, start):
+    for index in range(1, count + 1):
+        if rng.random() < 0.6:
+            name = rng.choice(ORGANIZATIONS)
+            organization = name
+            if index > len(ORGANIZATIONS):
+                name = f"{name} - مصلحة {index}"
+        else:
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            organization = rng.choice(ORGANIZATIONS + [None])
+        yield (f"C{index:03d}", name, organization,
+               f"75{rng.randint(100000, 999999)}", f"contact{index}@example.tn", f"{start.isoformat()} 08:00:00")
+
+
+def _reference_numbers(prefix, dates):
+    """أرقام مرجع متسلسلة داخل كل شهر بتنسيق البادئة-الرقم-الشهر-السنة"""
+    counters = {}
+    for day in dates:
+        key = (day.month, day.year)
+        counters[key] = counters.get(key, 0) + 1
+        yield f"{prefix}-{counters[key]:04d}-{day.month:02d}-{day.year}"
+
+
+def _incoming_rows(rng, count, contacts, users, start, end, attachments, attachment_ratio):
+    recent_limit = end - timedelta(days=60)
+    dates = _dates(rng, count, start, end)
+    for reference_no, received in zip(_reference_numbers('و', dates), dates):
+        contact_id, contact_name = rng.choice(contacts)
+        created_at = f"{received.isoformat()} {rng.randint(8, 16):02d}:{rng.randint(0, 59):02d}:00"
+        statuses = INCOMING_STATUS_RECENT if received >= recent_limit else INCOMING_STATUS_OLD
+        due_date = received + timedelta(days=rng.randint(3, 30)) if rng.random() < 0.4 else None
+        yield (
+            reference_no, contact_id, contact_name, _subject(rng), _content(rng),
+            rng.choices(*PRIORITIES)[0], rng.choices(*statuses)[0],
+            received.isoformat(), due_date.isoformat() if due_date else None,
+            rng.choices(*CATEGORIES)[0], _attachments(rng, attachments, attachment_ratio),
+            rng.choice(NOTES) or None, rng.choice(users), created_at, created_at
+        )
+
+
+def _outgoing_rows(rng, count, contacts, users, start, end, attachments, attachment_ratio):
+    dates = _dates(rng, count, start, end)
+    for reference_no, sent in zip(_reference_numbers('ص', dates), dates):
+        contact_id, contact_name = rng.choice(contacts)
+        created_at = f"{sent.isoformat()} {rng.randint(8, 16):02d}:{rng.randint(0, 59):02d}:00"
+        yield (
+            reference_no, contact_id, contact_name, _subject(rng), _content(rng),
+            rng.choices(*PRIORITIES)[0], rng.choices(*OUTGOING_STATUS)[0],
+            sent.isoformat(), rng.choice(users), rng.choices(*CATEGORIES)[0],
+            _attachments(rng, attachments, attachment_ratio), rng.choice(NOTES) or None,
+            created_at, created_at
+        )
+
+
+def _action_rows(rng, count, incoming_count, users, start, end):
+    span = (end - start).days
+    for _ in range(count):
+        created = start + timedelta(days=rng.randrange(span + 1))
+        status = rng.choices(*ACTION_STATUSES)[0]
+        completed = created + timedelta(days=rng.randint(0, 15)) if status == 'مكتمل' else None
+        yield (
+            rng.randint(1, incoming_count), 'incoming', rng.choice(ACTION_TYPES), _subject(rng),
+            rng.choice(users), (created + timedelta(days=rng.randint(2, 20))).isoformat(), status,
+            completed.isoformat() if completed else None, rng.choice(users),
+            f"{created.isoformat()} {rng.randint(8, 16):02d}:{rng.randint(0, 59):02d}:00"
+        )
+
+
+def _activity_rows(rng, count, users, start, end):
+    span = (end - start).days
+    for created in sorted(start + timedelta(days=rng.randrange(span + 1)) for _ in range(count)):
+        action = rng.choice(ACTIVITY_ACTIONS)
+        yield (
+            rng.choice(users), action, f"{action} (بيانات اصطناعية)", '127.0.0.1', 'generate_dataset',
+            f"{created.isoformat()} {rng.randint(7, 18):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+        )
+
+
+def generate(db_path, incoming=10000, outgoing=None, contacts=None, actions=None, activity=None,
+             seed=42, end_date=None, years=3, attachment_ratio=0.2, attachment_files=50,
+             attachment_size=4096, uploads_dir=None, batch_size=BATCH_SIZE, progress=print_progress):
+    """
+    توليد قاعدة بيانات اصطناعية
+
+    Returns:
+        dict: عدد الصفوف المولدة لكل جدول والمدة
+    """
+    started = time.time()
+    rng = random.Random(seed)
+
+    outgoing = incoming // 2 if outgoing is None else outgoing
+    contacts = max(50, incoming // 100) if contacts is None else contacts
+    actions = incoming // 10 if actions is None else actions
+    activity = incoming if activity is None else activity
+    end = end_date or date.today()
+    start = end - timedelta(days=365 * years)
+
+    init_db(db_path)
+    conn = get_db_connection(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -200000")
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        for index in BULK_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index}")
+        for trigger in BULK_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+        users = [row[0] for row in conn.execute("SELECT id FROM users WHERE is_active = 1")]
+        attachments = _create_attachment_files(uploads_dir, attachment_files, attachment_size, rng)
+
+        conn.execute("BEGIN")
+        _insert(conn, 'contacts', '''
+        INSERT INTO contacts (code, name, organization, phone, email, created_at) VALUES (?, ?, ?, ?, ?, ?)
+        ''', _contact_rows(rng, contacts, start), contacts, batch_size, progress)
+        contact_list = conn.execute("SELECT id, name FROM contacts").fetchall()
+
+        _insert(conn, 'incoming_mail', '''
+        INSERT INTO incoming_mail
+        (reference_no, sender_id, sender_name, subject, content, priority, status,
+         received_date, due_date, category, attachments, notes, recorded_by, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _incoming_rows(rng, incoming, contact_list, users, start, end, attachments, attachment_ratio),
+                incoming, batch_size, progress)
+
+        _insert(conn, 'outgoing_mail', '''
+        INSERT INTO outgoing_mail
+        (reference_no, recipient_id, recipient_name, subject, content, priority, status,
+         sent_date, sent_by, category, attachments, notes, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _outgoing_rows(rng, outgoing, contact_list, users, start, end, attachments, attachment_ratio),
+                outgoing, batch_size, progress)
+
+        if incoming:
+            _insert(conn, 'actions', '''
+            INSERT INTO actions
+            (mail_id, mail_type, action_type, description, assigned_to, due_date, status,
+             completed_date, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', _action_rows(rng, actions, incoming, users, start, end), actions, batch_size, progress)
+
+        _insert(conn, 'activity_log', '''
+        INSERT INTO activity_log (user_id, action, details, ip_address, user_agent, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', _activity_rows(rng, activity, users, start, end), activity, batch_size, progress)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # إعادة إنشاء الفهارس وتحديث إحصائيات المخطط
+    init_db(db_path)
+    conn = get_db_connection(db_path)
+    try:
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+    return {
+        'contacts': contacts,
+        'incoming_mail': incoming,
+        'outgoing_mail': outgoing,
+        'actions': actions if incoming else 0,
+        'activity_log': activity,
+        'seconds': round(time.time() - started, 2)
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="توليد قاعدة بيانات اصطناعية لاختبارات الحجم")
+    parser.add_argument("db", help="ملف قاعدة البيانات الناتج")
+    parser.add_argument("--incoming", type=int, default=10000, help="عدد البريد الوارد")
+    parser.add_argument("--outgoing", type=int, default=None, help="عدد البريد الصادر (افتراضياً نصف الوارد)")
+    parser.add_argument("--contacts", type=int, default=None, help="عدد جهات الاتصال")
+    parser.add_argument("--actions", type=int, default=None, help="عدد الإجراءات")
+    parser.add_argument("--activity", type=int, default=None, help="عدد أسطر سجل النشاطات")
+    parser.add_argument("--seed", type=int, default=42, help="بذرة التوليد")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None,
+                        help="آخر تاريخ (YYYY-MM-DD، افتراضياً اليوم) - ثبته لنتائج قابلة للتكرار")
+    parser.add_argument("--years", type=int, default=3, help="عدد السنوات التي يغطيها البريد")
+    parser.add_argument("--attachment-ratio", type=float, default=0.2, help="نسبة البريد ذي المرفقات")
+    parser.add_argument("--uploads", default=None, help="مجلد لإنشاء ملفات المرفقات الوهمية (اختياري)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="حجم الدفعة")
+    parser.add_argument("--force", action="store_true", help="حذف الملف إذا كان موجوداً")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            raise SystemExit(f"❌ الملف {args.db} موجود. استعمل --force لاستبداله")
+        os.remove(args.db)
+
+    result = generate(
+        args.db, incoming=args.incoming, outgoing=args.outgoing, contacts=args.contacts,
+        actions=args.actions, activity=args.activity, seed=args.seed, end_date=args.end_date,
+        years=args.years, attachment_ratio=args.attachment_ratio, uploads_dir=args.uploads,
+        batch_size=args.batch_size
+    )
+
+    print("=" * 50)
+    print(f"✅ تم توليد {args.db}")
+    for key, value in result.items():
+        print(f"{key}: {value}")
+    print("=" * 50)
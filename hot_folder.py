@@ -0,0 +1,190 @@
+# hot_folder.py - مراقبة مجلد الماسح الضوئي وتسجيل الملفات كمسودات بريد وارد
+"""
+يراقب المجلد الذي يحفظ فيه الماسح الضوئي ملفاته، ويسجل كل ملف جديد كبريد وارد
+بحالة "مسودة" مع الملف كمرفق، ليُستكمل لاحقاً من شاشة التعديل (تصفية: مسودة).
+
+الاستعمال:
+    python hot_folder.py --inbox /srv/scanner --user admin
+    python hot_folder.py --inbox /srv/scanner --once      (معالجة الموجود ثم الخروج)
+
+- مراقبة بالاستطلاع الدوري (مكتبة Python القياسية فقط، تعمل على Windows ومجلدات الشبكة)
+- الملف يُعتبر مكتملاً عندما لا يتغير حجمه ووقت تعديله بين فحصين ومرت عليه مدة --settle
+- الملفات الجاهزة تُسجل على دفعات في معاملة واحدة (services.intake.register_drafts)
+- بعد التسجيل يُنقل الملف إلى processed/YYYY-MM-DD/، والملفات المرفوضة إلى failed/
+"""
+import argparse
+import os
+import shutil
+import time
+from datetime import date, datetime
+
+import database
+import metrics
+from database import get_db_connection
+from services import intake, users as user_service
+
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+# ملفات مؤقتة يكتبها الماسح أو برامج النسخ أثناء النقل
+PARTIAL_SUFFIXES = ('.part', '.tmp', '.crdownload')
+
+
+def _load_actor(username):
+    """المستخدم الذي تُسجل المسودات باسمه (يجب أن يملك صلاحية الإضافة)"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT id, role FROM users WHERE username = ? AND is_active = 1", (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise SystemExit(f"❌ المستخدم '{username}' غير موجود أو غير نشط")
+    if not user_service.has_permission(row[1], 'add'):
+        raise SystemExit(f"❌ المستخدم '{username}' لا يملك صلاحية إضافة البريد")
+    return row[0]
+
+
+def _is_candidate(name):
+    """ملفات الماسح المقبولة فقط (دون المخفية والمؤقتة)"""
+    lower = name.lower()
+    if name.startswith(('.', '~')) or lower.endswith(PARTIAL_SUFFIXES):
+        return False
+    return lower.endswith(intake.ALLOWED_EXTENSIONS)
+
+
+def _unique_path(folder, name):
+    """مسار غير مستعمل داخل المجلد (يضيف رقماً عند تكرار الاسم)"""
+    stem, ext = os.path.splitext(name)
+    path = os.path.join(folder, name)
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{stem}_{counter}{ext}")
+        counter += 1
+    return path
+
+
+class HotFolder:
+    """حالة المراقبة: آخر حجم ووقت تعديل لكل ملف لم يُسجل بعد"""
+
+    def __init__(self, inbox, actor_id, batch_size=50, settle=2.0):
+        self.inbox = os.path.abspath(inbox)
+        self.actor_id = actor_id
+        self.batch_size = batch_size
+        self.settle = settle
+        self._seen = {}
+        os.makedirs(self.inbox, exist_ok=True)
+
+    def _move(self, path, folder):
+        os.makedirs(folder, exist_ok=True)
+        shutil.move(path, _unique_path(folder, os.path.basename(path)))
+
+    def ready_files(self, force=False):
+        """الملفات التي استقر حجمها ووقت تعديلها منذ الفحص السابق"""
+        now = time.time()
+        ready = []
+        current = {}
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                if not entry.is_file() or not _is_candidate(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # حُذف أو نُقل أثناء الفحص
+                signature = (stat.st_size, stat.st_mtime)
+                current[entry.path] = signature
+                stable = force or self._seen.get(entry.path) == signature
+                if stable and stat.st_size > 0 and now - stat.st_mtime >= self.settle:
+                    ready.append((stat.st_mtime, entry.path))
+        self._seen = current
+        # الأقدم أولاً حتى تتبع أرقام المرجع ترتيب المسح
+        return [path for _, path in sorted(ready)]
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        return {
+            'filename': os.path.basename(path),
+            'data': data,
+            'received_date': datetime.fromtimestamp(os.path.getmtime(path)).date()
+        }
+
+    def _register(self, paths):
+        """تسجيل دفعة ثم نقل ملفاتها إلى processed، وإرجاع المسودات المنشأة"""
+        drafts = intake.register_drafts([self._read(path) for path in paths], self.actor_id)
+        processed = os.path.join(self.inbox, PROCESSED_DIR, date.today().strftime('%Y-%m-%d'))
+        for path in paths:
+            self._move(path, processed)
+            self._seen.pop(path, None)
+        metrics.INTAKE_FILES.inc(len(paths), result="registered")
+        return drafts
+
+    def process(self, paths):
+        """تسجيل الملفات على دفعات؛ عند فشل دفعة يُعاد كل ملف منفرداً لعزل الملف المعطوب"""
+        registered = []
+        for start in range(0, len(paths), self.batch_size):
+            batch = paths[start:start + self.batch_size]
+            try:
+                registered.extend(self._register(batch))
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    self._reject(batch[0], e)
+                    continue
+                print(f"⚠️ خطأ في تسجيل دفعة من {len(batch)} ملف، إعادة المحاولة ملفاً ملفاً: {e}")
+
+            for path in batch:
+                try:
+                    registered.extend(self._register([path]))
+                except Exception as e:
+                    self._reject(path, e)
+        return registered
+
+    def _reject(self, path, error):
+        print(f"⚠️ خطأ في تسجيل الملف {os.path.basename(path)}: {error}")
+        try:
+            self._move(path, os.path.join(self.inbox, FAILED_DIR))
+        except OSError as e:
+            print(f"⚠️ خطأ في نقل الملف المرفوض: {e}")
+        self._seen.pop(path, None)
+        metrics.INTAKE_FILES.inc(result="failed")
+
+    def run_once(self, force=False):
+        drafts = self.process(self.ready_files(force))
+        for draft in drafts:
+            print(f"📠 {draft['filename']} ← {draft['reference_no']}")
+        return drafts
+
+    def watch(self, interval=5.0):
+        while True:
+            self.run_once()
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تسجيل ملفات الماسح الضوئي كمسودات بريد وارد")
+    parser.add_argument("--inbox", required=True, help="المجلد الذي يحفظ فيه الماسح الملفات")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--user", default="admin", help="المستخدم الذي تُسجل المسودات باسمه")
+    parser.add_argument("--interval", type=float, default=5.0, help="ثوانٍ بين فحصين للمجلد")
+    parser.add_argument("--batch-size", type=int, default=50, help="أقصى عدد ملفات في معاملة واحدة")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="أقل عمر (بالثواني) لآخر تعديل قبل اعتبار الملف مكتملاً")
+    parser.add_argument("--once", action="store_true", help="معالجة الملفات الموجودة ثم الخروج")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_db()
+
+    folder = HotFolder(args.inbox, _load_actor(args.user), args.batch_size, args.settle)
+    if args.once:
+        drafts = folder.run_once(force=True)
+        print(f"✅ تم تسجيل {len(drafts)} مسودة")
+    else:
+        print(f"✅ مراقبة {folder.inbox} كل {args.interval:g} ثانية (المستخدم: {args.user})")
+        try:
+            folder.watch(args.interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,78 @@
+# merge_contacts.py - اقتراح دمج جهات الاتصال المكررة وتطبيقه دفعياً
+"""
+يجمع جهات الاتصال والأسماء المكتوبة يدوياً في البريد (دون جهة) حسب تشابه الاسم
+الموحد، ويعرض اقتراحات الدمج أو يحفظها في CSV، أو يطبقها مباشرة مع --apply.
+
+الاستعمال:
+    python merge_contacts.py --output proposals.csv
+    python merge_contacts.py --apply --min-similarity 0.92 --user admin
+"""
+import argparse
+import time
+
+import pandas as pd
+
+import database
+from database import get_db_connection
+from services import contact_merge
+
+
+def _actor_id(username):
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT id FROM users WHERE username = ? AND is_active = 1", (username,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise SystemExit(f"❌ المستخدم '{username}' غير موجود أو غير نشط")
+    return row[0]
+
+
+def proposals_frame(proposals):
+    """اقتراحات الدمج كجدول: صف لكل عنصر مع رقم مجموعته"""
+    return pd.DataFrame([
+        {
+            'المجموعة': number,
+            'الاسم المعتمد': proposal['name'],
+            'الجهة المعتمدة': proposal['target'],
+            'النوع': 'جهة' if member['kind'] == 'contact' else 'اسم',
+            'المعرف': member['id'],
+            'الاسم': member['name'],
+            'عدد البريد': member['mail_count'],
+            'التشابه': proposal['similarity']
+        }
+        for number, proposal in enumerate(proposals, start=1)
+        for member in proposal['members']
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="اقتراح دمج جهات الاتصال المكررة وتطبيقه")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--min-similarity", type=float, default=contact_merge.MIN_SIMILARITY,
+                        help="أقل تشابه بين اسمين لاعتبارهما نفس الجهة")
+    parser.add_argument("--output", default=None, help="حفظ الاقتراحات في ملف CSV")
+    parser.add_argument("--apply", action="store_true", help="تطبيق كل الاقتراحات")
+    parser.add_argument("--user", default="admin", help="المستخدم الذي يُسجل الدمج باسمه")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_db()
+
+    started = time.perf_counter()
+    proposals = contact_merge.find_merge_candidates(args.min_similarity)
+    print(f"🔎 {len(proposals)} مجموعة مكررة ({time.perf_counter() - started:.1f} ثانية)")
+    if not proposals:
+        raise SystemExit(0)
+
+    frame = proposals_frame(proposals)
+    if args.output:
+        frame.to_csv(args.output, index=False, encoding='utf-8-sig')
+        print(f"✅ تم حفظ الاقتراحات في {args.output}")
+    else:
+        print(frame.head(60).to_string(index=False))
+
+    if args.apply:
+        success, message = contact_merge.apply_merges(proposals, actor_id=_actor_id(args.user))
+        print(f"{'✅' if success else '⚠️'} {message}")
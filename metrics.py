@@ -0,0 +1,252 @@
+# metrics.py - مقاييس التشغيل بصيغة Prometheus النصية
+"""
+سجل مقاييس بسيط (عدادات ومدرجات تكرارية) بدون مكتبات خارجية، يُصدّر بصيغة
+Prometheus النصية عبر:
+
+- المسار /metrics في api_server.py
+- خادم HTTP محلي داخل عملية Streamlit (MAIL_METRICS_PORT=9464)
+- ملف يُكتب دورياً لـ textfile collector (MAIL_METRICS_FILE=/var/lib/node_exporter/mail.prom)
+
+    metrics.MAIL_REGISTERED.inc(mail_type="incoming")
+    with metrics.EXPORT_SECONDS.time(mail_type="outgoing"):
+        ...
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """أساس المقاييس: اسم، وصف، وأسماء التسميات"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: التسميات المطلوبة {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+
+class Counter(Metric):
+    """عداد تراكمي"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Histogram(Metric):
+    """مدرج تكراري للأزمنة (بالثواني) أو الأحجام"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """قياس زمن كتلة وتسجيله"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    """مجموعة المقاييس المصدرة"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"المقياس {metric.name} مسجل مسبقاً")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """كل المقاييس بصيغة Prometheus النصية"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+PROCESS_START = time.time()
+
+# --- المقاييس المعرفة في النظام ---
+MAIL_REGISTERED = REGISTRY.register(Counter(
+    "mail_registrations_total", "Mails registered (incoming) or created (outgoing)", ["mail_type"]))
+BORDEREAU_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "mail_bordereau_render_seconds", "Time spent rendering bordereau documents"))
+EXPORT_SECONDS = REGISTRY.register(Histogram(
+    "mail_export_seconds", "Time spent building Excel exports", ["mail_type"]))
+EXPORT_ROWS = REGISTRY.register(Counter(
+    "mail_export_rows_total", "Rows written to Excel exports", ["mail_type"]))
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "mail_db_query_seconds", "SQLite statement latency (execute + fetch)", ["kind"]))
+DB_LOCK_ERRORS = REGISTRY.register(Counter(
+    "mail_db_lock_errors_total", "Statements that failed with 'database is locked' after the busy timeout"))
+WRITE_LOCK_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "mail_write_lock_wait_seconds", "Time API writers waited for the shared write lock"))
+ATTACHMENT_BYTES = REGISTRY.register(Counter(
+    "mail_attachment_bytes_written_total", "Bytes written to the uploads folder", ["kind"]))
+INTAKE_FILES = REGISTRY.register(Counter(
+    "mail_intake_files_total", "Scanner files picked up from the hot folder", ["result"]))
+LOGIN_ATTEMPTS = REGISTRY.register(Counter(
+    "mail_login_attempts_total", "Login attempts", ["result"]))
+PAGE_RERUN_SECONDS = REGISTRY.register(Histogram(
+    "mail_page_rerun_seconds", "Streamlit page rerun duration", ["page"]))
+API_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "mail_api_request_seconds", "HTTP API request duration", ["method", "status"]))
+
+
+def render():
+    """نص المقاييس مع وقت بدء العملية"""
+    return (REGISTRY.render()
+            + "# HELP mail_process_start_time_seconds Start time of the process since unix epoch\n"
+            + "# TYPE mail_process_start_time_seconds gauge\n"
+            + f"mail_process_start_time_seconds {PROCESS_START}\n")
+
+
+# --- التصدير ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_file(path):
+    """كتابة المقاييس في ملف (كتابة ذرية لـ textfile collector)"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(temp_path, path)
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port=None, path=None, interval=15):
+    """
+    تشغيل المصدرات مرة واحدة لكل عملية (خادم HTTP و/أو ملف دوري)
+
+    القيم الافتراضية من MAIL_METRICS_PORT و MAIL_METRICS_FILE و MAIL_METRICS_INTERVAL.
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+
+    port = port or os.environ.get("MAIL_METRICS_PORT")
+    path = path or os.environ.get("MAIL_METRICS_FILE")
+    interval = float(os.environ.get("MAIL_METRICS_INTERVAL", interval))
+
+    if port:
+        try:
+            server = ThreadingHTTPServer(("127.0.0.1", int(port)), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        except OSError as e:
+            print(f"⚠️ خطأ في تشغيل خادم المقاييس: {e}")
+
+    if path:
+        def loop():
+            while True:
+                try:
+                    write_file(path)
+                except OSError as e:
+                    print(f"⚠️ خطأ في كتابة ملف المقاييس: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="metrics-file", daemon=True).start()
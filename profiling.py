@@ -0,0 +1,201 @@
+# profiling.py - قياس زمن إعادة تشغيل صفحات Streamlit
+"""
+مؤقتات (spans) متداخلة لكل صفحة ودالة مساعدة، مع التقاط اختياري لـ cProfile
+و tracemalloc يفعله المشرف، وسجل زمني للإعادات (p50/p95 لكل صفحة).
+
+    profiling.begin_rerun(page, cpu_profile=False, memory_profile=False)
+    with profiling.span("الشريط الجانبي"):
+        ...
+    @profiling.timed
+    def get_contacts(): ...
+    result = profiling.end_rerun()
+
+خارج إعادة تشغيل (واجهة API، سكريبتات) تكون المؤقتات بلا أثر تقريباً.
+"""
+import cProfile
+import csv
+import functools
+import io
+import math
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+HISTORY_SIZE = 2000
+PROFILE_TOP = 25
+MEMORY_TOP = 15
+
+_local = threading.local()
+_lock = threading.Lock()
+_history = deque(maxlen=HISTORY_SIZE)
+
+
+class _Rerun:
+    """حالة إعادة تشغيل واحدة في الخيط الحالي"""
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.spans = []
+        self.stack = []
+        self.profiler = None
+        self.memory = False
+
+
+@contextmanager
+def span(name):
+    """قياس زمن كتلة باسم معين (مع التداخل)"""
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is None:
+        yield
+        return
+
+    depth = len(rerun.stack)
+    rerun.stack.append(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun.stack.pop()
+        rerun.spans.append({
+            'name': name,
+            'depth': depth,
+            'start_ms': round((started - rerun.started) * 1000, 3),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+
+
+def timed(func=None, *, name=None):
+    """مزخرف لقياس زمن دالة كـ span باسمها"""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, 'rerun', None) is None:
+                return func(*args, **kwargs)
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
+
+
+def begin_rerun(page, cpu_profile=False, memory_profile=False):
+    """بدء قياس إعادة تشغيل صفحة (مع cProfile أو tracemalloc اختيارياً)"""
+    rerun = _Rerun(page)
+    if cpu_profile:
+        rerun.profiler = cProfile.Profile()
+        rerun.profiler.enable()
+    if memory_profile and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        rerun.memory = True
+    _local.rerun = rerun
+
+
+def end_rerun():
+    """
+    إنهاء القياس وإضافته للسجل
+
+    Returns:
+        dict: page، total_ms، spans، cpu_profile (نص pstats)، memory (أكبر المواقع وذروة الاستهلاك)
+    """
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is None:
+        return None
+    _local.rerun = None
+    total_ms = (time.perf_counter() - rerun.started) * 1000
+
+    cpu_report = None
+    if rerun.profiler is not None:
+        rerun.profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(rerun.profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        cpu_report = output.getvalue()
+
+    memory_report = None
+    if rerun.memory:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory_report = {
+            'current_kb': round(current / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'top': [
+                {'location': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:MEMORY_TOP]
+            ]
+        }
+
+    spans = sorted(rerun.spans, key=lambda item: item['start_ms'])
+    # مجموع زمن كل span في هذه الإعادة (دالة مستدعاة عدة مرات تُجمع)
+    totals = {}
+    for item in spans:
+        totals[item['name']] = round(totals.get(item['name'], 0) + item['duration_ms'], 3)
+
+    with _lock:
+        _history.append({
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'page': rerun.page,
+            'total_ms': round(total_ms, 3),
+            'spans': totals
+        })
+
+    return {'page': rerun.page, 'total_ms': round(total_ms, 3), 'spans': spans,
+            'cpu_profile': cpu_report, 'memory': memory_report}
+
+
+def _percentile(values, percent):
+    """النسبة المئوية بطريقة أقرب رتبة"""
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def history():
+    """نسخة من سجل الإعادات"""
+    with _lock:
+        return list(_history)
+
+
+def summary():
+    """
+    ملخص السجل لكل صفحة ولكل span
+
+    Returns:
+        list: قواميس (page، span، count، p50_ms، p95_ms، max_ms)
+    """
+    samples = {}
+    for entry in history():
+        samples.setdefault((entry['page'], '(الصفحة كاملة)'), []).append(entry['total_ms'])
+        for name, duration in entry['spans'].items():
+            samples.setdefault((entry['page'], name), []).append(duration)
+
+    return [
+        {
+            'page': page,
+            'span': name,
+            'count': len(values),
+            'p50_ms': round(_percentile(values, 50), 2),
+            'p95_ms': round(_percentile(values, 95), 2),
+            'max_ms': round(max(values), 2)
+        }
+        for (page, name), values in sorted(samples.items())
+    ]
+
+
+def history_csv():
+    """تصدير سجل الإعادات بصيغة CSV (سطر لكل span)"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['timestamp', 'page', 'total_ms', 'span', 'span_ms'])
+    for entry in history():
+        if not entry['spans']:
+            writer.writerow([entry['timestamp'], entry['page'], entry['total_ms'], '', ''])
+        for name, duration in entry['spans'].items():
+            writer.writerow([entry['timestamp'], entry['page'], entry['total_ms'], name, duration])
+    return output.getvalue().encode('utf-8-sig')
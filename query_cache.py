@@ -0,0 +1,199 @@
+# query_cache.py - ذاكرة مؤقتة لنتائج الاستعلامات مرتبطة بإصدار قاعدة البيانات
+"""
+ذاكرة LRU مشتركة بين كل الجلسات (على مستوى العملية) لنتائج استعلامات القراءة، واحدة
+لكل قاعدة بيانات (مؤسسة في tenants.py) بحدها وقفلها واتصال مراقبتها: مدرسة كثيرة
+الاستعلامات لا تطرد نتائج غيرها، وقاعدة مقفلة بكتابة طويلة لا توقف قراءة الباقي.
+
+المفتاح: (مسار قاعدة البيانات، SQL، المعاملات، إصدار البيانات). الإصدار يُقرأ من
+PRAGMA data_version على اتصال مراقبة لا يكتب أبداً: تتغير قيمته عند كل commit من
+أي اتصال آخر (جلسة Streamlit أخرى، واجهة API، سكريبت استيراد...)، فتُهمل النتائج
+القديمة بدقة دون الحاجة لإبطال يدوي في مسارات الكتابة.
+
+    df = query_cache.get_or_compute(db_path, sql, params, lambda: pd.read_sql(...))
+    query_cache.stats()  # hits / misses / evictions / bytes
+
+الإعدادات عبر متغيرات البيئة:
+    MAIL_QUERY_CACHE=0         تعطيل الذاكرة المؤقتة
+    MAIL_QUERY_CACHE_MB=64     الحد الأقصى للذاكرة لكل قاعدة بيانات
+"""
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+
+ENABLED = os.environ.get("MAIL_QUERY_CACHE", "1") != "0"
+MAX_BYTES = int(float(os.environ.get("MAIL_QUERY_CACHE_MB", "64")) * 1024 * 1024)
+# النتائج الأكبر من هذه النسبة من الحد لا تُخزن (حتى لا تطرد كل ما سواها)
+MAX_ENTRY_RATIO = 0.25
+
+CACHE_REQUESTS = metrics.REGISTRY.register(metrics.Counter(
+    "mail_query_cache_requests_total", "Query cache lookups", ["result"]))
+
+
+def _sizeof(value):
+    """تقدير حجم النتيجة في الذاكرة بالبايت"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+def _share(value):
+    """نسخة آمنة للمستدعي: DataFrame بنسخة سطحية (copy-on-write) حتى لا يُعدل المخزن"""
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    return value
+
+
+class _VersionWatcher:
+    """اتصال قراءة فقط لكل قاعدة بيانات لقراءة PRAGMA data_version"""
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def version(self, db_path):
+        with self._lock:
+            conn = self._connections.get(db_path)
+            if conn is None:
+                conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._connections[db_path] = conn
+            return conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+
+class QueryCache:
+    """ذاكرة LRU محدودة بالحجم مع عدادات الإصابة"""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.watcher = _VersionWatcher()
+
+    def _drop(self, key):
+        _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _observe_version(self, db_path, version):
+        """عند تغير الإصدار تُحذف كل نتائج الإصدارات السابقة لنفس القاعدة"""
+        if self._versions.get(db_path) == version:
+            return
+        self._versions[db_path] = version
+        for key in [key for key in self._entries if key[0] == db_path and key[3] != version]:
+            self._drop(key)
+
+    def get_or_compute(self, db_path, sql, params, compute, variant=None):
+        """
+        إرجاع النتيجة المخزنة لنفس الاستعلام والإصدار، أو حسابها وتخزينها
+
+        variant يميز نتائج نفس الاستعلام بعد تحويلات مختلفة (مثل الأنواع المضغوطة).
+        """
+        if not ENABLED:
+            return compute()
+
+        version = self.watcher.version(db_path)
+        params_key = tuple(sorted(params.items())) if isinstance(params, dict) else tuple(params or ())
+        key = (db_path, " ".join(sql.split()), params_key, version, variant)
+
+        with self._lock:
+            self._observe_version(db_path, version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(result="hit")
+                return _share(entry[0])
+            self.misses += 1
+        CACHE_REQUESTS.inc(result="miss")
+
+        value = compute()
+        size = _sizeof(value)
+        if size > self.max_bytes * MAX_ENTRY_RATIO:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return _share(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """عدادات الذاكرة المؤقتة منذ بدء العملية"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / requests, 3) if requests else 0.0,
+                'evictions': self.evictions
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _cache_for(db_path):
+    with _caches_lock:
+        cache = _caches.get(db_path)
+        if cache is None:
+            cache = _caches[db_path] = QueryCache()
+        return cache
+
+
+def get_or_compute(db_path, sql, params, compute, variant=None):
+    return _cache_for(db_path).get_or_compute(db_path, sql, params, compute, variant)
+
+
+def stats(db_path=None):
+    """عدادات قاعدة واحدة، أو مجموعها لكل القواعد"""
+    if db_path is not None:
+        return _cache_for(db_path).stats()
+
+    with _caches_lock:
+        caches = list(_caches.values())
+    parts = [cache.stats() for cache in caches]
+    totals = {key: sum(part[key] for part in parts)
+              for key in ('entries', 'bytes', 'max_bytes', 'hits', 'misses', 'evictions')}
+    requests = totals['hits'] + totals['misses']
+    totals['hit_ratio'] = round(totals['hits'] / requests, 3) if requests else 0.0
+    return totals
+
+
+def clear():
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.clear()
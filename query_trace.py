@@ -0,0 +1,338 @@
+# query_trace.py - تتبع استعلامات SQL وسجل الاستعلامات البطيئة
+"""
+طبقة تتبع تُركب على كل اتصال من get_db_connection() (factory=TracedConnection).
+
+لكل استعلام: النص، المدة الفعلية (التنفيذ + جلب الصفوف)، عدد الصفوف المُرجعة،
+عدد خطوات محرك SQLite (progress handler) والدالة التي استدعته. set_trace_callback
+يلتقط المعاملات الضمنية (BEGIN) وعدد البرامج المنفذة لكل استعلام (بما فيها المشغلات)،
+ولا يُركب إلا أثناء إعادة تشغيل طلب فيها المشرف عدّ العبارات (أو مع
+MAIL_SQL_TRACE_STATEMENTS=1): sqlite3 يوسع المعاملات المربوطة في نص كل عبارة وكل
+برنامج مشغل، فتصير الكتابة بقائمة IN طويلة أبطأ بعشرات المرات. قياس الزمن والسجل
+البطيء والمقاييس مفعلة افتراضياً على كل اتصال لأنها لا تمر بهذا التوسيع.
+
+- الاستعلامات الأبطأ من العتبة تُكتب في سجل دوار (logs/slow_queries.log)
+- begin_rerun()/end_rerun() تجمع استعلامات إعادة تشغيل واحدة لصفحة Streamlit
+- page_stats() يُرجع المجاميع لكل صفحة منذ بدء العملية
+- زمن كل استعلام وأخطاء "database is locked" تُضاف لمقاييس metrics.py
+
+الإعدادات عبر متغيرات البيئة:
+    MAIL_SQL_TRACE=0              تعطيل التتبع كلياً
+    MAIL_SQL_TRACE_STATEMENTS=1   عدّ العبارات على كل الاتصالات (مكلف مع المعاملات الكبيرة)
+    MAIL_SLOW_QUERY_MS=100    عتبة الاستعلام البطيء
+    MAIL_SLOW_QUERY_LOG=...   مسار السجل
+"""
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+import metrics
+
+ENABLED = os.environ.get("MAIL_SQL_TRACE", "1") != "0"
+TRACE_STATEMENTS = os.environ.get("MAIL_SQL_TRACE_STATEMENTS", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("MAIL_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("MAIL_SLOW_QUERY_LOG", os.path.join("logs", "slow_queries.log"))
+PROGRESS_STEPS = 1000
+MAX_RERUN_QUERIES = 500
+
+# الوحدات التي لا تُعتبر "الدالة المستدعية" (نبحث عن أول إطار خارجها)
+_SKIP_MODULES = ('query_trace', 'sqlite3', 'pandas', 'contextlib', 'services.base', 'numpy')
+
+_local = threading.local()
+_lock = threading.Lock()
+_page_stats = {}
+_slow_logger = None
+
+
+def _caller():
+    """اسم أول دالة خارج طبقات الوصول للبيانات (وحدة.دالة)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(_SKIP_MODULES):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+def _get_slow_logger():
+    global _slow_logger
+    if _slow_logger is None:
+        logger = logging.getLogger("mail.slow_queries")
+        logger.setLevel(logging.WARNING)
+        logger.propagate = False
+        try:
+            os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or ".", exist_ok=True)
+            handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=1024 * 1024, backupCount=5,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+        except OSError as e:
+            print(f"⚠️ خطأ في فتح سجل الاستعلامات البطيئة: {e}")
+        _slow_logger = logger
+    return _slow_logger
+
+
+def _one_line(sql):
+    return " ".join(str(sql).split())
+
+
+class QueryRecord:
+    """استعلام واحد: يُفتح عند execute ويُغلق عند انتهاء جلب الصفوف أو إغلاق المؤشر"""
+
+    __slots__ = ('sql', 'caller', 'started', 'duration_ms', 'rows', 'steps', 'statements', 'kind',
+                 'finished')
+
+    def __init__(self, sql, caller, kind="query"):
+        self.sql = sql
+        self.caller = caller
+        self.started = time.time()
+        self.duration_ms = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.statements = 0
+        self.kind = kind
+        self.finished = False
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        metrics.DB_QUERY_SECONDS.observe(self.duration_ms / 1000, kind=self.kind)
+        if self.duration_ms >= SLOW_QUERY_MS:
+            _get_slow_logger().warning(
+                f"{self.duration_ms:.1f}ms rows={self.rows} steps~{self.steps} "
+                f"caller={self.caller} sql={_one_line(self.sql)[:2000]}")
+
+    def as_dict(self):
+        return {
+            'caller': self.caller,
+            'duration_ms': round(self.duration_ms, 3),
+            'rows': self.rows,
+            'steps': self.steps,
+            'statements': self.statements,
+            'kind': self.kind,
+            'sql': _one_line(self.sql)
+        }
+
+
+def _count_lock_error(error):
+    if "locked" in str(error):
+        metrics.DB_LOCK_ERRORS.inc()
+
+
+def _collect(record):
+    queries = getattr(_local, 'queries', None)
+    if queries is not None and len(queries) < MAX_RERUN_QUERIES:
+        queries.append(record)
+
+
+class TracedCursor(sqlite3.Cursor):
+    """مؤشر يقيس زمن التنفيذ وجلب الصفوف ويعدها"""
+
+    _record = None
+
+    def _timed(self, method, *args):
+        record = self._record
+        started = time.perf_counter()
+        try:
+            result = method(self, *args)
+        except sqlite3.OperationalError as e:
+            _count_lock_error(e)
+            raise
+        finally:
+            if record is not None:
+                record.duration_ms += (time.perf_counter() - started) * 1000
+        return result
+
+    def _begin(self, sql):
+        self._end()
+        self._record = QueryRecord(sql, _caller())
+        self.connection._current = self._record
+        self.connection._trace_statements()
+        _collect(self._record)
+
+    def _end(self):
+        if self._record is not None:
+            self._record.finish()
+            self._record = None
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        self._timed(sqlite3.Cursor.execute, sql, parameters)
+        if self.description is None:
+            # عبارة كتابة: لا صفوف لجلبها
+            self._record.rows = max(self.rowcount, 0)
+            self._end()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+        self._record.rows = max(self.rowcount, 0)
+        self._end()
+        return self
+
+    def fetchone(self):
+        row = self._timed(sqlite3.Cursor.fetchone)
+        if self._record is not None:
+            if row is None:
+                self._end()
+            else:
+                self._record.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(sqlite3.Cursor.fetchmany, self.arraysize if size is None else size)
+        if self._record is not None:
+            self._record.rows += len(rows)
+            if not rows:
+                self._end()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(sqlite3.Cursor.fetchall)
+        if self._record is not None:
+            self._record.rows += len(rows)
+            self._end()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(sqlite3.Cursor.__next__)
+        except StopIteration:
+            self._end()
+            raise
+        if self._record is not None:
+            self._record.rows += 1
+        return row
+
+    def close(self):
+        self._end()
+        super().close()
+
+    def __del__(self):
+        self._end()
+
+
+class TracedConnection(sqlite3.Connection):
+    """اتصال يُنشئ مؤشرات متتبعة ويلتقط العبارات الضمنية وخطوات المحرك"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._current = None
+        self._tracing = False
+        self.set_progress_handler(self._on_progress, PROGRESS_STEPS)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute في sqlite3 لا يمر عبر cursor()، لذا نعيد توجيهه
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def _trace_statements(self):
+        """تركيب callback العبارات أو نزعه حسب طلب الجمع في الخيط الحالي"""
+        wanted = TRACE_STATEMENTS or getattr(_local, 'statements', False)
+        if wanted != self._tracing:
+            self.set_trace_callback(self._on_statement if wanted else None)
+            self._tracing = wanted
+
+    def _on_statement(self, statement):
+        current = self._current
+        if statement.startswith('BEGIN') and (current is None or current.finished
+                                              or not current.sql.lstrip().upper().startswith('BEGIN')):
+            # بداية معاملة ضمنية يفتحها sqlite3 قبل أول عبارة كتابة
+            _collect(QueryRecord(statement, _caller(), kind="implicit"))
+        elif current is not None and not current.finished:
+            # العبارة نفسها ثم برامج المشغلات التي تطلقها
+            current.statements += 1
+
+    def _on_progress(self):
+        current = self._current
+        if current is not None and not current.finished:
+            current.steps += PROGRESS_STEPS
+        return 0
+
+    def commit(self):
+        record = QueryRecord("COMMIT", _caller(), kind="commit")
+        started = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _count_lock_error(e)
+            raise
+        finally:
+            record.duration_ms = (time.perf_counter() - started) * 1000
+            _collect(record)
+            record.finish()
+
+
+def connection_factory():
+    """مصنع الاتصال الذي يستعمله get_db_connection()"""
+    return TracedConnection if ENABLED else sqlite3.Connection
+
+
+# --- التجميع حسب إعادة التشغيل والصفحة ---
+def begin_rerun(page, statements=False):
+    """
+    بدء جمع استعلامات إعادة تشغيل صفحة في الخيط الحالي
+
+    statements: عدّ العبارات وبرامج المشغلات والمعاملات الضمنية (مكلف مع المعاملات الكبيرة)
+    """
+    _local.queries = []
+    _local.statements = statements
+    _local.page = page
+    _local.started = time.perf_counter()
+
+
+def end_rerun():
+    """
+    إنهاء الجمع وتحديث مجاميع الصفحة
+
+    Returns:
+        dict: page، queries (قائمة قواميس)، count، total_ms، wall_ms
+    """
+    queries = getattr(_local, 'queries', None)
+    if queries is None:
+        return None
+    page = _local.page
+    wall_ms = (time.perf_counter() - _local.started) * 1000
+    _local.queries = None
+    _local.statements = False
+
+    records = [record.as_dict() for record in queries]
+    executed = [record for record in records if record['kind'] != 'implicit']
+    total_ms = sum(record['duration_ms'] for record in executed)
+
+    with _lock:
+        stats = _page_stats.setdefault(page, {'reruns': 0, 'queries': 0, 'total_ms': 0.0,
+                                              'max_rerun_ms': 0.0})
+        stats['reruns'] += 1
+        stats['queries'] += len(executed)
+        stats['total_ms'] += total_ms
+        stats['max_rerun_ms'] = max(stats['max_rerun_ms'], total_ms)
+
+    return {'page': page, 'queries': records, 'count': len(executed),
+            'total_ms': round(total_ms, 3), 'wall_ms': round(wall_ms, 3)}
+
+
+def page_stats():
+    """مجاميع الاستعلامات لكل صفحة منذ بدء العملية"""
+    with _lock:
+        return {
+            page: {
+                'reruns': stats['reruns'],
+                'queries': stats['queries'],
+                'avg_queries': round(stats['queries'] / stats['reruns'], 1),
+                'avg_ms': round(stats['total_ms'] / stats['reruns'], 2),
+                'max_ms': round(stats['max_rerun_ms'], 2)
+            }
+            for page, stats in _page_stats.items()
+        }
@@ -0,0 +1,17 @@
+# services - طبقة الوصول إلى البيانات المستقلة عن واجهة Streamlit
+"""
+دوال خالصة للبريد وجهات الاتصال والمستخدمين والبوردرية والإحصائيات.
+
+لا تستعمل هذه الوحدات st.* ولا st.session_state: الأخطاء تُرفع كاستثناءات
+(ServiceError) أو تُرجع كـ (نجاح، رسالة)، وتقبل كل دالة اتصالاً اختيارياً
+(conn) لتنفيذ عدة عمليات على نفس الاتصال.
+"""
+from services.base import ConcurrentEditError, DuplicateReferenceError, NotFoundError, ServiceError, connection
+from services import (actions, attachments, bordereau, changes, contact_merge, contacts, duplicates, exports,
+                      fulltext, intake, mail, sla, stats, threads, users)
+
+__all__ = [
+    'ServiceError', 'DuplicateReferenceError', 'NotFoundError', 'ConcurrentEditError', 'connection',
+    'actions', 'attachments', 'bordereau', 'changes', 'contact_merge', 'contacts', 'duplicates', 'exports',
+    'fulltext', 'intake', 'mail', 'sla', 'stats', 'threads', 'users'
+]
@@ -0,0 +1,170 @@
+# services/actions.py - إجراءات المتابعة وقوائم مهام المستخدمين
+"""
+قائمة مهام كل مستخدم هي الإجراءات المفتوحة المكلف بها مرتبة بتاريخ الاستحقاق، وتُقرأ
+من الفهرس الجزئي idx_actions_queue صفحة بصفحة بمؤشر (الاستحقاق، المعرف)، فلا يؤثر
+عدد الإجراءات المكتملة القديمة في زمنها. الإكمال وإعادة التكليف الجماعيان استعلام
+UPDATE واحد لكل عملية.
+"""
+from datetime import date
+
+from database import ACTION_DUE_KEY, OPEN_ACTIONS, log_activity
+from services.base import ServiceError, connection, format_date, query_one, read_sql, to_int
+from services.mail import stage_ids, table_for
+
+ACTION_TYPES = ['رد', 'إحالة', 'متابعة', 'توقيع', 'أرشفة']
+ACTION_STATUSES = ['معلق', 'قيد التنفيذ', 'مكتمل', 'ملغي']
+QUEUE_PAGE_SIZE = 25
+
+
+def create_action(mail_id, mail_type, action_type, description=None, assigned_to=None, due_date=None,
+                  actor_id=None, conn=None):
+    """إضافة إجراء متابعة لبريد وإرجاع معرفه"""
+    if action_type not in ACTION_TYPES:
+        raise ServiceError(f"نوع إجراء غير صالح: {action_type}")
+
+    with connection(conn) as conn:
+        cursor = conn.execute('''
+        INSERT INTO actions (mail_id, mail_type, action_type, description, assigned_to, due_date, created_by)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (to_int(mail_id), "outgoing" if mail_type == "outgoing" else "incoming", action_type,
+              description, to_int(assigned_to), format_date(due_date), actor_id))
+        conn.commit()
+
+    log_activity(actor_id, "إضافة إجراء", f"{action_type} للبريد رقم {mail_id}")
+    return cursor.lastrowid
+
+
+def assign_mails(mail_ids, mail_type, user_id, action_type="متابعة", due_date=None, actor_id=None, conn=None):
+    """
+    تكليف مستخدم بإجراء على مجموعة بريد: INSERT ... SELECT واحد لكل البريد المحدد
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    if action_type not in ACTION_TYPES:
+        return False, f"نوع إجراء غير صالح: {action_type}"
+    mail_type = "outgoing" if mail_type == "outgoing" else "incoming"
+
+    with connection(conn) as conn:
+        user = conn.execute("SELECT full_name FROM users WHERE id = ? AND is_active = 1",
+                            (to_int(user_id),)).fetchone()
+        if user is None:
+            return False, "المستخدم غير موجود أو غير نشط"
+        if not stage_ids(mail_ids, conn):
+            return False, "لم يتم تحديد أي بريد"
+        created = conn.execute(f'''
+        INSERT INTO actions (mail_id, mail_type, action_type, assigned_to, due_date, created_by)
+        SELECT m.id, ?, ?, ?, ?, ? FROM {table_for(mail_type)} m
+        WHERE m.id IN (SELECT id FROM bulk_ids)
+        ''', (mail_type, action_type, to_int(user_id), format_date(due_date), actor_id)).rowcount
+        conn.commit()
+
+    log_activity(actor_id, "تكليف جماعي", f"{action_type} لـ {created} بريد إلى {user[0]}")
+    return True, f"تم تكليف {user[0]} بـ {action_type} على {created} بريد"
+
+
+def mail_actions(mail_id, mail_type="incoming", conn=None):
+    """إجراءات بريد واحد مع اسم المكلف"""
+    return read_sql('''
+    SELECT a.id, a.action_type, a.description, u.full_name AS assigned_user, a.due_date, a.status,
+           a.completed_date
+    FROM actions a LEFT JOIN users u ON u.id = a.assigned_to
+    WHERE a.mail_id = ? AND a.mail_type = ?
+    ORDER BY a.id
+    ''', conn, params=(to_int(mail_id), "outgoing" if mail_type == "outgoing" else "incoming"))
+
+
+def user_queue(user_id, cursor=None, page_size=QUEUE_PAGE_SIZE, conn=None):
+    """
+    صفحة من الإجراءات المفتوحة المكلف بها مستخدم، الأقرب استحقاقاً أولاً
+
+    Args:
+        cursor (tuple): (مفتاح الاستحقاق، المعرف) لآخر إجراء في الصفحة السابقة
+
+    Returns:
+        tuple: (DataFrame مع رقم مرجع البريد وموضوعه، مؤشر الصفحة التالية أو None)
+    """
+    params = {'user_id': to_int(user_id), 'limit': page_size + 1}
+    after = ""
+    if cursor is not None:
+        # الشرط الأول حد أدنى يستعمله الفهرس، والثاني يستبعد ما عُرض من نفس التاريخ
+        after = f"AND {ACTION_DUE_KEY} >= :due AND ({ACTION_DUE_KEY}, id) > (:due, :id)"
+        params.update({'due': cursor[0], 'id': cursor[1]})
+
+    df = read_sql(f'''
+    SELECT q.*, COALESCE(i.reference_no, o.reference_no) AS reference_no,
+           COALESCE(i.subject, o.subject) AS subject
+    FROM (
+        SELECT id, mail_type, mail_id, action_type, description, due_date, status, {ACTION_DUE_KEY} AS due_key
+        FROM actions
+        WHERE assigned_to = :user_id AND {OPEN_ACTIONS} {after}
+        ORDER BY {ACTION_DUE_KEY}, id
+        LIMIT :limit
+    ) q
+    LEFT JOIN incoming_mail i ON q.mail_type = 'incoming' AND i.id = q.mail_id
+    LEFT JOIN outgoing_mail o ON q.mail_type = 'outgoing' AND o.id = q.mail_id
+    ORDER BY q.due_key, q.id
+    ''', conn, params=params)
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        next_cursor = (df.iloc[-1]['due_key'], int(df.iloc[-1]['id']))
+    return df.drop(columns=['due_key']), next_cursor
+
+
+def queue_counts(user_id, conn=None):
+    """عدد الإجراءات المفتوحة للمستخدم والمتأخر منها (مخزن مع إصدار قاعدة البيانات)"""
+    open_count, overdue = query_one(f'''
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE {ACTION_DUE_KEY} < ?)
+    FROM actions WHERE assigned_to = ? AND {OPEN_ACTIONS}
+    ''', conn, (date.today().strftime('%Y-%m-%d'), to_int(user_id)))
+    return {'open': open_count, 'overdue': overdue}
+
+
+def complete_actions(action_ids, actor_id=None, conn=None):
+    """
+    إكمال مجموعة إجراءات مفتوحة في استعلام واحد
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    with connection(conn) as conn:
+        if not stage_ids(action_ids, conn):
+            return False, "لم يتم تحديد أي إجراء"
+        count = conn.execute(f'''
+        UPDATE actions SET status = 'مكتمل', completed_date = ?
+        WHERE id IN (SELECT id FROM bulk_ids) AND {OPEN_ACTIONS}
+        ''', (date.today().strftime('%Y-%m-%d'),)).rowcount
+        conn.commit()
+
+    if count == 0:
+        return False, "الإجراءات المحددة لم تعد مفتوحة"
+    log_activity(actor_id, "إكمال إجراءات", f"{count} إجراء")
+    return True, f"تم إكمال {count} إجراء"
+
+
+def reassign_actions(action_ids, user_id, actor_id=None, conn=None):
+    """
+    تكليف مستخدم آخر بمجموعة إجراءات مفتوحة في استعلام واحد
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    with connection(conn) as conn:
+        user = conn.execute("SELECT full_name FROM users WHERE id = ? AND is_active = 1",
+                            (to_int(user_id),)).fetchone()
+        if user is None:
+            return False, "المستخدم غير موجود أو غير نشط"
+        if not stage_ids(action_ids, conn):
+            return False, "لم يتم تحديد أي إجراء"
+        count = conn.execute(f'''
+        UPDATE actions SET assigned_to = ?
+        WHERE id IN (SELECT id FROM bulk_ids) AND {OPEN_ACTIONS}
+        ''', (to_int(user_id),)).rowcount
+        conn.commit()
+
+    if count == 0:
+        return False, "الإجراءات المحددة لم تعد مفتوحة"
+    log_activity(actor_id, "إعادة تكليف إجراءات", f"{count} إجراء إلى {user[0]}")
+    return True, f"تم تكليف {user[0]} بـ {count} إجراء"
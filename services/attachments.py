@@ -0,0 +1,50 @@
+# services/attachments.py - حفظ المرفقات وقراءتها
+import json
+import os
+from datetime import datetime
+
+import metrics
+import tenants
+
+# مجلد المرفقات في وضع المؤسسة الواحدة
+UPLOAD_ROOT = "uploads"
+
+
+def upload_root():
+    """مجلد مرفقات المؤسسة النشطة"""
+    return tenants.upload_root() or UPLOAD_ROOT
+
+
+def upload_dir(kind):
+    """مجلد الحفظ حسب النوع (incoming، outgoing، bordereau...)"""
+    path = os.path.join(upload_root(), kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_attachment(data, filename, mail_type="incoming"):
+    """حفظ محتوى ملف مرفق وإرجاع مساره"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filepath = os.path.join(upload_dir(mail_type), f"{timestamp}_{filename}")
+
+    with open(filepath, "wb") as f:
+        f.write(data)
+    metrics.ATTACHMENT_BYTES.inc(len(data), kind=mail_type)
+    return filepath
+
+
+def get_attachment_list(attachments_json):
+    """الحصول على قائمة المرفقات من JSON"""
+    if attachments_json and isinstance(attachments_json, str):
+        try:
+            return json.loads(attachments_json)
+        except ValueError:
+            return []
+    elif attachments_json and isinstance(attachments_json, list):
+        return attachments_json
+    return []
+
+
+def dump_attachment_list(attachments):
+    """تحويل قائمة المرفقات إلى JSON للتخزين (أو None إذا كانت فارغة)"""
+    return json.dumps(attachments) if attachments else None
@@ -0,0 +1,127 @@
+# services/base.py - أدوات مشتركة لطبقة الخدمات
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+import database
+import query_cache
+from database import get_db_connection
+
+
+class ServiceError(Exception):
+    """خطأ في عملية على البيانات (الرسالة معدة للعرض للمستخدم)"""
+
+
+class DuplicateReferenceError(ServiceError):
+    """رقم المرجع أو الكود مستعمل مسبقاً"""
+
+
+class NotFoundError(ServiceError):
+    """العنصر المطلوب غير موجود"""
+
+
+class ConcurrentEditError(ServiceError):
+    """
+    عدّل مستخدم آخر نفس الحقول منذ فتح النموذج
+
+    current: البريد كما هو محفوظ الآن، merged: القيم المدمجة (قيمة المستخدم في الحقول
+    المتعارضة)، conflicts: أسماء الحقول المتعارضة
+    """
+
+    def __init__(self, message, current, merged, conflicts):
+        super().__init__(message)
+        self.current = current
+        self.merged = merged
+        self.conflicts = conflicts
+
+
+@contextmanager
+def connection(conn=None):
+    """استعمال اتصال موجود (للعمليات الدفعية) أو فتح اتصال جديد وإغلاقه"""
+    if conn is not None:
+        yield conn
+        return
+
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+_readers = threading.local()
+
+
+def read_connection():
+    """
+    اتصال قراءة طويل العمر لكل خيط وقاعدة بيانات، للاستعلامات القصيرة بالمفتاح الأساسي
+
+    لا يكتب ولا يُغلق (لا معاملة مفتوحة بين الاستعلامات فيرى كل commit)، فلا يُدفع فتح
+    اتصال وقراءة المخطط مع كل قراءة.
+    """
+    db_path = current_db_path()
+    connections = getattr(_readers, 'connections', None)
+    if connections is None:
+        connections = _readers.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = get_db_connection(db_path)
+    return conn
+
+
+def current_db_path():
+    """المسار المطلق لقاعدة البيانات الحالية (جزء من مفاتيح الذاكرة المؤقتة)"""
+    return os.path.abspath(database.active_db_path())
+
+
+def read_sql(sql, conn=None, params=None, transform=None):
+    """
+    pd.read_sql مع الذاكرة المؤقتة المرتبطة بإصدار قاعدة البيانات
+
+    مع اتصال ممرر (معاملة جارية قد تحتوي كتابات غير مؤكدة) يُنفذ الاستعلام مباشرة.
+    transform (اختياري) يُطبق على النتيجة قبل تخزينها (مثل typed_mail_frame).
+    """
+    if conn is not None:
+        df = pd.read_sql(sql, conn, params=params)
+        return transform(df) if transform else df
+
+    def compute():
+        with connection() as conn:
+            df = pd.read_sql(sql, conn, params=params)
+        return transform(df) if transform else df
+
+    variant = transform.__name__ if transform else None
+    return query_cache.get_or_compute(current_db_path(), sql, params, compute, variant)
+
+
+def query_one(sql, conn=None, params=()):
+    """صف واحد (tuple) مع نفس الذاكرة المؤقتة"""
+    if conn is not None:
+        return conn.execute(sql, params).fetchone()
+
+    def compute():
+        with connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    return query_cache.get_or_compute(current_db_path(), sql, params, compute)
+
+
+def to_int(value):
+    """تحويل المعرفات القادمة من pandas (numpy.int64) إلى int قبل تمريرها لـ sqlite3"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_date(value):
+    """تحويل التاريخ إلى نص YYYY-MM-DD كما يُخزن في قاعدة البيانات"""
+    if value is None or value == '':
+        return None
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
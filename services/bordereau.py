@@ -0,0 +1,84 @@
+# services/bordereau.py - إنشاء البوردرية من القالب وحفظها
+import io
+import os
+
+from docxtpl import DocxTemplate
+
+import metrics
+
+from services.attachments import upload_dir
+from services.base import ServiceError
+
+TEMPLATE_PATH = "templates/bordereau_template.docx"
+
+# متغيرات القالب المطلوبة
+TEMPLATE_VARIABLES = {
+    'reference_no': 'رقم المرجع',
+    'sent_date': 'تاريخ الإرسال',
+    'recipient_name': 'اسم المستلم',
+    'organization': 'المؤسسة',
+    'phone': 'الهاتف',
+    'email': 'البريد الإلكتروني',
+    'subject': 'الموضوع',
+    'notes': 'الملاحظات'
+}
+
+
+class TemplateMissingError(ServiceError):
+    """قالب البوردرية غير موجود"""
+
+
+def bordereau_filename(reference_no):
+    """اسم ملف البوردرية لرقم مرجع"""
+    return f"بوردرية_{reference_no}.docx"
+
+
+def bordereau_path(filename):
+    """المسار الكامل لملف بوردرية محفوظ"""
+    return os.path.join(upload_dir("bordereau"), filename)
+
+
+def build_context(mail_data, contact_info=None):
+    """تحضير بيانات القالب من بيانات البريد ومعلومات جهة الاتصال"""
+    contact_info = contact_info or {}
+    return {
+        'reference_no': mail_data.get('reference_no', 'غير محدد'),
+        'sent_date': mail_data.get('sent_date', 'غير محدد'),
+        'recipient_name': mail_data.get('recipient_name', 'غير محدد'),
+        'organization': contact_info.get('organization', ''),
+        'phone': contact_info.get('phone', ''),
+        'email': contact_info.get('email', ''),
+        'subject': mail_data.get('subject', 'غير محدد'),
+        'notes': mail_data.get('notes', '')
+    }
+
+
+def render_bordereau(mail_data, contact_info=None):
+    """
+    إنشاء بوردرية للبريد الصادر باستخدام القالب
+
+    Returns:
+        BytesIO: الملف الناتج في الذاكرة
+    """
+    if not os.path.exists(TEMPLATE_PATH):
+        raise TemplateMissingError(
+            f"قالب البوردرية غير موجود. الرجاء وضع القالب في: {TEMPLATE_PATH}")
+
+    with metrics.BORDEREAU_RENDER_SECONDS.time():
+        doc = DocxTemplate(TEMPLATE_PATH)
+        doc.render(build_context(mail_data, contact_info))
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def save_bordereau(reference_no, buffer):
+    """حفظ البوردرية في مجلد النظام وإرجاع اسم الملف"""
+    filename = bordereau_filename(reference_no)
+    data = buffer.getvalue()
+    with open(bordereau_path(filename), "wb") as f:
+        f.write(data)
+    metrics.ATTACHMENT_BYTES.inc(len(data), kind="bordereau")
+    return filename
@@ -0,0 +1,108 @@
+# services/changes.py - قراءة سجل التغييرات وضغطه
+"""
+تكتب مشغلات database.change_log_triggers صفاً في change_log مع كل إضافة أو تعديل أو
+حذف في البريد وجهات الاتصال والمستخدمين والإجراءات، فيستطيع المستهلك (فهرس بحث خارجي،
+نسخة تقارير...) متابعة ما تغير منذ آخر قراءة بدل إعادة نسخ الجداول كاملة.
+
+المستهلك يحفظ المؤشر (seq) الذي تعيده changes_since ويعامل العملية كتلميح: delete
+يعني حذف الصف عنده، وغير ذلك يعني إعادة قراءة الصف الحالي. إذا أعادت reset=True فقد
+فاته ما لا يمكن استرجاعه (ضغط السجل أو تغييرات قبل إنشاء المشغلات) فيعيد النسخ كاملاً
+ثم يتابع من المؤشر المعاد.
+"""
+from datetime import datetime, timedelta
+
+from database import log_activity
+from services.base import connection, to_int
+
+CHANGE_LOG_RETENTION_DAYS = 30
+CHANGES_PAGE_SIZE = 1000
+MAX_CHANGES_PAGE_SIZE = 10000
+FLOOR_SETTING = 'change_log_floor'
+
+
+def _floor(conn):
+    """أصغر مؤشر ما زال سجله كاملاً (يرفعه الضغط)"""
+    row = conn.execute("SELECT setting_value FROM system_settings WHERE setting_key = ?",
+                       (FLOOR_SETTING,)).fetchone()
+    return to_int(row[0]) or 0 if row else 0
+
+
+def latest_cursor(conn=None):
+    """مؤشر آخر تغيير مسجل (نقطة البداية لمستهلك جديد بعد نسخه الكامل)"""
+    with connection(conn) as conn:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def changes_since(cursor=0, limit=CHANGES_PAGE_SIZE, conn=None):
+    """
+    التغييرات بعد المؤشر بترتيب حدوثها
+
+    Returns:
+        dict: changes (قائمة {seq, table, row_id, op, version, changed_at})، cursor (المؤشر
+        التالي)، more (بقيت تغييرات بعد هذه الصفحة)، reset (يجب إعادة النسخ الكامل)
+    """
+    cursor = to_int(cursor) or 0
+    limit = max(1, min(to_int(limit) or CHANGES_PAGE_SIZE, MAX_CHANGES_PAGE_SIZE))
+
+    with connection(conn) as conn:
+        reset_after = conn.execute("SELECT MAX(seq) FROM change_log WHERE op = 'reset' AND seq > ?",
+                                   (cursor,)).fetchone()[0]
+        if cursor < _floor(conn) or reset_after is not None:
+            # المؤشر المعاد يؤخذ قبل النسخ الكامل: ما يتغير أثناءه يُقرأ مرة ثانية فقط
+            return {'changes': [], 'cursor': latest_cursor(conn), 'more': False, 'reset': True}
+
+        rows = conn.execute('''
+        SELECT seq, table_name, row_id, op, version, changed_at
+        FROM change_log WHERE seq > ?
+        ORDER BY seq LIMIT ?
+        ''', (cursor, limit + 1)).fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{'seq': seq, 'table': table, 'row_id': row_id, 'op': op, 'version': version,
+                'changed_at': changed_at}
+               for seq, table, row_id, op, version, changed_at in rows]
+    return {'changes': changes, 'cursor': rows[-1][0] if rows else cursor, 'more': more, 'reset': False}
+
+
+def compact_change_log(retention_days=CHANGE_LOG_RETENTION_DAYS, actor_id=None, conn=None):
+    """
+    ضغط السجل في معاملة واحدة:
+    - حذف التغييرات التي يليها تغيير آخر لنفس الصف (يكفي المستهلك آخرها)
+    - حذف ما هو أقدم من مدة الاحتفاظ ورفع الحد الأدنى للمؤشر، فالمستهلك المتأخر أكثر
+      من ذلك يُطلب منه إعادة النسخ الكامل
+
+    Returns:
+        dict: superseded، expired، floor
+    """
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%f')
+
+    with connection(conn) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            superseded = conn.execute('''
+            DELETE FROM change_log
+            WHERE op != 'reset' AND seq < (
+                SELECT MAX(c.seq) FROM change_log c
+                WHERE c.table_name = change_log.table_name AND c.row_id = change_log.row_id
+            )
+            ''').rowcount
+
+            floor = _floor(conn)
+            expired_floor = conn.execute("SELECT MAX(seq) FROM change_log WHERE changed_at < ?",
+                                         (cutoff,)).fetchone()[0]
+            expired = 0
+            if expired_floor is not None:
+                expired = conn.execute("DELETE FROM change_log WHERE seq <= ?", (expired_floor,)).rowcount
+                floor = max(floor, expired_floor)
+                conn.execute('''
+                INSERT OR REPLACE INTO system_settings (setting_key, setting_value, description, updated_at)
+                VALUES (?, ?, 'أصغر مؤشر متاح في سجل التغييرات', CURRENT_TIMESTAMP)
+                ''', (FLOOR_SETTING, str(floor)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    log_activity(actor_id, "ضغط سجل التغييرات", f"{superseded} مكرر، {expired} منتهي")
+    return {'superseded': superseded, 'expired': expired, 'floor': floor}
@@ -0,0 +1,241 @@
+# services/contact_merge.py - كشف جهات الاتصال المكررة ودمجها
+"""
+يجمع جهات الاتصال وأسماء المرسلين/المستلمين غير المربوطة بجهة (sender_id أو
+recipient_id فارغ) في مجموعات لنفس الجهة بكتابات مختلفة، ثم يدمج كل مجموعة في جهة
+واحدة بتحويل معرفات البريد إليها في معاملة واحدة.
+
+- التوحيد: normalize_arabic (الهمزات والتاء المربوطة والتشكيل) ثم حذف الرموز
+- التقسيم (blocking): لا يُقارن اسمان إلا إذا اشتركا في زوج كلمات أو في بداية الاسم،
+  فعدد المقارنات يتبع حجم المجموعات الصغيرة لا N²
+- التشابه: SequenceMatcher على الأسماء الموحدة، مع رفض الأسماء التي تختلف أرقامها
+  ("مصلحة 17" ليست "مصلحة 18")
+"""
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from database import log_activity
+from services.base import ServiceError, connection, to_int
+from services.contacts import next_contact_code
+from services.fulltext import normalize_arabic
+from services.mail import DRAFT_SENDER, TOUCH_UPDATED_AT
+
+MIN_SIMILARITY = 0.88
+# مفاتيح تقسيم تظهر في أكثر من هذا العدد من الأسماء لا تُستعمل (وزارة التربية، ولاية قابس...)
+MAX_BLOCK_SIZE = 200
+PREFIX_LENGTH = 4
+
+_SYMBOLS = re.compile(r'[^\w\s]|_')
+_DIGITS = re.compile(r'\d+')
+
+
+def name_key(name):
+    """الاسم الموحد للمقارنة"""
+    return " ".join(_SYMBOLS.sub(' ', normalize_arabic(name)).split())
+
+
+def name_similarity(key_a, key_b, minimum=0.0):
+    """تشابه اسمين موحدين (0 إذا اختلفت الأرقام فيهما أو كان الحد الأعلى للتشابه أقل من minimum)"""
+    if key_a == key_b:
+        return 1.0
+    if _DIGITS.findall(key_a) != _DIGITS.findall(key_b):
+        return 0.0
+    matcher = SequenceMatcher(None, key_a.replace(" ", ""), key_b.replace(" ", ""))
+    # حدود عليا رخيصة (الطول ثم الحروف المشتركة) قبل الحساب الكامل
+    if matcher.real_quick_ratio() < minimum or matcher.quick_ratio() < minimum:
+        return 0.0
+    return matcher.ratio()
+
+
+def _entries(conn):
+    """جهات الاتصال والأسماء غير المربوطة مع عدد البريد لكل منها"""
+    entries = []
+    for contact_id, name, organization, mail_count in conn.execute('''
+    SELECT c.id, c.name, c.organization,
+           (SELECT COUNT(*) FROM incoming_mail WHERE sender_id = c.id) +
+           (SELECT COUNT(*) FROM outgoing_mail WHERE recipient_id = c.id)
+    FROM contacts c
+    '''):
+        entries.append({'kind': 'contact', 'id': contact_id, 'name': name,
+                        'organization': organization, 'mail_count': mail_count})
+
+    orphans = defaultdict(int)
+    for name, count in conn.execute('''
+    SELECT sender_name, COUNT(*) FROM incoming_mail
+    WHERE sender_id IS NULL AND sender_name != ? GROUP BY sender_name
+    UNION ALL
+    SELECT recipient_name, COUNT(*) FROM outgoing_mail
+    WHERE recipient_id IS NULL GROUP BY recipient_name
+    ''', (DRAFT_SENDER,)):
+        if name and name.strip():
+            orphans[name] += count
+    for name, count in orphans.items():
+        entries.append({'kind': 'name', 'id': None, 'name': name, 'organization': None, 'mail_count': count})
+
+    for entry in entries:
+        entry['key'] = name_key(entry['name'])
+    return [entry for entry in entries if entry['key']]
+
+
+def _blocks(entries):
+    """
+    مجموعات المقارنة: بداية الاسم، وكل زوج من كلماته (أو الكلمة الوحيدة)
+
+    كتابة مختلفة لكلمة واحدة تترك زوجاً مشتركاً من الكلمات الأخرى، بينما زوج كلمات
+    مشترك بين جهتين مختلفتين نادر فتبقى المجموعات صغيرة.
+    """
+    blocks = defaultdict(list)
+    for position, entry in enumerate(entries):
+        compact = entry['key'].replace(" ", "")
+        blocks[f"p:{compact[:PREFIX_LENGTH]}"].append(position)
+        words = sorted({word for word in entry['key'].split() if not word.isdigit()})
+        if len(words) == 1:
+            blocks[f"w:{words[0]}"].append(position)
+        for i, first in enumerate(words):
+            for second in words[i + 1:]:
+                blocks[f"w:{first} {second}"].append(position)
+    return [members for members in blocks.values() if 1 < len(members) <= MAX_BLOCK_SIZE]
+
+
+def find_merge_candidates(min_similarity=MIN_SIMILARITY, conn=None):
+    """
+    اقتراحات الدمج: مجموعات أسماء لنفس الجهة
+
+    Returns:
+        list: قواميس target (جهة الاتصال المقترح الإبقاء عليها أو None)، name (الاسم المعتمد)،
+              members (قائمة العناصر)، similarity (أقل تشابه داخل المجموعة)
+    """
+    with connection(conn) as conn:
+        entries = _entries(conn)
+
+    parent = list(range(len(entries)))
+
+    def find(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    # نفس الاسم الموحد: دمج مباشر دون مقارنة
+    scores = {}
+    same_key = {}
+    for position, entry in enumerate(entries):
+        first = same_key.setdefault(entry['key'].replace(" ", ""), position)
+        if first != position:
+            scores[(first, position)] = 1.0
+            parent[find(position)] = find(first)
+
+    compared = set()
+    for members in _blocks(entries):
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (min(a, b), max(a, b))
+                if pair in compared or find(a) == find(b):
+                    continue
+                compared.add(pair)
+                score = name_similarity(entries[a]['key'], entries[b]['key'], min_similarity)
+                if score >= min_similarity:
+                    scores[pair] = score
+                    parent[find(a)] = find(b)
+
+    clusters, cluster_scores = defaultdict(list), defaultdict(list)
+    for pair, score in scores.items():
+        cluster_scores[find(pair[0])].append(score)
+    for position in range(len(entries)):
+        root = find(position)
+        if root in cluster_scores:
+            clusters[root].append(position)
+
+    proposals = []
+    for root, members in clusters.items():
+        group = [entries[position] for position in members]
+        contacts = [entry for entry in group if entry['kind'] == 'contact']
+        # الإبقاء على الجهة الأكثر استعمالاً، وإلا على الكتابة الأكثر تكراراً
+        target = max(contacts, key=lambda entry: (entry['mail_count'], -entry['id'])) if contacts else None
+        name = target['name'] if target else max(group, key=lambda entry: entry['mail_count'])['name']
+        proposals.append({
+            'target': target['id'] if target else None,
+            'name': name,
+            'members': sorted(group, key=lambda entry: -entry['mail_count']),
+            'similarity': round(min(cluster_scores[root]), 2),
+            'mail_count': sum(entry['mail_count'] for entry in group)
+        })
+    proposals.sort(key=lambda proposal: -proposal['mail_count'])
+    return proposals
+
+
+def apply_merges(proposals, actor_id=None, conn=None):
+    """
+    تطبيق اقتراحات الدمج في معاملة واحدة: تحويل معرفات البريد إلى الجهة المعتمدة،
+    وربط الأسماء غير المربوطة بها، وحذف الجهات المدمجة
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    proposals = [proposal for proposal in proposals if len(proposal['members']) > 1]
+    if not proposals:
+        return False, "لا توجد اقتراحات دمج محددة"
+
+    with connection(conn) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS contact_remap (old_id INTEGER PRIMARY KEY, new_id INTEGER)")
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS name_remap (name TEXT PRIMARY KEY, new_id INTEGER)")
+            conn.execute("DELETE FROM contact_remap")
+            conn.execute("DELETE FROM name_remap")
+
+            for proposal in proposals:
+                target = to_int(proposal.get('target'))
+                if target is None:
+                    cursor = conn.execute("INSERT INTO contacts (code, name) VALUES (?, ?)",
+                                          (next_contact_code(conn), " ".join(proposal['name'].split())))
+                    target = cursor.lastrowid
+                elif conn.execute("SELECT 1 FROM contacts WHERE id = ?", (target,)).fetchone() is None:
+                    raise ServiceError(f"جهة الاتصال {target} غير موجودة")
+                conn.executemany("INSERT OR REPLACE INTO contact_remap (old_id, new_id) VALUES (?, ?)",
+                                 [(member['id'], target) for member in proposal['members']
+                                  if member['kind'] == 'contact' and member['id'] != target])
+                conn.executemany("INSERT OR REPLACE INTO name_remap (name, new_id) VALUES (?, ?)",
+                                 [(member['name'], target) for member in proposal['members']
+                                  if member['kind'] == 'name'])
+
+            incoming = conn.execute(f'''
+            UPDATE incoming_mail
+            SET sender_id = COALESCE((SELECT new_id FROM contact_remap WHERE old_id = incoming_mail.sender_id),
+                                     (SELECT new_id FROM name_remap WHERE name = incoming_mail.sender_name)),
+                {TOUCH_UPDATED_AT}
+            WHERE sender_id IN (SELECT old_id FROM contact_remap)
+               OR (sender_id IS NULL AND sender_name IN (SELECT name FROM name_remap))
+            ''').rowcount
+            outgoing = conn.execute(f'''
+            UPDATE outgoing_mail
+            SET recipient_id = COALESCE((SELECT new_id FROM contact_remap WHERE old_id = outgoing_mail.recipient_id),
+                                        (SELECT new_id FROM name_remap WHERE name = outgoing_mail.recipient_name)),
+                {TOUCH_UPDATED_AT}
+            WHERE recipient_id IN (SELECT old_id FROM contact_remap)
+               OR (recipient_id IS NULL AND recipient_name IN (SELECT name FROM name_remap))
+            ''').rowcount
+
+            # استكمال بيانات الجهة المعتمدة من الجهات المدمجة ثم حذفها
+            conn.execute('''
+            UPDATE contacts SET
+                organization = COALESCE(NULLIF(organization, ''), (SELECT c.organization FROM contacts c
+                    JOIN contact_remap r ON r.old_id = c.id
+                    WHERE r.new_id = contacts.id AND COALESCE(c.organization, '') != '' LIMIT 1)),
+                phone = COALESCE(NULLIF(phone, ''), (SELECT c.phone FROM contacts c
+                    JOIN contact_remap r ON r.old_id = c.id
+                    WHERE r.new_id = contacts.id AND COALESCE(c.phone, '') != '' LIMIT 1)),
+                email = COALESCE(NULLIF(email, ''), (SELECT c.email FROM contacts c
+                    JOIN contact_remap r ON r.old_id = c.id
+                    WHERE r.new_id = contacts.id AND COALESCE(c.email, '') != '' LIMIT 1))
+            WHERE id IN (SELECT new_id FROM contact_remap)
+            ''')
+            removed = conn.execute("DELETE FROM contacts WHERE id IN (SELECT old_id FROM contact_remap)").rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    log_activity(actor_id, "دمج جهات الاتصال",
+                 f"{len(proposals)} مجموعة، {removed} جهة محذوفة، {incoming + outgoing} بريد محول")
+    return True, f"تم دمج {len(proposals)} مجموعة: {removed} جهة مكررة محذوفة و {incoming + outgoing} بريد مربوط"
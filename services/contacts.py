@@ -0,0 +1,158 @@
+# services/contacts.py - جهات الاتصال
+import sqlite3
+
+import pandas as pd
+
+from services.base import DuplicateReferenceError, connection, query_one, read_sql, to_int
+
+TIMELINE_PAGE_SIZE = 25
+# فروع خط المراسلات: (نوع البريد، ترتيبه عند تساوي التاريخ، الجدول، عمود الجهة، عمود الاسم، عمود التاريخ)
+TIMELINE_SOURCES = [
+    ('incoming', 1, 'incoming_mail', 'sender_id', 'sender_name', 'received_date'),
+    ('outgoing', 0, 'outgoing_mail', 'recipient_id', 'recipient_name', 'sent_date')
+]
+
+
+def get_contacts(conn=None):
+    """جلب جميع جهات الاتصال"""
+    return read_sql("SELECT id, code, name, organization, phone, email FROM contacts ORDER BY name", conn)
+
+
+def get_contact_by_id(contact_id, conn=None):
+    """جلب معلومات جهة اتصال حسب ID"""
+    contact_id = to_int(contact_id)
+    if contact_id is None:
+        return None
+
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, organization, phone, email FROM contacts WHERE id = ?", (contact_id,))
+        contact = cursor.fetchone()
+
+    if contact:
+        return {
+            'name': contact[0],
+            'organization': contact[1],
+            'phone': contact[2],
+            'email': contact[3]
+        }
+    return None
+
+
+def next_contact_code(conn=None):
+    """توليد الكود التالي لجهة اتصال (C001، C002...)"""
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(CAST(SUBSTR(code, 2) AS INTEGER)) FROM contacts WHERE code LIKE 'C%'")
+        result = cursor.fetchone()[0]
+    return f"C{(result or 0) + 1:03d}"
+
+
+def create_contact(code, name, organization=None, phone=None, email=None, conn=None):
+    """إضافة جهة اتصال وإرجاع معرفها"""
+    with connection(conn) as conn:
+        try:
+            cursor = conn.execute('''
+            INSERT INTO contacts (code, name, organization, phone, email)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (code or next_contact_code(conn), name, organization, phone, email))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            raise DuplicateReferenceError(f"الكود '{code}' موجود مسبقاً!")
+        return cursor.lastrowid
+
+
+def contact_summary(contact_id, conn=None):
+    """
+    عدادات جهة اتصال من contact_stats (تحدّثها مشغلات قاعدة البيانات)
+
+    Returns:
+        dict: incoming، outgoing، open (وارد غير مكتمل وصادر مسودة)، last_exchange
+    """
+    row = query_one('''
+    SELECT incoming_count, outgoing_count, open_count, last_exchange
+    FROM contact_stats WHERE contact_id = ?
+    ''', conn, (to_int(contact_id),))
+    incoming, outgoing, open_count, last_exchange = row or (0, 0, 0, None)
+    return {'incoming': incoming, 'outgoing': outgoing, 'open': open_count, 'last_exchange': last_exchange}
+
+
+def count_contact_mail(contact_id, conn=None):
+    """عدد البريد الوارد والصادر المرتبط بجهة اتصال"""
+    summary = contact_summary(contact_id, conn)
+    return summary['incoming'] + summary['outgoing']
+
+
+def _timeline_branch(source, by_name, cursor):
+    """
+    فرع واحد من خط المراسلات مرتباً بالتاريخ تنازلياً ومحدوداً بحجم الصفحة
+
+    الترتيب الكلي (التاريخ، نوع البريد، المعرف) تنازلياً، فشرط المؤشر لكل فرع نطاق
+    واحد على فهرس (الجهة، التاريخ) أو الفهرس الجزئي للأسماء غير المربوطة.
+    """
+    mail_type, rank, table, id_column, name_column, date_column = source
+    where = f"{id_column} IS NULL AND {name_column} = :name" if by_name else f"{id_column} = :contact_id"
+    if cursor is None:
+        where += f" AND {date_column} IS NOT NULL"
+    elif rank == cursor[1]:
+        where += f" AND ({date_column}, id) < (:date, :id)"
+    elif rank > cursor[1]:
+        where += f" AND {date_column} < :date"
+    else:
+        where += f" AND {date_column} <= :date"
+    return f"""SELECT * FROM (
+        SELECT '{mail_type}' AS mail_type, id, reference_no, {name_column} AS party, subject,
+               {date_column} AS mail_date, status, {0 if by_name else 1} AS linked, {rank} AS type_rank
+        FROM {table} WHERE {where}
+        ORDER BY {date_column} DESC, id DESC LIMIT :limit)"""
+
+
+def timeline_query(cursor=None, with_names=True):
+    """اتحاد فروع الوارد والصادر (بمعرف الجهة ثم باسمها للبريد غير المربوط)"""
+    branches = [_timeline_branch(source, by_name, cursor)
+                for source in TIMELINE_SOURCES
+                for by_name in ((False, True) if with_names else (False,))]
+    return "\nUNION ALL\n".join(branches) + "\nORDER BY mail_date DESC, type_rank DESC, id DESC LIMIT :limit"
+
+
+def contact_timeline(contact_id, cursor=None, page_size=TIMELINE_PAGE_SIZE, conn=None):
+    """
+    صفحة من مراسلات جهة اتصال (الوارد منها والصادر إليها) من الأحدث إلى الأقدم
+
+    البريد غير المربوط بجهة يُضم إذا طابق اسم المرسل/المستلم اسم الجهة (linked = 0).
+    كل صفحة تقرأ page_size + 1 صفاً على الأكثر من كل فرع مهما كان عدد مراسلات الجهة.
+
+    Args:
+        cursor (tuple): (التاريخ، ترتيب النوع، المعرف) لآخر صف في الصفحة السابقة
+
+    Returns:
+        tuple: (DataFrame، مؤشر الصفحة التالية أو None)
+    """
+    contact = get_contact_by_id(contact_id, conn)
+    if contact is None:
+        return pd.DataFrame(), None
+
+    params = {'contact_id': to_int(contact_id), 'name': contact['name'], 'limit': page_size + 1}
+    if cursor is not None:
+        params.update({'date': cursor[0], 'id': cursor[2]})
+    df = read_sql(timeline_query(cursor), conn, params)
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        next_cursor = (last['mail_date'], int(last['type_rank']), int(last['id']))
+    return df.drop(columns=['type_rank']), next_cursor
+
+
+def delete_contact(contact_id, conn=None):
+    """حذف جهة اتصال غير مستعملة في أي بريد، وإرجاع (نجاح، رسالة)"""
+    contact_id = to_int(contact_id)
+    with connection(conn) as conn:
+        used = count_contact_mail(contact_id, conn)
+        if used > 0:
+            return False, f"لا يمكن حذف الجهة لأنها مستخدمة في {used} بريد"
+
+        conn.execute("DELETE FROM contacts WHERE id = ?", (contact_id,))
+        conn.commit()
+    return True, "تم حذف الجهة بنجاح"
@@ -0,0 +1,285 @@
+# services/duplicates.py - كشف البريد الوارد المكرر (فاكس ثم بريد عادي...)
+"""
+بصمة لكل بريد وارد (جدول mail_signatures): المرسل الموحد وتاريخ الاستلام و MinHash
+لثلاثيات حروف الموضوع. مفاتيح البحث (mail_signature_keys) هي نطاقات LSH للـ MinHash
+وبصمات SHA-256 للمرفقات، فالبحث عن المرشحين قراءة فهرس بعدد المفاتيح لا بحجم الأرشيف.
+
+    find_candidates(sender_name, subject, received_date, attachment_hashes)  عند التسجيل
+    find_archive_duplicates()                                                  مهمة دفعية
+
+البصمات تُحدث عند التسجيل والتعديل والحذف، و index_missing تستدرك ما أُدرج خارج
+طبقة الخدمات (الاستيراد الدفعي، قواعد قديمة).
+"""
+import hashlib
+import json
+import os
+import random
+from array import array
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pandas as pd
+
+from services.attachments import get_attachment_list, upload_root
+from services.base import connection, format_date, to_int
+from services.fulltext import file_hash, index_text
+
+# 6 نطاقات × 4 صفوف: احتمال أن يصبح بريدان مرشحين ≈ 50% عند تشابه 0.64 و 98% عند 0.8
+BANDS = 6
+ROWS_PER_BAND = 4
+NUM_PERM = BANDS * ROWS_PER_BAND
+MIN_SIMILARITY = 0.6
+# مع مرسل غير معروف (مسودة) يُشترط تشابه أعلى للموضوع أو مرفق مشترك
+UNKNOWN_SENDER_SIMILARITY = 0.9
+WINDOW_DAYS = 14
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20240101)  # معاملات ثابتة: البصمات المخزنة تبقى صالحة بين التشغيلات
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def content_hash(data):
+    """بصمة SHA-256 لمحتوى مرفق (نفس بصمة fulltext.file_hash)"""
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+def _sender_key(sender_name):
+    """المرسل الموحد، أو نص فارغ إذا كان غير معروف (مسودات الماسح)"""
+    from services.mail import DRAFT_SENDER
+
+    if not sender_name or sender_name == DRAFT_SENDER:
+        return ""
+    return "".join(index_text(sender_name).split())
+
+
+def shingles(subject):
+    """ثلاثيات حروف الموضوع الموحد"""
+    text = f" {index_text(subject)} "
+    if len(text.strip()) < 3:
+        return {text.strip()} if text.strip() else set()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@lru_cache(maxsize=8192)
+def _minhash_values(subject):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+              for shingle in shingles(subject)]
+    if not hashes:
+        return (0xFFFFFFFF,) * NUM_PERM
+    return tuple(min((a * value + b) % _PRIME for value in hashes) & 0xFFFFFFFF for a, b in _PERMUTATIONS)
+
+
+def minhash(subject):
+    """MinHash (NUM_PERM قيمة 32 بت) لثلاثيات الموضوع (المواضيع المتكررة تُحسب مرة واحدة)"""
+    return array('I', _minhash_values(subject or ""))
+
+
+def similarity(signature_a, signature_b):
+    """تقدير تشابه جاكارد بين موضوعين من بصمتيهما"""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+
+def _band_keys(signature):
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        keys.append(f"b{band}:{hashlib.blake2b(chunk, digest_size=8).hexdigest()}")
+    return keys
+
+
+def _lookup_keys(signature, attachment_hashes):
+    return _band_keys(signature) + [f"f:{blob_hash}" for blob_hash in attachment_hashes]
+
+
+def attachment_hashes(attachments):
+    """بصمات ملفات مرفقات بريد وارد محفوظة (أسماء في uploads/incoming)"""
+    hashes = []
+    for name in get_attachment_list(attachments):
+        path = os.path.join(upload_root(), "incoming", name)
+        if os.path.isfile(path):
+            hashes.append(file_hash(path))
+    return hashes
+
+
+def _load_signature(blob):
+    signature = array('I')
+    signature.frombytes(blob)
+    return signature
+
+
+def index_mail(mail_id, sender_name, subject, received_date, hashes=(), updated_at=None, conn=None):
+    """حفظ بصمة بريد وارد ومفاتيح البحث الخاصة به (بعد التسجيل أو التعديل)"""
+    mail_id = to_int(mail_id)
+    signature = minhash(subject)
+    with connection(conn) as conn:
+        conn.execute("DELETE FROM mail_signature_keys WHERE mail_id = ?", (mail_id,))
+        conn.execute('''
+        INSERT OR REPLACE INTO mail_signatures (mail_id, sender_key, received_date, minhash, file_hashes, updated_at)
+        VALUES (?, ?, ?, ?, ?, COALESCE(?, (SELECT updated_at FROM incoming_mail WHERE id = ?)))
+        ''', (mail_id, _sender_key(sender_name), format_date(received_date), signature.tobytes(),
+              ",".join(hashes), updated_at, mail_id))
+        conn.executemany("INSERT OR IGNORE INTO mail_signature_keys (key, received_date, mail_id) VALUES (?, ?, ?)",
+                         [(key, format_date(received_date), mail_id) for key in _lookup_keys(signature, hashes)])
+        conn.commit()
+
+
+def forget_mail(mail_id, conn=None):
+    """حذف بصمة بريد محذوف"""
+    forget_mails([mail_id], conn)
+
+
+def forget_mails(mail_ids, conn=None):
+    """حذف بصمات مجموعة بريد محذوف (عبارة DELETE واحدة لكل جدول)"""
+    ids = json.dumps([to_int(mail_id) for mail_id in mail_ids])
+    with connection(conn) as conn:
+        conn.execute("DELETE FROM mail_signature_keys WHERE mail_id IN (SELECT value FROM json_each(?))", (ids,))
+        conn.execute("DELETE FROM mail_signatures WHERE mail_id IN (SELECT value FROM json_each(?))", (ids,))
+        conn.commit()
+
+
+def _compare(sender_a, signature_a, hashes_a, sender_b, signature_b, hashes_b):
+    """(تشابه الموضوع، مرفق مشترك، تطابق المرسل) أو None إذا لم يكونا مكررين محتملين"""
+    same_attachment = bool(set(hashes_a) & set(hashes_b))
+    score = similarity(signature_a, signature_b)
+    if not sender_a or not sender_b:
+        same_sender, threshold = None, UNKNOWN_SENDER_SIMILARITY
+    else:
+        same_sender, threshold = sender_a == sender_b, MIN_SIMILARITY
+    if same_attachment or (score >= threshold and same_sender is not False):
+        return score, same_attachment, same_sender
+    return None
+
+
+def find_candidates(sender_name, subject, received_date, hashes=(), window_days=WINDOW_DAYS,
+                    exclude_id=None, limit=5, conn=None):
+    """
+    البريد الوارد المشابه لبريد قبل تسجيله
+
+    Returns:
+        list: قواميس id، reference_no، sender_name، subject، received_date، similarity، same_attachment
+              مرتبة بالأرجح أولاً
+    """
+    signature = minhash(subject)
+    sender_key = _sender_key(sender_name)
+    keys = _lookup_keys(signature, hashes)
+    day = datetime.strptime(format_date(received_date), '%Y-%m-%d').date()
+
+    with connection(conn) as conn:
+        rows = conn.execute(f'''
+        SELECT s.mail_id, s.sender_key, s.minhash, s.file_hashes,
+               m.reference_no, m.sender_name, m.subject, m.received_date
+        FROM mail_signatures s
+        JOIN incoming_mail m ON m.id = s.mail_id
+        WHERE s.mail_id IN (
+            SELECT mail_id FROM mail_signature_keys
+            WHERE key IN ({','.join('?' * len(keys))}) AND received_date BETWEEN ? AND ?
+        )
+        ''', keys + [format_date(day - timedelta(days=window_days)),
+                     format_date(day + timedelta(days=window_days))]).fetchall()
+
+    candidates = []
+    for mail_id, other_sender, blob, file_hashes, reference_no, other_name, other_subject, other_date in rows:
+        if mail_id == to_int(exclude_id):
+            continue
+        match = _compare(sender_key, signature, hashes, other_sender, _load_signature(blob),
+                         file_hashes.split(",") if file_hashes else [])
+        if match:
+            candidates.append({
+                'id': mail_id, 'reference_no': reference_no, 'sender_name': other_name,
+                'subject': other_subject, 'received_date': other_date,
+                'similarity': round(match[0], 2), 'same_attachment': match[1]
+            })
+    candidates.sort(key=lambda item: (item['same_attachment'], item['similarity']), reverse=True)
+    return candidates[:limit]
+
+
+def index_missing(batch_size=2000, conn=None):
+    """بصمات البريد الوارد الجديد أو المعدل خارج طبقة الخدمات، وحذف بصمات المحذوف؛ إرجاع عدد المفهرس"""
+    with connection(conn) as conn:
+        stale = conn.execute('''
+        SELECT m.id, m.sender_name, m.subject, m.received_date, m.attachments, m.updated_at
+        FROM incoming_mail m
+        LEFT JOIN mail_signatures s ON s.mail_id = m.id
+        WHERE s.mail_id IS NULL OR s.updated_at IS NOT m.updated_at
+        ''').fetchall()
+        for start in range(0, len(stale), batch_size):
+            signatures, keys = [], []
+            for mail_id, sender_name, subject, received_date, attachments, updated_at in stale[start:start + batch_size]:
+                signature = minhash(subject)
+                hashes = attachment_hashes(attachments)
+                signatures.append((mail_id, _sender_key(sender_name), received_date, signature.tobytes(),
+                                   ",".join(hashes), updated_at))
+                keys += [(key, received_date, mail_id) for key in _lookup_keys(signature, hashes)]
+            conn.executemany("DELETE FROM mail_signature_keys WHERE mail_id = ?", [(row[0],) for row in signatures])
+            conn.executemany('''
+            INSERT OR REPLACE INTO mail_signatures (mail_id, sender_key, received_date, minhash, file_hashes, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', signatures)
+            conn.executemany("INSERT OR IGNORE INTO mail_signature_keys (key, received_date, mail_id) VALUES (?, ?, ?)",
+                             keys)
+            conn.commit()
+
+        conn.execute("DELETE FROM mail_signature_keys WHERE mail_id NOT IN (SELECT id FROM incoming_mail)")
+        conn.execute("DELETE FROM mail_signatures WHERE mail_id NOT IN (SELECT id FROM incoming_mail)")
+        conn.commit()
+    return len(stale)
+
+
+def find_archive_duplicates(window_days=WINDOW_DAYS, conn=None):
+    """
+    أزواج البريد الوارد المكرر المحتمل في كل الأرشيف
+
+    المرشحون من نفس مفتاح LSH أو نفس المرفق فقط، وداخل كل مفتاح تُقارن الرسائل
+    المتقاربة في تاريخ الاستلام فقط (نافذة منزلقة).
+    """
+    with connection(conn) as conn:
+        index_missing(conn=conn)
+        signatures = {
+            mail_id: (sender_key, received_date, _load_signature(blob), file_hashes.split(",") if file_hashes else [])
+            for mail_id, sender_key, received_date, blob, file_hashes in conn.execute(
+                "SELECT mail_id, sender_key, received_date, minhash, file_hashes FROM mail_signatures")
+        }
+        buckets = conn.execute('''
+        SELECT group_concat(mail_id) FROM mail_signature_keys
+        GROUP BY key HAVING COUNT(*) > 1
+        ''').fetchall()
+
+        pairs, compared = {}, set()
+        for (members,) in buckets:
+            dated = sorted((signatures[int(mail_id)][1] or "", int(mail_id)) for mail_id in members.split(",")
+                           if int(mail_id) in signatures)
+            for position, (day_a, mail_a) in enumerate(dated):
+                limit = format_date(datetime.strptime(day_a, '%Y-%m-%d').date() + timedelta(days=window_days)) \
+                    if day_a else ""
+                for day_b, mail_b in dated[position + 1:]:
+                    if day_b > limit:
+                        break
+                    pair = (min(mail_a, mail_b), max(mail_a, mail_b))
+                    if pair in compared:
+                        continue
+                    compared.add(pair)
+                    a, b = signatures[pair[0]], signatures[pair[1]]
+                    match = _compare(a[0], a[2], a[3], b[0], b[2], b[3])
+                    if match:
+                        pairs[pair] = match
+
+        if not pairs:
+            return pd.DataFrame()
+        ids = sorted({mail_id for pair in pairs for mail_id in pair})
+        details = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            details.update((row[0], row[1:]) for row in conn.execute(
+                f"SELECT id, reference_no, subject, received_date FROM incoming_mail "
+                f"WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+
+    return pd.DataFrame([
+        {
+            'الأول': details[mail_a][0], 'الثاني': details[mail_b][0],
+            'موضوع الأول': details[mail_a][1], 'موضوع الثاني': details[mail_b][1],
+            'تاريخ الأول': details[mail_a][2], 'تاريخ الثاني': details[mail_b][2],
+            'التشابه': round(score, 2), 'مرفق مشترك': same_attachment,
+            'id_a': mail_a, 'id_b': mail_b
+        }
+        for (mail_a, mail_b), (score, same_attachment, _) in pairs.items()
+    ]).sort_values(['مرفق مشترك', 'التشابه'], ascending=False, ignore_index=True)
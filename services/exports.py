@@ -0,0 +1,106 @@
+# services/exports.py - تصدير البريد إلى Excel
+import io
+
+import pandas as pd
+
+import metrics
+from services.base import connection, to_int
+from services.contacts import get_contact_by_id, timeline_query
+
+INCOMING_EXPORT_QUERY = """
+SELECT
+    reference_no as 'رقم المرجع',
+    sender_name as 'المرسل',
+    received_date as 'تاريخ الاستلام',
+    subject as 'الموضوع',
+    priority as 'الأولوية',
+    status as 'الحالة',
+    category as 'التصنيف',
+    due_date as 'تاريخ الاستحقاق',
+    notes as 'ملاحظات'
+FROM incoming_mail
+ORDER BY received_date DESC
+"""
+
+OUTGOING_EXPORT_QUERY = """
+SELECT
+    reference_no as 'رقم المرجع',
+    recipient_name as 'المستلم',
+    sent_date as 'تاريخ الإرسال',
+    subject as 'الموضوع',
+    priority as 'الأولوية',
+    status as 'الحالة',
+    category as 'التصنيف',
+    notes as 'ملاحظات'
+FROM outgoing_mail
+ORDER BY sent_date DESC
+"""
+
+
+def dataframe_to_excel(df, sheet_name):
+    """إنشاء ملف Excel في الذاكرة مع تحسين عرض الأعمدة"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+
+        worksheet = writer.sheets[sheet_name]
+        for idx, col in enumerate(df.columns):
+            column_width = max(df[col].fillna('').astype(str).str.len().max(), len(col)) + 2
+            worksheet.column_dimensions[chr(65 + idx)].width = min(column_width, 50)
+
+    output.seek(0)
+    return output
+
+
+# أعمدة تصدير مراسلات جهة اتصال (contacts.timeline_query)
+TIMELINE_EXPORT_COLUMNS = {
+    'mail_type': 'النوع',
+    'reference_no': 'رقم المرجع',
+    'mail_date': 'التاريخ',
+    'party': 'المرسل / المستلم',
+    'subject': 'الموضوع',
+    'status': 'الحالة',
+    'linked': 'مربوط بالجهة'
+}
+TIMELINE_MAIL_TYPES = {'incoming': 'وارد', 'outgoing': 'صادر'}
+
+
+def _timeline_frame(df):
+    """مراسلات الجهة بأسماء أعمدة عربية"""
+    df = df[list(TIMELINE_EXPORT_COLUMNS)].copy()
+    df['mail_type'] = df['mail_type'].map(TIMELINE_MAIL_TYPES)
+    df['linked'] = df['linked'].map({1: 'نعم', 0: 'بالاسم فقط'})
+    return df.rename(columns=TIMELINE_EXPORT_COLUMNS)
+
+
+def _export(query, sheet_name, mail_type, conn=None, params=None, transform=None):
+    """تنفيذ استعلام التصدير وتحويله إلى Excel مع تسجيل الزمن وعدد الصفوف"""
+    with metrics.EXPORT_SECONDS.time(mail_type=mail_type):
+        with connection(conn) as conn:
+            df = pd.read_sql(query, conn, params=params)
+        if transform is not None:
+            df = transform(df)
+        if df.empty:
+            return None
+        output = dataframe_to_excel(df, sheet_name)
+    metrics.EXPORT_ROWS.inc(len(df), mail_type=mail_type)
+    return output
+
+
+def export_incoming(conn=None):
+    """تصدير البريد الوارد إلى Excel (أو None إذا لم يوجد بريد)"""
+    return _export(INCOMING_EXPORT_QUERY, 'البريد الوارد', "incoming", conn)
+
+
+def export_outgoing(conn=None):
+    """تصدير البريد الصادر إلى Excel (أو None إذا لم يوجد بريد)"""
+    return _export(OUTGOING_EXPORT_QUERY, 'البريد الصادر', "outgoing", conn)
+
+
+def export_contact_timeline(contact_id, conn=None):
+    """تصدير كل مراسلات جهة اتصال إلى Excel (أو None إذا لم توجد)"""
+    contact = get_contact_by_id(contact_id, conn)
+    if contact is None:
+        return None
+    params = {'contact_id': to_int(contact_id), 'name': contact['name'], 'limit': -1}
+    return _export(timeline_query(), 'مراسلات الجهة', "contact", conn, params, _timeline_frame)
@@ -0,0 +1,69 @@
+# services/frames.py - أنواع أعمدة مضغوطة لجداول القوائم (DataFrame)
+"""
+تحويل نتائج القوائم مرة واحدة عند التحميل (قبل تخزينها في query_cache):
+
+- الأعمدة قليلة القيم (الحالة، الأولوية، التصنيف، المرسل/المستلم) إلى Categorical،
+  والأولوية مرتبة حسب level في mail_priorities (تسمح بـ df['priority'] >= 'مهم')
+- أعمدة التواريخ إلى datetime64 بدل نصوص يُعاد تحليلها صفاً صفاً
+"""
+from datetime import date
+
+import pandas as pd
+
+from services.base import read_sql
+
+DATE_COLUMNS = ('received_date', 'due_date', 'sent_date')
+# أعمدة نصية تتكرر قيمها كثيراً (تُخزن كرموز بدل نسخة نصية لكل صف)
+REPEATED_COLUMNS = ('sender_name', 'recipient_name')
+
+
+def lookup_values():
+    """قيم الأولويات (مرتبة حسب المستوى) والتصنيفات من جداولها"""
+    priorities = read_sql("SELECT name FROM mail_priorities ORDER BY level, id")
+    categories = read_sql("SELECT name FROM mail_categories ORDER BY id")
+    return {
+        'priority': priorities['name'].tolist(),
+        'category': categories['name'].tolist()
+    }
+
+
+def categorical(series, values=(), ordered=False):
+    """Categorical بالقيم المعروفة أولاً ثم أي قيم أخرى موجودة في البيانات (دون فقدان أي قيمة)"""
+    known = list(dict.fromkeys(values))
+    extra = sorted(set(series.dropna().unique()) - set(known))
+    return pd.Categorical(series, categories=known + extra, ordered=ordered)
+
+
+def typed_mail_frame(df, statuses=()):
+    """تحويل أعمدة قائمة بريد إلى الأنواع المضغوطة"""
+    if df.empty:
+        return df
+
+    df = df.copy()
+    lookups = lookup_values()
+    if 'status' in df:
+        df['status'] = categorical(df['status'], statuses)
+    if 'priority' in df:
+        df['priority'] = categorical(df['priority'], lookups['priority'], ordered=True)
+    if 'category' in df:
+        df['category'] = categorical(df['category'], lookups['category'])
+    for column in REPEATED_COLUMNS:
+        if column in df:
+            df[column] = categorical(df[column])
+    for column in DATE_COLUMNS:
+        if column in df:
+            df[column] = pd.to_datetime(df[column], format='ISO8601', errors='coerce')
+    return df
+
+
+def days_until(dates, today=None):
+    """عدد الأيام المتبقية حتى كل تاريخ (سالب إذا تجاوز، <NA> إذا لم يوجد تاريخ)"""
+    today = pd.Timestamp(today or date.today())
+    return (dates - today).dt.days.astype('Int64')
+
+
+def format_day(value):
+    """عرض تاريخ datetime64 بصيغة YYYY-MM-DD (نص فارغ إذا لم يوجد)"""
+    if value is None or pd.isna(value):
+        return ""
+    return value.strftime('%Y-%m-%d')
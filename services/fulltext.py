@@ -0,0 +1,324 @@
+# services/fulltext.py - استخراج نصوص المرفقات وفهرس البحث النصي الكامل
+"""
+فهرس FTS5 (جدول mail_search) يجمع لكل بريد: رقم المرجع والموضوع والمرسل/المستلم
+والمحتوى ونصوص مرفقاته (PDF و DOCX) والبوردرية المولدة في uploads/bordereau/.
+
+- النصوص تُستخرج مرة واحدة لكل محتوى ملف (مفتاحها بصمة SHA-256 في attachment_text)،
+  وبصمة كل مسار تُحفظ مع حجمه ووقت تعديله (attachment_blobs) فلا يُعاد قراءة ملف لم يتغير
+- الاستخراج يجري في مجموعة عمليات (refresh_index) من text_indexer.py، لا أثناء البحث
+- صف البريد في الفهرس يُعاد بناؤه فقط عندما تتغير بصمته (updated_at + بصمات ملفاته)
+- البريد المرشح للتحديث يُقرأ من سجل التغييرات (services.changes) بعد المؤشر المحفوظ،
+  فلا يمر التحديث الدوري على كل الأرشيف؛ المرور الكامل عند أول تحديث في العملية فقط
+- النصوص والاستعلامات تُوحد بنفس الطريقة (index_text: التشكيل والهمزات وأداة التعريف)
+"""
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from services.attachments import get_attachment_list, upload_root
+from services.base import connection, current_db_path, to_int
+from services.changes import MAX_CHANGES_PAGE_SIZE, changes_since, latest_cursor
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF اختياري: بدونه تُؤجل ملفات PDF حتى تثبيت pypdf
+    PdfReader = None
+
+EXTRACTABLE_EXTENSIONS = ('.pdf', '.docx')
+# حد النص المفهرس لكل ملف (ملفات ضخمة لا تضخم الفهرس)
+MAX_TEXT_CHARS = 200_000
+
+TEXT_EXTRACTIONS = metrics.REGISTRY.register(metrics.Counter(
+    "mail_text_extractions_total", "Attachment text extractions", ["result"]))
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_CHARACTER_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ة': 'ه',
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)}
+})
+_WORD = re.compile(r'\w+')
+# أداة التعريف وما يسبقها من حروف (الميزانية، والميزانية، بالميزانية...) تُحذف من الكلمات المفهرسة
+_ARTICLE = re.compile(r'\b(?:[وفبك]?ال|لل)(?=\w{2})')
+
+# أعمدة كل نوع: (الجدول، عمود المرسل/المستلم، عمود البوردرية)
+MAIL_SOURCES = {
+    'incoming': ('incoming_mail', 'sender_name', None),
+    'outgoing': ('outgoing_mail', 'recipient_name', 'bordereau')
+}
+# آخر مؤشر في سجل التغييرات دخل الفهرس
+CURSOR_SETTING = 'fulltext_cursor'
+# القواعد التي مر عليها تحديث كامل في هذه العملية
+_full_passes = set()
+
+
+def normalize_arabic(text):
+    """توحيد النص العربي: حذف التشكيل والتطويل، توحيد الألف والياء والتاء المربوطة والأرقام"""
+    if not text:
+        return ""
+    text = _DIACRITICS.sub('', str(text)).translate(_CHARACTER_MAP).lower()
+    return " ".join(text.split())
+
+
+def index_text(text):
+    """النص كما يُفهرس ويُبحث فيه: موحد ودون أداة التعريف"""
+    return _ARTICLE.sub('', normalize_arabic(text))
+
+
+def search_rowid(mail_type, mail_id):
+    """معرف صف البريد في الفهرس (الوارد زوجي والصادر فردي) للتحديث دون مسح الجدول"""
+    return int(mail_id) * 2 + (1 if mail_type == 'outgoing' else 0)
+
+
+def file_hash(path):
+    """بصمة SHA-256 لمحتوى الملف"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_text(path):
+    """نص ملف PDF (طبقة النص) أو DOCX (الفقرات والجداول)، أو None إذا تعذر الآن"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.docx':
+        from docx import Document
+
+        document = Document(path)
+        parts = [paragraph.text for paragraph in document.paragraphs]
+        for table in document.tables:
+            for row in table.rows:
+                parts.extend(cell.text for cell in row.cells)
+        return "\n".join(part for part in parts if part.strip())
+    if extension == '.pdf':
+        if PdfReader is None:
+            return None
+        reader = PdfReader(path)
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    return ""
+
+
+def _extract_job(path):
+    """عمل مجموعة العمليات: (النص الموحد، الخطأ)"""
+    try:
+        text = extract_text(path)
+    except Exception as e:
+        return "", str(e)
+    if text is None:
+        return None, None
+    return index_text(text)[:MAX_TEXT_CHARS], None
+
+
+def mail_files(mail_type, attachments, bordereau=None):
+    """مسارات ملفات البريد القابلة للاستخراج (المرفقات ثم البوردرية)"""
+    paths = [os.path.join(upload_root(), mail_type, name) for name in get_attachment_list(attachments)]
+    if bordereau:
+        paths.append(os.path.join(upload_root(), "bordereau", bordereau))
+    return [path for path in paths
+            if path.lower().endswith(EXTRACTABLE_EXTENSIONS) and os.path.isfile(path)]
+
+
+def _blob_hashes(paths, conn):
+    """بصمة كل مسار، مع إعادة الحساب فقط للملفات التي تغير حجمها أو وقت تعديلها"""
+    hashes, changed = {}, []
+    for path in paths:
+        stat = os.stat(path)
+        cached = conn.execute("SELECT size, mtime, blob_hash FROM attachment_blobs WHERE path = ?",
+                              (path,)).fetchone()
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            hashes[path] = cached[2]
+            continue
+        hashes[path] = file_hash(path)
+        changed.append((path, stat.st_size, stat.st_mtime, hashes[path]))
+    if changed:
+        conn.executemany("INSERT OR REPLACE INTO attachment_blobs (path, size, mtime, blob_hash) VALUES (?, ?, ?, ?)",
+                         changed)
+        conn.commit()
+    return hashes
+
+
+def _extract_missing(hashes, workers, conn):
+    """استخراج نصوص البصمات الجديدة في مجموعة عمليات وحفظها، وإرجاع عدد الملفات المستخرجة"""
+    pending = {}
+    for path, blob_hash in hashes.items():
+        if blob_hash not in pending and not conn.execute(
+                "SELECT 1 FROM attachment_text WHERE blob_hash = ?", (blob_hash,)).fetchone():
+            pending[blob_hash] = path
+    if not pending:
+        return 0
+
+    paths = list(pending.values())
+    if workers and workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_extract_job, paths, chunksize=4))
+    else:
+        results = [_extract_job(path) for path in paths]
+
+    rows = []
+    for blob_hash, (text, error) in zip(pending, results):
+        if text is None:
+            TEXT_EXTRACTIONS.inc(result="deferred")
+            continue
+        if error:
+            print(f"⚠️ خطأ في استخراج نص {os.path.basename(pending[blob_hash])}: {error}")
+        TEXT_EXTRACTIONS.inc(result="failed" if error else "extracted")
+        rows.append((blob_hash, text, error))
+    conn.executemany("INSERT OR REPLACE INTO attachment_text (blob_hash, text, error) VALUES (?, ?, ?)", rows)
+    conn.commit()
+    return len(rows)
+
+
+def _changed_mail(cursor, conn):
+    """
+    البريد الذي تغير بعد المؤشر: ({النوع: معرفات}، المؤشر التالي)، أو (None، المؤشر)
+    إذا طلب السجل إعادة النسخ الكامل
+    """
+    types = {table: mail_type for mail_type, (table, _, _) in MAIL_SOURCES.items()}
+    changed = {}
+    while True:
+        page = changes_since(cursor, MAX_CHANGES_PAGE_SIZE, conn)
+        if page['reset']:
+            return None, page['cursor']
+        for change in page['changes']:
+            if change['table'] in types:
+                changed.setdefault(types[change['table']], set()).add(change['row_id'])
+        cursor = page['cursor']
+        if not page['more']:
+            return changed, cursor
+
+
+def _mail_rows(conn, changed=None):
+    """(النوع، الصف، الملفات) لكل البريد، أو للمعرفات في changed فقط"""
+    from services.mail import stage_ids
+
+    mails = []
+    for mail_type, (table, party, bordereau) in MAIL_SOURCES.items():
+        where = ""
+        if changed is not None:
+            if not changed.get(mail_type):
+                continue
+            stage_ids(changed[mail_type], conn)
+            where = "WHERE id IN (SELECT id FROM bulk_ids)"
+        for row in conn.execute(f'''
+        SELECT id, reference_no, subject, {party}, content, attachments, {bordereau or "NULL"}, updated_at
+        FROM {table} {where}
+        '''):
+            mails.append((mail_type, row, mail_files(mail_type, row[5], row[6])))
+    return mails
+
+
+def refresh_index(workers=None, conn=None, full=False):
+    """
+    تحديث تدريجي للفهرس: استخراج نصوص الملفات الجديدة ثم إعادة بناء صفوف البريد المتغيرة فقط
+
+    البريد المرشح هو ما سجله change_log بعد المؤشر المحفوظ (CURSOR_SETTING). يمر التحديث
+    على كل البريد عند أول تحديث للقاعدة في العملية (ملفات تغيرت خارج التطبيق، استخراج
+    مؤجل حتى تثبيت pypdf)، وبدون مؤشر محفوظ، وعند طلب السجل إعادة النسخ، ومع full.
+
+    Returns:
+        dict: extracted، indexed، removed، full
+    """
+    db_path = current_db_path()
+    with connection(conn) as conn:
+        row = conn.execute("SELECT setting_value FROM system_settings WHERE setting_key = ?",
+                           (CURSOR_SETTING,)).fetchone()
+        cursor = to_int(row[0]) if row else None
+        changed = None
+        if not full and cursor is not None and db_path in _full_passes:
+            changed, cursor = _changed_mail(cursor, conn)
+        if changed is None:
+            # المؤشر قبل القراءة: ما يتغير أثناء المرور الكامل يُعاد في التحديث التالي
+            cursor = latest_cursor(conn)
+            mails = _mail_rows(conn)
+            indexed_signatures = dict(conn.execute("SELECT rowid, signature FROM mail_search"))
+        else:
+            mails = _mail_rows(conn, changed)
+            indexed_signatures = {}
+            for mail_type, mail_ids in changed.items():
+                for mail_id in mail_ids:
+                    rowid = search_rowid(mail_type, mail_id)
+                    found = conn.execute("SELECT signature FROM mail_search WHERE rowid = ?", (rowid,)).fetchone()
+                    if found:
+                        indexed_signatures[rowid] = found[0]
+
+        hashes = _blob_hashes({path for _, _, paths in mails for path in paths}, conn)
+        extracted = _extract_missing(hashes, workers, conn)
+
+        texts = {}
+        updates = []
+        for mail_type, row, paths in mails:
+            rowid = search_rowid(mail_type, row[0])
+            signature = f"{row[7]}|{','.join(hashes[path] for path in paths)}"
+            if indexed_signatures.pop(rowid, None) == signature:
+                continue
+            bodies = []
+            for path in paths:
+                blob_hash = hashes[path]
+                if blob_hash not in texts:
+                    found = conn.execute("SELECT text FROM attachment_text WHERE blob_hash = ?", (blob_hash,)).fetchone()
+                    texts[blob_hash] = found[0] if found else None
+                if texts[blob_hash] is None:
+                    # استخراج مؤجل: بصمة ناقصة حتى يُعاد فهرسة البريد عند توفره
+                    signature = None
+                bodies.append(texts[blob_hash] or "")
+            body = "\n".join(part for part in [index_text(row[4])] + bodies if part)
+            updates.append((rowid, mail_type, row[0], signature, index_text(row[1]),
+                            index_text(row[2]), index_text(row[3]), body))
+
+        # البريد المحذوف: الصفوف المتبقية في الفهرس دون بريد مقابل
+        removed = list(indexed_signatures)
+        conn.executemany("DELETE FROM mail_search WHERE rowid = ?",
+                         [(rowid,) for rowid in removed] + [(update[0],) for update in updates])
+        conn.executemany('''
+        INSERT INTO mail_search (rowid, mail_type, mail_id, signature, reference_no, subject, party, body)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', updates)
+        conn.execute('''
+        INSERT OR REPLACE INTO system_settings (setting_key, setting_value, description, updated_at)
+        VALUES (?, ?, 'آخر مؤشر في سجل التغييرات دخل فهرس البحث', CURRENT_TIMESTAMP)
+        ''', (CURSOR_SETTING, str(cursor)))
+        conn.commit()
+    _full_passes.add(db_path)
+
+    return {'extracted': extracted, 'indexed': len(updates), 'removed': len(removed), 'full': changed is None}
+
+
+def match_expression(text):
+    """تحويل نص البحث إلى استعلام FTS5: كل الكلمات مطلوبة، مع مطابقة بداية الكلمة"""
+    words = _WORD.findall(index_text(text))
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def matching_ids(text, mail_type="incoming", conn=None):
+    """معرفات البريد المطابقة للنص في الفهرس (البيانات ومحتوى المرفقات)"""
+    expression = match_expression(text)
+    if not expression:
+        return []
+    with connection(conn) as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT mail_id FROM mail_search WHERE mail_search MATCH ? AND mail_type = ?",
+            (expression, mail_type))]
+
+
+def search(text, mail_type=None, limit=50, conn=None):
+    """بحث مرتب حسب الصلة مع مقتطف من النص المطابق"""
+    expression = match_expression(text)
+    if not expression:
+        return []
+    type_filter = "AND mail_type = ?" if mail_type else ""
+    params = [expression] + ([mail_type] if mail_type else []) + [int(limit)]
+    with connection(conn) as conn:
+        cursor = conn.execute(f'''
+        SELECT mail_type, mail_id, reference_no, subject,
+               snippet(mail_search, 6, '[', ']', '…', 12) AS snippet
+        FROM mail_search
+        WHERE mail_search MATCH ? {type_filter}
+        ORDER BY rank
+        LIMIT ?
+        ''', params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
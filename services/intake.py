@@ -0,0 +1,92 @@
+# services/intake.py - تسجيل ملفات الماسح الضوئي كمسودات بريد وارد
+import os
+import sqlite3
+from datetime import date
+
+import metrics
+from database import log_activity
+from services.attachments import dump_attachment_list, save_attachment
+from services import duplicates
+from services.base import DuplicateReferenceError, connection, format_date
+from services.mail import DRAFT_SENDER, DRAFT_STATUS, generate_ref_no
+
+ALLOWED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+def _next_references(count, conn):
+    """أرقام مرجع متتالية للدفعة ابتداءً من الرقم التالي للشهر الحالي"""
+    first = generate_ref_no("incoming", conn)
+    prefix, number, month, year = first.split("-")
+    return [f"{prefix}-{int(number) + offset:04d}-{month}-{year}" for offset in range(count)]
+
+
+def register_drafts(files, actor_id=None, conn=None):
+    """
+    حفظ دفعة ملفات كمرفقات وإنشاء بريد وارد بحالة "مسودة" لكل ملف في معاملة واحدة
+
+    Args:
+        files (list): قواميس filename، data (bytes)، received_date (اختياري)
+        actor_id (int): المستخدم الذي تُسجل الدفعة باسمه
+
+    Returns:
+        list: قواميس id، reference_no، filename، attachment
+    """
+    if not files:
+        return []
+
+    paths = []
+    try:
+        for item in files:
+            paths.append(save_attachment(item['data'], item['filename'], "incoming"))
+        saved = [os.path.basename(path) for path in paths]
+
+        with connection(conn) as conn:
+            # قفل الكتابة قبل حساب أرقام المرجع حتى لا تتكرر مع تسجيل متزامن من جلسة أخرى
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                references = _next_references(len(files), conn)
+                rows = [
+                    (reference_no, DRAFT_SENDER, os.path.splitext(item['filename'])[0],
+                     format_date(item.get('received_date') or date.today()), DRAFT_STATUS,
+                     dump_attachment_list([attachment]), actor_id)
+                    for reference_no, item, attachment in zip(references, files, saved)
+                ]
+                conn.executemany('''
+                INSERT INTO incoming_mail
+                (reference_no, sender_name, subject, received_date, status, attachments, recorded_by)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                ids = [row[0] for row in conn.execute(
+                    f"SELECT id FROM incoming_mail WHERE reference_no IN ({','.join('?' * len(references))}) "
+                    "ORDER BY id", references)]
+                conn.commit()
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                raise DuplicateReferenceError("تعارض في أرقام المرجع، أعد المحاولة")
+            except Exception:
+                conn.rollback()
+                raise
+
+            # بصمات كشف التكرار: نفس الملف الممسوح مرتين يُكتشف ببصمة المرفق
+            try:
+                for mail_id, row, item in zip(ids, rows, files):
+                    duplicates.index_mail(mail_id, None, row[2], row[3],
+                                          [duplicates.content_hash(item['data'])], conn=conn)
+            except Exception as e:
+                print(f"⚠️ خطأ في تحديث بصمة التكرار: {e}")
+    except Exception:
+        # لا نترك مرفقات يتيمة إذا فشل الإدراج
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+
+    metrics.MAIL_REGISTERED.inc(len(files), mail_type="incoming")
+    log_activity(actor_id, "استقبال ملفات الماسح",
+                 f"{len(files)} مسودة: {references[0]} إلى {references[-1]}")
+    return [
+        {'id': mail_id, 'reference_no': reference_no, 'filename': item['filename'], 'attachment': attachment}
+        for mail_id, reference_no, item, attachment in zip(ids, references, files, saved)
+    ]
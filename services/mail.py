@@ -0,0 +1,708 @@
+# services/mail.py - البريد الوارد والصادر
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import metrics
+from database import AWAITING_REPLY, log_activity
+from services.attachments import dump_attachment_list, get_attachment_list
+from services.base import (ConcurrentEditError, DuplicateReferenceError, NotFoundError, ServiceError, connection,
+                           current_db_path, format_date, read_connection, read_sql, to_int)
+from services.bordereau import TemplateMissingError, render_bordereau, save_bordereau
+from services.contacts import get_contact_by_id
+from services.frames import typed_mail_frame
+from services.fulltext import match_expression
+from services import duplicates
+
+PRIORITIES = ["عادي", "مهم", "عاجل"]
+CATEGORIES = ["إداري", "مالي", "فني", "قانوني", "أخرى"]
+INCOMING_STATUSES = ["جديد", "قيد المعالجة", "مكتمل", "ملغي", "مسودة"]
+OUTGOING_STATUSES = ["مسودة", "مرسل", "مؤرشف"]
+CLOSED_STATUSES = ('مكتمل', 'ملغي')
+# بريد وارد أنشأه استقبال ملفات الماسح وينتظر أن يستكمل الموظف بياناته
+DRAFT_STATUS = "مسودة"
+DRAFT_SENDER = "غير محدد"
+
+MAIL_TABLES = {
+    'incoming': 'incoming_mail',
+    'outgoing': 'outgoing_mail'
+}
+
+REF_PREFIXES = {
+    'incoming': 'و',
+    'outgoing': 'ص'
+}
+
+# الأعمدة التي تعرضها بطاقات القوائم (بدون content و notes و attachments الثقيلة)
+LIST_COLUMNS = {
+    'incoming': "id, reference_no, sender_name, subject, received_date, due_date, priority, status",
+    'outgoing': "id, reference_no, recipient_name, subject, sent_date, priority, status"
+}
+
+# ختم التعديل بدقة الملي ثانية (updated_at جزء من مفتاح ذاكرة التفاصيل) ورقم الإصدار الذي
+# تشترطه نماذج التعديل: كل كتابة على البريد تمر بهذا الختم
+TOUCH_UPDATED_AT = "updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now'), version = version + 1"
+
+# الحقول التي تكتبها نماذج التعديل (وتُدمج عند التعديل المتزامن)
+EDIT_FIELDS = {
+    'incoming': ['reference_no', 'sender_id', 'sender_name', 'subject', 'content', 'received_date', 'priority',
+                 'status', 'category', 'due_date', 'attachments', 'notes', 'reply_required'],
+    'outgoing': ['reference_no', 'recipient_id', 'recipient_name', 'subject', 'content', 'priority', 'status',
+                 'sent_date', 'category', 'attachments', 'bordereau', 'notes']
+}
+# محاولات إعادة الكتابة المشروطة بعد دمج تلقائي قبل اعتبار التعديل متعارضاً
+EDIT_RETRIES = 3
+DETAIL_CACHE_SIZE = 512
+
+# شروط التصفية في صفحات القوائم: (شرط WHERE، ترتيب)
+INCOMING_FILTERS = {
+    "الكل": ("1 = 1", "received_date DESC"),
+    "جديد": ("status = 'جديد'", "received_date DESC"),
+    "قيد المعالجة": ("status = 'قيد المعالجة'", "received_date DESC"),
+    "مكتمل": ("status = 'مكتمل'", "received_date DESC"),
+    "مهم": ("priority = 'مهم'", "received_date DESC"),
+    "عاجل": ("priority = 'عاجل'", "received_date DESC"),
+    "مسودة": ("status = 'مسودة'", "received_date DESC"),
+    "بانتظار الرد": (AWAITING_REPLY, "received_date DESC"),
+    "قريب من الاستحقاق": ("due_date IS NOT NULL AND due_date BETWEEN :today AND :next_week "
+                           "AND status NOT IN ('مكتمل', 'ملغي')", "due_date")
+}
+
+OUTGOING_FILTERS = {
+    "الكل": ("1 = 1", "sent_date DESC"),
+    "مسودة": ("status = 'مسودة'", "sent_date DESC"),
+    "مرسل": ("status = 'مرسل'", "sent_date DESC"),
+    "مؤرشف": ("status = 'مؤرشف'", "sent_date DESC"),
+    "عاجل": ("priority = 'عاجل'", "sent_date DESC")
+}
+
+
+def table_for(mail_type):
+    """اسم جدول البريد حسب النوع"""
+    return MAIL_TABLES["outgoing" if mail_type == "outgoing" else "incoming"]
+
+
+def generate_ref_no(mail_type="incoming", conn=None):
+    """توليد رقم مرجعي بالتنسيق: البادئة-الرقم-الشهر-السنة"""
+    current_month = datetime.now().strftime('%m')
+    current_year = datetime.now().strftime('%Y')
+    prefix = REF_PREFIXES["outgoing" if mail_type == "outgoing" else "incoming"]
+
+    with connection(conn) as conn:
+        try:
+            cursor = conn.execute(f'''
+            SELECT MAX(CAST(SUBSTR(reference_no, 3, 4) AS INTEGER))
+            FROM {table_for(mail_type)}
+            WHERE reference_no LIKE ?
+            ''', (f"{prefix}-____-{current_month}-{current_year}",))
+            count = cursor.fetchone()[0] or 0
+        except sqlite3.Error:
+            count = 0
+
+    return f"{prefix}-{count + 1:04d}-{current_month}-{current_year}"
+
+
+# --- تفاصيل البريد: ذاكرة LRU مفتاحها (المعرف، updated_at) ---
+_detail_cache = OrderedDict()
+_detail_lock = threading.Lock()
+
+
+def _dict_row(cursor, row):
+    """row_factory يُرجع الصف كقاموس مباشرة"""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _remember(key, mail):
+    with _detail_lock:
+        _detail_cache[key] = mail
+        _detail_cache.move_to_end(key)
+        while len(_detail_cache) > DETAIL_CACHE_SIZE:
+            _detail_cache.popitem(last=False)
+
+
+def clear_detail_cache():
+    """إفراغ ذاكرة التفاصيل (لقياس القراءة من قاعدة البيانات)"""
+    with _detail_lock:
+        _detail_cache.clear()
+
+
+def _forget(mail_type, mail_id):
+    """حذف نسخ بريد من ذاكرة التفاصيل بعد تعديله أو حذفه في هذه العملية"""
+    _forget_many(mail_type, [mail_id])
+
+
+def _forget_many(mail_type, mail_ids):
+    """حذف نسخ مجموعة بريد من ذاكرة التفاصيل في مرور واحد عليها"""
+    db_path, mail_type = current_db_path(), "outgoing" if mail_type == "outgoing" else "incoming"
+    ids = {to_int(mail_id) for mail_id in mail_ids}
+    with _detail_lock:
+        for key in [key for key in _detail_cache if key[0] == db_path and key[1] == mail_type and key[2] in ids]:
+            del _detail_cache[key]
+
+
+def get_mail(mail_id, mail_type="incoming", conn=None, neighbors=0):
+    """
+    جلب معلومات البريد حسب ID كقاموس أو None
+
+    يُقرأ updated_at أولاً (بحث بالمفتاح الأساسي)، ويُجلب الصف كاملاً فقط إذا لم
+    تكن نسخته الحالية في الذاكرة. بدون اتصال ممرر تُستعمل read_connection فلا تفتح
+    الإصابة اتصالاً جديداً. مع neighbors > 0 تُجلب معه السجلات المجاورة
+    (id ± neighbors) في نفس الاستعلام لتسريع التنقل بينها.
+    """
+    mail_id = to_int(mail_id)
+    mail_type = "outgoing" if mail_type == "outgoing" else "incoming"
+    table = table_for(mail_type)
+    db_path = current_db_path()
+
+    conn = conn or read_connection()
+    row = conn.execute(f"SELECT updated_at FROM {table} WHERE id = ?", (mail_id,)).fetchone()
+    if row is None:
+        return None
+
+    key = (db_path, mail_type, mail_id, row[0])
+    with _detail_lock:
+        mail = _detail_cache.get(key)
+        if mail is not None:
+            _detail_cache.move_to_end(key)
+            return dict(mail)
+
+    cursor = conn.cursor()
+    cursor.row_factory = _dict_row
+    cursor.execute(f"SELECT * FROM {table} WHERE id BETWEEN ? AND ?",
+                   (mail_id - neighbors, mail_id + neighbors))
+    rows = cursor.fetchall()
+
+    mail = None
+    for item in rows:
+        _remember((db_path, mail_type, item['id'], item['updated_at']), item)
+        if item['id'] == mail_id:
+            mail = item
+    return dict(mail) if mail is not None else None
+
+
+def get_mail_by_reference(reference_no, mail_type="incoming", conn=None):
+    """جلب البريد حسب رقم المرجع كقاموس أو None"""
+    with connection(conn) as conn:
+        cursor = conn.execute(f"SELECT * FROM {table_for(mail_type)} WHERE reference_no = ?", (reference_no,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+def search_mail(mail_type="incoming", text=None, status=None, priority=None,
+                date_from=None, date_to=None, limit=100, offset=0, batch_size=500, conn=None):
+    """
+    بحث في البريد مع إرجاع النتائج تدريجياً (مولد قواميس)
+
+    يبحث النص في رقم المرجع والموضوع واسم المرسل/المستلم، وفي فهرس النص الكامل
+    (المحتوى ونصوص المرفقات المستخرجة مسبقاً)، وتُقرأ النتائج على دفعات (fetchmany)
+    بدل تحميل القائمة كاملة في الذاكرة.
+    """
+    party, date_column = (("recipient_name", "sent_date") if mail_type == "outgoing"
+                          else ("sender_name", "received_date"))
+    conditions, params = [], []
+    if text:
+        expression = match_expression(text)
+        if expression:
+            conditions.append(f"""(reference_no LIKE ? OR subject LIKE ? OR {party} LIKE ?
+                OR id IN (SELECT mail_id FROM mail_search WHERE mail_search MATCH ? AND mail_type = ?))""")
+            params += [f"%{text}%"] * 3 + [expression, mail_type]
+        else:
+            conditions.append(f"(reference_no LIKE ? OR subject LIKE ? OR {party} LIKE ?)")
+            params += [f"%{text}%"] * 3
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if priority:
+        conditions.append("priority = ?")
+        params.append(priority)
+    if date_from:
+        conditions.append(f"{date_column} >= ?")
+        params.append(format_date(date_from))
+    if date_to:
+        conditions.append(f"{date_column} <= ?")
+        params.append(format_date(date_to))
+
+    where = " AND ".join(conditions) or "1 = 1"
+    params += [int(limit), int(offset)]
+
+    with connection(conn) as conn:
+        cursor = conn.execute(f'''
+        SELECT * FROM {table_for(mail_type)} WHERE {where}
+        ORDER BY {date_column} DESC, id DESC LIMIT ? OFFSET ?
+        ''', params)
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
+
+
+def _filter_params():
+    today = date.today()
+    return {
+        'today': today.strftime('%Y-%m-%d'),
+        'next_week': (today + timedelta(days=7)).strftime('%Y-%m-%d')
+    }
+
+
+def _typed_incoming(df):
+    return typed_mail_frame(df, INCOMING_STATUSES)
+
+
+def _typed_outgoing(df):
+    return typed_mail_frame(df, OUTGOING_STATUSES)
+
+
+def list_incoming(filter_name="الكل", conn=None):
+    """قائمة البريد الوارد حسب التصفية"""
+    where, order = INCOMING_FILTERS.get(filter_name, INCOMING_FILTERS["الكل"])
+    return read_sql(f"SELECT {LIST_COLUMNS['incoming']} FROM incoming_mail WHERE {where} ORDER BY {order}",
+                    conn, params=_filter_params() if ':' in where else None, transform=_typed_incoming)
+
+
+def list_outgoing(filter_name="الكل", conn=None):
+    """قائمة البريد الصادر حسب التصفية"""
+    where, order = OUTGOING_FILTERS.get(filter_name, OUTGOING_FILTERS["الكل"])
+    return read_sql(f"SELECT {LIST_COLUMNS['outgoing']} FROM outgoing_mail WHERE {where} ORDER BY {order}",
+                    conn, transform=_typed_outgoing)
+
+
+def list_outgoing_for_bordereau(conn=None):
+    """البريد الصادر المتاح لإنشاء بوردرية"""
+    return read_sql("""
+        SELECT id, reference_no, recipient_name, subject, sent_date, status
+        FROM outgoing_mail
+        WHERE status IN ('مسودة', 'مرسل')
+        ORDER BY sent_date DESC
+    """, conn)
+
+
+def due_date_reminders(days=3, conn=None):
+    """البريد الوارد غير المكتمل الذي يحل تاريخ استحقاقه خلال الأيام القادمة"""
+    today = date.today()
+    return read_sql("""
+    SELECT reference_no, subject, due_date, sender_name
+    FROM incoming_mail
+    WHERE due_date IS NOT NULL
+    AND due_date BETWEEN ? AND ?
+    AND status NOT IN ('مكتمل', 'ملغي')
+    ORDER BY due_date
+    """, conn, params=(today.strftime('%Y-%m-%d'), (today + timedelta(days=days)).strftime('%Y-%m-%d')),
+        transform=_typed_incoming)
+
+
+def _index_signature(mail_id, mail, conn):
+    """تحديث بصمة كشف التكرار (فشلها لا يلغي التسجيل: index_missing يستدركها)"""
+    try:
+        duplicates.index_mail(mail_id, mail['sender_name'], mail['subject'], mail['received_date'],
+                              duplicates.attachment_hashes(mail.get('attachments')), conn=conn)
+    except Exception as e:
+        print(f"⚠️ خطأ في تحديث بصمة التكرار: {e}")
+
+
+def register_incoming(mail, actor_id=None, conn=None):
+    """
+    تسجيل بريد وارد جديد
+
+    Args:
+        mail (dict): reference_no, sender_id, sender_name, subject, content, received_date,
+                     priority, category, due_date, attachments (قائمة)، notes، status (اختياري)،
+                     reply_required (اختياري)، reply_to_id (اختياري: البريد الصادر الذي يرد عليه)
+        actor_id (int): المستخدم المسجل
+
+    Returns:
+        int: معرف البريد الجديد
+    """
+    with connection(conn) as conn:
+        try:
+            cursor = conn.execute('''
+            INSERT INTO incoming_mail
+            (reference_no, sender_id, sender_name, subject, content, received_date,
+             priority, status, category, due_date, attachments, notes, recorded_by,
+             reply_required, reply_to_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                mail['reference_no'],
+                to_int(mail.get('sender_id')),  # يمكن أن يكون NULL إذا كان مرسل جديد
+                mail['sender_name'],
+                mail['subject'],
+                mail.get('content'),
+                format_date(mail['received_date']),
+                mail.get('priority', 'عادي'),
+                mail.get('status', 'جديد'),
+                mail.get('category'),
+                format_date(mail.get('due_date')),
+                dump_attachment_list(mail.get('attachments')),
+                mail.get('notes'),
+                actor_id,
+                1 if mail.get('reply_required') else 0,
+                to_int(mail.get('reply_to_id'))
+            ))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            raise DuplicateReferenceError(f"رقم المرجع '{mail['reference_no']}' موجود مسبقاً!")
+        mail_id = cursor.lastrowid
+        _index_signature(mail_id, mail, conn)
+
+    metrics.MAIL_REGISTERED.inc(mail_type="incoming")
+    log_activity(actor_id, "تسجيل بريد وارد",
+                 f"رقم المرجع: {mail['reference_no']} - المرسل: {mail['sender_name']}")
+    return mail_id
+
+
+def edit_values(mail_type, mail):
+    """قيم حقول التعديل بالشكل المخزن في قاعدة البيانات (للكتابة والمقارنة بين النسخ)"""
+    values = {}
+    for field in EDIT_FIELDS[mail_type]:
+        value = mail.get(field)
+        if field in ('sender_id', 'recipient_id'):
+            value = to_int(value)
+        elif field in ('received_date', 'due_date', 'sent_date'):
+            value = format_date(value)
+        elif field == 'attachments':
+            value = dump_attachment_list(get_attachment_list(value))
+        elif field == 'reply_required':
+            value = None if value is None else int(bool(value))
+        values[field] = value
+    return values
+
+
+def _same(a, b):
+    """تساوي قيمتين مخزنتين (النص الفارغ و NULL سواء)"""
+    return (None if a == '' else a) == (None if b == '' else b)
+
+
+def merge_edit(mail_type, base, mine, current):
+    """
+    دمج ثلاثي لحقول التعديل بين النسخة التي فُتح عليها النموذج وتعديل المستخدم والنسخة المحفوظة الآن
+
+    الحقل الذي لم يغيره المستخدم يأخذ القيمة المحفوظة، والحقل الذي لم يتغير منذ فتح النموذج يأخذ
+    قيمة المستخدم، والمرفقات المضافة من الطرفين تُجمع.
+
+    Returns:
+        tuple: (القيم المدمجة، أسماء الحقول التي غيرها الطرفان إلى قيمتين مختلفتين)
+    """
+    base, mine, current = (edit_values(mail_type, mail) for mail in (base, mine, current))
+    merged, conflicts = {}, []
+    for field in EDIT_FIELDS[mail_type]:
+        old, new, saved = base[field], mine[field], current[field]
+        if new is None and field == 'reply_required':
+            new = old
+        if _same(new, old) or _same(new, saved):
+            merged[field] = saved
+        elif _same(saved, old):
+            merged[field] = new
+        elif field == 'attachments':
+            attachments = get_attachment_list(saved)
+            merged[field] = dump_attachment_list(
+                attachments + [name for name in get_attachment_list(new) if name not in attachments])
+        else:
+            merged[field] = new
+            conflicts.append(field)
+    return merged, conflicts
+
+
+def _save_edit(mail_type, mail_id, mail, previous, conn):
+    """
+    كتابة حقول التعديل بشرط أن يكون البريد في الإصدار الذي فُتح عليه النموذج (previous)
+
+    عند تغير الإصدار تُدمج التعديلات مع النسخة المحفوظة وتُعاد الكتابة المشروطة، ويُرفع
+    ConcurrentEditError إذا غيّر الطرفان نفس الحقل. بدون previous تكون الكتابة غير مشروطة.
+
+    Returns:
+        dict: القيم المكتوبة
+    """
+    table = table_for(mail_type)
+    values = edit_values(mail_type, mail)
+    version = (previous or {}).get('version')
+    columns = ", ".join(
+        "reply_required = COALESCE(?, reply_required)" if field == 'reply_required' else f"{field} = ?"
+        for field in EDIT_FIELDS[mail_type])
+
+    for _ in range(EDIT_RETRIES):
+        condition, params = "id = ?", [values[field] for field in EDIT_FIELDS[mail_type]] + [to_int(mail_id)]
+        if version is not None:
+            condition += " AND version = ?"
+            params.append(to_int(version))
+        try:
+            updated = conn.execute(f"UPDATE {table} SET {columns}, {TOUCH_UPDATED_AT} WHERE {condition}",
+                                   params).rowcount
+        except sqlite3.IntegrityError:
+            raise DuplicateReferenceError(f"رقم المرجع '{values['reference_no']}' موجود مسبقاً لبريد آخر!")
+        if updated or version is None:
+            conn.commit()
+            return values
+
+        cursor = conn.cursor()
+        cursor.row_factory = _dict_row
+        current = cursor.execute(f"SELECT * FROM {table} WHERE id = ?", (to_int(mail_id),)).fetchone()
+        if current is None:
+            raise NotFoundError(f"البريد رقم {mail_id} غير موجود")
+        values, conflicts = merge_edit(mail_type, previous, mail, current)
+        if conflicts:
+            raise ConcurrentEditError("عدّل مستخدم آخر هذا البريد منذ فتح النموذج", current, values, conflicts)
+        previous, version = current, current['version']
+    raise ServiceError("البريد يُعدل باستمرار من مستخدمين آخرين، أعد المحاولة")
+
+
+def update_incoming(mail_id, mail, previous=None, actor_id=None, conn=None):
+    """
+    تحديث بريد وارد
+
+    Args:
+        previous (dict): البريد كما فُتح عليه نموذج التعديل (الكتابة مشروطة بإصداره)
+    """
+    with connection(conn) as conn:
+        values = _save_edit("incoming", mail_id, mail, previous, conn)
+        _index_signature(mail_id, values, conn)
+    _forget("incoming", mail_id)
+
+    log_activity(actor_id, "تعديل بريد وارد", f"رقم المرجع: {values['reference_no']}")
+
+
+def _bordereau_for(mail):
+    """إنشاء البوردرية وحفظها لبريد صادر مرسل، وإرجاع (اسم الملف، رسالة الخطأ)"""
+    recipient_id = to_int(mail.get('recipient_id'))
+    if not recipient_id:
+        return None, None
+
+    context = {
+        'reference_no': mail['reference_no'],
+        'sent_date': format_date(mail.get('sent_date')),
+        'recipient_name': mail['recipient_name'],
+        'subject': mail['subject'],
+        'notes': mail.get('notes')
+    }
+    try:
+        buffer = render_bordereau(context, get_contact_by_id(recipient_id))
+        return save_bordereau(mail['reference_no'], buffer), None
+    except TemplateMissingError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"خطأ في إنشاء البوردرية: {str(e)}"
+
+
+def create_outgoing(mail, actor_id=None, conn=None):
+    """
+    إنشاء بريد صادر (مع إنشاء البوردرية تلقائياً إذا كانت الحالة "مرسل")
+
+    mail['reply_to_id'] (اختياري) البريد الوارد الذي يرد عليه: يدخل الرد سلسلته ويُحسب
+    الوارد مجاباً (مشغلات thread_triggers في database.py).
+
+    Returns:
+        dict: id، bordereau (اسم الملف أو None)، bordereau_error
+    """
+    bordereau, bordereau_error = None, None
+    if mail.get('status') == "مرسل":
+        bordereau, bordereau_error = _bordereau_for(mail)
+
+    with connection(conn) as conn:
+        try:
+            cursor = conn.execute('''
+            INSERT INTO outgoing_mail
+            (reference_no, recipient_id, recipient_name, subject, content, priority,
+             status, sent_date, sent_by, category, attachments, bordereau, notes, reply_to_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                mail['reference_no'],
+                to_int(mail.get('recipient_id')),
+                mail['recipient_name'],
+                mail['subject'],
+                mail.get('content'),
+                mail.get('priority', 'عادي'),
+                mail.get('status', 'مسودة'),
+                format_date(mail.get('sent_date')),
+                actor_id,
+                mail.get('category'),
+                dump_attachment_list(mail.get('attachments')),
+                bordereau,
+                mail.get('notes'),
+                to_int(mail.get('reply_to_id'))
+            ))
+            conn.commit()
+        except sqlite3.IntegrityError:
+            raise DuplicateReferenceError(f"رقم المرجع '{mail['reference_no']}' موجود مسبقاً!")
+        mail_id = cursor.lastrowid
+
+    metrics.MAIL_REGISTERED.inc(mail_type="outgoing")
+    action = "إرسال بريد صادر" if mail.get('status') == "مرسل" else "حفظ مسودة بريد صادر"
+    log_activity(actor_id, action, f"رقم المرجع: {mail['reference_no']}")
+    return {'id': mail_id, 'bordereau': bordereau, 'bordereau_error': bordereau_error}
+
+
+def update_outgoing(mail_id, mail, previous=None, actor_id=None, conn=None):
+    """
+    تحديث بريد صادر (مع إنشاء بوردرية جديدة عند تغيير الحالة إلى "مرسل")
+
+    Args:
+        previous (dict): البريد كما فُتح عليه نموذج التعديل (للاحتفاظ بالبوردرية الحالية، والكتابة
+                         مشروطة بإصداره)
+
+    Returns:
+        dict: bordereau (اسم الملف)، bordereau_created، bordereau_error
+    """
+    previous = previous or {}
+    bordereau = previous.get('bordereau')
+    created, bordereau_error = False, None
+    if mail.get('status') == "مرسل" and previous.get('status') != "مرسل":
+        new_bordereau, bordereau_error = _bordereau_for(mail)
+        if new_bordereau:
+            bordereau, created = new_bordereau, True
+    if not created and 'bordereau' in mail:
+        # قيم مدمجة بعد تعارض: البوردرية المختارة فيها
+        bordereau = mail['bordereau']
+
+    with connection(conn) as conn:
+        values = _save_edit("outgoing", mail_id, {**mail, 'bordereau': bordereau}, previous, conn)
+    _forget("outgoing", mail_id)
+
+    log_activity(actor_id, "تعديل بريد صادر", f"رقم المرجع: {values['reference_no']}")
+    return {'bordereau': values['bordereau'], 'bordereau_created': created, 'bordereau_error': bordereau_error}
+
+
+def update_status(mail_id, status, mail_type="incoming", actor_id=None, conn=None):
+    """
+    تغيير حالة بريد وارد أو صادر (مع إنشاء البوردرية عند إرسال بريد صادر)
+
+    Returns:
+        dict: bordereau، bordereau_created، bordereau_error
+    """
+    statuses = OUTGOING_STATUSES if mail_type == "outgoing" else INCOMING_STATUSES
+    if status not in statuses:
+        raise ServiceError(f"حالة غير صالحة: {status}")
+
+    with connection(conn) as conn:
+        mail = get_mail(mail_id, mail_type, conn)
+        if mail is None:
+            raise NotFoundError(f"البريد رقم {mail_id} غير موجود")
+
+        bordereau = mail.get('bordereau')
+        created, bordereau_error = False, None
+        if mail_type == "outgoing" and status == "مرسل" and mail['status'] != "مرسل":
+            new_bordereau, bordereau_error = _bordereau_for(mail)
+            if new_bordereau:
+                bordereau, created = new_bordereau, True
+
+        if mail_type == "outgoing":
+            conn.execute(f'''
+            UPDATE outgoing_mail SET status = ?, bordereau = ?, {TOUCH_UPDATED_AT}
+            WHERE id = ?
+            ''', (status, bordereau, mail['id']))
+        else:
+            conn.execute(f'''
+            UPDATE incoming_mail SET status = ?, {TOUCH_UPDATED_AT}
+            WHERE id = ?
+            ''', (status, mail['id']))
+        conn.commit()
+    _forget(mail_type, mail_id)
+
+    log_activity(actor_id, "تغيير حالة البريد", f"رقم المرجع: {mail['reference_no']} - الحالة: {status}")
+    return {'bordereau': bordereau, 'bordereau_created': created, 'bordereau_error': bordereau_error}
+
+
+def set_bordereau(mail_id, filename, reference_no=None, actor_id=None, conn=None):
+    """ربط ملف بوردرية ببريد صادر"""
+    with connection(conn) as conn:
+        conn.execute(f"UPDATE outgoing_mail SET bordereau = ?, {TOUCH_UPDATED_AT} WHERE id = ?",
+                     (filename, to_int(mail_id)))
+        conn.commit()
+    _forget("outgoing", mail_id)
+
+    log_activity(actor_id, "إضافة بوردرية", f"للبريد الصادر: {reference_no}")
+
+
+def delete_mail(mail_id, mail_type="incoming", reference_no=None, actor_id=None, conn=None):
+    """حذف بريد وارد أو صادر"""
+    with connection(conn) as conn:
+        conn.execute(f"DELETE FROM {table_for(mail_type)} WHERE id = ?", (to_int(mail_id),))
+        conn.execute("DELETE FROM actions WHERE mail_id = ? AND mail_type = ?",
+                     (to_int(mail_id), "outgoing" if mail_type == "outgoing" else "incoming"))
+        conn.commit()
+        if mail_type != "outgoing":
+            duplicates.forget_mail(mail_id, conn)
+    _forget(mail_type, mail_id)
+
+    action = "حذف بريد وارد" if mail_type == "incoming" else "حذف بريد صادر"
+    log_activity(actor_id, action, f"{reference_no or mail_id}")
+
+
+# --- العمليات الجماعية ---
+def stage_ids(mail_ids, conn):
+    """
+    نسخ المعرفات إلى الجدول المؤقت bulk_ids لهذا الاتصال وإرجاعها مرتبة
+
+    تستعمل العملية الجماعية بعدها استعلاماً واحداً: WHERE id IN (SELECT id FROM bulk_ids).
+    لا تُمرر المعرفات كمعامل واحد كبير لأن متتبع الاستعلامات يوسع نص العبارة بمعاملاتها
+    مع كل برنامج مشغل تطلقه (مرة لكل صف معدل).
+    """
+    ids = sorted({to_int(mail_id) for mail_id in mail_ids} - {None})
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_ids (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM bulk_ids")
+    conn.executemany("INSERT INTO bulk_ids (id) VALUES (?)", [(mail_id,) for mail_id in ids])
+    return ids
+
+
+def bulk_update_status(mail_ids, status, mail_type="incoming", actor_id=None, conn=None):
+    """
+    تغيير حالة مجموعة بريد في استعلام UPDATE واحد وتسجيل نشاط واحد
+
+    لا تُنشأ البوردريات عند إرسال بريد صادر جماعياً: تُنشأ من صفحة إنشاء بوردرية.
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    statuses = OUTGOING_STATUSES if mail_type == "outgoing" else INCOMING_STATUSES
+    if status not in statuses:
+        return False, f"حالة غير صالحة: {status}"
+
+    with connection(conn) as conn:
+        ids = stage_ids(mail_ids, conn)
+        if not ids:
+            return False, "لم يتم تحديد أي بريد"
+        updated = conn.execute(f'''
+        UPDATE {table_for(mail_type)} SET status = ?, {TOUCH_UPDATED_AT}
+        WHERE id IN (SELECT id FROM bulk_ids) AND status != ?
+        ''', (status, status)).rowcount
+        conn.commit()
+    _forget_many(mail_type, ids)
+
+    label = "الصادر" if mail_type == "outgoing" else "الوارد"
+    log_activity(actor_id, "تغيير حالة البريد جماعياً", f"{updated} بريد {label} - الحالة: {status}")
+    return True, f"تم تغيير حالة {updated} بريد إلى {status}" + (
+        f" ({len(ids) - updated} في هذه الحالة مسبقاً)" if updated < len(ids) else "")
+
+
+def bulk_delete(mail_ids, mail_type="incoming", actor_id=None, conn=None):
+    """
+    حذف مجموعة بريد في معاملة واحدة وتسجيل نشاط واحد
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    with connection(conn) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ids = stage_ids(mail_ids, conn)
+            if not ids:
+                conn.rollback()
+                return False, "لم يتم تحديد أي بريد"
+            deleted = conn.execute(f"DELETE FROM {table_for(mail_type)} WHERE id IN (SELECT id FROM bulk_ids)").rowcount
+            # إجراءات المتابعة لا تُحذف بالتتابع (foreign_keys غير مفعلة)
+            conn.execute("DELETE FROM actions WHERE mail_type = ? AND mail_id IN (SELECT id FROM bulk_ids)",
+                         ("outgoing" if mail_type == "outgoing" else "incoming",))
+            if mail_type != "outgoing":
+                duplicates.forget_mails(ids, conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _forget_many(mail_type, ids)
+
+    action = "حذف بريد صادر جماعياً" if mail_type == "outgoing" else "حذف بريد وارد جماعياً"
+    log_activity(actor_id, action, f"{deleted} بريد")
+    return True, f"تم حذف {deleted} بريد"
@@ -0,0 +1,124 @@
+# services/sla.py - تقارير آجال معالجة البريد
+"""
+تقرأ المجاميع التي تحدّثها مشغلات database.status_triggers مع كل انتقال حالة
+(status_durations و handling_times) ولا تقرأ سجل الحالات نفسه، فزمن التقرير يتبع
+عدد (التصنيف، الأولوية، الشهر، الشريحة) لا عدد الانتقالات.
+
+الوسيط و p90 تقريبيان: يُحسبان بالاستيفاء الخطي داخل شريحة المدة.
+"""
+from datetime import date
+
+import pandas as pd
+
+from database import DURATION_BUCKETS_HOURS
+from services.base import query_one, read_sql
+
+GROUP_COLUMNS = {
+    'category': 'التصنيف',
+    'priority': 'الأولوية',
+    'month': 'الشهر'
+}
+
+
+def _since(months):
+    """أول شهر (YYYY-MM) في فترة التقرير"""
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def bucket_quantile(counts, q):
+    """
+    قيمة الترتيب q (بالساعات) من توزيع الشرائح
+
+    Args:
+        counts (dict): رقم الشريحة -> العدد
+    """
+    total = sum(counts.values())
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for bucket in sorted(counts):
+        count = counts[bucket]
+        if count and seen + count >= target:
+            lower = DURATION_BUCKETS_HOURS[bucket - 1] if bucket > 0 else 0
+            # الشريحة الأخيرة مفتوحة: نكتفي بحدها الأدنى
+            upper = DURATION_BUCKETS_HOURS[bucket] if bucket < len(DURATION_BUCKETS_HOURS) else lower
+            return round(lower + (upper - lower) * (target - seen) / count, 1)
+        seen += count
+    return None
+
+
+def _summarize(df, keys, count_column):
+    """صف لكل مجموعة: العدد والمتوسط والوسيط و p90 بالساعات"""
+    rows = []
+    for group, part in (df.groupby(keys, sort=True) if keys else [((), df)]):
+        counts = part.groupby('bucket')[count_column].sum().to_dict()
+        total = int(part[count_column].sum())
+        row = dict(zip(keys, group if isinstance(group, tuple) else (group,)))
+        row.update({
+            'count': total,
+            'mean_hours': round(part['total_seconds'].sum() / 3600 / total, 1) if total else None,
+            'median_hours': bucket_quantile(counts, 0.5),
+            'p90_hours': bucket_quantile(counts, 0.9)
+        })
+        if 'overdue' in part:
+            row['overdue_rate'] = round(100 * part['overdue'].sum() / total, 1) if total else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def handling_report(months=12, group_by='category', conn=None):
+    """
+    مدة معالجة البريد الوارد (من التسجيل إلى الاكتمال) ونسبة المكتمل بعد تاريخ الاستحقاق
+
+    Args:
+        group_by (str): category أو priority أو month أو None للمجموع
+
+    Returns:
+        DataFrame: المجموعة، العدد، المتوسط، الوسيط، p90 (ساعات)، نسبة التأخر (%)
+    """
+    df = read_sql('''
+    SELECT category, priority, month, bucket, completed, overdue, total_seconds
+    FROM handling_times WHERE month >= ?
+    ''', conn, params=(_since(months),))
+    if df.empty:
+        return pd.DataFrame()
+    keys = [group_by] if group_by else []
+    return _summarize(df, keys, 'completed').rename(columns={
+        **GROUP_COLUMNS,
+        'count': 'المكتمل',
+        'mean_hours': 'المتوسط (ساعة)',
+        'median_hours': 'الوسيط (ساعة)',
+        'p90_hours': 'p90 (ساعة)',
+        'overdue_rate': 'نسبة التأخر %'
+    })
+
+
+def status_time_report(months=12, mail_type="incoming", conn=None):
+    """المدة التي يقضيها البريد في كل حالة قبل مغادرتها"""
+    df = read_sql('''
+    SELECT status, bucket, SUM(transitions) AS transitions, SUM(total_seconds) AS total_seconds
+    FROM status_durations WHERE mail_type = ? AND month >= ?
+    GROUP BY status, bucket
+    ''', conn, params=(mail_type, _since(months)))
+    if df.empty:
+        return pd.DataFrame()
+    return _summarize(df, ['status'], 'transitions').rename(columns={
+        'status': 'الحالة',
+        'count': 'الانتقالات',
+        'mean_hours': 'المتوسط (ساعة)',
+        'median_hours': 'الوسيط (ساعة)',
+        'p90_hours': 'p90 (ساعة)'
+    })
+
+
+def open_overdue(conn=None):
+    """البريد الوارد المفتوح الذي تجاوز تاريخ استحقاقه الآن، وكل المفتوح ذي تاريخ استحقاق"""
+    overdue, with_due_date = query_one('''
+    SELECT COUNT(*) FILTER (WHERE due_date < ?), COUNT(*)
+    FROM incoming_mail
+    WHERE due_date IS NOT NULL AND status NOT IN ('مكتمل', 'ملغي')
+    ''', conn, (date.today().strftime('%Y-%m-%d'),))
+    return {'overdue': overdue, 'with_due_date': with_due_date}
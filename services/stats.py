@@ -0,0 +1,116 @@
+# services/stats.py - إحصائيات لوحة القيادة والبريد الوارد
+from datetime import date, timedelta
+
+import pandas as pd
+
+import tenants
+from database import OPEN_ACTIONS
+from services.base import query_one, read_sql
+
+
+def dashboard_counts(conn=None):
+    """عدادات لوحة القيادة في استعلام واحد"""
+    new_mail, pending_mail, total_contacts, total_mail, draft_mail = query_one('''
+    SELECT
+        (SELECT COUNT(*) FROM incoming_mail WHERE status = 'جديد'),
+        (SELECT COUNT(*) FROM incoming_mail WHERE status = 'قيد المعالجة'),
+        (SELECT COUNT(*) FROM contacts),
+        (SELECT COUNT(*) FROM incoming_mail),
+        (SELECT COUNT(*) FROM incoming_mail WHERE status = 'مسودة')
+    ''', conn)
+
+    return {
+        'new_mail': new_mail,
+        'pending_mail': pending_mail,
+        'total_contacts': total_contacts,
+        'total_mail': total_mail,
+        'draft_mail': draft_mail
+    }
+
+
+def due_soon(days=7, conn=None):
+    """البريد الوارد القريب من تاريخ الاستحقاق"""
+    today = date.today()
+    return read_sql('''
+    SELECT reference_no, sender_name, subject, received_date, due_date, status
+    FROM incoming_mail
+    WHERE due_date IS NOT NULL
+    AND due_date BETWEEN ? AND ?
+    AND status NOT IN ('مكتمل', 'ملغي')
+    ORDER BY due_date
+    ''', conn, params=(today.strftime('%Y-%m-%d'), (today + timedelta(days=days)).strftime('%Y-%m-%d')))
+
+
+def recent_incoming(limit=10, conn=None):
+    """آخر البريد الوارد"""
+    return read_sql('''
+    SELECT reference_no, sender_name, subject, received_date, priority, status
+    FROM incoming_mail
+    ORDER BY received_date DESC LIMIT ?
+    ''', conn, params=(limit,))
+
+def incoming_breakdown(months=6, conn=None):
+    """إحصائيات البريد الوارد حسب الحالة والأولوية والتصنيف والشهر"""
+    return {
+        'status': read_sql("""
+            SELECT status as 'الحالة', COUNT(*) as 'العدد'
+            FROM incoming_mail
+            GROUP BY status
+            ORDER BY COUNT(*) DESC
+        """, conn),
+        'priority': read_sql("""
+            SELECT priority as 'الأولوية', COUNT(*) as 'العدد'
+            FROM incoming_mail
+            GROUP BY priority
+            ORDER BY COUNT(*) DESC
+        """, conn),
+        'category': read_sql("""
+            SELECT category as 'التصنيف', COUNT(*) as 'العدد'
+            FROM incoming_mail
+            GROUP BY category
+            ORDER BY COUNT(*) DESC
+        """, conn),
+        'monthly': read_sql("""
+            SELECT strftime('%Y-%m', received_date) as 'الشهر', COUNT(*) as 'عدد الرسائل'
+            FROM incoming_mail
+            GROUP BY strftime('%Y-%m', received_date)
+            ORDER BY strftime('%Y-%m', received_date) DESC
+            LIMIT ?
+        """, conn, params=(months,))
+    }
+
+
+def _institution_counts():
+    """عدادات قاعدة المؤسسة النشطة لتقرير المؤسسات"""
+    return query_one(f'''
+    SELECT
+        (SELECT COUNT(*) FROM incoming_mail),
+        (SELECT COUNT(*) FROM incoming_mail WHERE status = 'جديد'),
+        (SELECT COUNT(*) FROM incoming_mail WHERE status = 'قيد المعالجة'),
+        (SELECT COUNT(*) FROM incoming_mail WHERE due_date < ? AND status NOT IN ('مكتمل', 'ملغي')),
+        (SELECT COUNT(*) FROM outgoing_mail),
+        (SELECT COUNT(*) FROM actions WHERE {OPEN_ACTIONS})
+    ''', params=(date.today().strftime('%Y-%m-%d'),))
+
+
+def institutions_report(codes=None):
+    """
+    عدادات كل المؤسسات (tenants.py) مع سطر المجموع
+
+    تُقرأ القواعد بالتوازي كل واحدة باتصالها؛ المؤسسة التي تفشل قراءتها (قاعدة مقفلة
+    أو مفقودة) تظهر بعمود الخطأ ولا تُحسب في المجموع.
+    """
+    columns = ['الوارد', 'جديد', 'قيد المعالجة', 'متأخر', 'الصادر', 'إجراءات مفتوحة']
+    rows = []
+    for tenant, counts, error in tenants.fan_out(_institution_counts, codes):
+        row = {'المؤسسة': tenant['name'] if tenant else 'المؤسسة الافتراضية'}
+        row.update(zip(columns, counts or [None] * len(columns)))
+        row['الخطأ'] = str(error) if error else None
+        rows.append(row)
+
+    df = pd.DataFrame(rows, columns=['المؤسسة'] + columns + ['الخطأ'])
+    df[columns] = df[columns].astype('Int64')
+    if len(df) > 1:
+        total = {'المؤسسة': 'المجموع', **df[columns].sum().astype(int).to_dict(), 'الخطأ': None}
+        df = pd.concat([df, pd.DataFrame([total])], ignore_index=True)
+    return df
@@ -0,0 +1,124 @@
+# services/threads.py - سلاسل المراسلات بين البريد الوارد والصادر
+"""
+كل بريد يمكن أن يرد على بريد من النوع الآخر (reply_to_id): الصادر على وارد والوارد على
+صادر. معرف السلسلة (thread_id) هو مفتاح أول بريد فيها، وتحافظ عليه مع عدد الردود
+على الوارد مشغلاتُ database.thread_triggers عند كل كتابة، فقائمة البريد الذي ينتظر
+رداً قراءة للفهرس الجزئي idx_incoming_mail_awaiting_reply وحده.
+"""
+from database import AWAITING_REPLY, log_activity
+from services.base import NotFoundError, ServiceError, connection, read_sql, to_int
+from services.mail import LIST_COLUMNS, TOUCH_UPDATED_AT, table_for
+
+# أقصى عدد للبريد الوارد المعروض في اختيار "رد على" عند إنشاء بريد صادر
+REPLY_CHOICES_LIMIT = 200
+
+
+def thread_key(mail_type, mail_id):
+    """مفتاح البريد في السلاسل: id * 2 للوارد و id * 2 + 1 للصادر"""
+    return to_int(mail_id) * 2 + (1 if mail_type == "outgoing" else 0)
+
+
+def other_type(mail_type):
+    """نوع البريد الذي يرد عليه بريد من هذا النوع"""
+    return "incoming" if mail_type == "outgoing" else "outgoing"
+
+
+def awaiting_reply(limit=None, conn=None):
+    """البريد الوارد الذي ينتظر رداً، الأحدث أولاً"""
+    sql = f"SELECT {LIST_COLUMNS['incoming']} FROM incoming_mail WHERE {AWAITING_REPLY} ORDER BY received_date DESC"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return read_sql(sql, conn)
+
+
+def get_thread(mail_id, mail_type="incoming", conn=None):
+    """
+    كل بريد السلسلة التي ينتمي إليها البريد، بترتيب التاريخ
+
+    Returns:
+        DataFrame: mail_type، id، reference_no، party، subject، mail_date، status، reply_to_id
+    """
+    return read_sql(f'''
+    WITH thread AS (SELECT thread_id FROM {table_for(mail_type)} WHERE id = :id)
+    SELECT 'incoming' AS mail_type, id, reference_no, sender_name AS party, subject,
+           received_date AS mail_date, status, reply_to_id
+    FROM incoming_mail WHERE thread_id = (SELECT thread_id FROM thread)
+    UNION ALL
+    SELECT 'outgoing', id, reference_no, recipient_name, subject, sent_date, status, reply_to_id
+    FROM outgoing_mail WHERE thread_id = (SELECT thread_id FROM thread)
+    ORDER BY mail_date, mail_type, id
+    ''', conn, params={'id': to_int(mail_id)})
+
+
+def _subtree(mail_type, mail_id, conn):
+    """البريد نفسه وكل ردوده وردود ردوده (قائمة (النوع، المعرف))"""
+    return conn.execute('''
+    WITH RECURSIVE subtree(mail_type, id) AS (
+        SELECT ?, ?
+        UNION
+        SELECT 'outgoing', o.id FROM outgoing_mail o JOIN subtree s
+            ON s.mail_type = 'incoming' AND o.reply_to_id = s.id
+        UNION
+        SELECT 'incoming', i.id FROM incoming_mail i JOIN subtree s
+            ON s.mail_type = 'outgoing' AND i.reply_to_id = s.id
+    )
+    SELECT mail_type, id FROM subtree
+    ''', (mail_type, mail_id)).fetchall()
+
+
+def set_reply_to(mail_id, mail_type, reply_to_id, actor_id=None, conn=None):
+    """
+    ربط بريد كرد على بريد من النوع الآخر (أو فك الربط مع reply_to_id = None)
+
+    ينقل البريد وكل ردوده إلى سلسلة البريد الأصلي (أو إلى سلسلة جديدة عند فك الربط).
+
+    Returns:
+        tuple: (نجاح، رسالة)
+    """
+    mail_type = "outgoing" if mail_type == "outgoing" else "incoming"
+    mail_id, reply_to_id = to_int(mail_id), to_int(reply_to_id)
+    parent_type = other_type(mail_type)
+
+    with connection(conn) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            mail = conn.execute(f"SELECT reference_no FROM {table_for(mail_type)} WHERE id = ?",
+                                (mail_id,)).fetchone()
+            if mail is None:
+                raise NotFoundError(f"البريد رقم {mail_id} غير موجود")
+
+            subtree = _subtree(mail_type, mail_id, conn)
+            if reply_to_id is None:
+                thread_id, parent_reference = thread_key(mail_type, mail_id), None
+            else:
+                parent = conn.execute(f"SELECT reference_no, thread_id FROM {table_for(parent_type)} WHERE id = ?",
+                                      (reply_to_id,)).fetchone()
+                if parent is None:
+                    raise NotFoundError(f"البريد رقم {reply_to_id} غير موجود")
+                if (parent_type, reply_to_id) in subtree:
+                    raise ServiceError("لا يمكن ربط البريد بأحد ردوده")
+                parent_reference = parent[0]
+                thread_id = parent[1] if parent[1] is not None else thread_key(parent_type, reply_to_id)
+
+            conn.execute(f"UPDATE {table_for(mail_type)} SET reply_to_id = ?, {TOUCH_UPDATED_AT} WHERE id = ?",
+                         (reply_to_id, mail_id))
+            for member_type in ("incoming", "outgoing"):
+                ids = [member_id for kind, member_id in subtree if kind == member_type]
+                if ids:
+                    conn.execute(f'''
+                    UPDATE {table_for(member_type)} SET thread_id = ?, {TOUCH_UPDATED_AT}
+                    WHERE id IN ({",".join("?" * len(ids))})
+                    ''', [thread_id] + ids)
+            conn.commit()
+        except ServiceError as e:
+            conn.rollback()
+            return False, str(e)
+        except Exception:
+            conn.rollback()
+            raise
+
+    if parent_reference is None:
+        log_activity(actor_id, "فك ربط الرد", f"رقم المرجع: {mail[0]}")
+        return True, f"تم فك ربط {mail[0]} من سلسلته"
+    log_activity(actor_id, "ربط رد", f"{mail[0]} رد على {parent_reference}")
+    return True, f"تم ربط {mail[0]} كرد على {parent_reference}"
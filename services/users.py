@@ -0,0 +1,186 @@
+# services/users.py - المستخدمون والمصادقة والصلاحيات
+import secrets
+
+import metrics
+from database import hash_password, log_activity
+from services.base import connection, read_sql
+
+# تعريف صلاحيات كل دور
+PERMISSIONS = {
+    'admin': ['view', 'add', 'edit', 'delete', 'manage_users', 'export'],
+    'user': ['view', 'add', 'edit', 'export'],
+    'viewer': ['view', 'export']
+}
+
+
+def has_permission(role, permission):
+    """التحقق من أن الدور يملك الصلاحية المطلوبة"""
+    return permission in PERMISSIONS.get(role, [])
+
+
+def generate_temp_password(length=8):
+    """توليد كلمة مرور مؤقتة"""
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%&"
+    return ''.join(secrets.choice(alphabet) for _ in range(length))
+
+
+def authenticate(username, password, conn=None):
+    """مصادقة المستخدم وإرجاع بياناته أو None"""
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, username, full_name, role, email, is_active FROM users
+        WHERE username = ? AND password = ? AND is_active = 1
+        ''', (username, hash_password(password)))
+        user = cursor.fetchone()
+
+    if not user:
+        metrics.LOGIN_ATTEMPTS.inc(result="failure")
+        return None
+
+    metrics.LOGIN_ATTEMPTS.inc(result="success")
+    log_activity(user[0], "تسجيل دخول", f"المستخدم {user[2]} سجل دخول")
+    return {
+        'id': user[0],
+        'username': user[1],
+        'full_name': user[2],
+        'role': user[3],
+        'email': user[4],
+        'is_active': user[5]
+    }
+
+
+def get_all_users(conn=None):
+    """جلب جميع المستخدمين مع اسم الدور المعروض"""
+    return read_sql("""
+        SELECT id, username, full_name, role, email,
+               created_at, last_login, is_active,
+               CASE WHEN role = 'admin' THEN 'مشرف'
+                    WHEN role = 'user' THEN 'مستخدم'
+                    WHEN role = 'viewer' THEN 'مستشار'
+                    ELSE role END as role_display
+        FROM users
+        ORDER BY created_at DESC
+    """, conn)
+
+
+def get_active_users(conn=None):
+    """جلب المستخدمين النشطين (للأغراض العامة)"""
+    return read_sql(
+        "SELECT id, username, full_name, role FROM users WHERE is_active = 1 ORDER BY full_name", conn)
+
+
+def create_user(username, full_name, email, role, password=None, actor_id=None, conn=None):
+    """إنشاء مستخدم جديد، وإرجاع (نجاح، كلمة المرور أو رسالة الخطأ)"""
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+            if cursor.fetchone():
+                return False, "اسم المستخدم موجود مسبقاً"
+
+            temp_password = password or generate_temp_password()
+            cursor.execute('''
+            INSERT INTO users (username, password, full_name, email, role, is_active, created_by)
+            VALUES (?, ?, ?, ?, ?, 1, ?)
+            ''', (username, hash_password(temp_password), full_name, email, role, actor_id))
+            conn.commit()
+        except Exception as e:
+            return False, f"خطأ في إنشاء المستخدم: {str(e)}"
+
+    log_activity(actor_id, "إنشاء مستخدم", f"تم إنشاء مستخدم جديد: {username}")
+    return True, temp_password
+
+
+def update_user(user_id, full_name=None, email=None, role=None, is_active=None, actor_id=None, conn=None):
+    """تحديث بيانات المستخدم"""
+    updates = []
+    params = []
+
+    if full_name is not None:
+        updates.append("full_name = ?")
+        params.append(full_name)
+    if email is not None:
+        updates.append("email = ?")
+        params.append(email)
+    if role is not None:
+        updates.append("role = ?")
+        params.append(role)
+    if is_active is not None:
+        updates.append("is_active = ?")
+        params.append(1 if is_active else 0)
+
+    if not updates:
+        return False, "لا توجد تحديثات لإجرائها"
+
+    with connection(conn) as conn:
+        try:
+            params.append(int(user_id))
+            conn.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = ?", params)
+            conn.commit()
+        except Exception as e:
+            return False, f"خطأ في تحديث المستخدم: {str(e)}"
+
+    log_activity(actor_id, "تحديث مستخدم", f"تم تحديث بيانات المستخدم ID: {user_id}")
+    return True, "تم تحديث بيانات المستخدم بنجاح"
+
+
+def reset_user_password(user_id, actor_id=None, conn=None):
+    """إعادة تعيين كلمة مرور المستخدم، وإرجاع (نجاح، كلمة المرور الجديدة أو رسالة الخطأ)"""
+    temp_password = generate_temp_password()
+    with connection(conn) as conn:
+        try:
+            conn.execute("UPDATE users SET password = ? WHERE id = ?",
+                         (hash_password(temp_password), int(user_id)))
+            conn.commit()
+        except Exception as e:
+            return False, f"خطأ في إعادة تعيين كلمة المرور: {str(e)}"
+
+    log_activity(actor_id, "إعادة تعيين كلمة مرور", f"تم إعادة تعيين كلمة مرور المستخدم ID: {user_id}")
+    return True, temp_password
+
+
+def change_password(user_id, old_password, new_password, conn=None):
+    """تغيير كلمة مرور مستخدم بعد التحقق من كلمة المرور القديمة"""
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM users WHERE id = ? AND password = ?",
+                           (user_id, hash_password(old_password)))
+            if not cursor.fetchone():
+                return False, "كلمة المرور القديمة غير صحيحة"
+
+            cursor.execute("UPDATE users SET password = ? WHERE id = ?",
+                           (hash_password(new_password), user_id))
+            conn.commit()
+        except Exception as e:
+            return False, f"خطأ في تغيير كلمة المرور: {str(e)}"
+
+    log_activity(user_id, "تغيير كلمة المرور", "تم تغيير كلمة المرور بنجاح")
+    return True, "تم تغيير كلمة المرور بنجاح"
+
+
+def delete_user(user_id, actor_id=None, conn=None):
+    """حذف مستخدم (مع منع حذف المشرف الوحيد)"""
+    user_id = int(user_id)
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin' AND is_active = 1")
+            admin_count = cursor.fetchone()[0]
+
+            cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+            if not row:
+                return False, "المستخدم غير موجود"
+
+            if row[0] == 'admin' and admin_count <= 1:
+                return False, "لا يمكن حذف المشرف الوحيد في النظام"
+
+            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            conn.commit()
+        except Exception as e:
+            return False, f"خطأ في حذف المستخدم: {str(e)}"
+
+    log_activity(actor_id, "حذف مستخدم", f"تم حذف المستخدم ID: {user_id}")
+    return True, "تم حذف المستخدم بنجاح"
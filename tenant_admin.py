@@ -0,0 +1,50 @@
+# tenant_admin.py - تهيئة قواعد المؤسسات وتقرير المؤسسات المجمع
+"""
+يهيئ (أو يرحّل) قاعدة كل مؤسسة معرفة في tenants.json، ويطبع تقرير العدادات
+المجمع لكل المؤسسات (تُقرأ القواعد بالتوازي).
+
+الاستعمال:
+    python tenant_admin.py --init
+    python tenant_admin.py --report --output institutions.csv
+"""
+import argparse
+import os
+import time
+
+import database
+import tenants
+from services import stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="تهيئة قواعد المؤسسات وتقرير المؤسسات المجمع")
+    parser.add_argument("--tenants", default=None, help="ملف المؤسسات (افتراضياً tenants.json)")
+    parser.add_argument("--init", action="store_true", help="إنشاء أو ترحيل قاعدة ومجلد مرفقات كل مؤسسة")
+    parser.add_argument("--report", action="store_true", help="طباعة عدادات كل المؤسسات")
+    parser.add_argument("--only", nargs="*", default=None, help="رموز المؤسسات المطلوبة (افتراضياً الكل)")
+    parser.add_argument("--output", default=None, help="حفظ التقرير في ملف CSV")
+    args = parser.parse_args()
+
+    if args.tenants:
+        tenants.TENANTS_FILE = args.tenants
+    if not tenants.registry():
+        raise SystemExit(f"❌ لا توجد مؤسسات معرفة في {tenants.TENANTS_FILE}")
+
+    if args.init:
+        for tenant in [tenants.get(code) for code in args.only] if args.only else tenants.registry().values():
+            started = time.perf_counter()
+            with tenants.use(tenant['code']):
+                database.init_db()
+            os.makedirs(tenant['uploads'], exist_ok=True)
+            print(f"🏫 {tenant['name']}: {tenant['db']} ({time.perf_counter() - started:.1f} ثانية)")
+
+    if args.report:
+        started = time.perf_counter()
+        report = stats.institutions_report(args.only)
+        print(f"📊 {len(tenants.registry()) if not args.only else len(args.only)} مؤسسة "
+              f"({time.perf_counter() - started:.1f} ثانية)")
+        if args.output:
+            report.to_csv(args.output, index=False, encoding='utf-8-sig')
+            print(f"✅ تم حفظ التقرير في {args.output}")
+        else:
+            print(report.to_string(index=False))
@@ -0,0 +1,144 @@
+# tenants.py - توجيه كل مؤسسة (مدرسة) إلى قاعدة بيانات ومجلد مرفقات خاصين بها
+"""
+كل مؤسسة قاعدة SQLite مستقلة (قفل كتابة مستقل: ضغط مدرسة لا يوقف غيرها) ومجلد
+مرفقات مستقل. المؤسسات تُعرّف في tenants.json (أو المسار في MAIL_TENANTS_FILE):
+
+    {
+        "amal": {"name": "المدرسة الإعدادية حي الأمل قابس", "db": "management.db", "uploads": "uploads"},
+        "nour": {"name": "المدرسة الإعدادية النور"}
+    }
+
+db و uploads اختياريان (افتراضياً tenants/<الرمز>/management.db و tenants/<الرمز>/uploads).
+بدون الملف يعمل النظام بمؤسسة واحدة كما كان (database.DB_PATH و uploads).
+
+المؤسسة النشطة تُحدد لكل سياق تنفيذ، فتتبعها get_db_connection و init_db ومجلد
+المرفقات ومفاتيح الذاكرة المؤقتة دون تمرير المسار في كل دالة:
+
+    with tenants.use("nour"):             # سكريبتات، تقارير، طلبات API
+        mail_service.search_mail(...)
+    tenants.set_resolver(func)            # Streamlit: المؤسسة من جلسة المستخدم
+    tenants.fan_out(func)                 # نفس الدالة على كل المؤسسات بالتوازي
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TENANTS_FILE = os.environ.get("MAIL_TENANTS_FILE", "tenants.json")
+TENANTS_DIR = "tenants"
+FAN_OUT_WORKERS = 8
+
+# _UNSET: لم تُحدد بـ use() فتُسأل دالة الجلسة، None: القاعدة الافتراضية صراحة
+_UNSET = object()
+_active = ContextVar("tenant", default=_UNSET)
+_resolver = None
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class UnknownTenantError(LookupError):
+    """رمز مؤسسة غير معرف في tenants.json"""
+
+
+def _load(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    tenants = {}
+    for code, entry in entries.items():
+        folder = os.path.join(TENANTS_DIR, code)
+        tenants[code] = {
+            'code': code,
+            'name': entry.get('name') or code,
+            'db': entry.get('db') or os.path.join(folder, 'management.db'),
+            'uploads': entry.get('uploads') or os.path.join(folder, 'uploads')
+        }
+    return tenants
+
+
+def registry():
+    """المؤسسات المعرفة (رمز -> {code, name, db, uploads})، فارغ في وضع المؤسسة الواحدة"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = _load(TENANTS_FILE)
+        return _registry
+
+
+def reload():
+    """إعادة قراءة tenants.json (بعد إضافة مؤسسة)"""
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+def get(code):
+    tenant = registry().get(code)
+    if tenant is None:
+        raise UnknownTenantError(f"مؤسسة غير معرفة: {code}")
+    return tenant
+
+
+def set_resolver(resolver):
+    """دالة تُرجع رمز المؤسسة عند عدم تحديده بـ use() (جلسة Streamlit الحالية)"""
+    global _resolver
+    _resolver = resolver
+
+
+def active():
+    """المؤسسة النشطة في هذا السياق أو None (وضع المؤسسة الواحدة)"""
+    code = _active.get()
+    if code is _UNSET:
+        code = _resolver() if _resolver is not None else None
+    return get(code) if code else None
+
+
+@contextmanager
+def use(code):
+    """تنفيذ كتلة على قاعدة مؤسسة محددة"""
+    if code is not None:
+        get(code)
+    token = _active.set(code)
+    try:
+        yield
+    finally:
+        _active.reset(token)
+
+
+def db_path():
+    """قاعدة المؤسسة النشطة (None: القاعدة الافتراضية)"""
+    tenant = active()
+    return tenant['db'] if tenant else None
+
+
+def upload_root():
+    """مجلد مرفقات المؤسسة النشطة (None: المجلد الافتراضي)"""
+    tenant = active()
+    return tenant['uploads'] if tenant else None
+
+
+def fan_out(func, codes=None, workers=FAN_OUT_WORKERS):
+    """
+    تنفيذ func() على كل مؤسسة بالتوازي، كل استدعاء في سياق مؤسسته
+
+    خطأ مؤسسة (قاعدة مقفلة أو تالفة) لا يوقف الباقي: يُرجع في مكان نتيجتها.
+
+    Returns:
+        list: (المؤسسة أو None في وضع المؤسسة الواحدة، النتيجة، الخطأ) بترتيب المؤسسات
+    """
+    tenants = [get(code) for code in codes] if codes else list(registry().values()) or [None]
+
+    def run(tenant):
+        with use(tenant['code'] if tenant else None):
+            try:
+                return tenant, func(), None
+            except Exception as e:
+                print(f"⚠️ خطأ في مؤسسة {tenant['code'] if tenant else 'الافتراضية'}: {e}")
+                return tenant, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenants)))) as pool:
+        return list(pool.map(run, tenants))
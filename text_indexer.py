@@ -0,0 +1,59 @@
+# text_indexer.py - تحديث فهرس البحث النصي الكامل في الخلفية
+"""
+يستخرج نصوص مرفقات PDF و DOCX والبوردرية الجديدة ويحدث فهرس البحث (mail_search)
+للبريد الذي تغير فقط. البحث في الواجهة و API يقرأ الفهرس ولا يفتح الملفات.
+
+الاستعمال:
+    python text_indexer.py                 (تحديث كل 60 ثانية)
+    python text_indexer.py --once --workers 8
+
+- الاستخراج في مجموعة عمليات (--workers، افتراضياً عدد المعالجات)
+- كل محتوى ملف يُستخرج مرة واحدة (مفتاحه بصمة SHA-256)، حتى لو أُرفق بعدة رسائل
+- التحديث الأول في العملية يمر على كل البريد، وما بعده على ما سجله change_log فقط
+- ملفات PDF تتطلب pypdf؛ بدونه تُؤجل وتُستخرج عند تثبيته (وإعادة تشغيل المفهرس)
+"""
+import argparse
+import os
+import time
+
+import database
+from services import fulltext
+
+
+def run_once(workers):
+    started = time.perf_counter()
+    result = fulltext.refresh_index(workers)
+    if result['extracted'] or result['indexed'] or result['removed']:
+        print(f"📄 {result['extracted']} ملف مستخرج، {result['indexed']} بريد مفهرس، "
+              f"{result['removed']} محذوف ({time.perf_counter() - started:.1f} ثانية)")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="استخراج نصوص المرفقات وتحديث فهرس البحث")
+    parser.add_argument("--db", default=None, help="قاعدة البيانات (افتراضياً management.db)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="عدد عمليات الاستخراج")
+    parser.add_argument("--interval", type=float, default=60.0, help="ثوانٍ بين تحديثين")
+    parser.add_argument("--once", action="store_true", help="تحديث واحد ثم الخروج")
+    args = parser.parse_args()
+
+    if args.db:
+        database.DB_PATH = args.db
+    database.init_db()
+
+    if fulltext.PdfReader is None:
+        print("⚠️ pypdf غير مثبت: ملفات PDF ستُؤجل حتى تثبيته (pip install pypdf)")
+
+    if args.once:
+        run_once(args.workers)
+    else:
+        print(f"✅ تحديث فهرس البحث كل {args.interval:g} ثانية ({args.workers} عملية)")
+        try:
+            while True:
+                try:
+                    run_once(args.workers)
+                except Exception as e:
+                    print(f"⚠️ خطأ في تحديث فهرس البحث: {e}")
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass